@@ -20,15 +20,39 @@ class Settings(BaseSettings):
     stream_heartbeat_seconds: int = 2
     stream_start_timeout_seconds: int = 2
     technical_stream_start_timeout_seconds: float = 6.0
+    technical_stream_early_abort: bool = True  # switch models when a technical stream starts off structure
+    technical_stream_probe_chars: int = 400  # output held back until a required header appears
     stream_idempotency_ttl_seconds: int = 90
     stream_idempotency_stale_seconds: int = 20
+    sse_resume_enabled: bool = True
+    sse_resume_max_events: int = 0  # frames logged per generation; 0 = services.sse_resume.MAX_LOGGED_EVENTS
+    generation_jobs_enabled: bool = False  # run generation in background jobs (long-lived hosts only)
+    generation_job_max_concurrency: int = 32
+    generation_job_max_seconds: int = 300
+    inference_max_concurrency: int = 16  # per model alias, per process
+    inference_alias_concurrency: str = ""  # overrides, e.g. "technical-primary=8,default-fast=32"
+    inference_queue_max: int = 64  # waiters per priority lane
+    inference_queue_timeout_seconds: float = 10.0
     stream_fallback_budget_seconds: int = 6
+    learning_batch_enabled: bool = False  # generate several learning levels in one multi-section call
+    learning_batch_min_levels: int = 2
+    learning_batch_max_tokens_per_level: int = 700
     trusted_proxies: str = ""
 
     redis_url: str = "redis://localhost:6379"
     upstash_redis_rest_url: str = ""
     upstash_redis_rest_token: str = ""
     cache_ttl: int = 86400  # 24 hours
+    cache_key_dual_read: bool = True
+    cache_warmup_enabled: bool = False
+    cache_warmup_concurrency: int = 4
+    cache_warmup_top_n: int = 20
+    cache_warmup_history_rows: int = 1000
+    semantic_cache_enabled: bool = True
+    semantic_cache_max_entries: int = 5000
+    stream_cache_enabled: bool = True
+    cache_compression_codec: str = "auto"  # auto (zstd if installed, else gzip), gzip, none
+    cache_compression_min_bytes: int = 1024
     rate_limit_strategy: str = "upstash_redis"
     rate_limit_per_user: int = 20  # Requests per minute
     rate_limit_burst: int = 5
@@ -42,7 +66,23 @@ class Settings(BaseSettings):
     circuit_breaker_tokens_per_minute: int = 300000
     circuit_breaker_open_seconds: int = 60
     circuit_breaker_action: str = "reject"
+    quota_reconcile_flush_seconds: float = 1.0
+    quota_reconcile_batch_size: int = 64
+    usage_ledger_flush_seconds: float = 10.0
+    usage_ledger_batch_size: int = 200
+    model_breaker_enabled: bool = True
+    model_breaker_window_seconds: int = 60
+    model_breaker_min_requests: int = 10
+    model_breaker_error_rate: float = 0.5
+    model_breaker_slow_call_seconds: float = 20.0
+    model_breaker_slow_call_rate: float = 0.8
+    model_breaker_open_seconds: int = 30
+    model_breaker_max_open_seconds: int = 300
+    model_breaker_probe_requests: int = 1
     estimated_output_tokens_per_request: int = 900
+    token_estimator_encoding: str = "cl100k_base"
+    token_estimator_min_samples: int = 20
+    token_estimator_output_quantile: float = 0.9
     message_rate_limit_max: int = 30
     message_rate_limit_window_seconds: int = 60
     message_cache_ttl_seconds: int = 3600
@@ -53,6 +93,24 @@ class Settings(BaseSettings):
     tavily_api_key: str = ""
     serper_api_key: str = ""
     exa_api_key: str = ""
+    search_cache_fresh_seconds: int = 21600
+    search_cache_stale_seconds: int = 86400
+    search_cache_negative_seconds: int = 600
+    search_hedge_min_seconds: float = 0.3
+    search_hedge_max_seconds: float = 2.5
+    search_explore_rate: float = 0.1
+    search_structured_fanout: int = 2
+    search_merge_grace_seconds: float = 0.25
+    search_context_token_budget: int = 800
+    image_cache_seconds: int = 604800
+    image_prefetch_wait_seconds: float = 0.5
+    retrieval_index_enabled: bool = True
+    retrieval_index_dir: str = ""
+    retrieval_index_flush_seconds: float = 30.0
+    retrieval_index_segment_docs: int = 256
+    retrieval_index_max_segments: int = 8
+    retrieval_index_max_documents: int = 20000
+    retrieval_index_max_doc_chars: int = 4000
 
     sentry_dsn: str = ""
     sentry_enabled: bool = True
@@ -9,10 +9,16 @@ import httpx
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from routers import pinned, query, export, history, webhooks, payments, messages
+from routers import pinned, query, export, history, webhooks, payments, messages, usage
 from auth import get_supabase_admin
 from services.cache import close_redis, get_redis
+from services.generation_jobs import generation_jobs
 from services.inference import close_client
+from services.rate_limit import usage_reconciler
+from services.retrieval_index import retrieval_index
+from services.token_estimator import load_encoder
+from services.usage_ledger import usage_ledger
+from services.warmup import warm_response_cache
 from services.llm_client import get_litellm_config_state
 from services.llm_errors import LLMError, LLMBadRequest, LLMInvalidAPIKey, LLMUnavailable
 from logging_config import (
@@ -77,9 +83,34 @@ async def lifespan(app: FastAPI):
         else:
             logger.warning("redis_unavailable_dev_mode_continuing", error=str(e))
 
+    warmup_task: asyncio.Task | None = None
+    settings = get_settings()
+    if (
+        bool(getattr(settings, "cache_warmup_enabled", False))
+        and redis_available
+        and bool(config_state.get("chat_enabled", False))
+    ):
+        # Runs in the background so startup is not blocked on LLM generation.
+        warmup_task = asyncio.create_task(warm_response_cache())
+
+    # The BPE ranks may be read from disk or fetched; keep that off the event loop.
+    await asyncio.to_thread(load_encoder)
+
+    try:
+        await asyncio.to_thread(retrieval_index.load)
+    except Exception as e:
+        logger.warning("retrieval_index_load_failed", error=str(e))
+
     logger.info("startup")
     
     yield
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+        await asyncio.gather(warmup_task, return_exceptions=True)
+    await generation_jobs.shutdown()
+    await usage_reconciler.shutdown()
+    await usage_ledger.shutdown()
+    await retrieval_index.shutdown()
     await asyncio.gather(close_redis(), close_client())
 
 
@@ -276,6 +307,7 @@ app.include_router(export.router, prefix="/api")
 app.include_router(history.router, prefix="/api")
 app.include_router(webhooks.router)  # No prefix - webhooks use full path
 app.include_router(payments.router, prefix="/api")
+app.include_router(usage.router, prefix="/api")
 
 
 @app.get("/api/health", tags=["health"])
@@ -63,6 +63,31 @@ Begin the Socratic dialogue now. Speak warmly and encouragingly. Use short quest
 Output ONLY the Socratic questions and gentle guidance. No "Thought:", no markdown headers, no final summary.""" ,
 }
 
+# ====================== BATCHED LEARNING LEVELS ======================
+# One call writes every requested level; services/learning_batch.py splits the sections.
+LEARNING_BATCH_SECTION_MARKER = "<<<{level}>>>"
+LEARNING_BATCH_END_MARKER = "<<<end>>>"
+
+LEARNING_BATCH_LEVEL_BRIEFS: Dict[str, str] = {
+    "eli5": "Like I'm 5 years old: very short sentences, everyday words and fun sensory analogies (sights, sounds, tastes, touches). End with one simple, engaging question.",
+    "eli10": "For a curious 10-year-old who loves science experiments: simple language, clear real-life examples from school or home, and exactly one fun \"Did you know?\" fact.",
+    "eli12": "For a 12-year-old starting to like science and technology: use some proper terms but define them right away, with relatable examples from games, sports or daily life.",
+    "eli15": "For a 15-year-old ready for real concepts: accurate terms explained clearly, the mechanisms involved, and real-world connections showing why it matters.",
+    "meme": "A single punchy, shareable meme-style one-liner or short paragraph with a hilarious but accurate analogy. Maximum 2-3 sentences. No labels, no hashtags.",
+}
+
+LEARNING_BATCH_PROMPT = """You are a master teacher writing several explanations of the same topic, one for each audience below.
+
+Topic: {topic}
+
+Write the sections in this order. Start each section with its marker alone on its own line, exactly as shown, then replace the brief under it with the explanation. After the last section, write <<<end>>> alone on its own line.
+
+{sections}
+
+Rules for every section:
+- Each section must stand on its own; never refer to the other sections.
+- Output ONLY the markers and the explanations in plain text. No thinking, no markdown, no bold, no headers."""
+
 # ====================== TECHNICAL DEPTH MODE ======================
 TECHNICAL_DEPTH_PROMPT = """
 You are a world-class technical writer and researcher.
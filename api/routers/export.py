@@ -1,6 +1,7 @@
 import asyncio
-import io
 import structlog
+from collections.abc import AsyncIterator
+from contextlib import aclosing
 from typing import Optional
 
 from fastapi import APIRouter, HTTPException, Depends
@@ -8,12 +9,22 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 from auth import verify_token, check_is_pro
-from utils import DEFAULT_CHAT_MODE, FREE_LEVELS, LEARNING_MODE, SUPPORTED_CHAT_MODES, normalize_mode, sanitize_filename
-from services.inference import generate_explanation
+from utils import (
+    DEFAULT_CHAT_MODE,
+    FREE_LEVELS,
+    SUPPORTED_CHAT_MODES,
+    normalize_mode,
+    sanitize_filename,
+    sanitize_topic,
+)
+from routers.query import _cache_get_response, _cache_set_response
+from services.inference import generate_explanation, generate_learning_batch, learning_batch_enabled
 
 logger = structlog.get_logger(__name__)
 router = APIRouter(tags=["export"])
 
+EXPORT_MEDIA_TYPES = {"txt": "text/plain", "md": "text/markdown"}
+
 
 class ExportRequest(BaseModel):
     topic: str = Field(..., min_length=1)
@@ -23,75 +34,127 @@ class ExportRequest(BaseModel):
     mode: str = DEFAULT_CHAT_MODE
     visuals: Optional[dict[str, str]] = None
 
+
+async def _resolve_levels(
+    futures: dict[str, asyncio.Future],
+    *,
+    topic: str,
+    cache_topic: str | None,
+    mode: str,
+    user_id: str,
+) -> None:
+    """Settle every unresolved level: response cache first, then one batched or per-level generation."""
+    pending = [level for level, future in futures.items() if not future.done()]
+    if cache_topic is not None and pending:
+        cached = await asyncio.gather(
+            *(_cache_get_response(cache_topic, level, mode) for level in pending), return_exceptions=True
+        )
+        for level, entry in zip(pending, cached):
+            text = entry.get("text") if isinstance(entry, dict) else None
+            if text:
+                futures[level].set_result(str(text))
+        pending = [level for level in pending if not futures[level].done()]
+
+    async def store(level: str, text: str) -> None:
+        futures[level].set_result(text)
+        if cache_topic is not None:
+            await _cache_set_response(cache_topic, level, mode, text)
+
+    if pending and learning_batch_enabled(mode, pending):
+        batched = await generate_learning_batch(topic, pending, user_id=user_id)
+        for level, text in batched.items():
+            await store(level, text)
+        pending = [level for level in pending if not futures[level].done()]
+
+    async def generate(level: str) -> None:
+        try:
+            text = await generate_explanation(topic, level, mode=mode)
+        except Exception as exc:
+            futures[level].set_result(f"Error generating content: {str(exc)}")
+            return
+        await store(level, text)
+
+    await asyncio.gather(*(generate(level) for level in pending))
+
+
+async def _sections_in_order(
+    levels: list[str],
+    provided: dict[str, str],
+    **resolve_kwargs,
+) -> AsyncIterator[tuple[str, str]]:
+    """
+    (level, text) in level order as soon as each is available.
+
+    Every level resolves concurrently; a level that finishes early waits in
+    its future until the levels before it have been written.
+    """
+    loop = asyncio.get_running_loop()
+    futures: dict[str, asyncio.Future] = {level: loop.create_future() for level in levels}
+    for level in levels:
+        if level in provided:
+            futures[level].set_result(provided[level])
+    resolver = asyncio.create_task(_resolve_levels(futures, **resolve_kwargs))
+    try:
+        for level in levels:
+            # A resolver that dies leaves its futures unset; surface its error instead of hanging.
+            await asyncio.wait({futures[level], resolver}, return_when=asyncio.FIRST_COMPLETED)
+            if not futures[level].done():
+                resolver.result()
+                raise RuntimeError(f"export level {level} was never resolved")
+            yield level, futures[level].result()
+    finally:
+        if not resolver.done():
+            resolver.cancel()
+
+
+async def _write_document(topic: str, sections: AsyncIterator[tuple[str, str]], section_count: int):
+    """Encode the export one section at a time; the full document is never held in memory."""
+    multiple = section_count > 1
+    rule = "---\n\n" if multiple else ""
+    yield f"# {topic}\n\n{rule}".encode()
+    async with aclosing(sections):
+        async for level, text in sections:
+            heading = f"## {level.replace('eli', 'ELI-').upper()}\n\n" if multiple else ""
+            yield f"{heading}{text.strip()}\n\n{rule}".encode()
+
+
 @router.post("/export")
 async def export_explanations(req: ExportRequest, auth_data: dict = Depends(verify_token)) -> StreamingResponse:
     """Export explanations in requested format."""
     # Verify pro status
     user = auth_data["user"]
     is_verified_pro = await check_is_pro(user.id)
-    
+
     if not is_verified_pro:
         raise HTTPException(status_code=403, detail="Exporting is a premium feature. Please upgrade to use this functionality.")
-        
+
+    media_type = EXPORT_MEDIA_TYPES.get(req.format)
+    if media_type is None:
+        raise HTTPException(400, "Requested format is currently disabled or invalid")
+
     req.mode = normalize_mode(req.mode)
     if req.mode not in SUPPORTED_CHAT_MODES:
         req.mode = DEFAULT_CHAT_MODE
 
-    # Identify levels to include based on mode
-    target_levels = set(FREE_LEVELS)
-    
-    current_levels = set(req.explanations.keys())
-    missing_levels = list(target_levels - current_levels)
-
-    if missing_levels:
-        tasks = {lvl: generate_explanation(req.topic, lvl, mode=req.mode) for lvl in missing_levels}
-        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
-        
-        for lvl, result in zip(tasks.keys(), results):
-            if isinstance(result, str):
-                req.explanations[lvl] = result
-            else:
-                req.explanations[lvl] = f"Error generating content: {str(result)}"
-    
-    ordered_explanations = {}
-    for lvl in FREE_LEVELS:
-        if lvl in req.explanations:
-            ordered_explanations[lvl] = req.explanations[lvl]
-                
-    req.explanations = ordered_explanations
+    try:
+        # Cache keys are built from the sanitized topic, as /query stores them.
+        cache_topic: str | None = sanitize_topic(req.topic)
+    except ValueError:
+        cache_topic = None
+
+    levels = list(FREE_LEVELS)
+    sections = _sections_in_order(
+        levels,
+        req.explanations,
+        topic=req.topic,
+        cache_topic=cache_topic,
+        mode=req.mode,
+        user_id=str(user.id),
+    )
 
     slug = sanitize_filename(req.topic)
-    filename_base = f"knowbear-{slug}"
-    if req.format == "txt":
-        content = f"# {req.topic}\n\n"
-        if len(req.explanations) > 1:
-            content += "---\n\n"
-        for level, text in req.explanations.items():
-            if len(req.explanations) > 1:
-                lvl_name = level.replace('eli', 'ELI-').upper()
-                content += f"## {lvl_name}\n\n"
-            content += f"{text.strip()}\n\n"
-            if len(req.explanations) > 1:
-                content += "---\n\n"
-        return StreamingResponse(
-            io.BytesIO(content.encode()),
-            media_type="text/plain",
-            headers={"Content-Disposition": f"attachment; filename={filename_base}.txt"},
-        )
-    elif req.format == "md":
-        content = f"# {req.topic}\n\n"
-        if len(req.explanations) > 1:
-            content += "---\n\n"
-        for level, text in req.explanations.items():
-            if len(req.explanations) > 1:
-                lvl_name = level.replace('eli', 'ELI-').upper()
-                content += f"## {lvl_name}\n\n"
-            content += f"{text.strip()}\n\n"
-            if len(req.explanations) > 1:
-                content += "---\n\n"
-        return StreamingResponse(
-            io.BytesIO(content.encode()),
-            media_type="text/markdown",
-            headers={"Content-Disposition": f"attachment; filename={filename_base}.md"},
-        )
-    raise HTTPException(400, "Requested format is currently disabled or invalid")
+    return StreamingResponse(
+        _write_document(req.topic, sections, len(levels)),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=knowbear-{slug}.{req.format}"},
+    )
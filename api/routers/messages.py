@@ -15,19 +15,37 @@ from auth import check_is_pro, get_supabase_admin, verify_token
 from config import get_settings
 from logging_config import anonymize_text, anonymize_user_id, logger, log_sampled_success
 from monitoring import capture_telemetry_event
-from services.cache import cache_get, cache_set, cache_set_if_absent
-from services.inference import generate_explanation, generate_stream_explanation
+from services.cache import cache_get, cache_set
+from services.generation_jobs import generation_job_max_seconds, generation_jobs, generation_jobs_enabled
+from services.idempotency import OUTCOME_BUSY, OUTCOME_REPLAY, IdempotencyManager
+from services.inference import generate_explanation, generate_stream_explanation, response_cache_version
 from services.llm_client import get_litellm_config_state
 from services.llm_errors import LLMUnavailable
-from services.rate_limit import enforce_request_controls, estimate_tokens_for_text
+from services.rate_limit import enforce_request_controls, usage_reconciler
+from services.retrieval_index import retrieval_index
+from services.search import search_service
+from services.semantic_cache import log_semantic_hit, semantic_cache, semantic_cache_enabled
+from services.sse_resume import (
+    EventLog,
+    EventLogReader,
+    event_log_key,
+    open_event_log,
+    parse_last_event_id,
+    resume_event_stream,
+    sse_resume_enabled,
+)
 from services.streaming import SseEventBuilder
+from services.token_estimator import estimate_request_tokens, reconcile_usage, usage_tokens
+from services.usage_ledger import usage_ledger
 from utils import (
+    CANONICAL_CACHE_KEY_SCHEMA,
     DEFAULT_CHAT_MODE,
     PROMPT_MODE_ALIASES,
     SUPPORTED_PROMPT_MODES,
     LEARNING_MODE,
     SOCRATIC_MODE,
     TECHNICAL_MODE,
+    canonicalize_topic,
     normalize_mode,
     normalize_prompt_level,
 )
@@ -65,12 +83,88 @@ class MessageRequest(BaseModel):
 
 
 def _message_cache_key(content: str, mode: str, prompt_mode: str, temperature: float) -> str:
+    version = response_cache_version(mode, prompt_mode)
+    digest = hashlib.sha256(
+        f"{canonicalize_topic(content)}\x00{mode}\x00{prompt_mode}\x00{temperature:.2f}\x00{version}".encode("utf-8")
+    ).hexdigest()
+    return f"knowbear:cache:{CANONICAL_CACHE_KEY_SCHEMA}:{digest}"
+
+
+def _legacy_message_cache_key(content: str, mode: str, prompt_mode: str, temperature: float) -> str:
+    # The key the previous release wrote: raw content and no schema or prompt version.
     digest = hashlib.sha256(
         f"{content}\x00{mode}\x00{prompt_mode}\x00{temperature:.2f}".encode("utf-8")
     ).hexdigest()
     return f"knowbear:cache:{digest}"
 
 
+def _message_semantic_scope(temperature: float) -> str:
+    return f"messages:{temperature:.2f}"
+
+
+async def _cache_get_message(
+    cache_key: str,
+    legacy_key: str,
+    ttl: int,
+    *,
+    content: str,
+    mode: str,
+    prompt_mode: str,
+    temperature: float,
+) -> tuple[dict[str, Any] | None, str | None]:
+    """
+    Read the canonical message cache key, falling back to the legacy key while
+    dual-read is on, then to a near-duplicate of a message cached on this instance.
+
+    Returns the payload and the key it now lives under.
+    """
+    cached = await cache_get(cache_key)
+    if cached:
+        return cached, cache_key
+    if bool(getattr(get_settings(), "cache_key_dual_read", True)):
+        legacy = await cache_get(legacy_key)
+        if legacy and legacy.get("response"):
+            logger.info("messages_cache_legacy_key_hit")
+            backfilled = await cache_set(cache_key, legacy, ttl=ttl)
+            return legacy, cache_key if backfilled else legacy_key
+    if not semantic_cache_enabled():
+        return None, None
+    scope = _message_semantic_scope(temperature)
+    match = semantic_cache.lookup(content, mode=mode, level=prompt_mode, scope=scope)
+    if match is None:
+        return None, None
+    similar = await cache_get(match.cache_key)
+    if not similar or not similar.get("response"):
+        semantic_cache.forget(match.cache_key, topic=content, mode=mode, level=prompt_mode, scope=scope)
+        return None, None
+    log_semantic_hit(match, mode=mode, level=prompt_mode, scope=scope)
+    return similar, match.cache_key
+
+
+async def _cache_set_message(
+    cache_key: str,
+    response: str,
+    ttl: int,
+    *,
+    content: str,
+    mode: str,
+    prompt_mode: str,
+    temperature: float,
+) -> str | None:
+    """Write a response to the message cache; returns the key on success so records can point at it."""
+    if not await cache_set(cache_key, {"response": response}, ttl=ttl):
+        return None
+    if semantic_cache_enabled():
+        semantic_cache.remember(
+            content,
+            cache_key,
+            mode=mode,
+            level=prompt_mode,
+            scope=_message_semantic_scope(temperature),
+        )
+    return cache_key
+
+
 def _idempotency_key(user_id: str, message_id: str) -> str:
     digest = hashlib.sha256(f"{user_id}\x00{message_id}".encode("utf-8")).hexdigest()
     return f"knowbear:idempotency:{digest}"
@@ -117,6 +211,14 @@ def _build_replay_response(
     )
 
 
+def _build_resume_response(reader: EventLogReader) -> StreamingResponse:
+    return StreamingResponse(
+        resume_event_stream(reader),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
+    )
+
+
 @router.post("/messages")
 async def send_message(req: MessageRequest, request: Request, auth_data: dict = Depends(verify_token)):
     request_received = time.perf_counter()
@@ -175,162 +277,160 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
     )
     trusted_proxies = _trusted_proxies_from_settings(config_settings)
 
+    idempotency = IdempotencyManager(
+        "messages",
+        ttl_seconds=idempotency_ttl_seconds,
+        stale_seconds=idempotency_stale_seconds,
+    )
     idempotency_key = _idempotency_key(user_id, client_message_id)
-    idempotency_payload = await cache_get(idempotency_key)
-    idempotency_claimed = False
-    if idempotency_payload:
-        status = idempotency_payload.get("status")
-        cached_response = idempotency_payload.get("response")
-        if status == "completed" and cached_response:
-            assistant_message_id = idempotency_payload.get("assistant_message_id")
-            replay_mode = idempotency_payload.get("mode") or DEFAULT_CHAT_MODE
-            replay_prompt_mode = idempotency_payload.get("prompt_mode") or normalize_prompt_level(None)
-            return _build_replay_response(
-                content=str(cached_response),
+    idempotency_claim = await idempotency.claim(
+        idempotency_key,
+        message_id=client_message_id,
+        assistant_client_id=assistant_client_id,
+    )
+    resume_enabled = sse_resume_enabled()
+    last_event_id = parse_last_event_id(request.headers.get("last-event-id")) if resume_enabled else None
+    if last_event_id is not None and idempotency_claim.outcome in {OUTCOME_REPLAY, OUTCOME_BUSY}:
+        reader = EventLogReader(
+            event_log_key(idempotency_key),
+            last_event_id,
+            is_live=lambda: idempotency.is_live(idempotency_key),
+            keepalive_seconds=heartbeat_seconds,
+        )
+        if await reader.available():
+            logger.info(
+                "messages_stream_resumed",
+                request_id=request_id,
+                user_id_hash=user_id_hash,
                 message_id=client_message_id,
-                assistant_message_id=assistant_message_id,
-                mode=replay_mode,
-                prompt_mode=replay_prompt_mode,
+                last_event_id=last_event_id,
+                outcome=idempotency_claim.outcome,
             )
+            return _build_resume_response(reader)
+    if idempotency_claim.outcome == OUTCOME_REPLAY:
+        existing = idempotency_claim.existing or {}
+        return _build_replay_response(
+            content=idempotency_claim.response or "",
+            message_id=client_message_id,
+            assistant_message_id=existing.get("assistant_message_id"),
+            mode=existing.get("mode") or DEFAULT_CHAT_MODE,
+            prompt_mode=existing.get("prompt_mode") or normalize_prompt_level(None),
+        )
+    if idempotency_claim.outcome == OUTCOME_BUSY:
+        raise HTTPException(status_code=409, detail="Duplicate request already in progress.")
 
-        if status == "in_progress":
-            started_at = idempotency_payload.get("started_at")
-            now_ts = int(time.time())
-            started_ts = int(started_at) if isinstance(started_at, (int, float)) else now_ts
-            age_seconds = max(now_ts - started_ts, 0)
-            if age_seconds < idempotency_stale_seconds:
-                raise HTTPException(status_code=409, detail="Duplicate request already in progress.")
-            reclaimed = await cache_set(
-                idempotency_key,
-                {
-                    "status": "reclaimed",
-                    "reclaimed_at": now_ts,
-                    "previous_started_at": started_ts,
-                    "message_id": client_message_id,
-                },
-                ttl=idempotency_ttl_seconds,
-            )
-            if not reclaimed:
-                raise HTTPException(status_code=409, detail="Duplicate request already in progress.")
-            idempotency_claimed = True
-
-    estimated_tokens = estimate_tokens_for_text(content)
-    client_ip = _resolve_client_ip(request, trusted_proxies=trusted_proxies)
-    await enforce_request_controls(
-        user_id=user_id,
-        client_ip=client_ip,
-        estimated_tokens=estimated_tokens,
-    )
+    reservation = None
+    try:
+        # The conversation's stored mode is not loaded yet, so estimate with what the request asked for.
+        token_estimate = estimate_request_tokens(
+            content,
+            mode=normalize_mode(req.mode),
+            levels=[normalize_prompt_level(PROMPT_MODE_ALIASES.get(req.prompt_mode or "", req.prompt_mode or ""))],
+        )
+        estimated_tokens = token_estimate.total
+        client_ip = _resolve_client_ip(request, trusted_proxies=trusted_proxies)
+        reservation = await enforce_request_controls(
+            user_id=user_id,
+            client_ip=client_ip,
+            estimated_tokens=estimated_tokens,
+        )
 
-    supabase = get_supabase_admin()
-    if not supabase:
-        raise HTTPException(status_code=500, detail="Database connection error")
+        supabase = get_supabase_admin()
+        if not supabase:
+            raise HTTPException(status_code=500, detail="Database connection error")
 
-    try:
-        conversation_resp = await asyncio.to_thread(
-            supabase.table("conversations")
-            .select("id, user_id, mode, settings")
-            .eq("id", req.conversation_id)
-            .eq("user_id", user_id)
-            .single()
-            .execute
+        try:
+            conversation_resp = await asyncio.to_thread(
+                supabase.table("conversations")
+                .select("id, user_id, mode, settings")
+                .eq("id", req.conversation_id)
+                .eq("user_id", user_id)
+                .single()
+                .execute
+            )
+            if not getattr(conversation_resp, "data", None):
+                raise HTTPException(status_code=404, detail="Conversation not found")
+            conversation = cast(Dict[str, Any], conversation_resp.data)
+        except HTTPException:
+            raise
+        except Exception as exc:
+            logger.error(
+                "messages_conversation_fetch_failed",
+                error=str(exc),
+                request_id=request_id,
+                user_id_hash=user_id_hash,
+                conversation_id=req.conversation_id,
+                retry=bool(req.regenerate),
+                sampled=False,
+            )
+            raise HTTPException(status_code=500, detail="Failed to load conversation") from exc
+
+        selected_mode = normalize_mode(req.mode or conversation.get("mode") or conversation.get("settings", {}).get("mode"))
+        if selected_mode not in {LEARNING_MODE, TECHNICAL_MODE, SOCRATIC_MODE}:
+            selected_mode = DEFAULT_CHAT_MODE
+        if selected_mode == LEARNING_MODE and not is_prod:
+            stream_start_timeout_seconds = max(raw_start_timeout, float(stream_max_seconds))
+        elif selected_mode == TECHNICAL_MODE:
+            stream_max_seconds = max(
+                stream_max_seconds,
+                int(getattr(config_settings, "technical_stream_max_seconds", 45)),
+            )
+            technical_start_timeout = float(
+                getattr(config_settings, "technical_stream_start_timeout_seconds", max(raw_start_timeout, 6.0))
+            )
+            technical_cap = max(4.0, min(float(stream_max_seconds) * 0.75, 20.0))
+            stream_start_timeout_seconds = min(max(technical_start_timeout, 2.0), technical_cap)
+            fallback_budget_seconds = max(fallback_budget_seconds, 4.0)
+        else:
+            cap = 2.0 if is_prod else 5.0
+            stream_start_timeout_seconds = min(max(raw_start_timeout, 0.1), cap)
+
+        requested_prompt_mode = PROMPT_MODE_ALIASES.get(req.prompt_mode or "", req.prompt_mode or "")
+        stored_prompt_mode = PROMPT_MODE_ALIASES.get(
+            cast(str, (conversation.get("settings") or {}).get("prompt_mode") or ""),
+            cast(str, (conversation.get("settings") or {}).get("prompt_mode") or ""),
         )
-        if not getattr(conversation_resp, "data", None):
-            raise HTTPException(status_code=404, detail="Conversation not found")
-        conversation = cast(Dict[str, Any], conversation_resp.data)
-    except HTTPException:
-        raise
-    except Exception as exc:
-        logger.error(
-            "messages_conversation_fetch_failed",
-            error=str(exc),
-            request_id=request_id,
-            user_id_hash=user_id_hash,
-            conversation_id=req.conversation_id,
-            retry=bool(req.regenerate),
-            sampled=False,
+        prompt_mode = normalize_prompt_level(requested_prompt_mode or stored_prompt_mode)
+        if prompt_mode not in SUPPORTED_PROMPT_MODES:
+            prompt_mode = normalize_prompt_level(None)
+
+        is_pro = await check_is_pro(user_id)
+        if selected_mode == TECHNICAL_MODE and not is_pro:
+            raise HTTPException(status_code=403, detail="Technical mode is a Pro feature")
+        request_temperature = max(0.0, min(float(req.temperature), 1.0))
+        cache_key = _message_cache_key(
+            content=content,
+            mode=selected_mode,
+            prompt_mode=prompt_mode,
+            temperature=request_temperature,
         )
-        raise HTTPException(status_code=500, detail="Failed to load conversation") from exc
-
-    selected_mode = normalize_mode(req.mode or conversation.get("mode") or conversation.get("settings", {}).get("mode"))
-    if selected_mode not in {LEARNING_MODE, TECHNICAL_MODE, SOCRATIC_MODE}:
-        selected_mode = DEFAULT_CHAT_MODE
-    if selected_mode == LEARNING_MODE and not is_prod:
-        stream_start_timeout_seconds = max(raw_start_timeout, float(stream_max_seconds))
-    elif selected_mode == TECHNICAL_MODE:
-        stream_max_seconds = max(
-            stream_max_seconds,
-            int(getattr(config_settings, "technical_stream_max_seconds", 45)),
+        legacy_cache_key = _legacy_message_cache_key(
+            content=content,
+            mode=selected_mode,
+            prompt_mode=prompt_mode,
+            temperature=request_temperature,
         )
-        technical_start_timeout = float(
-            getattr(config_settings, "technical_stream_start_timeout_seconds", max(raw_start_timeout, 6.0))
+        cached_payload, cached_payload_key = (
+            (None, None)
+            if req.regenerate
+            else await _cache_get_message(
+                cache_key,
+                legacy_cache_key,
+                cache_ttl_seconds,
+                content=content,
+                mode=selected_mode,
+                prompt_mode=prompt_mode,
+                temperature=request_temperature,
+            )
         )
-        technical_cap = max(4.0, min(float(stream_max_seconds) * 0.75, 20.0))
-        stream_start_timeout_seconds = min(max(technical_start_timeout, 2.0), technical_cap)
-        fallback_budget_seconds = max(fallback_budget_seconds, 4.0)
-    else:
-        cap = 2.0 if is_prod else 5.0
-        stream_start_timeout_seconds = min(max(raw_start_timeout, 0.1), cap)
-
-    requested_prompt_mode = PROMPT_MODE_ALIASES.get(req.prompt_mode or "", req.prompt_mode or "")
-    stored_prompt_mode = PROMPT_MODE_ALIASES.get(
-        cast(str, (conversation.get("settings") or {}).get("prompt_mode") or ""),
-        cast(str, (conversation.get("settings") or {}).get("prompt_mode") or ""),
-    )
-    prompt_mode = normalize_prompt_level(requested_prompt_mode or stored_prompt_mode)
-    if prompt_mode not in SUPPORTED_PROMPT_MODES:
-        prompt_mode = normalize_prompt_level(None)
-
-    is_pro = await check_is_pro(user_id)
-    if selected_mode == TECHNICAL_MODE and not is_pro:
-        raise HTTPException(status_code=403, detail="Technical mode is a Pro feature")
-    request_temperature = max(0.0, min(float(req.temperature), 1.0))
-    cache_key = _message_cache_key(
-        content=content,
-        mode=selected_mode,
-        prompt_mode=prompt_mode,
-        temperature=request_temperature,
-    )
-    cached_payload = None if req.regenerate else await cache_get(cache_key)
-    cached_response = cached_payload.get("response") if cached_payload else None
-    if cached_response and not isinstance(cached_response, str):
-        cached_response = str(cached_response)
-
-    idempotency_record = {
-        "status": "in_progress",
-        "started_at": int(time.time()),
-        "message_id": client_message_id,
-        "assistant_client_id": assistant_client_id,
-        "mode": selected_mode,
-        "prompt_mode": prompt_mode,
-    }
-    if idempotency_claimed:
-        reserved = await cache_set(idempotency_key, idempotency_record, ttl=idempotency_ttl_seconds)
-    else:
-        reserved = await cache_set_if_absent(idempotency_key, idempotency_record, idempotency_ttl_seconds)
-    if not reserved:
-        existing = await cache_get(idempotency_key)
-        if existing:
-            status = existing.get("status")
-            idempotency_response = existing.get("response")
-            if status == "completed" and idempotency_response:
-                return _build_replay_response(
-                    content=str(idempotency_response),
-                    message_id=client_message_id,
-                    assistant_message_id=existing.get("assistant_message_id"),
-                    mode=existing.get("mode") or selected_mode,
-                    prompt_mode=existing.get("prompt_mode") or prompt_mode,
-                )
-            if status == "in_progress":
-                started_at = existing.get("started_at")
-                now_ts = int(time.time())
-                started_ts = int(started_at) if isinstance(started_at, (int, float)) else now_ts
-                age_seconds = max(now_ts - started_ts, 0)
-                if age_seconds < idempotency_stale_seconds:
-                    raise HTTPException(status_code=409, detail="Duplicate request already in progress.")
-                await cache_set(idempotency_key, idempotency_record, ttl=idempotency_ttl_seconds)
-            if status == "failed":
-                await cache_set(idempotency_key, idempotency_record, ttl=idempotency_ttl_seconds)
+        cached_response = cached_payload.get("response") if cached_payload else None
+        if cached_response and not isinstance(cached_response, str):
+            cached_response = str(cached_response)
+    except HTTPException:
+        # Rejections before generation starts must not block a retry with the same id.
+        await idempotency.fail(idempotency_claim, message_id=client_message_id)
+        usage_reconciler.refund(reservation)
+        raise
 
     user_metadata = {
         "client_id": client_message_id,
@@ -361,11 +461,8 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
             retry=bool(req.regenerate),
             sampled=False,
         )
-        await cache_set(
-            idempotency_key,
-            {"status": "failed", "message_id": client_message_id},
-            ttl=idempotency_ttl_seconds,
-        )
+        await idempotency.fail(idempotency_claim, message_id=client_message_id)
+        usage_reconciler.refund(reservation)
         raise HTTPException(status_code=500, detail="Failed to save user message") from exc
 
     now_iso = datetime.now(timezone.utc).isoformat()
@@ -410,16 +507,11 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
         )
         assistant_data = cast(list[Dict[str, Any]], assistant_resp.data) if assistant_resp.data else []
         assistant_message_id = assistant_data[0]["id"] if assistant_data else None
-        await cache_set(
-            idempotency_key,
-            {
-                "status": "in_progress",
-                "message_id": client_message_id,
-                "assistant_message_id": assistant_message_id,
-                "mode": selected_mode,
-                "prompt_mode": prompt_mode,
-            },
-            ttl=idempotency_ttl_seconds,
+        await idempotency.update(
+            idempotency_claim,
+            assistant_message_id=assistant_message_id,
+            mode=selected_mode,
+            prompt_mode=prompt_mode,
         )
     except Exception as exc:
         logger.error(
@@ -431,17 +523,23 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
             retry=bool(req.regenerate),
             sampled=False,
         )
-        await cache_set(
-            idempotency_key,
-            {"status": "failed", "message_id": client_message_id},
-            ttl=idempotency_ttl_seconds,
-        )
+        await idempotency.fail(idempotency_claim, message_id=client_message_id)
+        usage_reconciler.refund(reservation)
         raise HTTPException(status_code=500, detail="Failed to start assistant message") from exc
 
+    # Job mode runs generation as a background task publishing to the event log;
+    # this request (and any reconnect) just follows the log.
+    detached = resume_enabled and generation_jobs_enabled() and generation_jobs.has_capacity()
+    if detached:
+        stream_max_seconds = max(stream_max_seconds, generation_job_max_seconds())
+    event_log: EventLog | None = None
+    if resume_enabled:
+        event_log = open_event_log(event_log_key(idempotency_key), ttl=idempotency_ttl_seconds)
+
     async def event_generator():
         start_time = time.perf_counter()
         full_content = ""
-        builder = SseEventBuilder()
+        builder = SseEventBuilder(recorder=event_log.record if event_log is not None else None)
         first_event_ms = None
         first_token_ms = None
         last_chunk_time = None
@@ -458,6 +556,20 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
         start_timeout = False
         telemetry_sink: dict[str, Any] = {}
         stream_failed = False
+        message_cache_key_written: str | None = None
+        inference_started = False
+        image_prefetch = search_service.prefetch_images(content)
+
+        async def complete_idempotency(response_key: str | None, **extra: Any) -> None:
+            await idempotency.complete(
+                idempotency_claim,
+                full_content,
+                response_key=response_key,
+                assistant_message_id=assistant_message_id,
+                mode=selected_mode,
+                prompt_mode=prompt_mode,
+                **extra,
+            )
 
         capture_telemetry_event(
             "stream_start",
@@ -486,6 +598,11 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                 return builder.emit_json(event, payload)
             return builder.emit(event, payload)
 
+        async def emit_images():
+            images = await search_service.prefetched_images(image_prefetch)
+            if images:
+                yield emit("images", {"images": images})
+
         async def close_stream(stream):
             close_fn = getattr(stream, "aclose", None)
             if close_fn:
@@ -494,6 +611,7 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                 except Exception:
                     pass
 
+        idempotency.start_heartbeat(idempotency_claim)
         try:
             meta_payload = {
                 "assistant_message_id": assistant_message_id,
@@ -517,25 +635,18 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                     sampled=True,
                 )
                 full_content = cached_response
-                await cache_set(
-                    idempotency_key,
-                    {
-                        "status": "completed",
-                        "response": full_content,
-                        "assistant_message_id": assistant_message_id,
-                        "mode": selected_mode,
-                        "prompt_mode": prompt_mode,
-                    },
-                    ttl=idempotency_ttl_seconds,
-                )
+                await complete_idempotency(cached_payload_key)
                 for index in range(0, len(cached_response), chunk_size):
                     chunk = cached_response[index : index + chunk_size]
                     record_chunk()
                     yield emit("delta", {"delta": chunk, "assistant_message_id": assistant_message_id})
+                async for event in emit_images():
+                    yield event
                 yield emit("done", "[DONE]")
                 return
 
             generation_start = time.perf_counter()
+            inference_started = True
             stream = generate_stream_explanation(
                 content,
                 prompt_mode,
@@ -544,13 +655,14 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                 regenerate=req.regenerate,
                 request_id=request_id,
                 user_id=user_id,
+                is_pro=is_pro,
                 telemetry_sink=telemetry_sink,
             )
             stream_iter = stream.__aiter__()
             start_deadline = start_time + stream_start_timeout_seconds
 
             while True:
-                if await request.is_disconnected():
+                if not detached and await request.is_disconnected():
                     aborted = True
                     abort_reason = "client_disconnect"
                     await close_stream(stream)
@@ -614,6 +726,7 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                             regenerate=req.regenerate,
                             request_id=request_id,
                             user_id=user_id,
+                            is_pro=is_pro,
                             telemetry_sink=telemetry_sink,
                         ),
                         timeout=max(
@@ -644,20 +757,20 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                     chunk = full_content[index : index + chunk_size]
                     record_chunk()
                     yield emit("delta", {"delta": chunk, "assistant_message_id": assistant_message_id})
+                async for event in emit_images():
+                    yield event
                 yield emit("done", "[DONE]")
                 if not req.regenerate:
-                    await cache_set(cache_key, {"response": full_content}, ttl=cache_ttl_seconds)
-                await cache_set(
-                    idempotency_key,
-                    {
-                        "status": "completed",
-                        "response": full_content,
-                        "assistant_message_id": assistant_message_id,
-                        "mode": selected_mode,
-                        "prompt_mode": prompt_mode,
-                    },
-                    ttl=idempotency_ttl_seconds,
-                )
+                    message_cache_key_written = await _cache_set_message(
+                        cache_key,
+                        full_content,
+                        cache_ttl_seconds,
+                        content=content,
+                        mode=selected_mode,
+                        prompt_mode=prompt_mode,
+                        temperature=request_temperature,
+                    )
+                await complete_idempotency(message_cache_key_written)
                 return
 
             response_truncated = bool(timed_out and not aborted)
@@ -667,29 +780,24 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                 yield emit("delta", {"delta": cutoff_message, "assistant_message_id": assistant_message_id})
 
             if full_content.strip() and not response_truncated and not req.regenerate:
-                await cache_set(cache_key, {"response": full_content}, ttl=cache_ttl_seconds)
+                message_cache_key_written = await _cache_set_message(
+                    cache_key,
+                    full_content,
+                    cache_ttl_seconds,
+                    content=content,
+                    mode=selected_mode,
+                    prompt_mode=prompt_mode,
+                    temperature=request_temperature,
+                )
 
             if full_content.strip():
-                await cache_set(
-                    idempotency_key,
-                    {
-                        "status": "completed",
-                        "response": full_content,
-                        "assistant_message_id": assistant_message_id,
-                        "mode": selected_mode,
-                        "prompt_mode": prompt_mode,
-                        "truncated": response_truncated,
-                    },
-                    ttl=idempotency_ttl_seconds,
-                )
+                await complete_idempotency(message_cache_key_written, truncated=response_truncated)
             else:
-                await cache_set(
-                    idempotency_key,
-                    {"status": "failed", "message_id": client_message_id},
-                    ttl=idempotency_ttl_seconds,
-                )
+                await idempotency.fail(idempotency_claim, message_id=client_message_id)
 
             if not aborted:
+                async for event in emit_images():
+                    yield event
                 yield emit("done", "[DONE]")
         except Exception as exc:
             stream_failed = True
@@ -715,6 +823,7 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                             regenerate=req.regenerate,
                             request_id=request_id,
                             user_id=user_id,
+                            is_pro=is_pro,
                             telemetry_sink=telemetry_sink,
                         ),
                         timeout=max(
@@ -730,20 +839,20 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                         chunk = full_content[index : index + chunk_size]
                         record_chunk()
                         yield emit("delta", {"delta": chunk, "assistant_message_id": assistant_message_id})
+                    async for event in emit_images():
+                        yield event
                     yield emit("done", "[DONE]")
                     if not req.regenerate:
-                        await cache_set(cache_key, {"response": full_content}, ttl=cache_ttl_seconds)
-                    await cache_set(
-                        idempotency_key,
-                        {
-                            "status": "completed",
-                            "response": full_content,
-                            "assistant_message_id": assistant_message_id,
-                            "mode": selected_mode,
-                            "prompt_mode": prompt_mode,
-                        },
-                        ttl=idempotency_ttl_seconds,
-                    )
+                        message_cache_key_written = await _cache_set_message(
+                            cache_key,
+                            full_content,
+                            cache_ttl_seconds,
+                            content=content,
+                            mode=selected_mode,
+                            prompt_mode=prompt_mode,
+                            temperature=request_temperature,
+                        )
+                    await complete_idempotency(message_cache_key_written)
                     return
                 except Exception as fallback_exc:
                     logger.error(
@@ -756,27 +865,20 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                         retry=bool(req.regenerate),
                         sampled=False,
                     )
-            await cache_set(
-                idempotency_key,
-                {"status": "failed", "message_id": client_message_id},
-                ttl=idempotency_ttl_seconds,
-            )
+            await idempotency.fail(idempotency_claim, message_id=client_message_id)
             if not aborted:
                 if full_content.strip():
                     if not req.regenerate and not response_truncated:
-                        await cache_set(cache_key, {"response": full_content}, ttl=cache_ttl_seconds)
-                    await cache_set(
-                        idempotency_key,
-                        {
-                            "status": "completed",
-                            "response": full_content,
-                            "assistant_message_id": assistant_message_id,
-                            "mode": selected_mode,
-                            "prompt_mode": prompt_mode,
-                            "partial": True,
-                        },
-                        ttl=idempotency_ttl_seconds,
-                    )
+                        message_cache_key_written = await _cache_set_message(
+                            cache_key,
+                            full_content,
+                            cache_ttl_seconds,
+                            content=content,
+                            mode=selected_mode,
+                            prompt_mode=prompt_mode,
+                            temperature=request_temperature,
+                        )
+                    await complete_idempotency(message_cache_key_written, partial=True)
                     yield emit(
                         "delta",
                         {
@@ -784,11 +886,17 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                             "assistant_message_id": assistant_message_id,
                         },
                     )
+                    async for event in emit_images():
+                        yield event
                     yield emit("done", "[DONE]")
                     return
                 yield emit("error", {"error": "Streaming failed"})
                 yield emit("done", "[DONE]")
         finally:
+            # Disconnects settle nothing; without heartbeats the record goes stale and can be reclaimed.
+            await idempotency.stop_heartbeat(idempotency_claim)
+            if event_log is not None:
+                await event_log.close()
             total_ms = (time.perf_counter() - start_time) * 1000
             avg_chunk_interval_ms = None
             if chunk_count > 1:
@@ -804,11 +912,37 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                     tokens_after_abort=tokens_after_abort,
                     reason=abort_reason,
                 )
-            queue_time_ms = round((start_time - request_received) * 1000, 2)
+            # Time before the generator started plus time spent in the inference admission queue.
+            queue_time_ms = round(
+                (start_time - request_received) * 1000 + float(telemetry_sink.get("queue_wait_ms") or 0),
+                2,
+            )
             model_inference_ms = telemetry_sink.get("model_inference_ms")
             stream_duration_ms = telemetry_sink.get("stream_duration_ms")
             token_usage = telemetry_sink.get("token_usage")
             estimated_cost_usd = telemetry_sink.get("estimated_cost_usd")
+            reconcile_usage(
+                token_estimate,
+                level=prompt_mode,
+                token_usage=token_usage,
+                alias=telemetry_sink.get("model_alias"),
+                mode=selected_mode,
+            )
+            # Cache hits are refunded in full; aborted streams pay for what was generated.
+            billed_tokens = usage_tokens(
+                token_estimate,
+                level=prompt_mode,
+                token_usage=token_usage,
+                streamed_text=full_content if inference_started else None,
+            )
+            usage_reconciler.settle(reservation, billed_tokens)
+            usage_ledger.record(
+                user_id,
+                tokens=billed_tokens,
+                token_usage=token_usage,
+                cost_usd=estimated_cost_usd,
+                is_pro=is_pro,
+            )
             log_sampled_success(
                 "messages_stream_observed",
                 request_id=request_id,
@@ -860,6 +994,17 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                 status = "timed_out"
             elif stream_failed:
                 status = "error"
+            if status == "success" and inference_started and assistant_message_id:
+                # Conversation answers are private to their user; the index scopes them by owner.
+                retrieval_index.add(
+                    f"message:{assistant_message_id}",
+                    full_content,
+                    title=content,
+                    source="message",
+                    mode=selected_mode,
+                    level=prompt_mode,
+                    owner=user_id,
+                )
             capture_telemetry_event(
                 "stream_end",
                 request_id=request_id,
@@ -872,6 +1017,16 @@ async def send_message(req: MessageRequest, request: Request, auth_data: dict =
                 fallback_used=fallback_used,
             )
 
+    if detached and event_log is not None and generation_jobs.submit(idempotency_key, event_generator):
+        reader = EventLogReader(
+            event_log.key,
+            0,
+            is_live=lambda: idempotency.is_live(idempotency_key),
+            keepalive_seconds=heartbeat_seconds,
+        )
+        await reader.available()
+        return _build_resume_response(reader)
+
     return StreamingResponse(
         event_generator(),
         media_type="text/event-stream",
@@ -14,12 +14,44 @@ from pydantic import BaseModel, Field
 from auth import check_is_pro, ensure_user_exists, get_supabase_admin, verify_token_optional
 from config import get_settings
 from logging_config import anonymize_text, anonymize_user_id, logger, log_sampled_success
-from services.cache import cache_get, cache_set, cache_set_if_absent
-from services.inference import generate_explanation, generate_stream_explanation
+from services.cache import cache_get, cache_set
+from services.generation_jobs import generation_job_max_seconds, generation_jobs, generation_jobs_enabled
+from services.idempotency import OUTCOME_BUSY, OUTCOME_REPLAY, IdempotencyClaim, IdempotencyManager
+from services.inference import (
+    generate_explanation,
+    generate_learning_batch,
+    generate_stream_explanation,
+    learning_batch_enabled,
+    legacy_response_cache_key,
+    response_cache_key,
+)
 from services.llm_client import get_litellm_config_state
 from services.llm_errors import LLMError, LLMUnavailable
-from services.rate_limit import enforce_request_controls, estimate_tokens_for_text
+from services.rate_limit import enforce_request_controls, usage_reconciler
+from services.retrieval_index import retrieval_index
+from services.search import search_service
+from services.semantic_cache import log_semantic_hit, semantic_cache, semantic_cache_enabled
+from services.sse_resume import (
+    EventLog,
+    EventLogReader,
+    event_log_key,
+    open_event_log,
+    parse_last_event_id,
+    resume_event_stream,
+    sse_resume_enabled,
+)
+from services.stream_cache import (
+    STATUS_COMPLETE,
+    StreamCacheReader,
+    StreamCacheWriter,
+    chunk_list_unusable,
+    read_first_page,
+    stream_cache_enabled,
+    stream_cache_key,
+)
 from services.streaming import SseEventBuilder
+from services.token_estimator import estimate_request_tokens, reconcile_usage, usage_tokens
+from services.usage_ledger import usage_ledger
 from utils import (
     DEFAULT_CHAT_MODE,
     FREE_LEVELS,
@@ -30,7 +62,6 @@ from utils import (
     SUPPORTED_CHAT_MODES,
     normalize_mode,
     sanitize_topic,
-    topic_cache_key,
 )
 
 router = APIRouter(tags=["query"])
@@ -61,7 +92,49 @@ def _normalize_levels(levels: list[str]) -> list[str]:
 
 
 def _cache_key(topic: str, level: str, mode: str) -> str:
-    return topic_cache_key(topic, level, mode=normalize_mode(mode))
+    return response_cache_key(topic, level, normalize_mode(mode))
+
+
+async def _cache_get_exact_response(topic: str, level: str, mode: str) -> dict[str, Any] | None:
+    """Read the canonical cache key, falling back to the legacy slug key while dual-read is on."""
+    key = _cache_key(topic, level, mode)
+    cached = await cache_get(key)
+    if cached or not bool(getattr(get_settings(), "cache_key_dual_read", True)):
+        return cached
+    legacy = await cache_get(legacy_response_cache_key(topic, level, normalize_mode(mode)))
+    if legacy and legacy.get("text"):
+        logger.info("cache_legacy_key_hit", mode=normalize_mode(mode), level=level)
+        await cache_set(key, legacy)
+    return legacy
+
+
+async def _cache_get_response(topic: str, level: str, mode: str) -> dict[str, Any] | None:
+    """Exact-key read, then a near-duplicate lookup against topics this instance has cached."""
+    cached = await _cache_get_exact_response(topic, level, mode)
+    if cached or not semantic_cache_enabled():
+        return cached
+    mode = normalize_mode(mode)
+    match = semantic_cache.lookup(topic, mode=mode, level=level, scope="query")
+    if match is None:
+        return cached
+    similar = await cache_get(match.cache_key)
+    if not similar or not similar.get("text"):
+        # The neighbour's value expired; stop offering it.
+        semantic_cache.forget(match.cache_key, topic=topic, mode=mode, level=level, scope="query")
+        return cached
+    log_semantic_hit(match, mode=mode, level=level, scope="query")
+    return similar
+
+
+async def _cache_set_response(topic: str, level: str, mode: str, text: str) -> str | None:
+    """Write a response to the cache; returns the key on success so records can point at it."""
+    key = _cache_key(topic, level, mode)
+    if not await cache_set(key, {"text": text}):
+        return None
+    if semantic_cache_enabled():
+        semantic_cache.remember(topic, key, mode=normalize_mode(mode), level=level, scope="query")
+    retrieval_index.add(key, text, title=topic, source="explanation", mode=normalize_mode(mode), level=level)
+    return key
 
 
 def _query_stream_idempotency_key(scope: str, message_id: str) -> str:
@@ -103,6 +176,7 @@ def _build_stream_replay_response(
     mode: str,
     message_id: str,
     content: str,
+    stream_key: str | None = None,
 ) -> StreamingResponse:
     async def replay_generator():
         builder = SseEventBuilder()
@@ -116,6 +190,18 @@ def _build_stream_replay_response(
                 "replay": True,
             },
         )
+        if stream_key and stream_cache_enabled():
+            # Chunk lists replay page by page; fall back to the stored text if the list has expired.
+            reader = StreamCacheReader(stream_key, follow=False)
+            async for chunk in reader.chunks():
+                yield builder.emit_json("chunk", {"chunk": chunk})
+            if reader.status == STATUS_COMPLETE:
+                yield builder.emit("done", "[DONE]")
+                return
+            if reader.emitted:
+                yield builder.emit_json("chunk", {"chunk": content[reader.emitted :]})
+                yield builder.emit("done", "[DONE]")
+                return
         for index in range(0, len(content), 400):
             yield builder.emit_json("chunk", {"chunk": content[index : index + 400]})
         yield builder.emit("done", "[DONE]")
@@ -127,6 +213,14 @@ def _build_stream_replay_response(
     )
 
 
+def _build_resume_response(reader: EventLogReader) -> StreamingResponse:
+    return StreamingResponse(
+        resume_event_stream(reader),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
+    )
+
+
 async def _stream_chunks(stream: AsyncIterable[str] | Iterable[str]) -> AsyncIterator[str]:
     if isinstance(stream, AsyncIterable):
         async for chunk in stream:
@@ -174,11 +268,11 @@ async def query_topic(
     effective_user_id = auth_data["user"].id if auth_data else None
     user_id_raw = str(effective_user_id) if effective_user_id else None
     user_id_hash = anonymize_user_id(user_id_raw)
-    estimated_tokens = estimate_tokens_for_text(topic, output_buffer=900 * max(len(levels), 1))
-    await enforce_request_controls(
+    token_estimate = estimate_request_tokens(topic, mode=mode, levels=levels)
+    reservation = await enforce_request_controls(
         user_id=str(effective_user_id) if effective_user_id else None,
         client_ip=request.client.host if request.client else "unknown",
-        estimated_tokens=estimated_tokens,
+        estimated_tokens=token_estimate.total,
     )
 
     explanations: dict[str, str] = {}
@@ -186,7 +280,7 @@ async def query_topic(
 
     if not req.bypass_cache:
         for level in levels:
-            cached = await cache_get(_cache_key(topic, level, mode))
+            cached = await _cache_get_response(topic, level, mode)
             if cached:
                 explanations[level] = cached.get("text", "")
             else:
@@ -195,11 +289,32 @@ async def query_topic(
         missing_levels = levels
 
     if not missing_levels and not req.bypass_cache:
+        usage_reconciler.refund(reservation)
+        usage_ledger.record(user_id_raw, tokens=0, is_pro=is_verified_pro)
         if auth_data:
             await _persist_history_safely(auth_data["user"], topic, levels, mode)
         return QueryResponse(topic=topic, explanations=explanations, cached=True)
 
     level_telemetry = {level: {} for level in missing_levels}
+    generation_strategy = "per_level"
+    if learning_batch_enabled(mode, missing_levels):
+        generation_strategy = "batched"
+        batched = await generate_learning_batch(
+            topic,
+            missing_levels,
+            level_telemetry=level_telemetry,
+            temperature=req.temperature,
+            regenerate=req.regenerate,
+            request_id=request_id,
+            user_id=user_id_raw,
+            is_pro=is_verified_pro,
+        )
+        for level, text in batched.items():
+            explanations[level] = text
+            await _cache_set_response(topic, level, mode, text)
+        if len(batched) < len(missing_levels):
+            # Sections the batch could not deliver are regenerated one level at a time.
+            generation_strategy = "batched_with_fallback"
     tasks = {
         level: generate_explanation(
             topic,
@@ -209,16 +324,18 @@ async def query_topic(
             regenerate=req.regenerate,
             request_id=request_id,
             user_id=user_id_raw,
+            is_pro=is_verified_pro,
             telemetry_sink=level_telemetry[level],
         )
         for level in missing_levels
+        if level not in explanations
     }
     results = await asyncio.gather(*tasks.values(), return_exceptions=True)
 
     for level, result in zip(tasks.keys(), results):
         if isinstance(result, str):
             explanations[level] = result
-            await cache_set(_cache_key(topic, level, mode), {"text": result})
+            await _cache_set_response(topic, level, mode, result)
         else:
             if isinstance(result, LLMError):
                 raise result
@@ -242,9 +359,16 @@ async def query_topic(
     estimated_cost_usd = 0.0
     has_cost = False
     model_inference_values: list[float] = []
+    queue_wait_values: list[float] = []
     model_alias = None
-    for telemetry in level_telemetry.values():
+    billed_tokens = 0
+    for level, telemetry in level_telemetry.items():
         usage = telemetry.get("token_usage")
+        reconcile_usage(token_estimate, level=level, token_usage=usage, alias=telemetry.get("model_alias"))
+        # A level that failed without reporting usage keeps its reservation.
+        billed_tokens += usage_tokens(token_estimate, level=level, token_usage=usage, streamed_text=None) or (
+            token_estimate.reserved_for(level)
+        )
         if isinstance(usage, dict):
             token_usage["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
             token_usage["completion_tokens"] += int(usage.get("completion_tokens") or 0)
@@ -256,17 +380,34 @@ async def query_topic(
         model_ms = telemetry.get("model_inference_ms")
         if isinstance(model_ms, (int, float)):
             model_inference_values.append(float(model_ms))
+        queue_wait = telemetry.get("queue_wait_ms")
+        if isinstance(queue_wait, (int, float)):
+            queue_wait_values.append(float(queue_wait))
         if not model_alias and isinstance(telemetry.get("model_alias"), str):
             model_alias = str(telemetry.get("model_alias"))
 
-    queue_time_ms = round((time.perf_counter() - request_started) * 1000, 2)
+    # Levels served from cache cost nothing, so they are refunded here too.
+    usage_reconciler.settle(reservation, billed_tokens)
+    usage_ledger.record(
+        user_id_raw,
+        tokens=billed_tokens,
+        token_usage=token_usage,
+        cost_usd=estimated_cost_usd if has_cost else None,
+        is_pro=is_verified_pro,
+    )
+
+    latency_ms = round((time.perf_counter() - request_started) * 1000, 2)
+    # Levels are generated in parallel, so the slowest admission is the one the caller waited on.
+    queue_time_ms = round(max(queue_wait_values), 2) if queue_wait_values else 0.0
     model_inference_ms = round(max(model_inference_values), 2) if model_inference_values else None
     log_sampled_success(
         "query_observed",
         request_id=request_id,
         user_id_hash=user_id_hash,
         model_alias=model_alias or mode,
-        latency_ms=queue_time_ms,
+        generation_strategy=generation_strategy,
+        levels_generated=len(missing_levels),
+        latency_ms=latency_ms,
         queue_time_ms=queue_time_ms,
         model_inference_ms=model_inference_ms,
         stream_duration_ms=None,
@@ -317,13 +458,6 @@ async def query_topic_stream(
     effective_user_id = auth_data["user"].id if auth_data else None
     user_id_raw = str(effective_user_id) if effective_user_id else None
     user_id_hash = anonymize_user_id(user_id_raw)
-    estimated_tokens = estimate_tokens_for_text(topic)
-    await enforce_request_controls(
-        user_id=str(effective_user_id) if effective_user_id else None,
-        client_ip=request.client.host if request.client else "unknown",
-        estimated_tokens=estimated_tokens,
-    )
-
     message_id = None
     if req.message_id:
         try:
@@ -368,79 +502,84 @@ async def query_topic_stream(
         cap = 2.0 if is_prod else 5.0
         stream_start_timeout_seconds = min(max(raw_start_timeout, 0.1), cap)
 
-    idempotency_key: str | None = None
-    idempotency_claimed = False
+    idempotency = IdempotencyManager(
+        "query_stream",
+        ttl_seconds=idempotency_ttl_seconds,
+        stale_seconds=idempotency_stale_seconds,
+    )
+    idempotency_claim: IdempotencyClaim | None = None
+    resume_enabled = sse_resume_enabled()
     if message_id:
         scope = user_id_raw or (request.client.host if request.client else "anonymous")
         idempotency_key = _query_stream_idempotency_key(str(scope), message_id)
-        idempotency_payload = await cache_get(idempotency_key)
-        if idempotency_payload:
-            status = idempotency_payload.get("status")
-            if status == "completed" and idempotency_payload.get("response"):
-                return _build_stream_replay_response(
-                    topic=topic,
-                    level=level,
-                    mode=mode,
-                    message_id=message_id or "",
-                    content=str(idempotency_payload.get("response")),
-                )
-            if status == "in_progress":
-                now_ts = int(time.time())
-                started_at = idempotency_payload.get("started_at")
-                started_ts = int(started_at) if isinstance(started_at, (int, float)) else now_ts
-                age_seconds = max(now_ts - started_ts, 0)
-                if age_seconds < idempotency_stale_seconds:
-                    raise HTTPException(status_code=409, detail="Duplicate request already in progress.")
-                reclaimed = await cache_set(
-                    idempotency_key,
-                    {
-                        "status": "reclaimed",
-                        "reclaimed_at": now_ts,
-                        "message_id": message_id,
-                        "mode": mode,
-                    },
-                    ttl=idempotency_ttl_seconds,
+        idempotency_claim = await idempotency.claim(
+            idempotency_key,
+            message_id=message_id,
+            mode=mode,
+            level=level,
+        )
+        last_event_id = parse_last_event_id(request.headers.get("last-event-id")) if resume_enabled else None
+        if last_event_id is not None and idempotency_claim.outcome in {OUTCOME_REPLAY, OUTCOME_BUSY}:
+            reader = EventLogReader(
+                event_log_key(idempotency_key),
+                last_event_id,
+                is_live=lambda: idempotency.is_live(idempotency_key),
+                keepalive_seconds=heartbeat_seconds,
+            )
+            if await reader.available():
+                logger.info(
+                    "query_stream_resumed",
+                    request_id=request_id,
+                    user_id_hash=user_id_hash,
+                    message_id=message_id,
+                    last_event_id=last_event_id,
+                    outcome=idempotency_claim.outcome,
                 )
-                if not reclaimed:
-                    raise HTTPException(status_code=409, detail="Duplicate request already in progress.")
-                idempotency_claimed = True
-
-    if idempotency_key:
-        idempotency_record = {
-            "status": "in_progress",
-            "started_at": int(time.time()),
-            "message_id": message_id,
-            "mode": mode,
-            "level": level,
-        }
-        if idempotency_claimed:
-            reserved = await cache_set(idempotency_key, idempotency_record, ttl=idempotency_ttl_seconds)
-        else:
-            reserved = await cache_set_if_absent(idempotency_key, idempotency_record, idempotency_ttl_seconds)
-        if not reserved:
-            existing = await cache_get(idempotency_key)
-            if existing:
-                status = existing.get("status")
-                if status == "completed" and existing.get("response"):
-                    return _build_stream_replay_response(
-                        topic=topic,
-                        level=level,
-                        mode=mode,
-                        message_id=message_id or "",
-                        content=str(existing.get("response")),
-                    )
-                if status == "in_progress":
-                    now_ts = int(time.time())
-                    started_at = existing.get("started_at")
-                    started_ts = int(started_at) if isinstance(started_at, (int, float)) else now_ts
-                    age_seconds = max(now_ts - started_ts, 0)
-                    if age_seconds < idempotency_stale_seconds:
-                        raise HTTPException(status_code=409, detail="Duplicate request already in progress.")
-                    await cache_set(idempotency_key, idempotency_record, ttl=idempotency_ttl_seconds)
+                return _build_resume_response(reader)
+        if idempotency_claim.outcome == OUTCOME_REPLAY:
+            existing = idempotency_claim.existing or {}
+            return _build_stream_replay_response(
+                topic=topic,
+                level=level,
+                mode=mode,
+                message_id=message_id,
+                content=idempotency_claim.response or "",
+                stream_key=existing.get("stream_key"),
+            )
+        if idempotency_claim.outcome == OUTCOME_BUSY:
+            raise HTTPException(status_code=409, detail="Duplicate request already in progress.")
+
+    # Reserved only once this request is known to generate, so resumes, replays and duplicates cost nothing.
+    token_estimate = estimate_request_tokens(topic, mode=mode, levels=[level])
+    try:
+        reservation = await enforce_request_controls(
+            user_id=str(effective_user_id) if effective_user_id else None,
+            client_ip=request.client.host if request.client else "unknown",
+            estimated_tokens=token_estimate.total,
+        )
+    except HTTPException:
+        # A rejected request must not block a retry with the same message id.
+        if idempotency_claim is not None:
+            await idempotency.fail(idempotency_claim, message_id=message_id, mode=mode, level=level)
+        raise
+
+    # Job mode runs generation as a background task publishing to the event log;
+    # this request (and any reconnect) just follows the log.
+    detached = (
+        idempotency_claim is not None
+        and resume_enabled
+        and generation_jobs_enabled()
+        and generation_jobs.has_capacity()
+    )
+    if detached:
+        stream_max_seconds = max(stream_max_seconds, generation_job_max_seconds())
+    event_log: EventLog | None = None
+    if idempotency_claim is not None and resume_enabled:
+        event_log = open_event_log(event_log_key(idempotency_claim.key), ttl=idempotency_ttl_seconds)
 
     async def event_generator():
         full_content = ""
-        builder = SseEventBuilder()
+        builder = SseEventBuilder(recorder=event_log.record if event_log is not None else None)
         start_time = time.perf_counter()
         queue_started = start_time
         first_event_ms = None
@@ -454,6 +593,13 @@ async def query_topic_stream(
         fallback_used = False
         telemetry_sink: dict[str, Any] = {}
         model_alias: str | None = None
+        use_chunk_cache = stream_cache_enabled()
+        chunk_cache_key = stream_cache_key(_cache_key(topic, level, mode))
+        chunk_writer: StreamCacheWriter | None = None
+        chunk_replay_done = False
+        response_cache_key_written: str | None = None
+        inference_started = False
+        image_prefetch = search_service.prefetch_images(topic)
 
         def record_chunk():
             nonlocal first_token_ms, last_chunk_time, total_chunk_interval_ms, chunk_count
@@ -473,6 +619,45 @@ async def query_topic_stream(
                 return builder.emit_json(event, payload)
             return builder.emit(event, payload)
 
+        async def emit_images():
+            images = await search_service.prefetched_images(image_prefetch)
+            if images:
+                yield emit("images", {"images": images})
+
+        def emit_chunk(chunk: str) -> str:
+            if chunk_writer is not None:
+                chunk_writer.append(chunk)
+            return emit("chunk", {"chunk": chunk})
+
+        async def store_response(content: str) -> None:
+            nonlocal response_cache_key_written
+            response_cache_key_written = await _cache_set_response(topic, level, mode, content)
+            if chunk_writer is not None:
+                await chunk_writer.finish()
+
+        async def new_chunk_writer(*, reset: bool) -> StreamCacheWriter | None:
+            writer = StreamCacheWriter(
+                chunk_cache_key,
+                ttl=int(getattr(settings, "cache_ttl", 3600)),
+                lock_ttl=int(stream_max_seconds + fallback_budget_seconds) + 5,
+            )
+            return writer if await writer.claim(reset=reset) else None
+
+        async def replay_chunk_cache(first_page: list[str] | None = None):
+            nonlocal full_content, chunk_replay_done
+            reader = StreamCacheReader(chunk_cache_key, idle_timeout=stream_start_timeout_seconds)
+            async for text in reader.chunks(first_page=first_page):
+                full_content += text
+                yield emit("chunk", {"chunk": text})
+            if reader.status != STATUS_COMPLETE:
+                if not reader.emitted:
+                    return
+                yield emit("chunk", {"chunk": "\n\n[Connection interrupted. Retry to continue.]"})
+            async for event in emit_images():
+                yield event
+            yield emit("done", "[DONE]")
+            chunk_replay_done = True
+
         async def close_stream(stream):
             close_fn = getattr(stream, "aclose", None)
             if close_fn:
@@ -481,6 +666,9 @@ async def query_topic_stream(
                 except Exception:
                     pass
 
+        if idempotency_claim is not None:
+            idempotency.start_heartbeat(idempotency_claim)
+
         try:
             yield emit(
                 "meta",
@@ -488,16 +676,47 @@ async def query_topic_stream(
             )
 
             if not req.bypass_cache:
-                cached = await cache_get(_cache_key(topic, level, mode))
+                first_page = await read_first_page(chunk_cache_key) if use_chunk_cache else None
+                if first_page and await chunk_list_unusable(chunk_cache_key):
+                    # A crashed or aborted writer's partial list would otherwise be replayed; regenerate over it.
+                    logger.warning("stream_cache_unusable", key=chunk_cache_key)
+                    replayable = False
+                else:
+                    replayable = bool(first_page)
+                if replayable:
+                    async for event in replay_chunk_cache(first_page):
+                        yield event
+                    if chunk_replay_done:
+                        if auth_data:
+                            await _persist_history_safely(auth_data["user"], topic, [level], mode)
+                        return
+
+                cached = await _cache_get_response(topic, level, mode)
                 if cached and cached.get("text"):
                     content = cached["text"]
                     for index in range(0, len(content), chunk_size):
                         yield emit("chunk", {"chunk": content[index : index + chunk_size]})
+                    async for event in emit_images():
+                        yield event
                     yield emit("done", "[DONE]")
                     if auth_data:
                         await _persist_history_safely(auth_data["user"], topic, [level], mode)
                     return
 
+                if first_page is not None:
+                    chunk_writer = await new_chunk_writer(reset=bool(first_page))
+                    if chunk_writer is None:
+                        # Another request is already generating this answer; tail it instead of paying twice.
+                        async for event in replay_chunk_cache():
+                            yield event
+                        if chunk_replay_done:
+                            if auth_data:
+                                await _persist_history_safely(auth_data["user"], topic, [level], mode)
+                            return
+            elif use_chunk_cache:
+                chunk_writer = await new_chunk_writer(reset=True)
+
+            inference_started = True
             stream = generate_stream_explanation(
                 topic,
                 level,
@@ -506,10 +725,12 @@ async def query_topic_stream(
                 regenerate=req.regenerate,
                 request_id=request_id,
                 user_id=user_id_raw,
+                is_pro=is_verified_pro,
                 telemetry_sink=telemetry_sink,
             )
             stream_iter = _stream_chunks(stream)
-            start_deadline = start_time + stream_start_timeout_seconds
+            # Measured from now so time spent on cache reads or tailing does not eat the start budget.
+            start_deadline = time.perf_counter() + stream_start_timeout_seconds
 
             while True:
                 elapsed = time.perf_counter() - start_time
@@ -540,7 +761,7 @@ async def query_topic_stream(
 
                 full_content += chunk
                 record_chunk()
-                yield emit("chunk", {"chunk": chunk})
+                yield emit_chunk(chunk)
 
             no_chunks = chunk_count == 0 and not full_content.strip()
             if (start_timeout or timed_out or no_chunks) and not full_content.strip():
@@ -555,6 +776,7 @@ async def query_topic_stream(
                             regenerate=req.regenerate,
                             request_id=request_id,
                             user_id=user_id_raw,
+                            is_pro=is_verified_pro,
                             telemetry_sink=telemetry_sink,
                         ),
                         timeout=max(
@@ -582,10 +804,12 @@ async def query_topic_stream(
 
                 full_content = str(fallback_content)
                 for index in range(0, len(full_content), chunk_size):
-                    yield emit("chunk", {"chunk": full_content[index : index + chunk_size]})
+                    yield emit_chunk(full_content[index : index + chunk_size])
+                async for event in emit_images():
+                    yield event
                 yield emit("done", "[DONE]")
                 if full_content.strip():
-                    await cache_set(_cache_key(topic, level, mode), {"text": full_content})
+                    await store_response(full_content)
                 if auth_data:
                     await _persist_history_safely(auth_data["user"], topic, [level], mode)
                 return
@@ -593,13 +817,15 @@ async def query_topic_stream(
             if timed_out:
                 cutoff_message = "\n\n[Response truncated to stay within serverless limits. Retry to continue.]"
                 full_content += cutoff_message
-                yield emit("chunk", {"chunk": cutoff_message})
+                yield emit_chunk(cutoff_message)
 
             if full_content.strip():
-                await cache_set(_cache_key(topic, level, mode), {"text": full_content})
+                await store_response(full_content)
             if auth_data:
                 await _persist_history_safely(auth_data["user"], topic, [level], mode)
 
+            async for event in emit_images():
+                yield event
             yield emit("done", "[DONE]")
         except Exception as exc:
             logger.error(
@@ -624,6 +850,7 @@ async def query_topic_stream(
                             regenerate=req.regenerate,
                             request_id=request_id,
                             user_id=user_id_raw,
+                            is_pro=is_verified_pro,
                             telemetry_sink=telemetry_sink,
                         ),
                         timeout=max(
@@ -637,10 +864,12 @@ async def query_topic_stream(
                     full_content = str(fallback_content)
                     for index in range(0, len(full_content), chunk_size):
                         record_chunk()
-                        yield emit("chunk", {"chunk": full_content[index : index + chunk_size]})
+                        yield emit_chunk(full_content[index : index + chunk_size])
+                    async for event in emit_images():
+                        yield event
                     yield emit("done", "[DONE]")
                     if full_content.strip():
-                        await cache_set(_cache_key(topic, level, mode), {"text": full_content})
+                        await store_response(full_content)
                     if auth_data:
                         await _persist_history_safely(auth_data["user"], topic, [level], mode)
                     return
@@ -658,49 +887,63 @@ async def query_topic_stream(
                     )
             if full_content.strip():
                 yield emit("chunk", {"chunk": "\n\n[Connection interrupted. Partial technical response delivered.]"})
+                async for event in emit_images():
+                    yield event
                 yield emit("done", "[DONE]")
                 if full_content.strip():
-                    await cache_set(_cache_key(topic, level, mode), {"text": full_content})
+                    await store_response(full_content)
                 if auth_data:
                     await _persist_history_safely(auth_data["user"], topic, [level], mode)
                 return
             yield emit("error", {"error": "An error occurred while streaming. Please try again."})
             yield emit("done", "[DONE]")
         finally:
-            if idempotency_key and message_id:
+            if event_log is not None:
+                await event_log.close()
+            if chunk_writer is not None:
+                await chunk_writer.abort()
+            if idempotency_claim is not None:
                 if full_content.strip():
-                    await cache_set(
-                        idempotency_key,
-                        {
-                            "status": "completed",
-                            "response": full_content,
-                            "message_id": message_id,
-                            "mode": mode,
-                            "level": level,
-                        },
-                        ttl=idempotency_ttl_seconds,
+                    stream_key = chunk_cache_key if chunk_writer is not None and chunk_writer.completed else None
+                    await idempotency.complete(
+                        idempotency_claim,
+                        full_content,
+                        response_key=response_cache_key_written,
+                        message_id=message_id,
+                        mode=mode,
+                        level=level,
+                        **({"stream_key": stream_key} if stream_key else {}),
                     )
                 else:
-                    await cache_set(
-                        idempotency_key,
-                        {
-                            "status": "failed",
-                            "message_id": message_id,
-                            "mode": mode,
-                            "level": level,
-                        },
-                        ttl=idempotency_ttl_seconds,
-                    )
+                    await idempotency.fail(idempotency_claim, message_id=message_id, mode=mode, level=level)
             total_ms = (time.perf_counter() - start_time) * 1000
             avg_chunk_interval_ms = None
             if chunk_count > 1:
                 avg_chunk_interval_ms = total_chunk_interval_ms / (chunk_count - 1)
-            queue_time_ms = round((queue_started - request_received) * 1000, 2)
+            queue_time_ms = round(
+                (queue_started - request_received) * 1000 + float(telemetry_sink.get("queue_wait_ms") or 0),
+                2,
+            )
             model_alias = str(telemetry_sink.get("model_alias") or mode)
             model_inference_ms = telemetry_sink.get("model_inference_ms")
             stream_duration_ms = telemetry_sink.get("stream_duration_ms")
             token_usage = telemetry_sink.get("token_usage")
             estimated_cost_usd = telemetry_sink.get("estimated_cost_usd")
+            reconcile_usage(token_estimate, level=level, token_usage=token_usage, alias=model_alias)
+            billed_tokens = usage_tokens(
+                token_estimate,
+                level=level,
+                token_usage=token_usage,
+                streamed_text=full_content if inference_started else None,
+            )
+            usage_reconciler.settle(reservation, billed_tokens)
+            usage_ledger.record(
+                user_id_raw,
+                tokens=billed_tokens,
+                token_usage=token_usage,
+                cost_usd=estimated_cost_usd,
+                is_pro=is_verified_pro,
+            )
             log_sampled_success(
                 "query_stream_observed",
                 request_id=request_id,
@@ -726,6 +969,16 @@ async def query_topic_stream(
                 sampled=True,
             )
 
+    if detached and event_log is not None and generation_jobs.submit(idempotency_claim.key, event_generator):
+        reader = EventLogReader(
+            event_log.key,
+            0,
+            is_live=lambda: idempotency.is_live(idempotency_claim.key),
+            keepalive_seconds=heartbeat_seconds,
+        )
+        await reader.available()
+        return _build_resume_response(reader)
+
     return StreamingResponse(
         event_generator(),
         media_type="text/event-stream",
@@ -0,0 +1,39 @@
+"""Per-user token usage endpoint."""
+
+from __future__ import annotations
+
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+
+from auth import verify_token
+from config import get_settings
+from services.usage_ledger import read_usage
+
+router = APIRouter(tags=["usage"])
+
+
+class UsageResponse(BaseModel):
+    """Today's and lifetime usage for the signed-in user."""
+    date: str
+    tier: str
+    requests_today: int
+    tokens_today: int
+    prompt_tokens_today: int
+    completion_tokens_today: int
+    cost_usd_today: float
+    total_requests: int
+    total_tokens: int
+    total_cost_usd: float
+    daily_token_limit: int
+    tokens_remaining: int | None
+
+
+@router.get("/usage", response_model=UsageResponse)
+async def get_usage(auth_data: dict = Depends(verify_token)):
+    usage = await read_usage(str(auth_data["user"].id))
+    limit = max(int(getattr(get_settings(), "daily_token_quota_per_user", 0)), 0)
+    return UsageResponse(
+        **usage,
+        daily_token_limit=limit,
+        tokens_remaining=max(limit - usage["tokens_today"], 0) if limit else None,
+    )
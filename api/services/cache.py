@@ -1,5 +1,7 @@
 """Upstash Redis REST cache service with a Redis-like async interface."""
 
+import base64
+import gzip
 import threading
 from typing import Any
 
@@ -9,6 +11,70 @@ import orjson
 from config import get_settings
 from logging_config import logger
 
+try:
+    import zstandard
+except Exception:  # pragma: no cover - optional dependency
+    zstandard = None  # type: ignore[assignment]
+
+
+# Encoded values are "~kb1:<codec>:<base64 payload>". Values below the size
+# threshold (and everything written before the codec existed) are bare JSON,
+# which can never start with "~", so reads stay backward compatible.
+CACHE_CODEC_VERSION = "kb1"
+_CODEC_PREFIX = f"~{CACHE_CODEC_VERSION}:"
+CODEC_ZSTD = "z"
+CODEC_GZIP = "g"
+
+_zstd_compressor = zstandard.ZstdCompressor(level=3) if zstandard else None
+_zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+
+def _select_codec() -> str | None:
+    configured = str(getattr(get_settings(), "cache_compression_codec", "auto") or "auto").strip().lower()
+    if configured in {"none", "off", "identity"}:
+        return None
+    if configured == "gzip":
+        return CODEC_GZIP
+    return CODEC_ZSTD if _zstd_compressor is not None else CODEC_GZIP
+
+
+def encode_cache_value(value: Any) -> str:
+    """Serialize ``value`` as JSON, compressing it when it is large enough to pay off."""
+    raw = orjson.dumps(value)
+    threshold = int(getattr(get_settings(), "cache_compression_min_bytes", 1024))
+    codec = _select_codec()
+    if codec is None or len(raw) < threshold:
+        return raw.decode("utf-8")
+
+    if codec == CODEC_ZSTD:
+        compressed = _zstd_compressor.compress(raw)
+    else:
+        compressed = gzip.compress(raw, compresslevel=6, mtime=0)
+    encoded = f"{_CODEC_PREFIX}{codec}:{base64.b64encode(compressed).decode('ascii')}"
+    # Base64 costs a third on top of the compressed size; keep plain JSON when that loses.
+    return encoded if len(encoded) < len(raw) else raw.decode("utf-8")
+
+
+def decode_cache_value(payload: bytes | str) -> Any:
+    """Inverse of :func:`encode_cache_value`; also accepts bare JSON from older writers."""
+    if isinstance(payload, (bytes, bytearray)):
+        payload = bytes(payload).decode("utf-8")
+    if not payload.startswith("~"):
+        return orjson.loads(payload)
+
+    header, _, body = payload.partition(":")
+    codec, _, data = body.partition(":")
+    if header != f"~{CACHE_CODEC_VERSION}" or not data:
+        raise ValueError(f"Unsupported cache value header: {header}")
+    compressed = base64.b64decode(data)
+    if codec == CODEC_ZSTD:
+        if _zstd_decompressor is None:
+            raise ValueError("zstandard is required to decode this cache value")
+        return orjson.loads(_zstd_decompressor.decompress(compressed))
+    if codec == CODEC_GZIP:
+        return orjson.loads(gzip.decompress(compressed))
+    raise ValueError(f"Unsupported cache value codec: {codec}")
+
 
 class UpstashRedisCompat:
     """Minimal async Redis-like client backed by Upstash REST API."""
@@ -35,6 +101,22 @@ class UpstashRedisCompat:
 
         return first.get("result") if isinstance(first, dict) else None
 
+    async def _execute_pipeline(self, *commands: tuple[Any, ...]) -> list[Any]:
+        payload = [[str(part) for part in command] for command in commands]
+        response = await self._client.post("/pipeline", json=payload)
+        response.raise_for_status()
+        data = response.json()
+        if not isinstance(data, list) or len(data) != len(commands):
+            raise RuntimeError("Invalid Upstash Redis response")
+
+        results = []
+        for item in data:
+            error = item.get("error") if isinstance(item, dict) else None
+            if error:
+                raise RuntimeError(str(error))
+            results.append(item.get("result") if isinstance(item, dict) else None)
+        return results
+
     async def ping(self) -> bool:
         await self._execute("PING")
         return True
@@ -65,6 +147,14 @@ class UpstashRedisCompat:
     async def eval(self, script: str, numkeys: int, *args: Any) -> Any:
         return await self._execute("EVAL", script, int(numkeys), *args)
 
+    async def eval_batch(self, script: str, calls: list[tuple[list[str], list[Any]]]) -> list[Any]:
+        """Run ``script`` once per (keys, args) pair in a single pipelined round trip."""
+        if not calls:
+            return []
+        return await self._execute_pipeline(
+            *(("EVAL", script, len(keys), *keys, *args) for keys, args in calls)
+        )
+
     async def expire(self, key: str, ttl_seconds: int) -> bool:
         result = await self._execute("EXPIRE", key, int(ttl_seconds))
         return bool(int(result)) if result is not None else False
@@ -73,6 +163,21 @@ class UpstashRedisCompat:
         result = await self._execute("TTL", key)
         return int(result) if result is not None else -2
 
+    async def delete(self, key: str) -> int:
+        result = await self._execute("DEL", key)
+        return int(result) if result is not None else 0
+
+    async def rpush(self, key: str, *values: str, ttl: int | None = None) -> int:
+        """Append values to a list; with ``ttl`` the expiry is set in the same round trip."""
+        if ttl is None:
+            return int(await self._execute("RPUSH", key, *values))
+        length, _ = await self._execute_pipeline(("RPUSH", key, *values), ("EXPIRE", key, int(ttl)))
+        return int(length)
+
+    async def lrange(self, key: str, start: int, stop: int) -> list[str]:
+        result = await self._execute("LRANGE", key, int(start), int(stop))
+        return list(result) if isinstance(result, list) else []
+
     async def close(self) -> None:
         await self._client.aclose()
 
@@ -113,13 +218,7 @@ async def cache_get(key: str) -> dict[str, Any] | None:
         val = await r.get(key)
         if val is None:
             return None
-        if isinstance(val, (bytes, bytearray)):
-            payload = bytes(val)
-        elif isinstance(val, str):
-            payload = val.encode("utf-8")
-        else:
-            payload = str(val).encode("utf-8")
-        loaded = orjson.loads(payload)
+        loaded = decode_cache_value(val if isinstance(val, (bytes, bytearray, str)) else str(val))
         return loaded if isinstance(loaded, dict) else None
     except Exception as e:
         logger.warning("cache_get_failed", key=key, error=str(e))
@@ -132,7 +231,7 @@ async def cache_set(key: str, value: dict[str, Any], ttl: int | None = None) ->
         r = await get_redis()
         settings = get_settings()
         ttl_seconds = int(ttl or getattr(settings, "cache_ttl", 3600))
-        await r.setex(key, ttl_seconds, orjson.dumps(value).decode("utf-8"))
+        await r.setex(key, ttl_seconds, encode_cache_value(value))
         return True
     except Exception as e:
         logger.error("cache_set_failed", key=key, error=str(e))
@@ -143,13 +242,46 @@ async def cache_set_if_absent(key: str, value: dict[str, Any], ttl: int) -> bool
     """Set cached JSON value only if the key is missing."""
     try:
         r = await get_redis()
-        payload = orjson.dumps(value).decode("utf-8")
-        return await r.set_if_not_exists(key, ttl, payload)
+        return await r.set_if_not_exists(key, ttl, encode_cache_value(value))
     except Exception as e:
         logger.error("cache_set_if_absent_failed", key=key, error=str(e))
         return False
 
 
+async def cache_list_append(key: str, values: list[str], ttl: int) -> bool:
+    """Append raw string entries to a list and refresh its TTL."""
+    if not values:
+        return True
+    try:
+        r = await get_redis()
+        await r.rpush(key, *values, ttl=ttl)
+        return True
+    except Exception as e:
+        logger.error("cache_list_append_failed", key=key, error=str(e))
+        return False
+
+
+async def cache_list_range(key: str, start: int, stop: int) -> list[str] | None:
+    """Read raw list entries; returns None (not an empty list) when Redis is unavailable."""
+    try:
+        r = await get_redis()
+        entries = await r.lrange(key, start, stop)
+        return [entry.decode("utf-8") if isinstance(entry, (bytes, bytearray)) else str(entry) for entry in entries]
+    except Exception as e:
+        logger.warning("cache_list_range_failed", key=key, error=str(e))
+        return None
+
+
+async def cache_delete(key: str) -> bool:
+    try:
+        r = await get_redis()
+        await r.delete(key)
+        return True
+    except Exception as e:
+        logger.warning("cache_delete_failed", key=key, error=str(e))
+        return False
+
+
 async def close_redis() -> None:
     """Close Upstash Redis REST client."""
     global _client
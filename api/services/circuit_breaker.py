@@ -0,0 +1,246 @@
+"""Per-model-alias circuit breakers driven by observed LiteLLM errors and latency."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from config import get_settings
+from logging_config import logger
+from services.cache import cache_get, cache_set
+from services.llm_errors import LLMBadRequest, LLMCapacityExceeded, LLMInvalidAPIKey, LLMUnavailable
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+SYNC_INTERVAL_SECONDS = 5.0
+
+# Caller mistakes and our own load shedding say nothing about the model's health.
+_IGNORED_ERRORS = (LLMBadRequest, LLMInvalidAPIKey, LLMCapacityExceeded)
+
+
+class LLMCircuitOpen(LLMUnavailable):
+    """Raised when a model alias is unhealthy and no fallback alias can take the call."""
+
+    error_type = "circuit_open"
+    retryable = True
+
+
+@dataclass(frozen=True)
+class BreakerPolicy:
+    window_seconds: float = 60.0
+    min_requests: int = 10
+    error_rate: float = 0.5
+    slow_call_seconds: float = 20.0
+    slow_call_rate: float = 0.8
+    open_seconds: float = 30.0
+    max_open_seconds: float = 300.0
+    probe_requests: int = 1
+
+    @classmethod
+    def from_settings(cls) -> "BreakerPolicy":
+        settings = get_settings()
+        return cls(
+            window_seconds=float(getattr(settings, "model_breaker_window_seconds", 60)),
+            min_requests=int(getattr(settings, "model_breaker_min_requests", 10)),
+            error_rate=float(getattr(settings, "model_breaker_error_rate", 0.5)),
+            slow_call_seconds=float(getattr(settings, "model_breaker_slow_call_seconds", 20)),
+            slow_call_rate=float(getattr(settings, "model_breaker_slow_call_rate", 0.8)),
+            open_seconds=float(getattr(settings, "model_breaker_open_seconds", 30)),
+            max_open_seconds=float(getattr(settings, "model_breaker_max_open_seconds", 300)),
+            probe_requests=max(int(getattr(settings, "model_breaker_probe_requests", 1)), 1),
+        )
+
+
+@dataclass
+class _Breaker:
+    alias: str
+    state: str = STATE_CLOSED
+    # (monotonic timestamp, ok, slow) for calls inside the rolling window.
+    outcomes: deque[tuple[float, bool, bool]] = field(default_factory=deque)
+    open_until: float = 0.0
+    open_seconds: float = 0.0
+    probes_in_flight: int = 0
+    probe_successes: int = 0
+    last_sync: float = 0.0
+    syncing: bool = False
+
+
+class CircuitBreakerRegistry:
+    """
+    Closed / open / half-open breakers keyed by model alias.
+
+    Decisions are made from in-process state, so ``allow`` never waits on the
+    network. A trip is published to Redis with the open deadline, and other
+    instances adopt it on their next periodic pull. Each instance probes its
+    own way back to closed.
+    """
+
+    def __init__(self, policy: BreakerPolicy | None = None):
+        self.policy = policy or BreakerPolicy()
+        self._breakers: dict[str, _Breaker] = {}
+
+    def _breaker(self, alias: str) -> _Breaker:
+        breaker = self._breakers.get(alias)
+        if breaker is None:
+            breaker = self._breakers[alias] = _Breaker(alias=alias)
+        return breaker
+
+    def reset(self) -> None:
+        self._breakers.clear()
+
+    def state(self, alias: str) -> str:
+        breaker = self._breaker(alias)
+        if breaker.state == STATE_OPEN and time.monotonic() >= breaker.open_until:
+            return STATE_HALF_OPEN
+        return breaker.state
+
+    def snapshot(self) -> dict[str, dict[str, object]]:
+        return {
+            alias: {"state": self.state(alias), "calls": len(breaker.outcomes)}
+            for alias, breaker in self._breakers.items()
+        }
+
+    def allow(self, alias: str) -> bool:
+        """Whether a call to ``alias`` may proceed now; half-open admits a bounded number of probes."""
+        breaker = self._breaker(alias)
+        self._schedule_sync(breaker)
+        if breaker.state == STATE_CLOSED:
+            return True
+        now = time.monotonic()
+        if breaker.state == STATE_OPEN:
+            if now < breaker.open_until:
+                return False
+            breaker.state = STATE_HALF_OPEN
+            breaker.probes_in_flight = 0
+            breaker.probe_successes = 0
+            logger.info("model_breaker_half_open", model_alias=alias)
+        if breaker.probes_in_flight >= self.policy.probe_requests:
+            return False
+        breaker.probes_in_flight += 1
+        return True
+
+    def record_success(self, alias: str, latency_seconds: float) -> None:
+        self._record(alias, ok=True, latency_seconds=latency_seconds)
+
+    def record_failure(self, alias: str, exc: BaseException, latency_seconds: float = 0.0) -> None:
+        if isinstance(exc, (_IGNORED_ERRORS, LLMCircuitOpen, asyncio.CancelledError)):
+            self.release(alias)
+            return
+        self._record(alias, ok=False, latency_seconds=latency_seconds)
+
+    def release(self, alias: str) -> None:
+        """Give back a half-open probe slot for a call that ended without a verdict."""
+        breaker = self._breaker(alias)
+        if breaker.state == STATE_HALF_OPEN and breaker.probes_in_flight:
+            breaker.probes_in_flight -= 1
+
+    def _record(self, alias: str, *, ok: bool, latency_seconds: float) -> None:
+        policy = self.policy
+        breaker = self._breaker(alias)
+        slow = latency_seconds >= policy.slow_call_seconds
+        healthy = ok and not slow
+
+        if breaker.state == STATE_HALF_OPEN:
+            breaker.probes_in_flight = max(breaker.probes_in_flight - 1, 0)
+            if not healthy:
+                self._trip(breaker, reason="probe_failed")
+                return
+            breaker.probe_successes += 1
+            if breaker.probe_successes >= policy.probe_requests:
+                breaker.state = STATE_CLOSED
+                breaker.outcomes.clear()
+                breaker.open_seconds = 0.0
+                logger.info("model_breaker_closed", model_alias=alias)
+            return
+        if breaker.state == STATE_OPEN:
+            # A call admitted before the trip finished; the window restarts on close anyway.
+            return
+
+        now = time.monotonic()
+        breaker.outcomes.append((now, ok, slow))
+        horizon = now - policy.window_seconds
+        while breaker.outcomes and breaker.outcomes[0][0] < horizon:
+            breaker.outcomes.popleft()
+
+        calls = len(breaker.outcomes)
+        if calls < policy.min_requests:
+            return
+        failures = sum(1 for _, call_ok, _ in breaker.outcomes if not call_ok)
+        slow_calls = sum(1 for _, _, call_slow in breaker.outcomes if call_slow)
+        if failures / calls >= policy.error_rate:
+            self._trip(breaker, reason="error_rate", error_rate=round(failures / calls, 3))
+        elif slow_calls / calls >= policy.slow_call_rate:
+            self._trip(breaker, reason="slow_calls", slow_rate=round(slow_calls / calls, 3))
+
+    def _trip(self, breaker: _Breaker, *, reason: str, **fields) -> None:
+        policy = self.policy
+        # Each failed probe doubles the cooldown, up to the cap.
+        if breaker.open_seconds:
+            breaker.open_seconds = min(breaker.open_seconds * 2, policy.max_open_seconds)
+        else:
+            breaker.open_seconds = policy.open_seconds
+        self._open(breaker, breaker.open_seconds)
+        logger.warning(
+            "model_breaker_opened",
+            model_alias=breaker.alias,
+            reason=reason,
+            open_seconds=breaker.open_seconds,
+            **fields,
+        )
+        self._spawn(self._publish(breaker.alias, breaker.open_seconds))
+
+    def _open(self, breaker: _Breaker, seconds: float) -> None:
+        breaker.state = STATE_OPEN
+        breaker.open_until = time.monotonic() + seconds
+        breaker.probes_in_flight = 0
+        breaker.probe_successes = 0
+        breaker.outcomes.clear()
+
+    @staticmethod
+    def _redis_key(alias: str) -> str:
+        return f"knowbear:breaker:{alias}"
+
+    @staticmethod
+    def _spawn(coro) -> None:
+        try:
+            asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+
+    async def _publish(self, alias: str, seconds: float) -> None:
+        await cache_set(
+            self._redis_key(alias),
+            {"state": STATE_OPEN, "until": time.time() + seconds},
+            ttl=max(int(seconds), 1),
+        )
+
+    def _schedule_sync(self, breaker: _Breaker) -> None:
+        now = time.monotonic()
+        if breaker.syncing or now - breaker.last_sync < SYNC_INTERVAL_SECONDS:
+            return
+        breaker.syncing = True
+        breaker.last_sync = now
+        self._spawn(self._pull(breaker))
+
+    async def _pull(self, breaker: _Breaker) -> None:
+        try:
+            remote = await cache_get(self._redis_key(breaker.alias))
+        finally:
+            breaker.syncing = False
+        if not remote or remote.get("state") != STATE_OPEN or breaker.state != STATE_CLOSED:
+            return
+        remaining = float(remote.get("until") or 0) - time.time()
+        if remaining > 0:
+            self._open(breaker, remaining)
+            logger.info("model_breaker_adopted", model_alias=breaker.alias, open_seconds=round(remaining, 2))
+
+
+def model_breaker_enabled() -> bool:
+    return bool(getattr(get_settings(), "model_breaker_enabled", True))
+
+
+circuit_breakers = CircuitBreakerRegistry(BreakerPolicy.from_settings())
@@ -0,0 +1,78 @@
+"""Background generation jobs that outlive the HTTP connection that started them."""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncIterator, Callable
+
+from config import get_settings
+from logging_config import log_sampled_success, logger
+
+
+def generation_jobs_enabled() -> bool:
+    return bool(getattr(get_settings(), "generation_jobs_enabled", False))
+
+
+def generation_job_max_seconds() -> int:
+    return max(int(getattr(get_settings(), "generation_job_max_seconds", 300)), 1)
+
+
+class GenerationJobPool:
+    """
+    Bounded set of asyncio tasks, each draining one SSE event generator.
+
+    A job's frames reach clients through its event log, so the generator runs
+    to completion (and persists its result) whether or not anyone is still
+    subscribed. When the pool is full, ``submit`` refuses and the caller
+    streams inline as before.
+    """
+
+    def __init__(self, max_jobs: int):
+        self.max_jobs = max(int(max_jobs), 1)
+        self._jobs: dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def has_capacity(self) -> bool:
+        return len(self._jobs) < self.max_jobs
+
+    def running(self, job_id: str) -> bool:
+        task = self._jobs.get(job_id)
+        return task is not None and not task.done()
+
+    def submit(self, job_id: str, factory: Callable[[], AsyncIterator[str]]) -> bool:
+        if not self.has_capacity():
+            logger.warning("generation_job_pool_full", active=len(self._jobs), max_jobs=self.max_jobs)
+            return False
+        task = asyncio.create_task(self._run(job_id, factory))
+        self._jobs[job_id] = task
+        task.add_done_callback(lambda done: self._forget(job_id, done))
+        return True
+
+    def _forget(self, job_id: str, task: asyncio.Task) -> None:
+        if self._jobs.get(job_id) is task:
+            del self._jobs[job_id]
+
+    async def _run(self, job_id: str, factory: Callable[[], AsyncIterator[str]]) -> None:
+        events = 0
+        try:
+            async for _frame in factory():
+                events += 1
+        except asyncio.CancelledError:
+            logger.warning("generation_job_cancelled", job_id=job_id, events=events)
+            raise
+        except Exception as exc:
+            logger.error("generation_job_failed", job_id=job_id, error=str(exc), events=events, sampled=False)
+            return
+        log_sampled_success("generation_job_completed", job_id=job_id, events=events)
+
+    async def shutdown(self) -> None:
+        tasks = list(self._jobs.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._jobs.clear()
+
+
+generation_jobs = GenerationJobPool(int(getattr(get_settings(), "generation_job_max_concurrency", 32)))
@@ -0,0 +1,283 @@
+"""Idempotency state machine shared by the streaming routers.
+
+A record moves ``in_progress -> completed | failed``. Claiming is one Lua
+round trip that either returns a record to replay, reports a live duplicate,
+or writes the caller's ``in_progress`` record. Owners refresh ``heartbeat_at``
+while they stream, so a crashed owner is detected within ``stale_seconds``
+instead of after a fixed age.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+import orjson
+
+from logging_config import log_sampled_success, logger
+from services.cache import cache_get, cache_set, cache_set_if_absent, decode_cache_value, get_redis
+
+OUTCOME_CLAIMED = "claimed"
+OUTCOME_RECLAIMED = "reclaimed"
+OUTCOME_REPLAY = "replay"
+OUTCOME_BUSY = "busy"
+
+CLAIM_SCRIPT = (
+    "local raw = redis.call('GET', KEYS[1])\n"
+    "local now = tonumber(ARGV[2])\n"
+    "if raw then\n"
+    "  local ok, record = pcall(cjson.decode, raw)\n"
+    "  if not ok or type(record) ~= 'table' then\n"
+    "    return {'unknown', raw}\n"
+    "  end\n"
+    "  if record['status'] == 'completed' then\n"
+    "    return {'replay', raw}\n"
+    "  end\n"
+    "  if record['status'] == 'in_progress' then\n"
+    "    local beat = tonumber(record['heartbeat_at'] or record['started_at'] or 0) or 0\n"
+    "    if now - beat < tonumber(ARGV[3]) then\n"
+    "      return {'busy', raw}\n"
+    "    end\n"
+    "  end\n"
+    "end\n"
+    "redis.call('SET', KEYS[1], ARGV[1], 'EX', tonumber(ARGV[4]))\n"
+    "if raw then\n"
+    "  return {'reclaimed', raw}\n"
+    "end\n"
+    "return {'claimed', ''}\n"
+)
+
+HEARTBEAT_SCRIPT = (
+    "local raw = redis.call('GET', KEYS[1])\n"
+    "if not raw then return 0 end\n"
+    "local ok, record = pcall(cjson.decode, raw)\n"
+    "if not ok or type(record) ~= 'table' then return 0 end\n"
+    "if record['status'] ~= 'in_progress' or record['owner'] ~= ARGV[1] then return 0 end\n"
+    "record['heartbeat_at'] = tonumber(ARGV[2])\n"
+    "redis.call('SET', KEYS[1], cjson.encode(record), 'EX', tonumber(ARGV[3]))\n"
+    "return 1\n"
+)
+
+
+def response_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def response_body_key(digest: str) -> str:
+    return f"knowbear:response_body:{digest}"
+
+
+async def response_pointer(text: str, *, cache_key: str | None, ttl: int) -> dict[str, str]:
+    """
+    Pointer fields for a completed idempotency record.
+
+    ``cache_key`` is a response-cache entry the caller has already written with
+    this exact text, so nothing else is stored. Without one, the body is written
+    once under its content hash; identical bodies share that entry.
+    """
+    digest = response_digest(text)
+    if cache_key is None:
+        cache_key = response_body_key(digest)
+        await cache_set_if_absent(cache_key, {"text": text}, ttl)
+    return {"response_hash": digest, "response_key": cache_key}
+
+
+async def resolve_response(record: dict[str, Any]) -> str | None:
+    """Return the body a completed record points at, or None if it expired or was replaced."""
+    inline = record.get("response")
+    if inline:
+        # Records written before pointers embedded the body.
+        return str(inline)
+
+    digest = record.get("response_hash")
+    key = record.get("response_key")
+    if not digest or not key:
+        return None
+    payload = await cache_get(str(key))
+    if not payload:
+        return None
+    text = payload.get("text") or payload.get("response")
+    if not text or response_digest(str(text)) != digest:
+        return None
+    return str(text)
+
+
+@dataclass
+class IdempotencyClaim:
+    key: str
+    outcome: str
+    record: dict[str, Any]
+    existing: dict[str, Any] | None = None
+    response: str | None = None
+    heartbeat_task: asyncio.Task | None = field(default=None, repr=False)
+
+    @property
+    def owned(self) -> bool:
+        return self.outcome in {OUTCOME_CLAIMED, OUTCOME_RECLAIMED}
+
+
+class IdempotencyManager:
+    """Claim, heartbeat, and settle idempotency records for one router namespace."""
+
+    def __init__(self, namespace: str, *, ttl_seconds: int, stale_seconds: int):
+        self.namespace = namespace
+        self.ttl_seconds = max(int(ttl_seconds), 1)
+        self.stale_seconds = max(int(stale_seconds), 1)
+        self.heartbeat_seconds = max(self.stale_seconds / 3, 1.0)
+
+    async def claim(self, key: str, **fields: Any) -> IdempotencyClaim:
+        """Claim ``key`` for this request, or return the record to replay / report as busy."""
+        now = int(time.time())
+        record = {
+            "status": "in_progress",
+            "owner": uuid.uuid4().hex,
+            "started_at": now,
+            "heartbeat_at": now,
+            **fields,
+        }
+        try:
+            redis = await get_redis()
+            result = await redis.eval(
+                CLAIM_SCRIPT,
+                1,
+                key,
+                orjson.dumps(record).decode("utf-8"),
+                now,
+                self.stale_seconds,
+                self.ttl_seconds,
+            )
+            outcome = str(result[0])
+            raw = result[1] if len(result) > 1 else None
+        except Exception as exc:
+            # Redis being down must not block chat; proceed as if the claim succeeded.
+            logger.warning("idempotency_claim_failed", namespace=self.namespace, error=str(exc))
+            _record_metric(self.namespace, "error")
+            return IdempotencyClaim(key=key, outcome=OUTCOME_CLAIMED, record=record)
+
+        existing = _decode_record(raw)
+        if outcome == "unknown":
+            # Values Lua cannot parse (e.g. compressed legacy records) are settled here.
+            outcome = OUTCOME_REPLAY if existing and existing.get("status") == "completed" else OUTCOME_RECLAIMED
+            if outcome == OUTCOME_RECLAIMED:
+                await cache_set(key, record, ttl=self.ttl_seconds)
+
+        response = None
+        if outcome == OUTCOME_REPLAY:
+            response = await resolve_response(existing or {})
+            if response is None:
+                # The body expired or was replaced; regenerate rather than replay nothing.
+                outcome = OUTCOME_RECLAIMED
+                await cache_set(key, record, ttl=self.ttl_seconds)
+
+        _record_metric(self.namespace, outcome)
+        if outcome == OUTCOME_CLAIMED:
+            log_sampled_success("idempotency_claim", namespace=self.namespace, outcome=outcome)
+        else:
+            logger.info("idempotency_claim", namespace=self.namespace, outcome=outcome)
+        return IdempotencyClaim(key=key, outcome=outcome, record=record, existing=existing, response=response)
+
+    async def update(self, claim: IdempotencyClaim, **fields: Any) -> None:
+        claim.record.update(fields)
+        claim.record["heartbeat_at"] = int(time.time())
+        await cache_set(claim.key, claim.record, ttl=self.ttl_seconds)
+
+    async def is_live(self, key: str) -> bool:
+        """Whether an owner is still streaming ``key`` (in progress with a fresh heartbeat)."""
+        record = await cache_get(key)
+        if not record or record.get("status") != "in_progress":
+            return False
+        beat = record.get("heartbeat_at") or record.get("started_at") or 0
+        return int(time.time()) - int(beat) < self.stale_seconds
+
+    def start_heartbeat(self, claim: IdempotencyClaim) -> None:
+        if not claim.owned or claim.heartbeat_task is not None:
+            return
+
+        async def _beat() -> None:
+            while True:
+                await asyncio.sleep(self.heartbeat_seconds)
+                if not await self._heartbeat(claim):
+                    _record_metric(self.namespace, "heartbeat_lost")
+                    logger.warning("idempotency_heartbeat_lost", namespace=self.namespace)
+                    return
+
+        claim.heartbeat_task = asyncio.create_task(_beat())
+
+    async def _heartbeat(self, claim: IdempotencyClaim) -> bool:
+        try:
+            redis = await get_redis()
+            result = await redis.eval(
+                HEARTBEAT_SCRIPT,
+                1,
+                claim.key,
+                claim.record.get("owner", ""),
+                int(time.time()),
+                self.ttl_seconds,
+            )
+            return bool(int(result or 0))
+        except Exception as exc:
+            logger.warning("idempotency_heartbeat_failed", namespace=self.namespace, error=str(exc))
+            return True
+
+    async def stop_heartbeat(self, claim: IdempotencyClaim) -> None:
+        task = claim.heartbeat_task
+        claim.heartbeat_task = None
+        if task is None or task.done():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def complete(
+        self,
+        claim: IdempotencyClaim,
+        response: str,
+        *,
+        response_key: str | None,
+        **fields: Any,
+    ) -> None:
+        await self.stop_heartbeat(claim)
+        record = {
+            "status": "completed",
+            **fields,
+            **await response_pointer(response, cache_key=response_key, ttl=self.ttl_seconds),
+        }
+        await cache_set(claim.key, record, ttl=self.ttl_seconds)
+        _record_metric(self.namespace, "completed")
+
+    async def fail(self, claim: IdempotencyClaim, **fields: Any) -> None:
+        await self.stop_heartbeat(claim)
+        await cache_set(claim.key, {"status": "failed", **fields}, ttl=self.ttl_seconds)
+        _record_metric(self.namespace, "failed")
+
+
+def _decode_record(raw: Any) -> dict[str, Any] | None:
+    if not raw:
+        return None
+    try:
+        loaded = decode_cache_value(raw)
+    except Exception:
+        return None
+    return loaded if isinstance(loaded, dict) else None
+
+
+_metrics: Counter[tuple[str, str]] = Counter()
+
+
+def _record_metric(namespace: str, outcome: str) -> None:
+    _metrics[(namespace, outcome)] += 1
+
+
+def idempotency_metrics() -> dict[str, dict[str, int]]:
+    """Per-namespace counts of claim outcomes and settlements since process start."""
+    snapshot: dict[str, dict[str, int]] = {}
+    for (namespace, outcome), count in _metrics.items():
+        snapshot.setdefault(namespace, {})[outcome] = count
+    return snapshot
@@ -4,28 +4,35 @@ import asyncio
 import json
 import re
 import time
+from collections import Counter, deque
+from collections.abc import AsyncIterator, Sequence
+from contextlib import aclosing, asynccontextmanager
 import httpx
 import structlog
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from config import get_settings
-from prompts import (
-    PROMPTS,
-    TECHNICAL_DEPTH_PROMPT,
-    TECHNICAL_STRUCTURED_PROMPT,
-    TECHNICAL_COMPARE_PROMPT,
-    TECHNICAL_BRAINSTORM_PROMPT,
-    _TECHNICAL_DEEPER_LAYER,
-    _TECHNICAL_DIAGRAM_INSTRUCTION,
-)
 from logging_config import logger, anonymize_user_id, log_sampled_success
+from services.prompt_registry import prompt_registry
 from services.search import search_service
+from services.learning_batch import LevelSectionSplitter, split_usage
 from services.intent import (
+    STREAM_FIRST_HEADER_CHARS,
+    StructureTracker,
     detect_intent_and_depth,
     detect_diagram_type,
     validate_technical_response,
 )
-from utils import LEARNING_MODE, SOCRATIC_MODE, TECHNICAL_MODE, normalize_mode
+from utils import (
+    LEARNING_MODE,
+    SOCRATIC_MODE,
+    TECHNICAL_MODE,
+    canonical_topic_key,
+    normalize_mode,
+    topic_cache_key,
+)
 from services.llm_client import close_llm_client, create_chat_completion, stream_chat_completion
+from services.circuit_breaker import LLMCircuitOpen, circuit_breakers, model_breaker_enabled
+from services.llm_errors import LLMCapacityExceeded
 
 _tech_logger = structlog.get_logger(__name__)
 
@@ -60,6 +67,31 @@ def _learning_model_for_level(level: str) -> str:
     return LEARNING_MODEL_SIMPLE
 
 
+def _default_model_alias(mode: str, level: str) -> str:
+    if mode == TECHNICAL_MODE:
+        return TECHNICAL_MODEL_PRIMARY
+    if mode == SOCRATIC_MODE:
+        return "socratic"
+    return _learning_model_for_level(level)
+
+
+def response_cache_version(mode: str, level: str) -> str:
+    """Version tag for cached responses: prompt template hash plus the model alias that serves it."""
+    mode = normalize_mode(mode)
+    return f"{prompt_registry.version_for(mode, level)}.{_default_model_alias(mode, level)}"
+
+
+def response_cache_key(topic: str, level: str, mode: str) -> str:
+    """Cache key for a generated explanation, invalidated when its prompt or model alias changes."""
+    mode = normalize_mode(mode)
+    return canonical_topic_key(topic, level, mode=mode, version=response_cache_version(mode, level))
+
+
+def legacy_response_cache_key(topic: str, level: str, mode: str) -> str:
+    """Unversioned slug key the previous release wrote, read during the dual-read migration window."""
+    return topic_cache_key(topic, level, mode=normalize_mode(mode))
+
+
 def build_technical_prompt(
     topic: str,
     intent: str,
@@ -67,35 +99,38 @@ def build_technical_prompt(
     diagram_type: str | None,
 ) -> str:
     """
-    Assembles the final prompt string from components.
+    Renders the precompiled technical prompt for this combination.
     No LLM calls. Pure string construction.
     """
-    diagram_instruction = (
-        _TECHNICAL_DIAGRAM_INSTRUCTION.format(diagram_type=diagram_type)
-        if diagram_type and intent != "compare"
-        else ""
-    )
-
-    if intent == "brainstorm":
-        return TECHNICAL_BRAINSTORM_PROMPT.format(
-            topic=topic,
-            diagram_instruction=diagram_instruction,
-        )
-
-    if intent == "compare":
-        return TECHNICAL_COMPARE_PROMPT.format(topic=topic)
+    compiled = prompt_registry.get(TECHNICAL_MODE, intent=intent, depth=depth, diagram_type=diagram_type)
+    return compiled.render(topic=topic) if compiled else ""
 
-    deeper_layer_instruction = _TECHNICAL_DEEPER_LAYER if depth == "deep" else ""
 
-    return TECHNICAL_STRUCTURED_PROMPT.format(
-        topic=topic,
-        deeper_layer_instruction=deeper_layer_instruction,
-        diagram_instruction=diagram_instruction,
-    )
+def _classify_technical(topic: str, failure_event: str) -> tuple[str, str, str | None]:
+    """(intent, depth, diagram_type) for a technical topic, with safe defaults if classification fails."""
+    intent = "unknown"
+    depth = "shallow"
+    diagram_type = "generic"
+    try:
+        classification = detect_intent_and_depth(topic)
+        intent = classification["intent"]
+        depth = classification["depth"]
+        diagram_type = detect_diagram_type(topic)
+    except Exception as exc:
+        _tech_logger.warning(
+            failure_event,
+            error=str(exc),
+            intent=intent,
+            depth=depth,
+            diagram_type=diagram_type,
+        )
+    return intent, depth, diagram_type
 
 
 async def technical_mode_handler(
     topic: str,
+    *,
+    classification: tuple[str, str, str | None] | None = None,
     **kwargs,
 ) -> str:
     """
@@ -108,25 +143,15 @@ async def technical_mode_handler(
     - Output validation with one retry on invalid output
     - Guaranteed non-empty return (last resort response if all else fails)
 
-    kwargs are passed through to call_model for telemetry/request_id/etc.
+    ``classification`` is an (intent, depth, diagram_type) tuple from a caller
+    that already classified the topic (the stream fallback), so it is not
+    classified twice. kwargs are passed through to call_model for
+    telemetry/request_id/etc.
     Never raises. Always returns a non-empty string.
     """
-    intent = "unknown"
-    depth = "shallow"
-    diagram_type = "generic"
-    try:
-        classification = detect_intent_and_depth(topic)
-        intent = classification["intent"]
-        depth = classification["depth"]
-        diagram_type = detect_diagram_type(topic)
-    except Exception as exc:
-        _tech_logger.warning(
-            "technical_classification_failed",
-            error=str(exc),
-            intent=intent,
-            depth=depth,
-            diagram_type=diagram_type,
-        )
+    if classification is None:
+        classification = _classify_technical(topic, "technical_classification_failed")
+    intent, depth, diagram_type = classification
 
     prompt = build_technical_prompt(topic, intent, depth, diagram_type)
     if not prompt or not prompt.strip():
@@ -321,6 +346,236 @@ def _extract_estimated_cost(result, usage: dict[str, int] | None) -> float | Non
     return None
 
 
+PRIORITY_PRO = "pro"
+PRIORITY_FREE = "free"
+_ADMISSION_LANES = (PRIORITY_PRO, PRIORITY_FREE)
+
+
+def _parse_alias_limits(raw: str) -> dict[str, int]:
+    """Parse ``"technical-primary=8,default-fast=32"`` into per-alias caps."""
+    limits: dict[str, int] = {}
+    for part in (raw or "").split(","):
+        alias, _, value = part.partition("=")
+        try:
+            limits[alias.strip()] = max(int(value), 1)
+        except ValueError:
+            continue
+    return limits
+
+
+class _AliasGate:
+    __slots__ = ("limit", "active", "queues", "service_seconds")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.queues: dict[str, deque[asyncio.Future]] = {lane: deque() for lane in _ADMISSION_LANES}
+        # EWMA of how long a call holds its slot, used to predict queue waits.
+        self.service_seconds = 2.0
+
+
+class InferenceScheduler:
+    """
+    Admission control for LiteLLM calls made by this process.
+
+    Each model alias admits at most ``limit`` concurrent calls. Waiters queue
+    in a Pro or free lane, and a freed slot goes to the Pro lane first. Each
+    lane is bounded. A request is rejected up front when its deadline cannot
+    be met given the backlog, so it does not time out later.
+    """
+
+    def __init__(self, *, default_limit: int, alias_limits: dict[str, int], max_queue: int, max_wait_seconds: float):
+        self.default_limit = max(int(default_limit), 1)
+        self.alias_limits = dict(alias_limits)
+        self.max_queue = max(int(max_queue), 0)
+        self.max_wait_seconds = max(float(max_wait_seconds), 0.0)
+        self._gates: dict[str, _AliasGate] = {}
+        self.rejections: Counter[tuple[str, str]] = Counter()
+
+    def _gate(self, alias: str) -> _AliasGate:
+        gate = self._gates.get(alias)
+        if gate is None:
+            gate = self._gates[alias] = _AliasGate(self.alias_limits.get(alias, self.default_limit))
+        return gate
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        return {
+            alias: {
+                "active": gate.active,
+                "limit": gate.limit,
+                **{f"queued_{lane}": len(queue) for lane, queue in gate.queues.items()},
+            }
+            for alias, gate in self._gates.items()
+        }
+
+    def _reject(self, alias: str, priority: str, reason: str, **fields) -> LLMCapacityExceeded:
+        self.rejections[(alias, reason)] += 1
+        logger.warning("inference_admission_rejected", model_alias=alias, priority=priority, reason=reason, **fields)
+        return LLMCapacityExceeded("Inference capacity exceeded. Please retry shortly.")
+
+    @asynccontextmanager
+    async def admit(self, alias: str, *, priority: str = PRIORITY_FREE, deadline: float | None = None):
+        """
+        Hold one of ``alias``'s slots for the body of the ``async with``.
+
+        ``deadline`` is a ``time.perf_counter()`` timestamp. The context value
+        is the time spent queued, in milliseconds.
+        """
+        gate = self._gate(alias)
+        lane = priority if priority in gate.queues else PRIORITY_FREE
+        queued_at = time.perf_counter()
+        if gate.active < gate.limit:
+            gate.active += 1
+        else:
+            await self._wait_for_slot(alias, gate, lane, deadline)
+        held_at = time.perf_counter()
+        try:
+            yield round((held_at - queued_at) * 1000, 2)
+        finally:
+            gate.service_seconds = 0.8 * gate.service_seconds + 0.2 * (time.perf_counter() - held_at)
+            self._release(gate)
+
+    async def _wait_for_slot(self, alias: str, gate: _AliasGate, lane: str, deadline: float | None) -> None:
+        queue = gate.queues[lane]
+        if len(queue) >= self.max_queue:
+            raise self._reject(alias, lane, "queue_full", queued=len(queue))
+
+        ahead = len(gate.queues[PRIORITY_PRO]) + (len(queue) if lane == PRIORITY_FREE else 0)
+        expected_wait = (ahead + 1) / gate.limit * gate.service_seconds
+        timeout = self.max_wait_seconds
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.perf_counter())
+        if expected_wait > timeout:
+            raise self._reject(alias, lane, "deadline", expected_wait_ms=round(expected_wait * 1000, 2))
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=timeout)
+        except asyncio.TimeoutError:
+            _discard(queue, waiter)
+            raise self._reject(alias, lane, "timeout", waited_ms=round(timeout * 1000, 2)) from None
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled; pass it on.
+                self._release(gate)
+            else:
+                _discard(queue, waiter)
+            raise
+
+    def _release(self, gate: _AliasGate) -> None:
+        for lane in _ADMISSION_LANES:
+            queue = gate.queues[lane]
+            while queue:
+                waiter = queue.popleft()
+                if not waiter.done():
+                    # Hand the slot straight over so a new arrival cannot jump the queue.
+                    waiter.set_result(None)
+                    return
+        gate.active -= 1
+
+
+def _discard(queue: deque, waiter: asyncio.Future) -> None:
+    try:
+        queue.remove(waiter)
+    except ValueError:
+        pass
+
+
+def _build_scheduler() -> InferenceScheduler:
+    settings = get_settings()
+    return InferenceScheduler(
+        default_limit=int(getattr(settings, "inference_max_concurrency", 16)),
+        alias_limits=_parse_alias_limits(str(getattr(settings, "inference_alias_concurrency", "") or "")),
+        max_queue=int(getattr(settings, "inference_queue_max", 64)),
+        max_wait_seconds=float(getattr(settings, "inference_queue_timeout_seconds", 10)),
+    )
+
+
+inference_scheduler = _build_scheduler()
+
+
+# Where a call goes while its alias's breaker is open, instead of waiting for it to time out.
+_BREAKER_FALLBACKS = {
+    TECHNICAL_MODEL_PRIMARY: TECHNICAL_MODEL_FALLBACK,
+    LEARNING_MODEL_DETAILED: LEARNING_MODEL_SIMPLE,
+}
+
+
+def _route_alias(alias: str) -> str:
+    """``alias`` itself, or its fallback while ``alias``'s breaker is open."""
+    if not model_breaker_enabled() or circuit_breakers.allow(alias):
+        return alias
+    fallback = _BREAKER_FALLBACKS.get(alias)
+    if fallback and circuit_breakers.allow(fallback):
+        logger.info("model_breaker_rerouted", model_alias=alias, fallback_alias=fallback)
+        return fallback
+    raise LLMCircuitOpen(f"Model {alias} is temporarily unavailable.")
+
+
+def _breaker_success(alias: str, latency_seconds: float) -> None:
+    if model_breaker_enabled():
+        circuit_breakers.record_success(alias, latency_seconds)
+
+
+def _breaker_failure(alias: str, exc: BaseException, latency_seconds: float) -> None:
+    if model_breaker_enabled():
+        circuit_breakers.record_failure(alias, exc, latency_seconds)
+
+
+def _breaker_release(alias: str) -> None:
+    """Return the probe slot ``_route_alias`` took for a call that never reached the model."""
+    if model_breaker_enabled():
+        circuit_breakers.release(alias)
+
+
+def _admission_priority(kwargs: dict) -> str:
+    return PRIORITY_PRO if kwargs.get("is_pro") else PRIORITY_FREE
+
+
+def _record_queue_wait(telemetry_sink: dict | None, wait_ms: float) -> None:
+    if telemetry_sink is not None:
+        telemetry_sink["queue_wait_ms"] = round(float(telemetry_sink.get("queue_wait_ms") or 0) + wait_ms, 2)
+
+
+async def _admitted_stream(alias: str, admission: dict, **stream_kwargs):
+    """``stream_chat_completion`` behind the alias's breaker, holding an admission slot for the stream."""
+    alias = _route_alias(alias)
+    admitted = False
+    try:
+        async with inference_scheduler.admit(
+            alias,
+            priority=_admission_priority(admission),
+            deadline=admission.get("deadline"),
+        ) as wait_ms:
+            admitted = True
+            route_sink = admission.get("telemetry_sink")
+            _record_queue_wait(route_sink if isinstance(route_sink, dict) else None, wait_ms)
+            started = time.perf_counter()
+            first_chunk_at: float | None = None
+            try:
+                # aclosing: a consumer that stops early (e.g. an off-track technical stream) closes the provider stream now.
+                async with aclosing(stream_chat_completion(model=alias, **stream_kwargs)) as chunks:
+                    async for chunk in chunks:
+                        if first_chunk_at is None:
+                            first_chunk_at = time.perf_counter()
+                        yield chunk
+            except Exception as exc:
+                _breaker_failure(alias, exc, time.perf_counter() - started)
+                raise
+            except BaseException:
+                # The consumer stopped early; that says nothing about the model's health.
+                _breaker_release(alias)
+                raise
+            # Time to first token is what a slow provider costs a streaming user.
+            _breaker_success(alias, (first_chunk_at or time.perf_counter()) - started)
+    except BaseException:
+        # Rejected or cancelled while queued: the model was never called, so the probe slot goes back.
+        if not admitted:
+            _breaker_release(alias)
+        raise
+
+
 @retry(
     stop=stop_after_attempt(2),
     wait=wait_exponential(multiplier=1, min=2, max=10),
@@ -333,20 +588,39 @@ async def call_model(model: str | None, prompt: str, max_tokens: int = 1024, **k
     if model in ["openai/gpt-oss-20b", "gpt-oss-20b", "deep_dive"]:
         task = "coding"
             
+    alias = _route_alias(model or "default-fast")
+    admitted = False
     try:
-        alias = model or "default-fast"
         request_id = kwargs.get("request_id")
         retry_flag = bool(kwargs.get("regenerate", False))
         anonymized_user_id = anonymize_user_id(str(kwargs.get("user_id") or "") or None)
         telemetry_sink = kwargs.get("telemetry_sink") if isinstance(kwargs.get("telemetry_sink"), dict) else None
-        model_start = time.perf_counter()
-        result = await create_chat_completion(
-            model=alias,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=max_tokens,
-            temperature=kwargs.get("temperature", 0.7),
-            request_id=request_id,
-        )
+        try:
+            async with inference_scheduler.admit(
+                alias,
+                priority=_admission_priority(kwargs),
+                deadline=kwargs.get("deadline"),
+            ) as queue_wait_ms:
+                admitted = True
+                _record_queue_wait(telemetry_sink, queue_wait_ms)
+                model_start = time.perf_counter()
+                try:
+                    result = await create_chat_completion(
+                        model=alias,
+                        messages=[{"role": "user", "content": prompt}],
+                        max_tokens=max_tokens,
+                        temperature=kwargs.get("temperature", 0.7),
+                        request_id=request_id,
+                    )
+                except BaseException as exc:
+                    _breaker_failure(alias, exc, time.perf_counter() - model_start)
+                    raise
+        except BaseException:
+            # Rejected or cancelled while queued: the model was never called, so the probe slot goes back.
+            if not admitted:
+                _breaker_release(alias)
+            raise
+        _breaker_success(alias, time.perf_counter() - model_start)
         model_inference_ms = round((time.perf_counter() - model_start) * 1000, 2)
         usage = _extract_usage_dict(getattr(result, "usage", None))
         estimated_cost_usd = _extract_estimated_cost(result, usage)
@@ -364,6 +638,7 @@ async def call_model(model: str | None, prompt: str, max_tokens: int = 1024, **k
             model_alias=alias,
             model=model_name,
             latency_ms=model_inference_ms,
+            queue_wait_ms=queue_wait_ms,
             token_usage=usage,
             estimated_cost_usd=estimated_cost_usd,
             retry=retry_flag,
@@ -376,7 +651,7 @@ async def call_model(model: str | None, prompt: str, max_tokens: int = 1024, **k
         logger.error(
             "inference_failed",
             error=str(e),
-            model_alias=model or "default-fast",
+            model_alias=alias,
             request_id=kwargs.get("request_id"),
             user_id_hash=anonymize_user_id(str(kwargs.get("user_id") or "") or None),
             retry=bool(kwargs.get("regenerate", False)),
@@ -396,21 +671,21 @@ async def generate_explanation(topic: str, level: str, model: str | None = None,
     # ────────────────────────────────────────────────────────────────────────
 
     if mode == SOCRATIC_MODE:
-        template = PROMPTS.get("socratic")
+        template = prompt_registry.get(SOCRATIC_MODE)
         if not template:
             raise ValueError("Unknown mode template: socratic")
-        prompt = template.format(
+        prompt = template.render(
             topic=topic,
             conversation_context=kwargs.get("conversation_context", "No prior context."),
         )
         response = await call_model(model or "socratic", prompt, **kwargs)
         return _enforce_socratic_response_constraints(response)
 
-    template = PROMPTS.get(level)
+    template = prompt_registry.get(LEARNING_MODE, level=level)
     if not template:
         raise ValueError(f"Unknown level: {level}")
         
-    prompt = template.format(topic=topic)
+    prompt = template.render(topic=topic)
         
     model_alias = model or _learning_model_for_level(level)
     return await call_model(model_alias, prompt, **kwargs)
@@ -424,65 +699,130 @@ async def generate_stream_explanation(topic: str, level: str, model: str | None
     prompt = ""
 
     if mode == TECHNICAL_MODE:
-        intent = "unknown"
-        depth = "shallow"
-        diagram_type = "generic"
-        try:
-            classification = detect_intent_and_depth(topic)
-            intent = classification["intent"]
-            depth = classification["depth"]
-            diagram_type = detect_diagram_type(topic)
-        except Exception as exc:
-            _tech_logger.warning(
-                "technical_stream_classification_failed",
-                error=str(exc),
-                intent=intent,
-                depth=depth,
-                diagram_type=diagram_type,
-            )
+        intent, depth, diagram_type = _classify_technical(topic, "technical_stream_classification_failed")
 
         prompt = build_technical_prompt(topic, intent, depth, diagram_type)
         if not prompt or not prompt.strip():
             prompt = TECHNICAL_MINIMAL_PROMPT
 
         alias = model or TECHNICAL_MODEL_PRIMARY
+        settings = get_settings()
+        # One switch to the fallback model when the primary goes off structure before anything was shown.
+        switch_alias = (
+            TECHNICAL_MODEL_FALLBACK
+            if alias != TECHNICAL_MODEL_FALLBACK and bool(getattr(settings, "technical_stream_early_abort", True))
+            else None
+        )
+        probe_chars = int(getattr(settings, "technical_stream_probe_chars", STREAM_FIRST_HEADER_CHARS))
         stream_telemetry: dict[str, object] = {}
         stream_start = time.perf_counter()
         streamed_chunks = 0
         stream_completed = True
         partial_failure = False
-
-        try:
-            async for chunk in stream_chat_completion(
-                model=alias,
+        structure_abort: dict[str, object] | None = None
+
+        while True:
+            tracker = StructureTracker(intent, first_header_chars=probe_chars)
+            # Chunks are held back until a required header shows up, so an off-track start can be
+            # discarded and regenerated without the user seeing it.
+            held: list[str] | None = []
+            attempt_chunks = 0
+            off_track: str | None = None
+            stream = _admitted_stream(
+                alias,
+                kwargs,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=TECHNICAL_MAX_TOKENS,
                 temperature=TECHNICAL_TEMPERATURE,
                 request_id=request_id,
                 telemetry_sink=stream_telemetry,
-            ):
-                streamed_chunks += 1
-                yield chunk
-        except Exception as exc:
-            _tech_logger.warning(
-                "technical_stream_failed",
-                error=str(exc),
-                streamed_chunks=streamed_chunks,
-                model_alias=alias,
             )
-            if streamed_chunks == 0:
-                full_response = await technical_mode_handler(topic, **kwargs)
-                for index in range(0, len(full_response), 400):
-                    yield full_response[index : index + 400]
-            else:
-                stream_completed = False
-                partial_failure = True
+            try:
+                async for chunk in stream:
+                    attempt_chunks += 1
+                    off_track = tracker.feed(chunk)
+                    if held is None:
+                        streamed_chunks += 1
+                        yield chunk
+                        continue
+                    held.append(chunk)
+                    if off_track and switch_alias:
+                        break
+                    if tracker.on_track or off_track:
+                        released, held = held, None
+                        for pending in released:
+                            streamed_chunks += 1
+                            yield pending
+            except Exception as exc:
                 _tech_logger.warning(
-                    "technical_stream_partial_failure",
+                    "technical_stream_failed",
                     error=str(exc),
                     streamed_chunks=streamed_chunks,
                     model_alias=alias,
-                    partial_failure=True,
+                )
+                if attempt_chunks == 0 and streamed_chunks == 0:
+                    full_response = await technical_mode_handler(
+                        topic, classification=(intent, depth, diagram_type), **kwargs
+                    )
+                    for index in range(0, len(full_response), 400):
+                        yield full_response[index : index + 400]
+                else:
+                    for pending in held or ():
+                        streamed_chunks += 1
+                        yield pending
+                    stream_completed = False
+                    partial_failure = True
+                    _tech_logger.warning(
+                        "technical_stream_partial_failure",
+                        error=str(exc),
+                        streamed_chunks=streamed_chunks,
+                        model_alias=alias,
+                        partial_failure=True,
+                    )
+                break
+
+            if held and off_track and switch_alias:
+                await stream.aclose()
+                structure_abort = {
+                    "reason": off_track,
+                    "model_alias": alias,
+                    "discarded_chars": tracker.length,
+                }
+                _tech_logger.warning(
+                    "technical_stream_off_track",
+                    intent=intent,
+                    switch_alias=switch_alias,
+                    **structure_abort,
+                )
+                alias, switch_alias = switch_alias, None
+                stream_telemetry = {}
+                continue
+
+            for pending in held or ():
+                streamed_chunks += 1
+                yield pending
+            if off_track:
+                # Already shown to the user (or nothing left to switch to); record it, keep the answer.
+                _tech_logger.warning(
+                    "technical_stream_off_track",
+                    reason=off_track,
+                    model_alias=alias,
+                    intent=intent,
+                    switch_alias=None,
+                )
+            break
+
+        # Streamed answers get the same verdict the non-stream path uses, for telemetry.
+        structure_valid: bool | None = None
+        if attempt_chunks:
+            structure_valid, structure_failure = tracker.result()
+            if not structure_valid:
+                _tech_logger.warning(
+                    "technical_stream_invalid",
+                    validation_failure=structure_failure,
+                    model_alias=alias,
+                    intent=intent,
+                    response_length=tracker.length,
                 )
 
         stream_duration_ms = round((time.perf_counter() - stream_start) * 1000, 2)
@@ -500,6 +840,8 @@ async def generate_stream_explanation(topic: str, level: str, model: str | None
             route_telemetry_sink["model"] = model_name
             route_telemetry_sink["stream_completed"] = stream_completed
             route_telemetry_sink["partial_failure"] = partial_failure
+            route_telemetry_sink["structure_valid"] = structure_valid
+            route_telemetry_sink["structure_abort"] = structure_abort
 
         if stream_completed:
             log_sampled_success(
@@ -533,26 +875,27 @@ async def generate_stream_explanation(topic: str, level: str, model: str | None
         return
 
     if mode == SOCRATIC_MODE:
-        template = PROMPTS.get("socratic")
+        template = prompt_registry.get(SOCRATIC_MODE)
         if not template:
             raise ValueError("Unknown mode template: socratic")
-        prompt = template.format(
+        prompt = template.render(
             topic=topic,
             conversation_context=kwargs.get("conversation_context", "No prior context."),
         )
     else:
-        template = PROMPTS.get(level)
+        template = prompt_registry.get(LEARNING_MODE, level=level)
         if not template:
             raise ValueError(f"Unknown level: {level}")
-        prompt = template.format(topic=topic)
+        prompt = template.render(topic=topic)
     
     alias = model or ("socratic" if mode == SOCRATIC_MODE else _learning_model_for_level(level))
     stream_telemetry: dict[str, object] = {}
     stream_start = time.perf_counter()
     if mode == SOCRATIC_MODE:
         socratic_chunks: list[str] = []
-        async for chunk in stream_chat_completion(
-            model=alias,
+        async for chunk in _admitted_stream(
+            alias,
+            kwargs,
             messages=[{"role": "user", "content": prompt}],
             temperature=kwargs.get("temperature", 0.7),
             request_id=request_id,
@@ -564,8 +907,9 @@ async def generate_stream_explanation(topic: str, level: str, model: str | None
         for index in range(0, len(constrained_response), 400):
             yield constrained_response[index : index + 400]
     else:
-        async for chunk in stream_chat_completion(
-            model=alias,
+        async for chunk in _admitted_stream(
+            alias,
+            kwargs,
             messages=[{"role": "user", "content": prompt}],
             temperature=kwargs.get("temperature", 0.7),
             request_id=request_id,
@@ -600,3 +944,133 @@ async def generate_stream_explanation(topic: str, level: str, model: str | None
         retry=retry_flag,
         sampled=True,
     )
+
+
+def learning_batch_enabled(mode: str, levels: Sequence[str]) -> bool:
+    """Whether ``levels`` are generated by one batched call instead of one call per level (opt-in)."""
+    settings = get_settings()
+    return (
+        normalize_mode(mode) == LEARNING_MODE
+        and bool(getattr(settings, "learning_batch_enabled", False))
+        and len(levels) >= max(int(getattr(settings, "learning_batch_min_levels", 2)), 2)
+    )
+
+
+async def stream_learning_batch(topic: str, levels: Sequence[str], **kwargs) -> AsyncIterator[tuple[str, str]]:
+    """
+    Stream every learning level from one ``learning-detailed`` call as (level, text) pieces.
+
+    Never raises for a bad or failed batch: the telemetry sink ends up with
+    ``missing_levels`` (sections that were absent, empty, cut off or never
+    produced), which the caller regenerates with per-level calls.
+    """
+    levels = tuple(levels)
+    sink = kwargs.get("telemetry_sink") if isinstance(kwargs.get("telemetry_sink"), dict) else {}
+    kwargs["telemetry_sink"] = sink
+    sink["generation_strategy"] = "batched"
+    sink["missing_levels"] = list(levels)
+    compiled = prompt_registry.learning_batch(levels)
+    if compiled is None:
+        return
+
+    per_level_tokens = int(getattr(get_settings(), "learning_batch_max_tokens_per_level", 700))
+    splitter = LevelSectionSplitter(levels)
+    stream_telemetry: dict[str, object] = {}
+    started = time.perf_counter()
+    first_section_ms: float | None = None
+    try:
+        async for chunk in _admitted_stream(
+            LEARNING_MODEL_DETAILED,
+            kwargs,
+            messages=[{"role": "user", "content": compiled.render(topic=topic)}],
+            max_tokens=per_level_tokens * len(levels),
+            temperature=kwargs.get("temperature", 0.7),
+            request_id=kwargs.get("request_id"),
+            telemetry_sink=stream_telemetry,
+        ):
+            for level, text in splitter.feed(chunk):
+                if first_section_ms is None:
+                    first_section_ms = round((time.perf_counter() - started) * 1000, 2)
+                yield level, text
+        for level, text in splitter.close():
+            yield level, text
+    except Exception as exc:
+        logger.warning(
+            "learning_batch_failed",
+            error=str(exc),
+            request_id=kwargs.get("request_id"),
+            levels=list(levels),
+            completed_levels=sorted(splitter.sections()),
+        )
+    finally:
+        sections = splitter.sections()
+        sink["missing_levels"] = [level for level in levels if level not in sections]
+        sink["section_chars"] = {level: len(text) for level, text in sections.items()}
+        sink["first_section_ms"] = first_section_ms
+        sink["stream_duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        sink["token_usage"] = stream_telemetry.get("token_usage")
+        sink["estimated_cost_usd"] = stream_telemetry.get("estimated_cost_usd")
+        sink["model_inference_ms"] = stream_telemetry.get("model_inference_ms")
+        sink["model"] = stream_telemetry.get("model")
+        sink["model_alias"] = LEARNING_MODEL_DETAILED
+
+
+async def generate_learning_batch(
+    topic: str,
+    levels: Sequence[str],
+    *,
+    level_telemetry: dict[str, dict] | None = None,
+    **kwargs,
+) -> dict[str, str]:
+    """
+    Explanations for ``levels`` from one batched call, keyed by level.
+
+    Levels absent from the result need a per-level ``generate_explanation``.
+    The call's usage and cost are divided between the returned levels in
+    ``level_telemetry``, so per-level billing and output-size tracking work
+    as they do for separate calls.
+    """
+    sink: dict[str, object] = {}
+    kwargs["telemetry_sink"] = sink
+    parts: dict[str, list[str]] = {level: [] for level in levels}
+    async for level, text in stream_learning_batch(topic, levels, **kwargs):
+        parts[level].append(text)
+
+    missing = set(sink.get("missing_levels") or ())
+    results = {level: "".join(parts[level]).strip() for level in levels if level not in missing}
+    shares = split_usage(sink.get("token_usage"), {level: len(text) for level, text in results.items()})
+    total_tokens = sum(share["total_tokens"] for share in shares.values())
+    cost = sink.get("estimated_cost_usd")
+    if level_telemetry is not None:
+        for level in results:
+            share = shares.get(level)
+            level_sink = level_telemetry.setdefault(level, {})
+            level_sink.update(
+                token_usage=share,
+                estimated_cost_usd=(
+                    float(cost) * share["total_tokens"] / total_tokens
+                    if isinstance(cost, (int, float)) and share and total_tokens
+                    else None
+                ),
+                model_inference_ms=sink.get("model_inference_ms"),
+                queue_wait_ms=sink.get("queue_wait_ms", 0.0),
+                model_alias=sink.get("model_alias"),
+                generation_strategy="batched",
+            )
+
+    log_sampled_success(
+        "learning_batch_observed",
+        request_id=kwargs.get("request_id"),
+        user_id_hash=anonymize_user_id(str(kwargs.get("user_id") or "") or None),
+        model_alias=sink.get("model_alias"),
+        model=sink.get("model"),
+        levels=len(levels),
+        missing_levels=sorted(missing),
+        latency_ms=sink.get("model_inference_ms"),
+        first_section_ms=sink.get("first_section_ms"),
+        stream_duration_ms=sink.get("stream_duration_ms"),
+        token_usage=sink.get("token_usage"),
+        estimated_cost_usd=cost,
+        sampled=True,
+    )
+    return results
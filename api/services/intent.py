@@ -1,4 +1,6 @@
 import re
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Literal
 
 IntentType = Literal["explain", "compare", "brainstorm"]
@@ -66,30 +68,6 @@ DEPTH_PATTERNS: list[tuple[DepthType, list[str]]] = [
 ]
 
 
-def detect_intent_and_depth(query: str) -> dict:
-    """
-    Deterministic heuristic classifier. No LLM. <1ms.
-    Intent and depth are detected independently so combinations
-    like "compare in depth" return {"intent": "compare", "depth": "deep"}.
-    Returns: {"intent": IntentType, "depth": DepthType}
-    """
-    lowered = query.lower().strip()
-
-    intent: IntentType = "explain"
-    for intent_name, patterns in INTENT_PATTERNS:
-        if any(re.search(pattern, lowered) for pattern in patterns):
-            intent = intent_name
-            break
-
-    depth: DepthType = "medium"
-    for depth_name, patterns in DEPTH_PATTERNS:
-        if any(re.search(pattern, lowered) for pattern in patterns):
-            depth = depth_name
-            break
-
-    return {"intent": intent, "depth": depth}
-
-
 # Ordered: more specific keywords first
 DIAGRAM_TRIGGERS: list[tuple[str, str]] = [
     ("er diagram", "erDiagram"),
@@ -108,16 +86,101 @@ DIAGRAM_TRIGGERS: list[tuple[str, str]] = [
 ]
 
 
+CLASSIFIER_CACHE_SIZE = 4096
+
+
+@dataclass(frozen=True, slots=True)
+class Classification:
+    intent: IntentType
+    depth: DepthType
+    diagram_type: str | None
+
+
+class QueryClassifier:
+    """
+    Intent, depth and diagram type with precompiled, merged patterns.
+
+    Each category gets one guard regex (all of its patterns as a single
+    alternation), so a query that matches nothing in the category costs one
+    search. Otherwise labels are tried in priority order, each with its
+    patterns merged into one compiled regex, which keeps the first-match-wins
+    order of INTENT_PATTERNS, DEPTH_PATTERNS and DIAGRAM_TRIGGERS.
+    """
+
+    def __init__(
+        self,
+        intent_patterns: list[tuple[IntentType, list[str]]] = INTENT_PATTERNS,
+        depth_patterns: list[tuple[DepthType, list[str]]] = DEPTH_PATTERNS,
+        diagram_triggers: list[tuple[str, str]] = DIAGRAM_TRIGGERS,
+    ):
+        self._intent = self._compile(intent_patterns)
+        self._depth = self._compile(depth_patterns)
+        self._diagram = self._compile([(diagram_type, [re.escape(keyword)]) for keyword, diagram_type in diagram_triggers])
+        self._default_intent = intent_patterns[-1][0]
+        self._default_depth = depth_patterns[-1][0]
+
+    @staticmethod
+    def _compile(rules: list[tuple[str, list[str]]]) -> tuple[re.Pattern | None, list[tuple[str, re.Pattern]]]:
+        def merge(patterns: list[str]) -> str:
+            return "|".join(f"(?:{pattern})" for pattern in patterns)
+
+        ordered = [(label, re.compile(merge(patterns))) for label, patterns in rules if patterns]
+        guard = re.compile(merge([pattern for _, patterns in rules for pattern in patterns])) if ordered else None
+        return guard, ordered
+
+    @staticmethod
+    def _first(query: str, compiled: tuple[re.Pattern | None, list[tuple[str, re.Pattern]]]) -> str | None:
+        guard, ordered = compiled
+        if guard is None or not guard.search(query):
+            return None
+        for label, pattern in ordered:
+            if pattern.search(query):
+                return label
+        return None
+
+    def classify(self, query: str) -> Classification:
+        """Classify an already lowercased query."""
+        return Classification(
+            intent=self._first(query, self._intent) or self._default_intent,
+            depth=self._first(query, self._depth) or self._default_depth,
+            diagram_type=self._first(query, self._diagram),
+        )
+
+
+classifier = QueryClassifier()
+
+
+def _normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+@lru_cache(maxsize=CLASSIFIER_CACHE_SIZE)
+def _classify_normalized(normalized: str) -> Classification:
+    return classifier.classify(normalized)
+
+
+def classify(query: str) -> Classification:
+    """Intent, depth and diagram type for ``query``, memoized per normalized query. <1ms."""
+    return _classify_normalized(_normalize(query))
+
+
+def detect_intent_and_depth(query: str) -> dict:
+    """
+    Deterministic heuristic classifier. No LLM. <1ms.
+    Intent and depth are detected independently so combinations
+    like "compare in depth" return {"intent": "compare", "depth": "deep"}.
+    Returns: {"intent": IntentType, "depth": DepthType}
+    """
+    result = classify(query)
+    return {"intent": result.intent, "depth": result.depth}
+
+
 def detect_diagram_type(query: str) -> str | None:
     """
     Returns a mermaid diagram type string if the query benefits from
     a visual, otherwise None. <1ms.
     """
-    lowered = query.lower().strip()
-    for keyword, diagram_type in DIAGRAM_TRIGGERS:
-        if keyword in lowered:
-            return diagram_type
-    return None
+    return classify(query).diagram_type
 
 
 DEFAULT_STRUCTURE_HEADERS = [
@@ -148,6 +211,115 @@ MIN_COMPARE_HEADERS = 3
 MIN_BRAINSTORM_HEADERS = 2
 
 
+# Streamed responses: how far output may run without (or between) required headers.
+STREAM_FIRST_HEADER_CHARS = 400
+STREAM_SECTION_MAX_CHARS = 3000
+
+
+def _structure_for(intent: str) -> tuple[list[str], int, str]:
+    """(required headers, minimum present, failure code) for ``intent``."""
+    if intent == "brainstorm":
+        return BRAINSTORM_STRUCTURE_HEADERS, MIN_BRAINSTORM_HEADERS, "missing_brainstorm_structure"
+    if intent == "compare":
+        return COMPARE_STRUCTURE_HEADERS, MIN_COMPARE_HEADERS, "missing_compare_structure"
+    return DEFAULT_STRUCTURE_HEADERS, MIN_DEFAULT_HEADERS, "missing_structure"
+
+
+class StructureTracker:
+    """
+    Incremental structural check for a technical response arriving as deltas.
+
+    Tracks which required headers have appeared (across delta boundaries) and
+    the response length, without keeping the text. ``feed`` returns an
+    off-track code as soon as the response clearly will not have the expected
+    structure: "no_structure" when no required header appears within
+    ``first_header_chars``, "structure_stalled" when output runs
+    ``section_max_chars`` past the last header before enough headers were
+    seen. ``result`` gives the same verdict as validate_technical_response on
+    the full text.
+    """
+
+    def __init__(
+        self,
+        intent: str,
+        *,
+        first_header_chars: int = STREAM_FIRST_HEADER_CHARS,
+        section_max_chars: int = STREAM_SECTION_MAX_CHARS,
+    ):
+        self.intent = intent
+        headers, self.required_headers, self._missing_reason = _structure_for(intent)
+        self._missing = list(headers)
+        self._overlap = max(len(header) for header in headers) - 1
+        self._first_header_chars = first_header_chars
+        self._section_max_chars = section_max_chars
+        self._tail = ""
+        self._trailing_whitespace = 0
+        self._last_char = ""
+        self._last_header_at = 0
+        self.length = 0  # characters after leading whitespace
+        self.headers_seen = 0
+        self.off_track_reason: str | None = None
+
+    @property
+    def on_track(self) -> bool:
+        """A required header has appeared and nothing has gone off track yet."""
+        return self.headers_seen > 0 and self.off_track_reason is None
+
+    def feed(self, delta: str) -> str | None:
+        """Consume one delta. Returns the off-track code once the response is off track, else None."""
+        if not self.length:
+            delta = delta.lstrip()
+        if not delta:
+            return self.off_track_reason
+        self.length += len(delta)
+        content = delta.rstrip()
+        if content:
+            self._last_char = content[-1]
+            self._trailing_whitespace = len(delta) - len(content)
+        else:
+            self._trailing_whitespace += len(delta)
+
+        if self._missing:
+            window = self._tail + delta
+            found = [header for header in self._missing if header in window]
+            if found:
+                self._missing = [header for header in self._missing if header not in found]
+                self.headers_seen += len(found)
+                self._last_header_at = self.length
+            self._tail = window[-self._overlap :]
+
+        if self.off_track_reason is None:
+            if not self.headers_seen and self.length >= self._first_header_chars:
+                self.off_track_reason = "no_structure"
+            elif (
+                self.headers_seen < self.required_headers
+                and self.headers_seen
+                and self.length - self._last_header_at >= self._section_max_chars
+            ):
+                self.off_track_reason = "structure_stalled"
+        return self.off_track_reason
+
+    def result(self) -> tuple[bool, str]:
+        """(is_valid, reason) for everything fed so far, as validate_technical_response."""
+        if not self.length:
+            return False, "empty"
+        if self._last_char not in VALID_TERMINAL_CHARS:
+            return False, "truncated"
+        too_short = self.length - self._trailing_whitespace < MIN_RESPONSE_LENGTH
+        structured = self.headers_seen >= self.required_headers
+        if self.intent in ("brainstorm", "compare"):
+            if not structured:
+                return False, self._missing_reason
+            if too_short:
+                return False, "too_short"
+        else:
+            if too_short:
+                return False, "too_short"
+            if not structured:
+                return False, self._missing_reason
+        return True, ""
+
+
 def validate_technical_response(response: str, intent: str) -> tuple[bool, str]:
     """
     Returns (is_valid: bool, reason: str).
@@ -157,31 +329,7 @@ def validate_technical_response(response: str, intent: str) -> tuple[bool, str]:
                    "missing_structure", "missing_brainstorm_structure",
                    "missing_compare_structure"
     """
-    if not response or not response.strip():
-        return False, "empty"
-
-    stripped = response.strip()
-
-    if stripped[-1] not in VALID_TERMINAL_CHARS:
-        return False, "truncated"
-
-    if intent == "brainstorm":
-        present = sum(1 for header in BRAINSTORM_STRUCTURE_HEADERS if header in response)
-        if present < MIN_BRAINSTORM_HEADERS:
-            return False, "missing_brainstorm_structure"
-        if len(stripped) < MIN_RESPONSE_LENGTH:
-            return False, "too_short"
-    elif intent == "compare":
-        present = sum(1 for header in COMPARE_STRUCTURE_HEADERS if header in response)
-        if present < MIN_COMPARE_HEADERS:
-            return False, "missing_compare_structure"
-        if len(stripped) < MIN_RESPONSE_LENGTH:
-            return False, "too_short"
-    else:
-        if len(stripped) < MIN_RESPONSE_LENGTH:
-            return False, "too_short"
-        present = sum(1 for header in DEFAULT_STRUCTURE_HEADERS if header in response)
-        if present < MIN_DEFAULT_HEADERS:
-            return False, "missing_structure"
-
-    return True, ""
+    tracker = StructureTracker(intent)
+    if response:
+        tracker.feed(response)
+    return tracker.result()
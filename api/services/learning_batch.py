@@ -0,0 +1,147 @@
+"""Section splitting for batched learning-level generation (all levels from one model call)."""
+
+from __future__ import annotations
+
+import re
+from collections.abc import Sequence
+
+from prompts import LEARNING_BATCH_END_MARKER
+
+_MARKER_LINE = re.compile(r"^\s*<<<\s*([A-Za-z0-9_-]+)\s*>>>\s*$")
+_END_NAME = LEARNING_BATCH_END_MARKER.strip("<>")
+
+
+class LevelSectionSplitter:
+    """
+    Routes a streamed multi-section response to its levels as it arrives.
+
+    Sections start with a ``<<<level>>>`` marker line and the response ends
+    with ``<<<end>>>``. Text before the first marker, under an unrequested
+    marker, or after the end marker is dropped. A marker can be split across
+    deltas, so a partial line that could still become a marker is held back;
+    any other partial line is routed immediately. ``feed`` and ``close``
+    return ``(level, text)`` pieces in arrival order.
+
+    A section counts as complete once the next marker (or the end marker)
+    follows it; the last section of a stream cut off before ``<<<end>>>``
+    may be truncated and is reported as missing, so the caller can
+    regenerate it on its own.
+    """
+
+    def __init__(self, levels: Sequence[str]):
+        self.levels = tuple(levels)
+        self._wanted = set(self.levels)
+        self._parts: dict[str, list[str]] = {level: [] for level in self.levels}
+        self._completed: set[str] = set()
+        self._current: str | None = None
+        self._pending = ""
+        self._mid_line = False  # part of the current line was already routed as text
+        self.ended = False
+
+    def _open(self, name: str) -> None:
+        if self._current is not None:
+            self._completed.add(self._current)
+        if name == _END_NAME:
+            self._current = None
+            self.ended = True
+            return
+        self._current = name if name in self._wanted else None
+
+    def _route(self, text: str, out: list[tuple[str, str]]) -> None:
+        if self._current is None or self.ended or not text:
+            return
+        self._parts[self._current].append(text)
+        if out and out[-1][0] == self._current:
+            out[-1] = (self._current, out[-1][1] + text)
+        else:
+            out.append((self._current, text))
+
+    def feed(self, delta: str) -> list[tuple[str, str]]:
+        out: list[tuple[str, str]] = []
+        if not delta or self.ended:
+            return out
+        buffer = self._pending + delta
+        self._pending = ""
+        while buffer:
+            newline = buffer.find("\n")
+            if newline < 0:
+                if self._mid_line or not _could_be_marker(buffer):
+                    self._route(buffer, out)
+                    self._mid_line = True
+                else:
+                    self._pending = buffer
+                break
+            line, buffer = buffer[: newline + 1], buffer[newline + 1 :]
+            if not self._mid_line:
+                marker = _MARKER_LINE.match(line)
+                if marker:
+                    self._open(marker.group(1).lower())
+                    if self.ended:
+                        break
+                    continue
+            self._route(line, out)
+            self._mid_line = False
+        return out
+
+    def close(self) -> list[tuple[str, str]]:
+        """Flush the held-back tail at end of stream."""
+        out: list[tuple[str, str]] = []
+        pending, self._pending = self._pending, ""
+        if pending and not self.ended:
+            marker = _MARKER_LINE.match(pending)
+            if marker:
+                self._open(marker.group(1).lower())
+            else:
+                self._route(pending, out)
+        return out
+
+    def sections(self) -> dict[str, str]:
+        """Text of every complete, non-empty section, keyed by level."""
+        sections = {}
+        for level in self.levels:
+            text = "".join(self._parts[level]).strip()
+            if level in self._completed and text:
+                sections[level] = text
+        return sections
+
+    def missing(self) -> list[str]:
+        present = self.sections()
+        return [level for level in self.levels if level not in present]
+
+
+def _could_be_marker(partial: str) -> bool:
+    stripped = partial.lstrip()
+    if not stripped:
+        return True
+    if stripped.startswith("<<<"):
+        return ">>>" not in stripped or bool(_MARKER_LINE.match(stripped))
+    return "<<<".startswith(stripped)
+
+
+def split_usage(token_usage: dict | None, section_chars: dict[str, int]) -> dict[str, dict[str, int]]:
+    """
+    Divide one batched call's token usage between its levels.
+
+    Prompt tokens are shared evenly, completion tokens in proportion to each
+    section's length, and rounding remainders go to the first level so the
+    parts add up to the reported totals.
+    """
+    if not isinstance(token_usage, dict) or not section_chars:
+        return {}
+    levels = list(section_chars)
+    prompt = int(token_usage.get("prompt_tokens") or 0)
+    completion = int(token_usage.get("completion_tokens") or 0)
+    total_chars = sum(section_chars.values())
+    shares: dict[str, dict[str, int]] = {}
+    for level in levels:
+        weight = section_chars[level] / total_chars if total_chars else 1 / len(levels)
+        shares[level] = {
+            "prompt_tokens": prompt // len(levels),
+            "completion_tokens": int(completion * weight),
+        }
+    first = shares[levels[0]]
+    first["prompt_tokens"] += prompt - sum(share["prompt_tokens"] for share in shares.values())
+    first["completion_tokens"] += completion - sum(share["completion_tokens"] for share in shares.values())
+    for share in shares.values():
+        share["total_tokens"] = share["prompt_tokens"] + share["completion_tokens"]
+    return shares
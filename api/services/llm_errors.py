@@ -15,6 +15,13 @@ class LLMUnavailable(LLMError):
     retryable = False
 
 
+class LLMCapacityExceeded(LLMUnavailable):
+    """Raised when inference admission control sheds a request instead of queueing it."""
+
+    error_type = "capacity_exceeded"
+    retryable = True
+
+
 class LLMBadRequest(LLMError):
     """Raised when the LLM request is invalid."""
 
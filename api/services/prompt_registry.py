@@ -0,0 +1,192 @@
+"""Precompiled prompt templates keyed by (mode, level, intent, depth, diagram_type)."""
+
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass
+from string import Formatter
+from typing import Any
+
+from prompts import (
+    LEARNING_BATCH_LEVEL_BRIEFS,
+    LEARNING_BATCH_PROMPT,
+    LEARNING_BATCH_SECTION_MARKER,
+    PROMPTS,
+    TECHNICAL_BRAINSTORM_PROMPT,
+    TECHNICAL_COMPARE_PROMPT,
+    TECHNICAL_STRUCTURED_PROMPT,
+    _TECHNICAL_DEEPER_LAYER,
+    _TECHNICAL_DIAGRAM_INSTRUCTION,
+)
+from services.intent import DIAGRAM_TRIGGERS
+from utils import LEARNING_MODE, PROMPT_LEVELS, SOCRATIC_MODE, TECHNICAL_MODE
+
+PromptKey = tuple[str, str | None, str | None, str | None, str | None]
+
+TECHNICAL_INTENTS = ("explain", "compare", "brainstorm")
+TECHNICAL_DEPTHS = ("shallow", "medium", "deep")
+# "generic" is the fallback diagram type used when classification fails.
+TECHNICAL_DIAGRAM_TYPES: tuple[str | None, ...] = (
+    None,
+    "generic",
+    *dict.fromkeys(diagram_type for _, diagram_type in DIAGRAM_TRIGGERS),
+)
+
+_formatter = Formatter()
+
+
+def _hash_text(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:12]
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledPrompt:
+    """Template split into literal segments around its remaining runtime fields.
+
+    ``segments`` always has one more entry than ``fields``; rendering interleaves
+    them, so a single-field template is just ``prefix + value + suffix``.
+    """
+
+    segments: tuple[str, ...]
+    fields: tuple[str, ...]
+    version: str
+
+    def render(self, **values: Any) -> str:
+        if len(self.fields) == 1:
+            return f"{self.segments[0]}{values[self.fields[0]]}{self.segments[1]}"
+        parts = [self.segments[0]]
+        for field_name, segment in zip(self.fields, self.segments[1:]):
+            parts.append(str(values[field_name]))
+            parts.append(segment)
+        return "".join(parts)
+
+
+def compile_template(template: str, **static_values: str) -> CompiledPrompt:
+    """
+    Parse a ``str.format`` template once, inlining ``static_values`` as literal
+    text and keeping every other field as a runtime slot.
+    """
+    segments: list[str] = [""]
+    fields: list[str] = []
+    for literal, field_name, format_spec, conversion in _formatter.parse(template):
+        segments[-1] += literal
+        if field_name is None:
+            continue
+        if format_spec or conversion:
+            raise ValueError(f"Unsupported format spec in prompt field: {field_name}")
+        if field_name in static_values:
+            segments[-1] += static_values[field_name]
+            continue
+        fields.append(field_name)
+        segments.append("")
+
+    fingerprint = "\x00".join(segments) + "\x01" + "\x00".join(fields)
+    return CompiledPrompt(segments=tuple(segments), fields=tuple(fields), version=_hash_text(fingerprint))
+
+
+def _normalize_technical_key(
+    intent: str | None,
+    depth: str | None,
+    diagram_type: str | None,
+) -> tuple[str, str | None, str | None]:
+    # Mirrors the branching in the technical templates so equivalent inputs share one entry.
+    if intent == "compare":
+        return "compare", None, None
+    if intent == "brainstorm":
+        return "brainstorm", None, diagram_type
+    return "explain", "deep" if depth == "deep" else "shallow", diagram_type
+
+
+def _compile_technical(intent: str, depth: str | None, diagram_type: str | None) -> CompiledPrompt:
+    diagram_instruction = (
+        compile_template(_TECHNICAL_DIAGRAM_INSTRUCTION, diagram_type=diagram_type).render()
+        if diagram_type and intent != "compare"
+        else ""
+    )
+    if intent == "brainstorm":
+        return compile_template(TECHNICAL_BRAINSTORM_PROMPT, diagram_instruction=diagram_instruction)
+    if intent == "compare":
+        return compile_template(TECHNICAL_COMPARE_PROMPT)
+    return compile_template(
+        TECHNICAL_STRUCTURED_PROMPT,
+        deeper_layer_instruction=_TECHNICAL_DEEPER_LAYER if depth == "deep" else "",
+        diagram_instruction=diagram_instruction,
+    )
+
+
+class PromptRegistry:
+    """All prompt variants compiled at import; lookups are a dict hit."""
+
+    def __init__(self):
+        self._prompts: dict[PromptKey, CompiledPrompt] = {}
+        for level in PROMPT_LEVELS:
+            template = PROMPTS.get(level)
+            if template:
+                self._prompts[(LEARNING_MODE, level, None, None, None)] = compile_template(template)
+        socratic_template = PROMPTS.get("socratic")
+        if socratic_template:
+            self._prompts[(SOCRATIC_MODE, None, None, None, None)] = compile_template(socratic_template)
+        for intent in TECHNICAL_INTENTS:
+            for depth in TECHNICAL_DEPTHS:
+                for diagram_type in TECHNICAL_DIAGRAM_TYPES:
+                    key_parts = _normalize_technical_key(intent, depth, diagram_type)
+                    key = (TECHNICAL_MODE, None, *key_parts)
+                    if key not in self._prompts:
+                        self._prompts[key] = _compile_technical(*key_parts)
+        self.version = _hash_text("\x00".join(sorted(prompt.version for prompt in self._prompts.values())))
+        self._batches: dict[tuple[str, ...], CompiledPrompt] = {}
+        self._technical_version = _hash_text(
+            "\x00".join(sorted(prompt.version for key, prompt in self._prompts.items() if key[0] == TECHNICAL_MODE))
+        )
+
+    def get(
+        self,
+        mode: str,
+        level: str | None = None,
+        intent: str | None = None,
+        depth: str | None = None,
+        diagram_type: str | None = None,
+    ) -> CompiledPrompt | None:
+        """Return the compiled prompt for a combination, or None for an unknown level/mode."""
+        if mode == TECHNICAL_MODE:
+            key_parts = _normalize_technical_key(intent, depth, diagram_type)
+            key: PromptKey = (TECHNICAL_MODE, None, *key_parts)
+            compiled = self._prompts.get(key)
+            if compiled is None:
+                # Diagram types outside DIAGRAM_TRIGGERS are compiled once on first use.
+                compiled = _compile_technical(*key_parts)
+                self._prompts[key] = compiled
+            return compiled
+        if mode == SOCRATIC_MODE:
+            return self._prompts.get((SOCRATIC_MODE, None, None, None, None))
+        return self._prompts.get((LEARNING_MODE, level, None, None, None))
+
+    def learning_batch(self, levels: tuple[str, ...]) -> CompiledPrompt | None:
+        """Multi-section learning prompt for ``levels`` in order, compiled once per combination."""
+        compiled = self._batches.get(levels)
+        if compiled is None:
+            if not levels or any(level not in LEARNING_BATCH_LEVEL_BRIEFS for level in levels):
+                return None
+            sections = "\n\n".join(
+                f"{LEARNING_BATCH_SECTION_MARKER.format(level=level)}\n{LEARNING_BATCH_LEVEL_BRIEFS[level]}"
+                for level in levels
+            )
+            compiled = compile_template(LEARNING_BATCH_PROMPT, sections=sections)
+            self._batches[levels] = compiled
+        return compiled
+
+    def version_for(self, mode: str, level: str | None = None) -> str:
+        """
+        Content hash of every template a (mode, level) request can render.
+        Technical mode picks its variant from the topic, so it covers all of them.
+        """
+        if mode == TECHNICAL_MODE:
+            return self._technical_version
+        compiled = self.get(mode, level=level)
+        return compiled.version if compiled else self.version
+
+    def keys(self) -> list[PromptKey]:
+        return list(self._prompts.keys())
+
+
+prompt_registry = PromptRegistry()
@@ -0,0 +1,186 @@
+"""Bundled quote corpus for loading and regeneration messages, indexed by tag and length."""
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable, Sequence
+
+from logging_config import logger
+
+CORPUS_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data", "quotes.json"))
+
+LOADING_TAGS = frozenset({"education", "knowledge", "learning", "science", "wisdom", "research", "effort", "creativity"})
+LOADING_MAX_CHARS = 100
+REGENERATION_TAGS = LOADING_TAGS | {"philosophy", "technology", "innovation", "discovery", "critical-thinking"}
+REGENERATION_MIN_CHARS = 50
+REGENERATION_MAX_CHARS = 120
+OVERUSED_AUTHORS = frozenset({"Albert Einstein", "Plutarch", "Marcus Aurelius", "Socrates", "Benjamin Franklin"})
+REGENERATION_STYLES = (
+    "---\n*“{content}”* — {author}",
+    "---\nAs {author} said: *“{content}”*",
+    "---\n*“{content}”*\n— {author}",
+    "---\nIn the words of {author}: *“{content}”*",
+    "---\nA thought worth keeping: *“{content}”* — {author}",
+)
+# Rotation positions remembered per seed (user or request) before the oldest are forgotten.
+MAX_ROTATION_SEEDS = 4096
+
+_FALLBACK_QUOTES = (
+    ("The mind is not a vessel to be filled, but a fire to be kindled.", "Plutarch", ("education", "learning")),
+    ("Learning never exhausts the mind.", "Leonardo da Vinci", ("learning", "education")),
+    (
+        "The first principle is that you must not fool yourself and you are the easiest person to fool.",
+        "Richard Feynman",
+        ("science", "critical-thinking"),
+    ),
+)
+
+
+class QuoteCorpus:
+    """
+    Quotes as parallel tuples, with index pools per tag and a length-sorted order.
+
+    Pools for a (tags, length range, excluded authors) selection are built once
+    and memoized, so picking a quote is an index computation. Rotation walks a
+    pool with a stride coprime to its size, starting at an offset derived from
+    the seed, so one seed sees every quote in the pool before any repeats and
+    different seeds start in different places. Rotation state lives in process
+    memory only.
+    """
+
+    def __init__(self, quotes: Iterable[tuple[str, str, Sequence[str]]]):
+        rows = [(" ".join(content.split()), author.strip(), tuple(tags)) for content, author, tags in quotes if content]
+        self.contents: tuple[str, ...] = tuple(row[0] for row in rows)
+        self.authors: tuple[str, ...] = tuple(row[1] for row in rows)
+        by_tag: dict[str, list[int]] = {}
+        for position, (_, _, tags) in enumerate(rows):
+            for tag in tags:
+                by_tag.setdefault(tag, []).append(position)
+        self._by_tag = {tag: frozenset(positions) for tag, positions in by_tag.items()}
+        self._by_length = sorted(range(len(rows)), key=lambda position: len(self.contents[position]))
+        self._lengths = [len(self.contents[position]) for position in self._by_length]
+        self._pools: dict[tuple, tuple[int, ...]] = {}
+        self._rotations: OrderedDict[tuple[str, tuple[int, ...]], int] = OrderedDict()
+        self._counter = itertools.count(random.randrange(1 << 16))
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.contents)
+
+    def pool(
+        self,
+        *,
+        tags: frozenset[str] | None = None,
+        min_chars: int = 0,
+        max_chars: int | None = None,
+        exclude_authors: frozenset[str] = frozenset(),
+    ) -> tuple[int, ...]:
+        """Quote positions matching any of ``tags`` within the length range, shortest first."""
+        key = (tags, min_chars, max_chars, exclude_authors)
+        cached = self._pools.get(key)
+        if cached is not None:
+            return cached
+        start = bisect.bisect_left(self._lengths, min_chars)
+        end = len(self._lengths) if max_chars is None else bisect.bisect_right(self._lengths, max_chars)
+        tagged = None
+        if tags:
+            tagged = frozenset().union(*(self._by_tag.get(tag, frozenset()) for tag in tags))
+        selected = tuple(
+            position
+            for position in self._by_length[start:end]
+            if (tagged is None or position in tagged) and self.authors[position] not in exclude_authors
+        )
+        self._pools[key] = selected
+        return selected
+
+    def _next_step(self, seed: str | None, pool: tuple[int, ...]) -> tuple[int, int]:
+        """(offset, step) for the seed's next pick from ``pool``."""
+        if seed is None:
+            return 0, next(self._counter)
+        offset = int.from_bytes(hashlib.blake2b(seed.encode("utf-8"), digest_size=4).digest(), "big")
+        key = (seed, pool)
+        with self._lock:
+            step = self._rotations.pop(key, 0)
+            self._rotations[key] = step + 1
+            while len(self._rotations) > MAX_ROTATION_SEEDS:
+                self._rotations.popitem(last=False)
+        return offset, step
+
+    @staticmethod
+    def _stride(size: int) -> int:
+        # Coprime to the pool size so consecutive steps visit every position once per cycle.
+        stride = max(size // 2 + 1, 1)
+        while math.gcd(stride, size) != 1:
+            stride += 1
+        return stride
+
+    def pick(self, pool: tuple[int, ...], *, seed: str | None = None, avoid_author: str | None = None) -> int:
+        """Next position from ``pool`` in the seed's rotation, skipping ``avoid_author`` when possible."""
+        if not pool:
+            raise ValueError("empty quote pool")
+        offset, step = self._next_step(seed, pool)
+        stride = self._stride(len(pool))
+        position = pool[(offset + step * stride) % len(pool)]
+        if avoid_author and self.authors[position] == avoid_author and len(pool) > 1:
+            position = pool[(offset + (step + 1) * stride) % len(pool)]
+        return position
+
+    def style_index(self, seed: str | None) -> int:
+        """Rotating style index; consecutive calls for one seed never repeat a style."""
+        offset, step = self._next_step(seed, ())
+        return (offset + step) % len(REGENERATION_STYLES)
+
+
+def load_corpus(path: str = CORPUS_PATH) -> QuoteCorpus:
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            data = json.load(handle)
+        quotes = [(str(row["content"]), str(row["author"]), tuple(row.get("tags") or ())) for row in data["quotes"]]
+        if not quotes:
+            raise ValueError("quote corpus is empty")
+    except Exception as exc:
+        logger.warning("quote_corpus_load_failed", path=path, error=str(exc))
+        quotes = list(_FALLBACK_QUOTES)
+    return QuoteCorpus(quotes)
+
+
+quote_corpus = load_corpus()
+_last_author: dict[str, str] = {}
+
+
+def loading_quote(seed: str | None = None) -> str:
+    """Short quote for loading screens."""
+    pool = quote_corpus.pool(tags=LOADING_TAGS, max_chars=LOADING_MAX_CHARS) or quote_corpus.pool()
+    position = quote_corpus.pick(pool, seed=seed)
+    return f"«{quote_corpus.contents[position]}» — {quote_corpus.authors[position]}"
+
+
+def regeneration_quote(seed: str | None = None) -> str:
+    """Styled quote appended to regenerated answers, rotating author and style per seed."""
+    pool = (
+        quote_corpus.pool(
+            tags=REGENERATION_TAGS,
+            min_chars=REGENERATION_MIN_CHARS,
+            max_chars=REGENERATION_MAX_CHARS,
+            exclude_authors=OVERUSED_AUTHORS,
+        )
+        or quote_corpus.pool()
+    )
+    last_author = _last_author.get(seed) if seed is not None else None
+    position = quote_corpus.pick(pool, seed=seed, avoid_author=last_author)
+    author = quote_corpus.authors[position]
+    if seed is not None:
+        _last_author.pop(seed, None)
+        _last_author[seed] = author
+        if len(_last_author) > MAX_ROTATION_SEEDS:
+            del _last_author[next(iter(_last_author))]
+    style = REGENERATION_STYLES[quote_corpus.style_index(seed)]
+    return style.format(content=quote_corpus.contents[position], author=author)
@@ -1,5 +1,6 @@
 """Distributed abuse and cost controls backed by Upstash Redis."""
 
+import asyncio
 import time
 from dataclasses import dataclass
 
@@ -8,6 +9,7 @@ from fastapi import HTTPException
 from config import get_settings
 from logging_config import logger
 from services.cache import get_redis
+from services.token_estimator import count_tokens
 
 
 @dataclass
@@ -25,12 +27,28 @@ class QuotaResult:
     consumed: int
     limit: int
     retry_after: int
+    key: str | None = None
 
 
 @dataclass
 class CircuitBreakerResult:
     allowed: bool
     retry_after: int
+    usage_key: str | None = None
+
+
+@dataclass
+class UsageReservation:
+    """Tokens debited up front and the counters they were debited from."""
+
+    tokens: int
+    quota_key: str | None = None
+    breaker_key: str | None = None
+    settled: bool = False
+
+    @property
+    def keys(self) -> list[str]:
+        return [key for key in (self.quota_key, self.breaker_key) if key]
 
 
 def estimate_tokens_for_text(text: str, *, output_buffer: int | None = None) -> int:
@@ -41,7 +59,7 @@ def estimate_tokens_for_text(text: str, *, output_buffer: int | None = None) ->
         if output_buffer is not None
         else getattr(settings, "estimated_output_tokens_per_request", 900)
     )
-    prompt_tokens = max(len((text or "").strip()) // 4, 1)
+    prompt_tokens = max(count_tokens((text or "").strip()), 1)
     return max(prompt_tokens + response_tokens, 1)
 
 
@@ -149,6 +167,7 @@ async def check_daily_quota(*, user_id: str, estimated_tokens: int) -> QuotaResu
         consumed=consumed,
         limit=limit,
         retry_after=max(ttl, 1),
+        key=key if allowed_flag == 1 else None,
     )
 
 
@@ -183,7 +202,7 @@ async def check_circuit_breaker(*, estimated_tokens: int, fail_open: bool) -> Ci
             await redis.setex(open_key, open_seconds, "1")
             return CircuitBreakerResult(allowed=False, retry_after=open_seconds)
 
-        return CircuitBreakerResult(allowed=True, retry_after=0)
+        return CircuitBreakerResult(allowed=True, retry_after=0, usage_key=usage_key)
     except Exception as exc:
         logger.warning("circuit_breaker_check_failed", fail_open=fail_open, error=str(exc))
         if fail_open:
@@ -196,10 +215,11 @@ async def enforce_request_controls(
     user_id: str | None,
     client_ip: str | None,
     estimated_tokens: int,
-) -> None:
+) -> UsageReservation:
     """Apply auth-scoped quota, distributed rate limiting, and circuit breaker checks.
 
     Enforcement order: auth (handled by route dependency) -> quota -> rate limit -> inference.
+    Returns the reservation to settle with ``usage_reconciler`` once real usage is known.
     """
     settings = get_settings()
     strategy = str(getattr(settings, "rate_limit_strategy", "upstash_redis") or "upstash_redis").lower()
@@ -209,6 +229,7 @@ async def enforce_request_controls(
     is_authenticated = bool(user_id)
     fail_open = is_authenticated
 
+    reservation = UsageReservation(tokens=max(int(estimated_tokens), 1))
     if is_authenticated:
         try:
             quota_result = await check_daily_quota(user_id=str(user_id), estimated_tokens=estimated_tokens)
@@ -227,6 +248,7 @@ async def enforce_request_controls(
                 },
                 headers={"Retry-After": str(quota_result.retry_after)},
             )
+        reservation.quota_key = quota_result.key
 
     if is_authenticated:
         identifier = f"user:{user_id}"
@@ -298,3 +320,100 @@ async def enforce_request_controls(
             detail={"type": "circuit_breaker_open", "action": "reject"},
             headers={"Retry-After": str(max(breaker.retry_after, 1))},
         )
+    reservation.breaker_key = breaker.usage_key
+    return reservation
+
+
+# Applies a correction only while the counter's window is still open, never below zero,
+# and without touching its TTL.
+ADJUST_SCRIPT = (
+    "local current = redis.call('GET', KEYS[1])\n"
+    "if not current then return 0 end\n"
+    "local value = tonumber(current) + tonumber(ARGV[1])\n"
+    "if value < 0 then value = 0 end\n"
+    "redis.call('SET', KEYS[1], value, 'KEEPTTL')\n"
+    "return value\n"
+)
+
+
+class UsageReconciler:
+    """
+    Corrects up-front token debits once a call's real usage is known.
+
+    Deltas are summed per counter key in memory and written by a background
+    flush, so a busy key costs one round trip per interval instead of one per
+    request. Refunds for cache hits and aborted streams are just negative deltas.
+    """
+
+    def __init__(self):
+        self._pending: dict[str, int] = {}
+        self._flush_task: asyncio.Task | None = None
+        self.stats = {"settled": 0, "flushes": 0, "flush_failures": 0, "refunded_tokens": 0, "charged_tokens": 0}
+
+    def pending(self) -> dict[str, int]:
+        return dict(self._pending)
+
+    def reset(self) -> None:
+        self._pending.clear()
+        self._flush_task = None
+
+    def settle(self, reservation: UsageReservation | None, actual_tokens: int) -> int:
+        """Queue ``actual - reserved`` against the reservation's counters; returns the delta."""
+        if reservation is None or reservation.settled:
+            return 0
+        reservation.settled = True
+        delta = max(int(actual_tokens), 0) - reservation.tokens
+        self.stats["settled"] += 1
+        if delta == 0 or not reservation.keys:
+            return delta
+        if delta < 0:
+            self.stats["refunded_tokens"] += -delta
+        else:
+            self.stats["charged_tokens"] += delta
+        for key in reservation.keys:
+            self._pending[key] = self._pending.get(key, 0) + delta
+        self._schedule_flush()
+        return delta
+
+    def refund(self, reservation: UsageReservation | None) -> int:
+        return self.settle(reservation, 0)
+
+    def _schedule_flush(self) -> None:
+        settings = get_settings()
+        batch_size = max(int(getattr(settings, "quota_reconcile_batch_size", 64)), 1)
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        delay = 0.0 if len(self._pending) >= batch_size else float(getattr(settings, "quota_reconcile_flush_seconds", 1.0))
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_after(max(delay, 0.0)))
+        except RuntimeError:
+            return
+
+    async def _flush_after(self, delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self) -> None:
+        batch, self._pending = self._pending, {}
+        batch = {key: delta for key, delta in batch.items() if delta}
+        if not batch:
+            return
+        try:
+            redis = await get_redis()
+            await redis.eval_batch(ADJUST_SCRIPT, [([key], [delta]) for key, delta in batch.items()])
+            self.stats["flushes"] += 1
+        except Exception as exc:
+            # Losing a correction only leaves the conservative up-front debit in place.
+            self.stats["flush_failures"] += 1
+            logger.warning("usage_reconcile_flush_failed", keys=len(batch), error=str(exc))
+
+    async def shutdown(self) -> None:
+        task = self._flush_task
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+
+usage_reconciler = UsageReconciler()
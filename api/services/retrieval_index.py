@@ -0,0 +1,476 @@
+"""Local BM25 index over finished explanations, persisted as append-only on-disk segments."""
+
+from __future__ import annotations
+
+import asyncio
+import gzip
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+
+from config import get_settings
+from logging_config import log_sampled_success, logger
+from services.search_results import BM25_B, BM25_K1, SearchResult, bm25_terms, pack_context
+
+SEGMENT_SCHEMA = 1
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".json.gz"
+MIN_DOCUMENT_CHARS = 80
+
+_PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+
+
+@dataclass(slots=True)
+class IndexedDocument:
+    key: str
+    text: str
+    title: str = ""
+    source: str = ""
+    mode: str = ""
+    level: str = ""
+    # Empty for shared documents (cached explanations); a user id for conversation messages.
+    owner: str = ""
+    added_at: float = 0.0
+    digest: str = ""
+
+
+@dataclass(slots=True)
+class RetrievedDocument:
+    key: str
+    title: str
+    snippet: str
+    source: str
+    mode: str
+    level: str
+    score: float
+
+
+@dataclass(slots=True, eq=False)
+class _Segment:
+    """Documents plus their postings. Sealed segments are never mutated, only replaced by compaction."""
+
+    docs: list[IndexedDocument] = field(default_factory=list)
+    lengths: list[int] = field(default_factory=list)
+    postings: dict[str, list[tuple[int, int]]] = field(default_factory=dict)
+    name: str | None = None
+    # Per-document flag cleared when a newer version supersedes it or compaction drops it.
+    live: list[bool] = field(default_factory=list)
+
+    def append(self, doc: IndexedDocument, terms: list[str]) -> int:
+        position = len(self.docs)
+        self.docs.append(doc)
+        self.lengths.append(len(terms))
+        self.live.append(False)
+        for term, frequency in Counter(terms).items():
+            self.postings.setdefault(term, []).append((position, frequency))
+        return position
+
+    def to_payload(self) -> dict:
+        return {
+            "schema": SEGMENT_SCHEMA,
+            "docs": [asdict(doc) for doc in self.docs],
+            "lengths": self.lengths,
+            "postings": self.postings,
+        }
+
+    @classmethod
+    def from_payload(cls, payload: dict, name: str) -> "_Segment":
+        return cls(
+            docs=[IndexedDocument(**doc) for doc in payload["docs"]],
+            lengths=[int(length) for length in payload["lengths"]],
+            postings={term: [(int(doc), int(tf)) for doc, tf in entries] for term, entries in payload["postings"].items()},
+            name=name,
+            live=[False] * len(payload["docs"]),
+        )
+
+
+def _default_directory() -> str:
+    configured = str(getattr(get_settings(), "retrieval_index_dir", "") or "")
+    return configured or os.path.join(tempfile.gettempdir(), "knowbear-retrieval")
+
+
+def _best_passage(text: str, query_terms: set[str], max_chars: int) -> str:
+    """The paragraph with the most query-term hits, cut to ``max_chars`` on a word boundary."""
+    paragraphs = [part.strip() for part in _PARAGRAPH_SPLIT.split(text) if part.strip()] or [text.strip()]
+    best = max(paragraphs, key=lambda part: sum(1 for term in bm25_terms(part) if term in query_terms))
+    if len(best) <= max_chars:
+        return best
+    return best[:max_chars].rsplit(" ", 1)[0] + "…"
+
+
+class RetrievalIndex:
+    """
+    BM25 over prior answers: an in-memory tail plus immutable gzip JSON segments.
+
+    New documents are searchable as soon as they are added. A background flush
+    seals the tail into a segment file, and once there are more than
+    ``retrieval_index_max_segments`` files they are compacted into one, dropping
+    superseded and overflow documents. A key added again supersedes its earlier
+    version, so a regenerated answer replaces the old one. Segments written by
+    other workers sharing the directory are picked up by ``load()``.
+    """
+
+    def __init__(self, directory: str | None = None):
+        self.directory = directory
+        self._segments: list[_Segment] = []
+        self._tail = _Segment()
+        self._latest: dict[str, tuple[_Segment, int]] = {}
+        self._known_files: set[str] = set()
+        self._loaded = False
+        self._lock = threading.RLock()
+        self._flush_task: asyncio.Task | None = None
+        self._total_length = 0
+        self.stats = {"added": 0, "skipped": 0, "queries": 0, "segments_written": 0, "compactions": 0, "flush_failures": 0}
+
+    def reset(self, directory: str | None = None) -> None:
+        with self._lock:
+            self.directory = directory
+            self._segments = []
+            self._tail = _Segment()
+            self._latest = {}
+            self._known_files = set()
+            self._loaded = False
+            self._flush_task = None
+            self._total_length = 0
+            self.stats = {key: 0 for key in self.stats}
+
+    def _directory(self) -> str:
+        if self.directory is None:
+            self.directory = _default_directory()
+        return self.directory
+
+    def __len__(self) -> int:
+        return len(self._latest)
+
+    # Loading -----------------------------------------------------------------
+
+    def load(self) -> int:
+        """Read segment files not seen yet; returns how many were loaded."""
+        directory = self._directory()
+        try:
+            names = sorted(
+                name for name in os.listdir(directory) if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+            )
+        except FileNotFoundError:
+            names = []
+        loaded = 0
+        for name in names:
+            if name in self._known_files:
+                continue
+            try:
+                with gzip.open(os.path.join(directory, name), "rt", encoding="utf-8") as handle:
+                    payload = json.load(handle)
+                if payload.get("schema") != SEGMENT_SCHEMA:
+                    continue
+                segment = _Segment.from_payload(payload, name)
+            except FileNotFoundError:
+                # Compacted away by another worker between listing and reading.
+                continue
+            except Exception as exc:
+                logger.warning("retrieval_segment_unreadable", segment=name, error=str(exc))
+                continue
+            with self._lock:
+                self._known_files.add(name)
+                self._segments.append(segment)
+                for position, doc in enumerate(segment.docs):
+                    self._claim(doc.key, segment, position)
+            loaded += 1
+        with self._lock:
+            self._loaded = True
+        if loaded:
+            log_sampled_success("retrieval_index_loaded", segments=loaded, documents=len(self._latest))
+        return loaded
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.load()
+
+    def _claim(self, key: str, segment: _Segment, position: int) -> bool:
+        """Point ``key`` at this copy unless a newer one is already live."""
+        current = self._latest.get(key)
+        doc = segment.docs[position]
+        if current is not None:
+            current_segment, current_position = current
+            if current_segment.docs[current_position].added_at > doc.added_at:
+                return False
+            current_segment.live[current_position] = False
+            self._total_length -= current_segment.lengths[current_position]
+        self._latest[key] = (segment, position)
+        segment.live[position] = True
+        self._total_length += segment.lengths[position]
+        return True
+
+    # Indexing ----------------------------------------------------------------
+
+    def add(
+        self,
+        key: str,
+        text: str,
+        *,
+        title: str = "",
+        source: str = "",
+        mode: str = "",
+        level: str = "",
+        owner: str | None = None,
+    ) -> bool:
+        """Index a finished answer; returns False when it was skipped (too short, disabled or unchanged)."""
+        settings = get_settings()
+        if not bool(getattr(settings, "retrieval_index_enabled", True)):
+            return False
+        text = (text or "").strip()
+        if not key or len(text) < MIN_DOCUMENT_CHARS:
+            return False
+        text = text[: max(int(getattr(settings, "retrieval_index_max_doc_chars", 4000)), MIN_DOCUMENT_CHARS)]
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+        self._ensure_loaded()
+        with self._lock:
+            current = self._latest.get(key)
+            if current is not None and current[0].docs[current[1]].digest == digest:
+                self.stats["skipped"] += 1
+                return False
+            doc = IndexedDocument(
+                key=key,
+                text=text,
+                title=title.strip()[:200],
+                source=source,
+                mode=mode,
+                level=level,
+                owner=str(owner or ""),
+                added_at=time.time(),
+                digest=digest,
+            )
+            position = self._tail.append(doc, bm25_terms(f"{doc.title} {text}"))
+            self._claim(key, self._tail, position)
+            self.stats["added"] += 1
+            pending = len(self._tail.docs)
+        self._schedule_flush(pending)
+        return True
+
+    def _schedule_flush(self, pending: int) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        settings = get_settings()
+        batch_size = max(int(getattr(settings, "retrieval_index_segment_docs", 256)), 1)
+        delay = 0.0 if pending >= batch_size else float(getattr(settings, "retrieval_index_flush_seconds", 30))
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_after(max(delay, 0.0)))
+        except RuntimeError:
+            return
+
+    async def _flush_after(self, delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Seal the in-memory tail into a segment file, then compact if there are too many."""
+        with self._lock:
+            if not self._tail.docs:
+                return
+            sealed, self._tail = self._tail, _Segment()
+            self._segments.append(sealed)
+        try:
+            await asyncio.to_thread(self._write_segment, sealed)
+        except Exception as exc:
+            self.stats["flush_failures"] += 1
+            # The sealed segment stays searchable in memory; a later compaction persists it.
+            logger.warning("retrieval_segment_write_failed", documents=len(sealed.docs), error=str(exc))
+            return
+        self.stats["segments_written"] += 1
+        log_sampled_success("retrieval_segment_written", segment=sealed.name, documents=len(sealed.docs))
+
+        max_segments = max(int(getattr(get_settings(), "retrieval_index_max_segments", 8)), 1)
+        if len(self._segments) > max_segments:
+            try:
+                await asyncio.to_thread(self.compact)
+            except Exception as exc:
+                logger.warning("retrieval_compaction_failed", error=str(exc))
+
+    def _write_segment(self, segment: _Segment) -> None:
+        directory = self._directory()
+        os.makedirs(directory, exist_ok=True)
+        name = f"{SEGMENT_PREFIX}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}"
+        path = os.path.join(directory, name)
+        temp_path = f"{path}.tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8", compresslevel=5) as handle:
+            json.dump(segment.to_payload(), handle, separators=(",", ":"))
+        # Readers only list finished names, so a crash mid-write never leaves a torn segment.
+        os.replace(temp_path, path)
+        with self._lock:
+            segment.name = name
+            self._known_files.add(name)
+
+    def compact(self) -> None:
+        """Merge every sealed segment into one, keeping the newest ``retrieval_index_max_documents`` live documents."""
+        max_documents = max(int(getattr(get_settings(), "retrieval_index_max_documents", 20000)), 1)
+        with self._lock:
+            sources = list(self._segments)
+            live = [
+                (segment, position)
+                for segment in sources
+                for position in range(len(segment.docs))
+                if segment.live[position]
+            ]
+        live.sort(key=lambda item: item[0].docs[item[1]].added_at)
+        dropped = live[:-max_documents]
+        kept = live[-max_documents:]
+
+        merged = _Segment()
+        moved: list[tuple[_Segment, int, int]] = []
+        new_positions: dict[tuple[int, int], int] = {}
+        for segment, position in kept:
+            new_positions[(id(segment), position)] = len(merged.docs)
+            moved.append((segment, position, len(merged.docs)))
+            merged.docs.append(segment.docs[position])
+            merged.lengths.append(segment.lengths[position])
+            merged.live.append(False)
+        for segment in sources:
+            for term, entries in segment.postings.items():
+                for position, frequency in entries:
+                    target = new_positions.get((id(segment), position))
+                    if target is not None:
+                        merged.postings.setdefault(term, []).append((target, frequency))
+        for entries in merged.postings.values():
+            entries.sort()
+        self._write_segment(merged)
+
+        with self._lock:
+            for segment, position, new_position in moved:
+                if segment.live[position]:
+                    segment.live[position] = False
+                    merged.live[new_position] = True
+                    self._latest[segment.docs[position].key] = (merged, new_position)
+            for segment, position in dropped:
+                if segment.live[position]:
+                    segment.live[position] = False
+                    self._total_length -= segment.lengths[position]
+                    del self._latest[segment.docs[position].key]
+            compacted = {id(segment) for segment in sources}
+            self._segments = [merged] + [segment for segment in self._segments if id(segment) not in compacted]
+        for segment in sources:
+            if segment.name:
+                self._known_files.discard(segment.name)
+                try:
+                    os.remove(os.path.join(self._directory(), segment.name))
+                except FileNotFoundError:
+                    pass
+        self.stats["compactions"] += 1
+        log_sampled_success(
+            "retrieval_index_compacted", segments=len(sources), documents=len(merged.docs), dropped=len(dropped)
+        )
+
+    # Querying ----------------------------------------------------------------
+
+    def search(
+        self,
+        query: str,
+        *,
+        limit: int = 5,
+        owner: str | None = None,
+        mode: str | None = None,
+        exclude_key: str | None = None,
+        snippet_chars: int = 600,
+    ) -> list[RetrievedDocument]:
+        """
+        Top ``limit`` documents for ``query`` by BM25.
+
+        Only shared documents and those owned by ``owner`` are visible, so one
+        user's conversation never grounds another user's answer. Document
+        frequencies count live documents only.
+        """
+        query_terms = set(bm25_terms(query))
+        if not query_terms or limit <= 0:
+            return []
+        self._ensure_loaded()
+        owner = str(owner or "")
+        with self._lock:
+            self.stats["queries"] += 1
+            total = len(self._latest)
+            if not total:
+                return []
+            average_length = self._total_length / total or 1.0
+            segments = [*self._segments, self._tail]
+            # Live postings per query term, per segment.
+            per_term: list[list[tuple[_Segment, list[tuple[int, int]]]]] = []
+            for term in query_terms:
+                matches = []
+                for segment in segments:
+                    entries = segment.postings.get(term)
+                    if entries:
+                        live = segment.live
+                        matches.append((segment, [entry for entry in entries if live[entry[0]]]))
+                per_term.append(matches)
+
+            scores: dict[tuple[int, int], float] = {}
+            by_id = {id(segment): segment for segment in segments}
+            visible: dict[tuple[int, int], bool] = {}
+            for matches in per_term:
+                document_frequency = sum(len(entries) for _, entries in matches)
+                if not document_frequency:
+                    continue
+                idf = math.log(1 + (total - document_frequency + 0.5) / (document_frequency + 0.5))
+                for segment, entries in matches:
+                    segment_id, lengths, docs = id(segment), segment.lengths, segment.docs
+                    for position, frequency in entries:
+                        slot = (segment_id, position)
+                        allowed = visible.get(slot)
+                        if allowed is None:
+                            doc = docs[position]
+                            allowed = visible[slot] = (
+                                (not doc.owner or doc.owner == owner)
+                                and (not mode or doc.mode == mode)
+                                and doc.key != exclude_key
+                            )
+                        if not allowed:
+                            continue
+                        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[position] / average_length)
+                        scores[slot] = scores.get(slot, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + length_norm)
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            docs = [(by_id[segment_id].docs[position], score) for (segment_id, position), score in best]
+
+        return [
+            RetrievedDocument(
+                key=doc.key,
+                title=doc.title,
+                snippet=_best_passage(doc.text, query_terms, snippet_chars),
+                source=doc.source,
+                mode=doc.mode,
+                level=doc.level,
+                score=round(score, 4),
+            )
+            for doc, score in docs
+        ]
+
+    def related_context(self, query: str, *, token_budget: int, owner: str | None = None, **filters) -> str:
+        """Prior explanations related to ``query``, packed for a prompt; empty when nothing matches."""
+        started = time.perf_counter()
+        documents = self.search(query, owner=owner, **filters)
+        context = pack_context(
+            [SearchResult(title=doc.title, url="", snippet=doc.snippet, provider="local", score=doc.score) for doc in documents],
+            token_budget,
+        )
+        log_sampled_success(
+            "retrieval_context_built",
+            documents=len(documents),
+            latency_ms=round((time.perf_counter() - started) * 1000, 3),
+        )
+        return context
+
+    async def shutdown(self) -> None:
+        task = self._flush_task
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+
+retrieval_index = RetrievalIndex()
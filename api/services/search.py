@@ -1,57 +1,302 @@
+import asyncio
 import hashlib
 import random
+import time
+from collections import deque
 import httpx
 from typing import Dict, Any, List, Optional
 from config import get_settings
-from services.cache import cache_get, cache_set
-from logging_config import logger
+from services.cache import cache_get, cache_set, cache_set_if_absent
+from services.intent import detect_diagram_type
+from services.quotes import loading_quote, regeneration_quote
+from services.search_results import SearchResult, merge_results, pack_context, rank_results
+from logging_config import log_sampled_success, logger
+from utils import canonicalize_topic
 
 settings = get_settings()
 
+SEARCH_CACHE_SCHEMA = "v2"
+IMAGE_CACHE_SCHEMA = "v1"
+NO_CONTEXT = "No external context found."
+
+
+def normalize_search_query(query: str) -> str:
+    """Canonical form used for cache keys, so casing, punctuation and filler words share an entry."""
+    return canonicalize_topic(query)
+
+
+def search_cache_key(query: str) -> str:
+    digest = hashlib.sha256(normalize_search_query(query).encode("utf-8")).hexdigest()[:32]
+    return f"knowbear:search:{SEARCH_CACHE_SCHEMA}:{digest}"
+
+
+def image_cache_key(query: str) -> str:
+    digest = hashlib.sha256(normalize_search_query(query).encode("utf-8")).hexdigest()[:32]
+    return f"knowbear:images:{IMAGE_CACHE_SCHEMA}:{digest}"
+
+
+PROVIDERS = ("tavily", "serper", "exa")
+HEALTH_ALPHA = 0.2
+LATENCY_SAMPLES = 64
+
+
+class ProviderHealth:
+    """EWMA latency and success rate for one provider, plus recent latencies for a p90."""
+
+    def __init__(self, initial_latency: float = 1.0):
+        self.latency = initial_latency
+        self.success = 1.0
+        self.samples: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def observe(self, latency_seconds: float, ok: bool) -> None:
+        if ok:
+            # Failures are often instant (bad key, 4xx), so only successes shape latency.
+            self.latency += HEALTH_ALPHA * (latency_seconds - self.latency)
+            self.samples.append(latency_seconds)
+        self.success += HEALTH_ALPHA * ((1.0 if ok else 0.0) - self.success)
+
+    def p90(self) -> float:
+        if len(self.samples) < 5:
+            return self.latency * 2
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * 0.9), len(ordered) - 1)]
+
+    def score(self) -> float:
+        return self.success / max(self.latency, 0.05)
+
+
 class SearchManager:
     def __init__(self):
         self.visual_keywords = {"diagram", "flowchart", "image", "photo", "visual", "graph", "chart"}
+        # One fetch per cache key at a time: concurrent misses and background refreshes share it.
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.health: Dict[str, ProviderHealth] = {name: ProviderHealth() for name in PROVIDERS}
 
-    async def get_search_context(self, query: str) -> str:
-        # Check cache
+    @staticmethod
+    def _cache_windows() -> tuple[int, int, int]:
+        fresh = max(int(getattr(settings, "search_cache_fresh_seconds", 21600)), 1)
+        stale = max(int(getattr(settings, "search_cache_stale_seconds", 86400)), 0)
+        negative = max(int(getattr(settings, "search_cache_negative_seconds", 600)), 1)
+        return fresh, stale, negative
+
+    @staticmethod
+    def _cached_results(entry: Dict[str, Any], horizon: float) -> tuple[Dict[str, List[SearchResult]], float]:
+        """Per-provider results still inside the stale window, and when the newest was fetched."""
+        providers = entry.get("providers")
+        if not isinstance(providers, dict):
+            return {}, 0.0
+        usable = [
+            (float(stored.get("fetched_at") or 0), name, stored["results"])
+            for name, stored in providers.items()
+            if isinstance(stored, dict) and stored.get("results") and float(stored.get("fetched_at") or 0) >= horizon
+        ]
+        # Freshest provider first, so its results win merge-order ties.
+        usable.sort(key=lambda item: item[0], reverse=True)
+        results = {
+            name: [SearchResult.from_dict(item) for item in stored if isinstance(item, dict)] for _, name, stored in usable
+        }
+        return results, usable[0][0] if usable else 0.0
+
+    async def _read_entry(self, key: str) -> Optional[Dict[str, Any]]:
         try:
-            cache_key = f"search:{hashlib.sha256(query.encode()).hexdigest()}"
-            cached = await cache_get(cache_key)
-            if cached and isinstance(cached, dict) and "content" in cached:
-                logger.info("search_cache_hit", query=query)
-                return cached["content"]
+            cached = await cache_get(key)
         except Exception as e:
             logger.warning("cache_error_search", error=str(e))
+            return None
+        return cached if isinstance(cached, dict) else None
+
+    async def _lookup(self, query: str, *, fanout: int = 1) -> Dict[str, Any]:
+        """
+        Resolve a query through the cache into ranked, deduplicated results.
+
+        Fresh entries are served as is. Stale entries are served immediately
+        while one background task refreshes them. Recent empty results are
+        remembered so a dead query does not hit providers on every request.
+        Every provider's results in the entry are merged, so a refresh by one
+        provider adds to what the others found instead of replacing it.
+        """
+        key = search_cache_key(query)
+        fresh_seconds, stale_seconds, negative_seconds = self._cache_windows()
+        entry = await self._read_entry(key)
+        now = time.time()
+
+        if entry:
+            by_provider, fetched_at = self._cached_results(entry, now - fresh_seconds - stale_seconds)
+            if by_provider:
+                age = now - fetched_at
+                status = "hit"
+                if age >= fresh_seconds:
+                    status = "stale"
+                    self._refresh_in_background(key, query, fanout)
+                logger.info(f"search_cache_{status}", providers=sorted(by_provider), age_seconds=round(age, 1))
+                return self._resolved(query, by_provider, status, fetched_at)
+            empty_at = float(entry.get("empty_at") or 0)
+            if now - empty_at < negative_seconds:
+                logger.info("search_cache_negative_hit")
+                return self._resolved(query, {}, "negative", empty_at)
+
+        by_provider = await self._fetch_shared(key, query, fanout)
+        return self._resolved(query, by_provider, "miss", now)
+
+    @staticmethod
+    def _resolved(query: str, by_provider: Dict[str, List[SearchResult]], status: str, fetched_at: float) -> Dict[str, Any]:
+        results = rank_results(query, merge_results(by_provider.values()))
+        return {
+            "results": results,
+            "provider": results[0].provider if results else None,
+            "providers": sorted(by_provider),
+            "cache": status,
+            "fetched_at": fetched_at,
+        }
+
+    async def _fetch_shared(self, key: str, query: str, fanout: int) -> Dict[str, List[SearchResult]]:
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._track(key, self._fetch_and_store(key, query, fanout))
+        by_provider = await asyncio.shield(task)
+        if not by_provider and task.get_name() == "search_refresh":
+            # Joined a refresh that lost the cross-instance lock; fetch for this caller directly.
+            return await self._fetch_and_store(key, query, fanout)
+        return by_provider
+
+    def _track(self, key: str, coro, name: str = "search_fetch") -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        self._inflight[key] = task
+
+        def forget(done: asyncio.Task) -> None:
+            if self._inflight.get(key) is done:
+                del self._inflight[key]
+
+        task.add_done_callback(forget)
+        return task
+
+    def _refresh_in_background(self, key: str, query: str, fanout: int) -> None:
+        if key in self._inflight:
+            return
+
+        async def refresh() -> Dict[str, List[SearchResult]]:
+            fresh_seconds, _, _ = self._cache_windows()
+            # Instances that see the same stale entry race for a short lock; only the winner refreshes.
+            if not await cache_set_if_absent(f"{key}:refresh", {"at": time.time()}, ttl=max(min(fresh_seconds, 30), 5)):
+                return {}
+            return await self._fetch_and_store(key, query, fanout)
+
+        self._track(key, refresh(), name="search_refresh")
+
+    async def _fetch_and_store(self, key: str, query: str, fanout: int) -> Dict[str, List[SearchResult]]:
+        fetched = await self._fetch(query, fanout=fanout)
+        fresh_seconds, stale_seconds, negative_seconds = self._cache_windows()
+        now = time.time()
+        entry = await self._read_entry(key) or {}
+        stored = entry.get("providers") if isinstance(entry.get("providers"), dict) else {}
+        try:
+            if fetched:
+                for name, results in fetched.items():
+                    stored[name] = {"results": [result.to_dict() for result in results], "fetched_at": now}
+                # Results from other providers past the stale window are dropped, not carried forever.
+                horizon = now - fresh_seconds - stale_seconds
+                stored = {
+                    name: value
+                    for name, value in stored.items()
+                    if isinstance(value, dict) and float(value.get("fetched_at") or 0) >= horizon
+                }
+                await cache_set(key, {"providers": stored}, ttl=fresh_seconds + stale_seconds)
+            elif not stored:
+                await cache_set(key, {"providers": {}, "empty_at": now}, ttl=negative_seconds)
+        except Exception as e:
+            logger.warning("cache_error_search", error=str(e))
+        return fetched
+
+    async def _fetch(self, query: str, *, fanout: int = 1) -> Dict[str, List[SearchResult]]:
+        """
+        Query providers best-first, hedging instead of waiting out a slow one.
 
-        # Determine provider
-        provider = self._select_provider(query)
-        logger.info("search_provider_selected", provider=provider, query=query)
+        ``fanout`` providers start together; beyond that, the newest running
+        provider gets until its p90 latency before the next one is hedged in,
+        and a failure starts the next one at once. After the first non-empty
+        answer, providers still running get a short grace period to join the
+        merge; the rest are cancelled.
+        """
+        order = self._provider_order(query)
+        logger.info("search_provider_selected", provider=order[0], query=query)
+        running: Dict[asyncio.Task, str] = {}
+        collected: Dict[str, List[SearchResult]] = {}
+        launched = 0
 
-        content = ""
+        def launch() -> str:
+            nonlocal launched
+            name = order[launched]
+            launched += 1
+            running[asyncio.create_task(self._timed_search(name, query))] = name
+            return name
+
+        for _ in range(min(max(fanout, 1), len(order))):
+            launch()
         try:
-            if provider == "tavily":
-                content = await self._search_tavily(query)
-            elif provider == "serper":
-                content = await self._search_serper(query)
-            elif provider == "exa":
-                content = await self._search_exa(query)
+            while running:
+                timeout = None
+                if collected:
+                    timeout = float(getattr(settings, "search_merge_grace_seconds", 0.25))
+                elif launched < len(order):
+                    timeout = self._hedge_delay(order[launched - 1])
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if collected:
+                        break
+                    waiting_on = sorted(running.values())
+                    logger.info("search_hedge_started", provider=launch(), waiting_on=waiting_on)
+                    continue
+                for task in done:
+                    name = running.pop(task)
+                    results = [] if task.exception() is not None else task.result()
+                    if results:
+                        collected[name] = results
+                if not collected and launched < len(order):
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+        return collected
+
+    async def _timed_search(self, provider: str, query: str) -> List[SearchResult]:
+        search = {
+            "tavily": self._search_tavily,
+            "serper": self._search_serper,
+            "exa": self._search_exa,
+        }[provider]
+        started = time.perf_counter()
+        try:
+            raw = await search(query)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error("search_provider_failed", provider=provider, error=str(e))
-            content = await self._fallback_search(query, failed_provider=provider)
+            self.health[provider].observe(time.perf_counter() - started, ok=False)
+            logger.warning("search_provider_failed", provider=provider, error=str(e))
+            raise
+        self.health[provider].observe(time.perf_counter() - started, ok=True)
+        if isinstance(raw, str):
+            # Plain-text answers (e.g. from a stubbed provider) become a single URL-less result.
+            return [SearchResult(title="", url="", snippet=raw, provider=provider)] if raw.strip() else []
+        return list(raw or [])
 
-        if not content and content is not None:
-             # Try fallback if content is empty string (failure)
-             content = await self._fallback_search(query, failed_provider=provider)
+    def _hedge_delay(self, provider: str) -> float:
+        floor = float(getattr(settings, "search_hedge_min_seconds", 0.3))
+        ceiling = float(getattr(settings, "search_hedge_max_seconds", 2.5))
+        return min(max(self.health[provider].p90(), floor), max(ceiling, floor))
 
-        # Cache result if valid
-        if content:
-            await cache_set(cache_key, {"content": content}, ttl=86400) # 24h default
+    @staticmethod
+    def _token_budget() -> int:
+        return max(int(getattr(settings, "search_context_token_budget", 800)), 1)
 
-        return content if content else "No external context found."
+    async def get_search_context(self, query: str) -> str:
+        result = await self._lookup(query)
+        return pack_context(result["results"], self._token_budget()) or NO_CONTEXT
 
     async def get_structured_search_context(self, query: str) -> Dict[str, Any]:
         """Return a structured payload suitable for prompt injection in technical mode."""
-        content = await self.get_search_context(query)
+        fanout = max(int(getattr(settings, "search_structured_fanout", 2)), 1)
+        result = await self._lookup(query, fanout=fanout)
+        results = result["results"]
         return {
             "query": query,
             "provider_keys_present": {
@@ -59,27 +304,47 @@ class SearchManager:
                 "serper": bool(settings.serper_api_key),
                 "exa": bool(settings.exa_api_key),
             },
-            "context": content,
+            "provider": result["provider"],
+            "providers": result["providers"],
+            "cache": result["cache"],
+            "fetched_at": result["fetched_at"],
+            "results": [item.to_dict() for item in results],
+            "context": pack_context(results, self._token_budget()) or NO_CONTEXT,
         }
+
+    def _configured_providers(self) -> List[str]:
+        keys = {
+            "tavily": settings.tavily_api_key,
+            "serper": settings.serper_api_key,
+            "exa": settings.exa_api_key,
+        }
+        # Without any keys every provider fails fast; keep them all so the error path is unchanged.
+        return [name for name in PROVIDERS if keys[name]] or list(PROVIDERS)
 
     def _select_provider(self, query: str) -> str:
         # Check for visual keywords - favor Serper
         if any(keyword in query.lower() for keyword in self.visual_keywords):
-            return "serper" if random.random() < 0.7 else self._weighted_random()
-        
-        return self._weighted_random()
-
-    def _weighted_random(self) -> str:
-        # Tavily 50%, Serper 30%, Exa 20%
-        rand = random.random()
-        if rand < 0.5:
-            return "tavily"
-        elif rand < 0.8:
-            return "serper"
-        else:
-            return "exa"
-
-    async def _search_tavily(self, query: str) -> str:
+            return "serper" if random.random() < 0.7 else self._ranked_choice()
+
+        return self._ranked_choice()
+
+    def _ranked_choice(self) -> str:
+        candidates = self._configured_providers()
+        # A small share of traffic explores, so a recovered provider can win its place back.
+        if len(candidates) > 1 and random.random() < float(getattr(settings, "search_explore_rate", 0.1)):
+            return random.choice(candidates)
+        return max(candidates, key=lambda name: self.health[name].score())
+
+    def _provider_order(self, query: str) -> List[str]:
+        primary = self._select_provider(query)
+        rest = sorted(
+            (name for name in self._configured_providers() if name != primary),
+            key=lambda name: self.health[name].score(),
+            reverse=True,
+        )
+        return [primary, *rest]
+
+    async def _search_tavily(self, query: str) -> List[SearchResult]:
         if not settings.tavily_api_key:
             raise ValueError("Tavily API key missing")
         
@@ -94,11 +359,15 @@ class SearchManager:
             resp = await client.post("https://api.tavily.com/search", json=payload)
             resp.raise_for_status()
             data = resp.json()
-            results = data.get("results", [])
-            formatted = "\n".join([f"- {r['title']}: {r['content']} ({r['url']})" for r in results])
-            return f"Answer: {data.get('answer', '')}\nSources:\n{formatted}"
+            results = [
+                SearchResult(title=r.get("title") or "", url=r.get("url") or "", snippet=r.get("content") or "", provider="tavily")
+                for r in data.get("results", [])
+            ]
+            if data.get("answer"):
+                results.insert(0, SearchResult(title="Answer", url="", snippet=data["answer"], provider="tavily"))
+            return results
 
-    async def _search_serper(self, query: str) -> str:
+    async def _search_serper(self, query: str) -> List[SearchResult]:
         if not settings.serper_api_key:
             raise ValueError("Serper API key missing")
         
@@ -115,10 +384,12 @@ class SearchManager:
             resp.raise_for_status()
             data = resp.json()
             organic = data.get("organic", [])
-            formatted = "\n".join([f"- {r.get('title')}: {r.get('snippet')} ({r.get('link')})" for r in organic[:5]])
-            return formatted
+            return [
+                SearchResult(title=r.get("title") or "", url=r.get("link") or "", snippet=r.get("snippet") or "", provider="serper")
+                for r in organic[:5]
+            ]
 
-    async def _search_exa(self, query: str) -> str:
+    async def _search_exa(self, query: str) -> List[SearchResult]:
         if not settings.exa_api_key:
              raise ValueError("Exa API key missing")
              
@@ -134,46 +405,36 @@ class SearchManager:
             )
             resp.raise_for_status()
             data = resp.json()
-            results = data.get("results", [])
-            formatted = "\n".join([f"- {r.get('title')}: {r.get('text', '')[:300]}... ({r.get('url')})" for r in results])
-            return formatted
+            return [
+                SearchResult(title=r.get("title") or "", url=r.get("url") or "", snippet=(r.get("text") or "")[:300], provider="exa")
+                for r in data.get("results", [])
+            ]
 
-    async def _fallback_search(self, query: str, failed_provider: str) -> str:
-        """Optimized parallel fallback with faster timeout."""
-        import asyncio
-        
-        providers = ["tavily", "serper", "exa"]
-        if failed_provider in providers:
-            providers.remove(failed_provider)
-        
-        # Try all remaining providers in parallel for faster fallback
-        tasks = []
-        for p in providers:
-            if p == "tavily":
-                tasks.append(self._search_tavily(query))
-            elif p == "serper":
-                tasks.append(self._search_serper(query))
-            elif p == "exa":
-                tasks.append(self._search_exa(query))
-        
-        # Return first successful result
-        for coro in asyncio.as_completed(tasks):
-            try:
-                result = await coro
-                if result:  # Return first non-empty result
-                    return result
-            except Exception as e:
-                logger.warning("fallback_provider_failed", error=str(e))
-                continue
-        
-        return ""
+    def wants_images(self, topic: str) -> bool:
+        lowered = topic.lower()
+        return bool(detect_diagram_type(topic)) or any(keyword in lowered for keyword in self.visual_keywords)
 
     async def get_images(self, query: str) -> List[Dict[str, str]]:
-        # Fallback to Serper Images if Unsplash key is missing or logic dictates
-        # This implementation uses Serper for simplicity as Unsplash key was not provided
+        """
+        Top image results for a topic, cached under its canonical form.
+
+        Empty results are cached for the negative window; concurrent lookups
+        of the same topic (a prefetch and a direct call) share one request.
+        """
         if not settings.serper_api_key:
             return []
-            
+        key = image_cache_key(query)
+        cached = await self._read_entry(key)
+        if cached is not None and isinstance(cached.get("images"), list):
+            log_sampled_success("image_cache_hit", images=len(cached["images"]))
+            return cached["images"]
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._track(key, self._fetch_images(key, query), name="image_fetch")
+        return await asyncio.shield(task)
+
+    async def _fetch_images(self, key: str, query: str) -> List[Dict[str, str]]:
         headers = {
             'X-API-KEY': settings.serper_api_key,
             'Content-Type': 'application/json'
@@ -188,102 +449,43 @@ class SearchManager:
                 resp.raise_for_status()
                 data = resp.json()
                 images = data.get("images", [])
-                return [{"url": img["imageUrl"], "title": img["title"]} for img in images[:3]]
+                results = [{"url": img["imageUrl"], "title": img["title"]} for img in images[:3]]
         except Exception as e:
             logger.error("image_search_failed", error=str(e))
+            # Failures are not cached; the next request tries again.
             return []
 
-    async def get_quote(self) -> str:
-        # Simple quote for loading messages
-        tags = "education|knowledge|learning|science|wisdom|research|effort|creativity"
+        _, _, negative_seconds = self._cache_windows()
+        ttl = int(getattr(settings, "image_cache_seconds", 604800)) if results else negative_seconds
         try:
-            async with httpx.AsyncClient(timeout=3.0) as client:
-                resp = await client.get(f"https://api.quotable.io/random?tags={tags}&maxLength=100")
-                if resp.status_code == 200:
-                    data = resp.json()
-                    return f"«{data['content']}» — {data['author']}"
-        except:
-            pass
-        
-        fallbacks = [
-            "The mind is not a vessel to be filled, but a fire to be kindled. — Plutarch",
-            "An investment in knowledge pays the best interest. — Benjamin Franklin",
-            "Wisdom is not a product of schooling but of the lifelong attempt to acquire it. — Albert Einstein",
-            "The important thing is not to stop questioning. Curiosity has its own reason for existence. — Albert Einstein",
-            "Live as if you were to die tomorrow. Learn as if you were to live forever. — Mahatma Gandhi"
-        ]
-        return random.choice(fallbacks)
-
-    async def get_regeneration_quote(self) -> str:
-        """Specialized quote fetching for regenerated answers with style variety."""
-        tags = "education|knowledge|learning|science|wisdom|philosophy|technology|research|creativity|innovation|discovery|effort|critical-thinking"
-        styles = [
-            "---\n*“{content}”* — {author}",
-            "---\nAs {author} said: *“{content}”*",
-            "---\n*“{content}”*\n— {author}",
-            "---\nIn the words of {author}: *“{content}”*",
-            "---\nA thought worth keeping: *“{content}”* — {author}"
-        ]
-        
-        fallback_quotes = [
-            {"author": "Marie Curie", "content": "Nothing in life is to be feared, it is only to be understood. Now is the time to understand more."},
-            {"author": "Richard Feynman", "content": "The first principle is that you must not fool yourself and you are the easiest person to fool."},
-            {"author": "Leonardo da Vinci", "content": "Learning never exhausts the mind."},
-            {"author": "Srinivasa Ramanujan", "content": "An equation for me has no meaning unless it expresses a thought of God."},
-            {"author": "Ada Lovelace", "content": "That brain of mine is something more than merely mortal; as time will show."},
-            {"author": "Hypatia", "content": "Reserve your right to think, for even to think wrongly is better than not to think at all."},
-            {"author": "Nikola Tesla", "content": "The present is theirs; the future, for which I really worked, is mine."},
-            {"author": "Rosalind Franklin", "content": "Science and everyday life cannot and should not be separated."},
-            {"author": "Isaac Newton", "content": "If I have seen further it is by standing on the shoulders of Giants."},
-            {"author": "Grace Hopper", "content": "The most dangerous phrase in the language is, 'We've always done it this way.'"}
-        ]
+            await cache_set(key, {"images": results, "fetched_at": time.time()}, ttl=max(ttl, 1))
+        except Exception as e:
+            logger.warning("cache_error_images", error=str(e))
+        return results
 
-        # Get session state for variety (author and style index)
-        cache_key = "regen_quote_state"
-        state = await cache_get(cache_key) or {"last_author": "", "last_style_idx": -1}
-        
-        quote_data = None
-        attempts = 0
-        
-        async with httpx.AsyncClient(timeout=4.0) as client:
-            while attempts < 2:
-                attempts += 1
-                try:
-                    # minLength=50, maxLength=120 as requested
-                    resp = await client.get(f"https://api.quotable.io/random?tags={tags}&minLength=50&maxLength=120")
-                    if resp.status_code == 200:
-                        data = resp.json()
-                        # Avoid overused authors if possible
-                        overused = ["Albert Einstein", "Plutarch", "Marcus Aurelius", "Socrates", "Benjamin Franklin"]
-                        if data["author"] == state.get("last_author") or (data["author"] in overused and attempts == 1):
-                            continue # Try again once
-                        quote_data = data
-                        break
-                except:
-                    break
-
-        if not quote_data:
-            # Fallback rotation
-            last_fallback_idx = state.get("last_fallback_idx", -1)
-            next_fallback_idx = (last_fallback_idx + 1) % len(fallback_quotes)
-            quote_data = fallback_quotes[next_fallback_idx]
-            state["last_fallback_idx"] = next_fallback_idx
-
-        # Style rotation
-        last_style_idx = state.get("last_style_idx", -1)
-        available_styles = [i for i in range(len(styles)) if i != last_style_idx]
-        style_idx = random.choice(available_styles)
-        
-        formatted_quote = styles[style_idx].format(
-            content=quote_data["content"].replace("«", "").replace("»", "").strip(), 
-            author=quote_data["author"]
-        )
-        
-        # Save state
-        state["last_author"] = quote_data["author"]
-        state["last_style_idx"] = style_idx
-        await cache_set(cache_key, state, ttl=3600)
-        
-        return formatted_quote
+    def prefetch_images(self, topic: str) -> Optional[asyncio.Task]:
+        """Start the image lookup for a visual topic so it runs alongside text generation."""
+        if not settings.serper_api_key or not self.wants_images(topic):
+            return None
+        return asyncio.create_task(self.get_images(topic), name="image_prefetch")
+
+    async def prefetched_images(self, task: Optional[asyncio.Task]) -> List[Dict[str, str]]:
+        """Prefetched images if they arrive within ``image_prefetch_wait_seconds``; never raises."""
+        if task is None:
+            return []
+        wait = max(float(getattr(settings, "image_prefetch_wait_seconds", 0.5)), 0.0)
+        try:
+            # Shielded: a late lookup still finishes and fills the cache for the next request.
+            return await asyncio.wait_for(asyncio.shield(task), timeout=wait)
+        except Exception:
+            return []
+
+    async def get_quote(self, seed: Optional[str] = None) -> str:
+        """Loading-screen quote from the bundled corpus; ``seed`` (a user or request id) keeps its own rotation."""
+        return loading_quote(seed)
+
+    async def get_regeneration_quote(self, seed: Optional[str] = None) -> str:
+        """Styled quote for regenerated answers, rotating author and style per ``seed`` without shared state."""
+        return regeneration_quote(seed)
 
 search_service = SearchManager()
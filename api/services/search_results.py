@@ -0,0 +1,143 @@
+"""Provider-neutral search results: canonical-URL dedup, BM25 ranking and token-budgeted packing."""
+
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from collections.abc import Iterable, Sequence
+from dataclasses import asdict, dataclass
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from services.token_estimator import count_tokens
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TERM_PATTERN = re.compile(r"[^\W_]+(?:[+#]+|\.js)?")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from how in is it of on or that the this to what when where which who why with".split()
+)
+_TRACKING_PARAMS = frozenset({"gclid", "fbclid", "msclkid", "ref", "ref_src", "source", "igshid", "mc_cid", "mc_eid"})
+
+
+@dataclass(slots=True)
+class SearchResult:
+    title: str
+    url: str
+    snippet: str
+    provider: str
+    score: float = 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SearchResult":
+        return cls(
+            title=str(data.get("title") or ""),
+            url=str(data.get("url") or ""),
+            snippet=str(data.get("snippet") or ""),
+            provider=str(data.get("provider") or ""),
+            score=float(data.get("score") or 0.0),
+        )
+
+    def render(self) -> str:
+        if not self.url:
+            return f"{self.title}: {self.snippet}" if self.title else self.snippet
+        return f"- {self.title}: {self.snippet} ({self.url})"
+
+
+def canonical_url(url: str) -> str:
+    """Comparable form of a URL: no scheme/www/fragment/tracking params, sorted query, no trailing slash."""
+    if not url:
+        return ""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in _TRACKING_PARAMS
+    )
+    path = parts.path.rstrip("/") or ""
+    return urlunsplit(("", host, path, urlencode(query), ""))
+
+
+def bm25_terms(text: str) -> list[str]:
+    """Casefolded word terms without stopwords; ``c++``/``c#``/``node.js`` stay whole."""
+    return [term for term in _TERM_PATTERN.findall(text.casefold()) if term not in _STOPWORDS]
+
+
+def merge_results(result_lists: Iterable[Sequence[SearchResult]]) -> list[SearchResult]:
+    """
+    Interleave provider lists and drop duplicate URLs.
+
+    Lists are interleaved rank by rank so no provider crowds out the others
+    before ranking. A duplicate keeps the longer snippet; results without a
+    URL (provider answers) are deduplicated by their text.
+    """
+    merged: dict[str, SearchResult] = {}
+    lists = [list(results) for results in result_lists]
+    for rank in range(max((len(results) for results in lists), default=0)):
+        for results in lists:
+            if rank >= len(results):
+                continue
+            result = results[rank]
+            if not result.snippet and not result.title:
+                continue
+            key = canonical_url(result.url) or f"text:{result.snippet.strip().casefold()}"
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = SearchResult(result.title, result.url, result.snippet, result.provider, result.score)
+            elif len(result.snippet) > len(existing.snippet):
+                existing.snippet = result.snippet
+                existing.title = existing.title or result.title
+    return list(merged.values())
+
+
+def rank_results(query: str, results: list[SearchResult]) -> list[SearchResult]:
+    """Score results with BM25 over title + snippet and sort best first; ties keep merge order."""
+    query_terms = set(bm25_terms(query))
+    documents = [bm25_terms(f"{result.title} {result.snippet}") for result in results]
+    if not results or not query_terms:
+        return list(results)
+
+    average_length = sum(len(document) for document in documents) / len(documents) or 1.0
+    document_frequency = Counter(term for document in documents for term in set(document) if term in query_terms)
+    total = len(documents)
+    for result, document in zip(results, documents):
+        frequencies = Counter(document)
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * len(document) / average_length)
+        score = 0.0
+        for term in query_terms:
+            frequency = frequencies.get(term, 0)
+            if not frequency:
+                continue
+            idf = math.log(1 + (total - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * frequency * (BM25_K1 + 1) / (frequency + length_norm)
+        result.score = round(score, 4)
+    return sorted(results, key=lambda result: result.score, reverse=True)
+
+
+def pack_context(results: Sequence[SearchResult], token_budget: int) -> str:
+    """Render ranked results until the token budget is spent; answers without a URL go first."""
+    ordered = [result for result in results if not result.url] + [result for result in results if result.url]
+    lines: list[str] = []
+    remaining = max(int(token_budget), 0)
+    for result in ordered:
+        if remaining <= 0:
+            break
+        line = result.render()
+        cost = count_tokens(line) + 1
+        if cost <= remaining:
+            lines.append(line)
+            remaining -= cost
+        elif not lines:
+            # Never return nothing when the best result alone is too long; trim it to fit instead.
+            lines.append(" ".join(line.split()[: max(remaining * 3 // 4, 1)]))
+            remaining = 0
+    return "\n".join(lines)
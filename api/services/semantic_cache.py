@@ -0,0 +1,258 @@
+"""In-process near-duplicate topic index (MinHash + LSH) in front of the exact-key cache."""
+
+from __future__ import annotations
+
+import hashlib
+import random
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from dataclasses import dataclass
+
+from config import get_settings
+from logging_config import logger
+from services.intent import detect_diagram_type, detect_intent_and_depth
+from utils import LEARNING_MODE, SOCRATIC_MODE, TECHNICAL_MODE, canonicalize_topic
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+MAX_SEMANTIC_TOPIC_CHARS = 200
+MAX_VERIFIED_CANDIDATES = 16
+
+# Technical prompts are sensitive to wording ("vs", "in depth"), so they require closer matches.
+SIMILARITY_THRESHOLDS = {
+    LEARNING_MODE: 0.8,
+    SOCRATIC_MODE: 0.85,
+    TECHNICAL_MODE: 0.9,
+}
+
+# Style modifiers that change tone, not subject; the level already captures audience.
+_MODIFIER_PATTERN = re.compile(
+    r"\b(?:simply|briefly|quickly|in simple terms|in plain english|for kids|for beginners|like i'?m five|eli5)\b"
+)
+_TOKEN_PATTERN = re.compile(r"[^\s]+")
+_DIGIT_PATTERN = re.compile(r"\d")
+_ROMAN_NUMERAL_PATTERN = re.compile(r"^m{0,3}(?:cm|cd|d?c{0,3})(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3})$")
+# Short tokens usually name the subject ("cpu"/"gpu", "hepatitis a"/"b"); these are just phrasing.
+MAX_IDENTIFIER_CHARS = 3
+_FILLER_TOKENS = frozenset(
+    {"an", "and", "are", "as", "at", "by", "can", "do", "for", "how", "in", "is", "it", "its",
+     "of", "on", "or", "the", "to", "vs", "was", "way", "we", "who", "why", "you"}
+)
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = tuple(
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)
+)
+
+
+def _stem(token: str) -> str:
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def semantic_form(topic: str) -> str:
+    """Canonical topic with tone modifiers removed and plurals folded."""
+    text = _MODIFIER_PATTERN.sub(" ", canonicalize_topic(topic))
+    return " ".join(_stem(token) for token in _TOKEN_PATTERN.findall(text))
+
+
+def identifier_tokens(form: str) -> tuple[str, ...]:
+    """
+    Tokens that name a distinct entity while barely moving trigram Jaccard.
+
+    Numbers ("python 2"/"python 3"), single letters ("hepatitis a"/"b"), Roman
+    numerals ("henry vii"/"viii") and other short tokens ("cpu"/"gpu") flip the
+    subject with a one-character edit, so they must match exactly.
+    """
+    found = {
+        token
+        for token in _TOKEN_PATTERN.findall(form)
+        if _DIGIT_PATTERN.search(token)
+        or _ROMAN_NUMERAL_PATTERN.match(token)
+        or (len(token) <= MAX_IDENTIFIER_CHARS and token not in _FILLER_TOKENS)
+    }
+    return tuple(sorted(found))
+
+
+def shingles(text: str) -> frozenset[str]:
+    """Word-boundary padded character trigrams."""
+    padded = f" {text} "
+    if len(padded) < 3:
+        return frozenset({padded})
+    return frozenset(padded[index : index + 3] for index in range(len(padded) - 2))
+
+
+def minhash_signature(items: frozenset[str]) -> tuple[int, ...]:
+    base_hashes = [
+        int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "big") for item in items
+    ]
+    return tuple(
+        min(((a * value + b) % _MERSENNE_PRIME) & _MAX_HASH for value in base_hashes) for a, b in _PERMUTATIONS
+    )
+
+
+def jaccard(left: frozenset[str], right: frozenset[str]) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+@dataclass(slots=True)
+class _Entry:
+    namespace: tuple[str, ...]
+    cache_key: str
+    shingles: frozenset[str]
+    bands: tuple[tuple[int, ...], ...]
+
+
+@dataclass(frozen=True, slots=True)
+class SemanticMatch:
+    cache_key: str
+    similarity: float
+
+
+class SemanticCacheIndex:
+    """
+    Bounded LRU of topic sketches bucketed by LSH band.
+
+    Candidates from shared bands are verified with exact trigram Jaccard, so a
+    hit is never a pure MinHash estimate. Everything is in-process and CPU-only.
+    """
+
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max(int(max_entries), 1)
+        self._entries: OrderedDict[tuple[tuple[str, ...], str], _Entry] = OrderedDict()
+        self._buckets: dict[tuple, set[tuple[tuple[str, ...], str]]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def namespace(mode: str, level: str, scope: str, topic: str) -> tuple[str, ...]:
+        identifiers = " ".join(identifier_tokens(semantic_form(topic)))
+        if mode == TECHNICAL_MODE:
+            # Technical prompts vary by intent/depth/diagram, so paraphrases must agree on all three.
+            classification = detect_intent_and_depth(topic)
+            return (
+                scope,
+                mode,
+                level,
+                classification["intent"],
+                classification["depth"],
+                detect_diagram_type(topic) or "",
+                identifiers,
+            )
+        return (scope, mode, level, identifiers)
+
+    def _sketch(self, topic: str) -> tuple[frozenset[str], tuple[tuple[int, ...], ...]] | None:
+        if len(topic) > MAX_SEMANTIC_TOPIC_CHARS:
+            return None
+        form = semantic_form(topic)
+        if not form:
+            return None
+        items = shingles(form)
+        signature = minhash_signature(items)
+        bands = tuple(signature[band * LSH_ROWS : (band + 1) * LSH_ROWS] for band in range(LSH_BANDS))
+        return items, bands
+
+    def remember(self, topic: str, cache_key: str, *, mode: str, level: str, scope: str = "query") -> None:
+        sketch = self._sketch(topic)
+        if sketch is None:
+            return
+        items, bands = sketch
+        namespace = self.namespace(mode, level, scope, topic)
+        entry_id = (namespace, cache_key)
+        with self._lock:
+            if entry_id in self._entries:
+                self._entries.move_to_end(entry_id)
+                return
+            self._entries[entry_id] = _Entry(namespace, cache_key, items, bands)
+            for index, band in enumerate(bands):
+                self._buckets[(namespace, index, band)].add(entry_id)
+            while len(self._entries) > self.max_entries:
+                evicted_id, evicted = self._entries.popitem(last=False)
+                self._unbucket_locked(evicted_id, evicted)
+                self.stats["evictions"] += 1
+
+    def forget(self, cache_key: str, *, topic: str, mode: str, level: str, scope: str = "query") -> None:
+        """Drop an entry whose backing cache value has expired."""
+        entry_id = (self.namespace(mode, level, scope, topic), cache_key)
+        with self._lock:
+            entry = self._entries.pop(entry_id, None)
+            if entry is not None:
+                self._unbucket_locked(entry_id, entry)
+
+    def _unbucket_locked(self, entry_id: tuple[tuple[str, ...], str], entry: _Entry) -> None:
+        for index, band in enumerate(entry.bands):
+            bucket_key = (entry.namespace, index, band)
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                continue
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[bucket_key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self.stats = {"lookups": 0, "hits": 0, "misses": 0, "evictions": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, topic: str, *, mode: str, level: str, scope: str = "query") -> SemanticMatch | None:
+        threshold = SIMILARITY_THRESHOLDS.get(mode, max(SIMILARITY_THRESHOLDS.values()))
+        sketch = self._sketch(topic)
+        with self._lock:
+            self.stats["lookups"] += 1
+            if sketch is None:
+                self.stats["misses"] += 1
+                return None
+            items, bands = sketch
+            namespace = self.namespace(mode, level, scope, topic)
+            collisions: Counter[tuple[tuple[str, ...], str]] = Counter()
+            for index, band in enumerate(bands):
+                collisions.update(self._buckets.get((namespace, index, band), ()))
+
+            # Shared bands track similarity, so only the strongest candidates are verified exactly.
+            best: SemanticMatch | None = None
+            for entry_id, _ in collisions.most_common(MAX_VERIFIED_CANDIDATES):
+                entry = self._entries[entry_id]
+                similarity = jaccard(items, entry.shingles)
+                if similarity >= threshold and (best is None or similarity > best.similarity):
+                    best = SemanticMatch(cache_key=entry.cache_key, similarity=round(similarity, 4))
+
+            if best is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end((namespace, best.cache_key))
+            self.stats["hits"] += 1
+            return best
+
+
+def _build_index() -> SemanticCacheIndex:
+    return SemanticCacheIndex(max_entries=int(getattr(get_settings(), "semantic_cache_max_entries", 5000)))
+
+
+semantic_cache = _build_index()
+
+
+def semantic_cache_enabled() -> bool:
+    return bool(getattr(get_settings(), "semantic_cache_enabled", True))
+
+
+def log_semantic_hit(match: SemanticMatch, *, mode: str, level: str, scope: str) -> None:
+    logger.info(
+        "semantic_cache_hit",
+        mode=mode,
+        level=level,
+        scope=scope,
+        similarity=match.similarity,
+        hits=semantic_cache.stats["hits"],
+        lookups=semantic_cache.stats["lookups"],
+    )
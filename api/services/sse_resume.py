@@ -0,0 +1,341 @@
+"""Per-message SSE event logs so a dropped client can resume with ``Last-Event-ID``."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+from config import get_settings
+from logging_config import logger
+from services.cache import cache_delete, cache_list_append, cache_list_range, decode_cache_value, encode_cache_value
+from services.streaming import SseEventBuilder
+
+# Frames logged per generation when sse_resume_max_events is unset. Every delta frame carries at least
+# one output token, so this covers the longest outputs the models are allowed, plus control events.
+MAX_LOGGED_EVENTS = 16384
+LOCAL_BUFFER_EVENTS = 512
+MAX_LOCAL_LOGS = 256
+FLUSH_INTERVAL_SECONDS = 0.1
+REPLAY_PAGE_SIZE = 64
+TAIL_POLL_SECONDS = 0.15
+
+# Keepalives carry no content; resumed streams send their own.
+UNLOGGED_EVENTS = frozenset({"heartbeat"})
+
+END_DONE = "done"
+END_INTERRUPTED = "interrupted"
+END_TRUNCATED = "truncated"
+
+STATUS_MISS = "miss"
+STATUS_STALLED = "stalled"
+# The Redis list is missing frames the reader needs (e.g. a failed append), so replay cannot continue.
+STATUS_GAP = "gap"
+
+
+def sse_resume_enabled() -> bool:
+    return bool(getattr(get_settings(), "sse_resume_enabled", True))
+
+
+def max_logged_events() -> int:
+    configured = int(getattr(get_settings(), "sse_resume_max_events", 0) or 0)
+    return configured if configured > 0 else MAX_LOGGED_EVENTS
+
+
+def event_log_key(idempotency_key: str) -> str:
+    return f"{idempotency_key}:events"
+
+
+def parse_last_event_id(value: str | None) -> int | None:
+    if value is None:
+        return None
+    try:
+        parsed = int(value.strip())
+    except ValueError:
+        return None
+    return parsed if parsed >= 0 else None
+
+
+class EventLog:
+    """
+    Records formatted SSE frames for one generation.
+
+    Frames are kept in a bounded in-process deque, which same-worker resumes
+    tail without touching Redis, and appended to a Redis list in batched
+    background flushes so any worker can serve the replay. Each frame's
+    sequence number is its index in the Redis list, so a reader that falls
+    behind the deque continues from the list without a gap. A ``done`` event
+    closes the log; ``close`` marks anything else as interrupted.
+    """
+
+    def __init__(self, key: str, *, ttl: int):
+        self.key = key
+        self.ttl = max(int(ttl), 1)
+        self.frames: deque[tuple[int, str]] = deque(maxlen=LOCAL_BUFFER_EVENTS)
+        self.logged = 0
+        self.max_events = max_logged_events()
+        self.end: str | None = None
+        self._pending: list[str] = []
+        self._last_flush = time.perf_counter()
+        self._tail: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    @property
+    def closed(self) -> bool:
+        return self.end is not None
+
+    def record(self, event_id: int, event: str, frame: str) -> None:
+        if self.closed or event in UNLOGGED_EVENTS:
+            return
+        if self.logged >= self.max_events:
+            # Past the cap a replay would have a hole, so resumes must regenerate instead.
+            logger.warning("sse_event_log_truncated", key=self.key, logged=self.logged, max_events=self.max_events)
+            self._finish(END_TRUNCATED)
+            return
+        self._pending.append(encode_cache_value({"i": event_id, "f": frame, "s": self.logged}))
+        self.frames.append((event_id, frame))
+        self.logged += 1
+        if event == "done":
+            self._finish(END_DONE)
+            return
+        self._notify()
+        if time.perf_counter() - self._last_flush >= FLUSH_INTERVAL_SECONDS:
+            self._flush()
+
+    def _finish(self, end: str) -> None:
+        self.end = end
+        self._pending.append(encode_cache_value({"end": end}))
+        self._flush()
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _flush(self) -> None:
+        self._last_flush = time.perf_counter()
+        if not self._pending:
+            return
+        entries, self._pending = self._pending, []
+        previous = self._tail
+
+        async def _push() -> None:
+            if previous is not None:
+                await previous
+            await cache_list_append(self.key, entries, self.ttl)
+
+        self._tail = asyncio.create_task(_push())
+
+    @property
+    def first_sequence(self) -> int:
+        """Sequence number (Redis list index) of the oldest frame still in the deque."""
+        return self.logged - len(self.frames)
+
+    async def sync(self) -> None:
+        """Push buffered frames to Redis now and wait until every write so far has landed."""
+        self._flush()
+        if self._tail is not None:
+            await self._tail
+
+    def changed(self) -> asyncio.Event:
+        """Event set on the next recorded frame or when the log closes."""
+        return self._changed
+
+    async def close(self) -> None:
+        """Seal the log (as interrupted unless ``done`` was recorded) and wait for pending writes."""
+        if not self.closed:
+            self._finish(END_INTERRUPTED)
+        if self._tail is not None:
+            await self._tail
+
+
+_local_logs: OrderedDict[str, EventLog] = OrderedDict()
+
+
+def open_event_log(key: str, *, ttl: int) -> EventLog:
+    """Start a fresh log for ``key``; a previous generation's frames must not leak into it."""
+    log = EventLog(key, ttl=ttl)
+    # The reset heads the flush chain, so it never delays the first event.
+    log._tail = asyncio.create_task(cache_delete(key))
+    _local_logs[key] = log
+    _local_logs.move_to_end(key)
+    while len(_local_logs) > MAX_LOCAL_LOGS:
+        _local_logs.popitem(last=False)
+    return log
+
+
+def local_event_log(key: str) -> EventLog | None:
+    return _local_logs.get(key)
+
+
+def clear_local_logs() -> None:
+    _local_logs.clear()
+
+
+class EventLogReader:
+    """
+    Yields frames after ``last_event_id`` and then tails the live generation.
+
+    A log owned by this process is followed in memory. Otherwise the Redis
+    list is paged and polled while ``is_live`` reports the owner is still
+    heartbeating. ``end`` is how the log finished, or a STATUS_* value when it
+    could not be followed to the end; ``last_id`` is the newest id seen.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        last_event_id: int,
+        *,
+        is_live: Callable[[], Awaitable[bool]],
+        keepalive_seconds: float,
+    ):
+        self.key = key
+        self.last_id = last_event_id
+        self.is_live = is_live
+        self.keepalive_seconds = max(float(keepalive_seconds), 0.05)
+        self.end: str = STATUS_MISS
+        self._local: EventLog | None = None
+        self._first_page: list[str] | None = None
+        self._next_sequence: int | None = None
+
+    async def available(self) -> bool:
+        """Whether the frames after ``last_event_id`` can still be served without a gap."""
+        local = local_event_log(self.key)
+        if local is not None:
+            if local.end == END_TRUNCATED:
+                return False
+            if not local.frames or local.frames[0][0] <= self.last_id + 1:
+                self._local = local
+                return True
+        self._first_page = await cache_list_range(self.key, 0, REPLAY_PAGE_SIZE - 1)
+        if not self._first_page:
+            return False
+        first = _decode(self._first_page[0])
+        return bool(first) and "i" in first and int(first["i"]) <= self.last_id + 1
+
+    async def frames(self) -> AsyncIterator[str]:
+        if self._local is not None:
+            async for frame in self._follow_local(self._local):
+                yield frame
+            return
+        async for frame in self._follow_redis(cursor=0, page=self._first_page):
+            yield frame
+
+    async def _follow_local(self, log: EventLog) -> AsyncIterator[str]:
+        idle = False
+        while True:
+            # Taken before the snapshot so a frame recorded while we yield still wakes the wait.
+            changed = log.changed()
+            closed = log.closed
+            snapshot = list(log.frames)
+            first_sequence = log.first_sequence
+            if self._next_sequence is None:
+                self._next_sequence = first_sequence + sum(1 for event_id, _ in snapshot if event_id <= self.last_id)
+            if self._next_sequence < first_sequence:
+                # A slow reader fell behind the deque; the frames it still needs are in the Redis list.
+                logger.info(
+                    "sse_resume_local_overrun",
+                    key=self.key,
+                    next_sequence=self._next_sequence,
+                    first_sequence=first_sequence,
+                )
+                await log.sync()
+                async for frame in self._follow_redis(cursor=self._next_sequence, page=None):
+                    yield frame
+                return
+            progressed = False
+            for sequence, (event_id, frame) in enumerate(snapshot, start=first_sequence):
+                if sequence < self._next_sequence:
+                    continue
+                self._next_sequence = sequence + 1
+                if event_id > self.last_id:
+                    self.last_id = event_id
+                    progressed = True
+                    yield frame
+            if closed:
+                self.end = log.end or END_INTERRUPTED
+                return
+            if idle and not progressed:
+                yield ": keepalive\n\n"
+            idle = not await _wait(changed, self.keepalive_seconds)
+
+    async def _follow_redis(self, *, cursor: int, page: list[str] | None) -> AsyncIterator[str]:
+        last_progress = time.perf_counter()
+        while True:
+            if page is None:
+                page = await cache_list_range(self.key, cursor, cursor + REPLAY_PAGE_SIZE - 1)
+            if page is None:
+                self.end = STATUS_STALLED
+                return
+            if not page:
+                if not await self.is_live():
+                    # The owner's final flush can land just after it settles; look once more.
+                    await asyncio.sleep(TAIL_POLL_SECONDS)
+                    page = await cache_list_range(self.key, cursor, cursor + REPLAY_PAGE_SIZE - 1)
+                    if not page:
+                        self.end = STATUS_STALLED
+                        return
+                    continue
+                if time.perf_counter() - last_progress >= self.keepalive_seconds:
+                    last_progress = time.perf_counter()
+                    yield ": keepalive\n\n"
+                await asyncio.sleep(TAIL_POLL_SECONDS)
+                page = None
+                continue
+
+            for raw in page:
+                index = cursor
+                cursor += 1
+                entry = _decode(raw)
+                if entry is None:
+                    continue
+                if "end" in entry:
+                    self.end = str(entry["end"])
+                    return
+                if int(entry.get("s", index)) != index:
+                    # An append was lost, so list positions no longer match the frames; stop rather than skip.
+                    logger.warning("sse_event_log_gap", key=self.key, index=index, sequence=entry.get("s"))
+                    self.end = STATUS_GAP
+                    return
+                event_id = int(entry.get("i", 0))
+                if event_id > self.last_id:
+                    self.last_id = event_id
+                    yield str(entry.get("f", ""))
+            last_progress = time.perf_counter()
+            page = None
+
+
+async def resume_event_stream(reader: EventLogReader) -> AsyncIterator[str]:
+    """Missed frames, then live ones; a log that ends without ``done`` gets a closing error."""
+    async for frame in reader.frames():
+        yield frame
+    if reader.end == END_DONE:
+        return
+    logger.info("sse_resume_interrupted", end=reader.end, last_event_id=reader.last_id)
+    builder = SseEventBuilder(event_id=reader.last_id)
+    if reader.end == END_TRUNCATED:
+        payload = {"error": "Response too long to replay. Retry to regenerate.", "resumable": False, "truncated": True}
+    else:
+        payload = {"error": "Stream interrupted. Retry to continue.", "resumable": False}
+    yield builder.emit_json("error", payload)
+    yield builder.emit("done", "[DONE]")
+
+
+async def _wait(event: asyncio.Event, timeout: float) -> bool:
+    try:
+        await asyncio.wait_for(event.wait(), timeout=timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+def _decode(raw: str) -> dict[str, Any] | None:
+    try:
+        entry = decode_cache_value(raw)
+    except Exception:
+        logger.warning("sse_event_log_entry_invalid")
+        return None
+    return entry if isinstance(entry, dict) else None
@@ -0,0 +1,218 @@
+"""Chunked response cache: generations append to a Redis list that replays and tails can read."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from typing import Any
+
+from config import get_settings
+from logging_config import logger
+from services.cache import (
+    cache_delete,
+    cache_get,
+    cache_list_append,
+    cache_list_range,
+    cache_set_if_absent,
+    decode_cache_value,
+    encode_cache_value,
+)
+
+FLUSH_CHARS = 1024
+FLUSH_INTERVAL_SECONDS = 0.25
+REPLAY_PAGE_SIZE = 16
+TAIL_POLL_SECONDS = 0.15
+TAIL_IDLE_SECONDS = 8.0
+ABORTED_TTL_SECONDS = 30
+
+STATUS_MISS = "miss"
+STATUS_COMPLETE = "complete"
+STATUS_ABORTED = "aborted"
+STATUS_STALLED = "stalled"
+
+
+def stream_cache_key(response_key: str) -> str:
+    return f"{response_key}:chunks"
+
+
+def _writer_key(list_key: str) -> str:
+    return f"{list_key}:writer"
+
+
+def stream_cache_enabled() -> bool:
+    return bool(getattr(get_settings(), "stream_cache_enabled", True))
+
+
+class StreamCacheWriter:
+    """
+    Appends generated text to ``list_key`` in coalesced batches, then a
+    ``{"done": ...}`` or ``{"aborted": ...}`` marker.
+
+    Only the request holding the writer lock appends, so concurrent misses for
+    the same key cannot interleave. Flushes run as chained background tasks;
+    the SSE loop never waits on a Redis round trip until ``finish``/``abort``.
+    """
+
+    def __init__(self, list_key: str, *, ttl: int, lock_ttl: int):
+        self.list_key = list_key
+        self.ttl = max(int(ttl), 1)
+        self.lock_ttl = max(int(lock_ttl), 1)
+        self.claimed = False
+        self.closed = False
+        self.completed = False
+        self.chunks_written = 0
+        self._buffer: list[str] = []
+        self._buffered_chars = 0
+        self._last_flush = time.perf_counter()
+        self._tail: asyncio.Task | None = None
+
+    async def claim(self, *, reset: bool = False) -> bool:
+        self.claimed = await cache_set_if_absent(
+            _writer_key(self.list_key),
+            {"started_at": int(time.time())},
+            self.lock_ttl,
+        )
+        if self.claimed and reset:
+            # A previous aborted or superseded generation must not prefix this one.
+            await cache_delete(self.list_key)
+        self._last_flush = time.perf_counter()
+        return self.claimed
+
+    def append(self, chunk: str) -> None:
+        if not self.claimed or self.closed or not chunk:
+            return
+        self._buffer.append(chunk)
+        self._buffered_chars += len(chunk)
+        now = time.perf_counter()
+        if self._buffered_chars >= FLUSH_CHARS or now - self._last_flush >= FLUSH_INTERVAL_SECONDS:
+            self._schedule(self._drain(), ttl=self.ttl)
+
+    def _drain(self) -> list[str]:
+        if not self._buffer:
+            return []
+        entry = encode_cache_value({"c": "".join(self._buffer)})
+        self._buffer = []
+        self._buffered_chars = 0
+        self._last_flush = time.perf_counter()
+        self.chunks_written += 1
+        return [entry]
+
+    def _schedule(self, entries: list[str], *, ttl: int) -> None:
+        if not entries:
+            return
+        previous = self._tail
+
+        async def _push() -> None:
+            if previous is not None:
+                await previous
+            await cache_list_append(self.list_key, entries, ttl)
+
+        self._tail = asyncio.create_task(_push())
+
+    async def _close(self, marker: dict[str, Any], ttl: int) -> None:
+        if not self.claimed or self.closed:
+            return
+        self.closed = True
+        self._schedule([*self._drain(), encode_cache_value(marker)], ttl=ttl)
+        if self._tail is not None:
+            await self._tail
+        await cache_delete(_writer_key(self.list_key))
+
+    async def finish(self) -> None:
+        if self.claimed and not self.closed:
+            self.completed = True
+        await self._close({"done": True, "entries": self.chunks_written}, self.ttl)
+
+    async def abort(self) -> None:
+        """Mark the list unusable for replay; tailers stop instead of waiting out the idle timeout."""
+        self._buffer = []
+        self._buffered_chars = 0
+        await self._close({"aborted": True}, ABORTED_TTL_SECONDS)
+
+
+class StreamCacheReader:
+    """
+    Pages through a chunk list, yielding text as soon as each page arrives.
+
+    With ``follow`` the reader tails an in-progress generation until its
+    completion marker, polling while the writer lock is held. ``status`` tells
+    the caller how iteration ended and ``emitted`` how much text was yielded.
+    """
+
+    def __init__(self, list_key: str, *, follow: bool = True, idle_timeout: float = TAIL_IDLE_SECONDS):
+        self.list_key = list_key
+        self.follow = follow
+        self.idle_timeout = idle_timeout
+        self.status = STATUS_MISS
+        self.emitted = 0
+
+    async def _writer_active(self) -> bool:
+        return bool(await cache_get(_writer_key(self.list_key)))
+
+    async def chunks(self, *, first_page: list[str] | None = None) -> AsyncIterator[str]:
+        cursor = 0
+        last_progress = time.perf_counter()
+        page = first_page
+        while True:
+            if page is None:
+                page = await cache_list_range(self.list_key, cursor, cursor + REPLAY_PAGE_SIZE - 1)
+            if page is None:
+                self.status = STATUS_MISS if not self.emitted else STATUS_STALLED
+                return
+            if not page:
+                idle = time.perf_counter() - last_progress
+                if not self.follow or idle >= self.idle_timeout or not await self._writer_active():
+                    self.status = STATUS_MISS if not self.emitted else STATUS_STALLED
+                    return
+                await asyncio.sleep(TAIL_POLL_SECONDS)
+                page = None
+                continue
+
+            for raw in page:
+                cursor += 1
+                try:
+                    entry = decode_cache_value(raw)
+                except Exception:
+                    logger.warning("stream_cache_entry_invalid", key=self.list_key)
+                    continue
+                if not isinstance(entry, dict):
+                    continue
+                if entry.get("done"):
+                    self.status = STATUS_COMPLETE
+                    return
+                if entry.get("aborted"):
+                    self.status = STATUS_ABORTED
+                    return
+                text = entry.get("c")
+                if text:
+                    self.emitted += len(text)
+                    yield str(text)
+            last_progress = time.perf_counter()
+            page = None
+
+
+async def read_first_page(list_key: str) -> list[str] | None:
+    return await cache_list_range(list_key, 0, REPLAY_PAGE_SIZE - 1)
+
+
+async def chunk_list_unusable(list_key: str) -> bool:
+    """
+    Whether ``list_key`` holds a partial answer no one will finish: no writer lock and no ``done`` marker.
+
+    That covers a crashed writer's leftovers (no marker, full TTL) and an
+    aborted generation whose chunks were flushed before ``abort``. Writers
+    append their marker before releasing the lock, so checking the lock first
+    cannot mistake a generation that just finished for an unusable one.
+    Callers must regenerate (claiming with ``reset``) rather than replay it.
+    """
+    if await cache_get(_writer_key(list_key)):
+        return False
+    tail = await cache_list_range(list_key, -1, -1)
+    if not tail:
+        return False
+    try:
+        entry = decode_cache_value(tail[0])
+    except Exception:
+        return True
+    return not (isinstance(entry, dict) and entry.get("done"))
@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+from collections.abc import Callable
 from dataclasses import dataclass, field
 from threading import Lock
 from typing import Any
@@ -29,16 +30,24 @@ def format_sse_json(event: str, payload: dict[str, Any], event_id: int) -> str:
 @dataclass
 class SseEventBuilder:
     event_id: int = 0
+    # Called with (event_id, event, frame) for every emitted event, e.g. to log it for resumes.
+    recorder: Callable[[int, str, str], None] | None = field(default=None, repr=False)
     _lock: Lock = field(default_factory=Lock, repr=False, init=False)
 
-    def emit(self, event: str, data: str) -> str:
+    def _next_id(self) -> int:
         with self._lock:
             self.event_id += 1
-            event_id = self.event_id
-        return format_sse(event, data, event_id)
+            return self.event_id
+
+    def _record(self, event_id: int, event: str, frame: str) -> str:
+        if self.recorder is not None:
+            self.recorder(event_id, event, frame)
+        return frame
+
+    def emit(self, event: str, data: str) -> str:
+        event_id = self._next_id()
+        return self._record(event_id, event, format_sse(event, data, event_id))
 
     def emit_json(self, event: str, payload: dict[str, Any]) -> str:
-        with self._lock:
-            self.event_id += 1
-            event_id = self.event_id
-        return format_sse_json(event, payload, event_id)
+        event_id = self._next_id()
+        return self._record(event_id, event, format_sse_json(event, payload, event_id))
@@ -0,0 +1,282 @@
+"""Pre-call token estimates from a local BPE tokenizer and learned output lengths."""
+
+from __future__ import annotations
+
+import math
+import os
+import re
+import threading
+from collections import deque
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from config import get_settings
+from logging_config import log_sampled_success, logger
+
+try:
+    import tiktoken
+except Exception:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+DEFAULT_ENCODING = "cl100k_base"
+MAX_SAMPLES_PER_KEY = 256
+MAX_TRACKED_KEYS = 512
+
+# Mirrors the BPE pre-tokenizer split: letter runs, digit groups of up to three, single symbols.
+_PRETOKEN_PATTERN = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]|_")
+
+
+# tiktoken downloads BPE ranks on first use unless they are in TIKTOKEN_CACHE_DIR;
+# scripts/fetch_tiktoken_bpe.py fills this directory at build time.
+BUNDLED_BPE_DIR = Path(__file__).resolve().parent.parent / "data" / "tiktoken"
+
+_encoders: dict[str, Any] = {}
+_encoders_lock = threading.Lock()
+
+
+def load_encoder(name: str | None = None) -> Any | None:
+    """
+    Load the BPE encoder into the in-process registry; blocking, so run it off the event loop.
+
+    Failures are logged but not remembered, so a later call can still
+    succeed once the ranks are reachable. Until an encoder is loaded,
+    ``count_tokens`` uses the approximation and never loads one itself.
+    """
+    name = name or _encoding_name()
+    with _encoders_lock:
+        encoder = _encoders.get(name)
+        if encoder is not None or tiktoken is None:
+            return encoder
+        if BUNDLED_BPE_DIR.is_dir():
+            os.environ.setdefault("TIKTOKEN_CACHE_DIR", str(BUNDLED_BPE_DIR))
+        try:
+            encoder = tiktoken.get_encoding(name)
+        except Exception as exc:
+            logger.warning("token_encoder_load_failed", encoding=name, error=str(exc))
+            return None
+        _encoders[name] = encoder
+        return encoder
+
+
+def _encoder(name: str) -> Any | None:
+    return _encoders.get(name)
+
+
+def _encoding_name() -> str:
+    return str(getattr(get_settings(), "token_estimator_encoding", DEFAULT_ENCODING) or DEFAULT_ENCODING)
+
+
+def _approximate_tokens(text: str) -> int:
+    tokens = 0
+    for piece in _PRETOKEN_PATTERN.findall(text):
+        if not piece.isascii():
+            # Non-Latin scripts rarely merge beyond a character per token.
+            tokens += len(piece)
+        elif piece[0].isalpha():
+            # Common English words are a single token; long ones split every ~6 characters.
+            tokens += 1 + (len(piece) - 1) // 6
+        else:
+            tokens += 1
+    return tokens
+
+
+def count_tokens(text: str) -> int:
+    """Token count for ``text`` with the local BPE encoder, or a pre-tokenizer approximation without it."""
+    if not text:
+        return 0
+    encoder = _encoder(_encoding_name())
+    if encoder is not None:
+        return len(encoder.encode_ordinary(text))
+    return _approximate_tokens(text)
+
+
+def count_tokens_batch(texts: Sequence[str]) -> list[int]:
+    encoder = _encoder(_encoding_name())
+    if encoder is not None:
+        return [len(tokens) for tokens in encoder.encode_ordinary_batch(list(texts))]
+    return [_approximate_tokens(text) if text else 0 for text in texts]
+
+
+@dataclass
+class TokenEstimate:
+    prompt_tokens: int
+    output_tokens: dict[str, int] = field(default_factory=dict)
+    mode: str = ""
+    prompt_overhead: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def total(self) -> int:
+        return max(sum(self.reserved_for(level) for level in self.output_tokens), self.prompt_tokens, 1)
+
+    def reserved_for(self, level: str) -> int:
+        return self.prompt_tokens + self.prompt_overhead.get(level, 0) + self.output_tokens.get(level, 0)
+
+
+@dataclass
+class _Samples:
+    completion: deque[int] = field(default_factory=lambda: deque(maxlen=MAX_SAMPLES_PER_KEY))
+    overhead: deque[int] = field(default_factory=lambda: deque(maxlen=MAX_SAMPLES_PER_KEY))
+    cached_quantile: tuple[float, int] | None = None
+
+
+class OutputSizeModel:
+    """
+    Rolling per-(mode, level, alias) samples of completion length and prompt overhead.
+
+    Reservations use a high percentile of recent completions, so quota is held
+    back for long answers without charging every request the worst case. Each
+    observation is also folded into an alias-agnostic (mode, level) key, which
+    is what routers can look up before the alias is chosen.
+    """
+
+    def __init__(self):
+        self._samples: dict[tuple[str, str, str], _Samples] = {}
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+    def observe(
+        self,
+        *,
+        mode: str,
+        level: str,
+        alias: str | None,
+        completion_tokens: int,
+        prompt_overhead: int | None = None,
+    ) -> None:
+        keys = [(mode, level, "")]
+        if alias:
+            keys.append((mode, level, alias))
+        with self._lock:
+            for key in keys:
+                samples = self._samples.get(key)
+                if samples is None:
+                    if len(self._samples) >= MAX_TRACKED_KEYS:
+                        continue
+                    samples = self._samples[key] = _Samples()
+                samples.completion.append(max(int(completion_tokens), 0))
+                if prompt_overhead is not None:
+                    samples.overhead.append(max(int(prompt_overhead), 0))
+                samples.cached_quantile = None
+
+    def _lookup(self, mode: str, level: str, alias: str | None, min_samples: int) -> _Samples | None:
+        for key in ((mode, level, alias or ""), (mode, level, "")):
+            samples = self._samples.get(key)
+            if samples is not None and len(samples.completion) >= min_samples:
+                return samples
+        return None
+
+    def output_tokens(self, mode: str, level: str, alias: str | None = None) -> int | None:
+        settings = get_settings()
+        min_samples = max(int(getattr(settings, "token_estimator_min_samples", 20)), 1)
+        quantile = min(max(float(getattr(settings, "token_estimator_output_quantile", 0.9)), 0.5), 1.0)
+        with self._lock:
+            samples = self._lookup(mode, level, alias, min_samples)
+            if samples is None:
+                return None
+            cached = samples.cached_quantile
+            if cached is not None and cached[0] == quantile:
+                return cached[1]
+            ordered = sorted(samples.completion)
+            value = ordered[min(math.ceil(quantile * len(ordered)) - 1, len(ordered) - 1)]
+            samples.cached_quantile = (quantile, value)
+            return value
+
+    def prompt_overhead(self, mode: str, level: str, alias: str | None = None) -> int:
+        settings = get_settings()
+        min_samples = max(int(getattr(settings, "token_estimator_min_samples", 20)), 1)
+        with self._lock:
+            samples = self._lookup(mode, level, alias, min_samples)
+            if samples is None or not samples.overhead:
+                return 0
+            ordered = sorted(samples.overhead)
+            return ordered[len(ordered) // 2]
+
+
+output_sizes = OutputSizeModel()
+
+
+def estimate_request_tokens(text: str, *, mode: str, levels: Sequence[str], alias: str | None = None) -> TokenEstimate:
+    """Reserve prompt tokens once per level plus a learned output size for each level."""
+    default_output = int(getattr(get_settings(), "estimated_output_tokens_per_request", 900))
+    prompt_tokens = max(count_tokens((text or "").strip()), 1)
+    estimate = TokenEstimate(prompt_tokens=prompt_tokens, mode=mode)
+    for level in levels or [""]:
+        learned = output_sizes.output_tokens(mode, level, alias)
+        estimate.output_tokens[level] = default_output if learned is None else learned
+        estimate.prompt_overhead[level] = output_sizes.prompt_overhead(mode, level, alias)
+    return estimate
+
+
+def reconcile_usage(
+    estimate: TokenEstimate | None,
+    *,
+    level: str,
+    token_usage: dict | None,
+    alias: str | None = None,
+    mode: str | None = None,
+) -> int | None:
+    """
+    Feed a finished call's real usage back into the output model.
+
+    Returns actual minus reserved tokens for the level (negative means we
+    over-reserved), or None when the call reported no usage.
+    """
+    if estimate is None or not isinstance(token_usage, dict):
+        return None
+    completion = int(token_usage.get("completion_tokens") or 0)
+    prompt = int(token_usage.get("prompt_tokens") or 0)
+    total = int(token_usage.get("total_tokens") or 0) or completion + prompt
+    if total <= 0:
+        return None
+    mode = mode or estimate.mode
+    output_sizes.observe(
+        mode=mode,
+        level=level,
+        alias=alias,
+        completion_tokens=completion,
+        prompt_overhead=max(prompt - estimate.prompt_tokens, 0) if prompt else None,
+    )
+    reserved = estimate.reserved_for(level)
+    delta = total - reserved
+    log_sampled_success(
+        "token_estimate_reconciled",
+        mode=mode,
+        level=level,
+        model_alias=alias,
+        reserved_tokens=reserved,
+        actual_tokens=total,
+        delta_tokens=delta,
+    )
+    return delta
+
+
+def usage_tokens(
+    estimate: TokenEstimate | None,
+    *,
+    level: str,
+    token_usage: dict | None,
+    streamed_text: str | None,
+) -> int:
+    """
+    Best known token count for one level's call, for settling its quota reservation.
+
+    Reported usage wins. Streams cut off before the provider reported usage are
+    counted from the text they produced; ``streamed_text=None`` means the model
+    was never called (cache hit or replay), which costs nothing.
+    """
+    if isinstance(token_usage, dict):
+        total = int(token_usage.get("total_tokens") or 0) or int(token_usage.get("prompt_tokens") or 0) + int(
+            token_usage.get("completion_tokens") or 0
+        )
+        if total > 0:
+            return total
+    if streamed_text is None:
+        return 0
+    if estimate is None:
+        return count_tokens(streamed_text)
+    return estimate.prompt_tokens + estimate.prompt_overhead.get(level, 0) + count_tokens(streamed_text)
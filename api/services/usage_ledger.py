@@ -0,0 +1,268 @@
+"""Per-user token and cost accounting, aggregated in memory and flushed to ``user_usage``."""
+
+from __future__ import annotations
+
+import asyncio
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+from auth import get_supabase_admin
+from config import get_settings
+from logging_config import anonymize_user_id, log_sampled_success, logger
+
+RECORD_FUNCTION = "record_user_usage"
+# Unflushed deltas kept across failed flushes before new ones are dropped.
+MAX_PENDING_ENTRIES = 10000
+# Row-level failures (while other rows in the same flush succeed) before a delta is dead-lettered.
+MAX_ROW_ATTEMPTS = 3
+# Consecutive row failures with no success before a row-by-row retry is treated as an outage.
+OUTAGE_PROBE_ROWS = 2
+# SQLSTATE classes that retrying cannot fix: data exceptions and integrity violations (e.g. a deleted user's FK).
+PERMANENT_SQLSTATE_CLASSES = ("22", "23")
+
+
+def usage_day(now: datetime | None = None) -> str:
+    return (now or datetime.now(timezone.utc)).date().isoformat()
+
+
+@dataclass
+class UsageDelta:
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    cost_usd: float = 0.0
+    tier: str = "free"
+
+    def merge(self, other: "UsageDelta") -> None:
+        self.requests += other.requests
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.total_tokens += other.total_tokens
+        self.cost_usd += other.cost_usd
+        self.tier = other.tier
+
+
+class UsageLedger:
+    """
+    Sums per-request usage by (user, UTC day) and upserts the totals in batches.
+
+    Each flush is one ``record_user_usage`` RPC per day present in the batch
+    (normally one), which adds the deltas to the user's row server-side. A
+    failed batch is retried row by row so one bad row cannot block the rest:
+    rows that fail permanently, or keep failing while others succeed, are
+    dead-lettered to the error log; everything else goes back in the queue
+    so nothing billed is lost on a blip.
+    """
+
+    def __init__(self):
+        self._pending: dict[tuple[str, str], UsageDelta] = {}
+        self._attempts: dict[tuple[str, str], int] = {}
+        self._flush_task: asyncio.Task | None = None
+        self.stats = {"recorded": 0, "flushes": 0, "flush_failures": 0, "dropped": 0, "dead_lettered": 0}
+
+    def reset(self) -> None:
+        self._pending.clear()
+        self._attempts.clear()
+        self._flush_task = None
+
+    def record(
+        self,
+        user_id: str | None,
+        *,
+        tokens: int,
+        token_usage: dict | None = None,
+        cost_usd: float | None = None,
+        is_pro: bool = False,
+    ) -> None:
+        """Add one request's usage; ``tokens`` is what the request was billed for."""
+        if not user_id:
+            return
+        usage = token_usage if isinstance(token_usage, dict) else {}
+        delta = UsageDelta(
+            requests=1,
+            prompt_tokens=int(usage.get("prompt_tokens") or 0),
+            completion_tokens=int(usage.get("completion_tokens") or 0),
+            total_tokens=max(int(tokens), 0),
+            cost_usd=float(cost_usd) if isinstance(cost_usd, (int, float)) else 0.0,
+            tier="pro" if is_pro else "free",
+        )
+        if not self._add((str(user_id), usage_day()), delta):
+            return
+        self.stats["recorded"] += 1
+        self._schedule_flush()
+
+    def _add(self, key: tuple[str, str], delta: UsageDelta) -> bool:
+        existing = self._pending.get(key)
+        if existing is not None:
+            existing.merge(delta)
+            return True
+        if len(self._pending) >= MAX_PENDING_ENTRIES:
+            self.stats["dropped"] += 1
+            logger.error("usage_ledger_backlog_full", pending=len(self._pending), sampled=False)
+            return False
+        self._pending[key] = delta
+        return True
+
+    def pending_for(self, user_id: str, day: str | None = None) -> UsageDelta:
+        """Unflushed usage for one user, optionally limited to a single day."""
+        total = UsageDelta()
+        for (pending_user, pending_day), delta in self._pending.items():
+            if pending_user == user_id and (day is None or pending_day == day):
+                total.merge(delta)
+        return total
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        settings = get_settings()
+        batch_size = max(int(getattr(settings, "usage_ledger_batch_size", 200)), 1)
+        delay = 0.0 if len(self._pending) >= batch_size else float(getattr(settings, "usage_ledger_flush_seconds", 10))
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_after(max(delay, 0.0)))
+        except RuntimeError:
+            return
+
+    async def _flush_after(self, delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self) -> None:
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        supabase = get_supabase_admin()
+        by_day: dict[str, list[dict]] = {}
+        for (user_id, day), delta in batch.items():
+            row = asdict(delta)
+            row["cost_usd"] = round(row["cost_usd"], 8)
+            by_day.setdefault(day, []).append({"user_id": user_id, "usage_date": day, **row})
+
+        for day in sorted(by_day):
+            rows = by_day[day]
+            try:
+                if not supabase:
+                    raise RuntimeError("Supabase admin client unavailable")
+                await asyncio.to_thread(supabase.rpc(RECORD_FUNCTION, {"batch": rows}).execute)
+            except Exception as exc:
+                self.stats["flush_failures"] += 1
+                logger.warning("usage_ledger_flush_failed", day=day, users=len(rows), error=str(exc))
+                if not supabase:
+                    for row in rows:
+                        self._add((row["user_id"], day), batch[(row["user_id"], day)])
+                    continue
+                await self._flush_rows(supabase, day, rows, batch)
+                continue
+            for row in rows:
+                self._attempts.pop((row["user_id"], day), None)
+            self.stats["flushes"] += 1
+            log_sampled_success("usage_ledger_flushed", day=day, users=len(rows))
+
+    async def _flush_rows(
+        self,
+        supabase,
+        day: str,
+        rows: list[dict],
+        batch: dict[tuple[str, str], UsageDelta],
+    ) -> None:
+        """Retry a failed batch one row at a time, isolating the rows that cannot be written."""
+        reachable = False
+        failed: list[tuple[dict, Exception]] = []
+        for index, row in enumerate(rows):
+            key = (row["user_id"], day)
+            try:
+                await asyncio.to_thread(supabase.rpc(RECORD_FUNCTION, {"batch": [row]}).execute)
+            except Exception as exc:
+                if _is_permanent(exc):
+                    self._dead_letter(row, exc)
+                    continue
+                failed.append((row, exc))
+                if not reachable and len(failed) >= OUTAGE_PROBE_ROWS:
+                    # Nothing has gone through, so this is an outage rather than bad rows; keep everything.
+                    for pending in [*rows[index + 1 :], *(failed_row for failed_row, _ in failed)]:
+                        self._add((pending["user_id"], day), batch[(pending["user_id"], day)])
+                    return
+                continue
+            reachable = True
+            self._attempts.pop(key, None)
+            self.stats["flushes"] += 1
+
+        for row, exc in failed:
+            key = (row["user_id"], day)
+            if reachable:
+                # Other rows were written, so the failure is specific to this row.
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts >= MAX_ROW_ATTEMPTS:
+                    self._dead_letter(row, exc)
+                    continue
+                self._attempts[key] = attempts
+            self._add(key, batch[key])
+
+    def _dead_letter(self, row: dict, exc: Exception) -> None:
+        self._attempts.pop((row["user_id"], row["usage_date"]), None)
+        self.stats["dead_lettered"] += 1
+        logger.error(
+            "usage_ledger_row_dead_lettered",
+            user_id_hash=anonymize_user_id(row["user_id"]),
+            usage_date=row["usage_date"],
+            requests=row["requests"],
+            total_tokens=row["total_tokens"],
+            cost_usd=row["cost_usd"],
+            error=str(exc),
+            sampled=False,
+        )
+
+    async def shutdown(self) -> None:
+        task = self._flush_task
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+
+def _is_permanent(exc: Exception) -> bool:
+    code = str(getattr(exc, "code", "") or "")
+    return code[:2] in PERMANENT_SQLSTATE_CLASSES
+
+
+async def read_usage(user_id: str) -> dict:
+    """The user's persisted ``user_usage`` row with this process's unflushed usage folded in."""
+    today = usage_day()
+    row: dict = {}
+    supabase = get_supabase_admin()
+    if supabase:
+        try:
+            response = await asyncio.to_thread(
+                supabase.table("user_usage").select("*").eq("user_id", user_id).limit(1).execute
+            )
+            data = getattr(response, "data", None)
+            if isinstance(data, list):
+                row = data[0] if data else {}
+            elif isinstance(data, dict):
+                row = data
+        except Exception as exc:
+            logger.warning("usage_read_failed", user_id_hash=anonymize_user_id(user_id), error=str(exc))
+
+    same_day = str(row.get("last_reset_date") or "") == today
+    pending_today = usage_ledger.pending_for(user_id, today)
+    pending_total = usage_ledger.pending_for(user_id)
+
+    def daily(column: str) -> float:
+        return float(row.get(column) or 0) if same_day else 0.0
+
+    return {
+        "date": today,
+        "tier": row.get("tier") or pending_total.tier,
+        "requests_today": int(daily("prompts_today")) + pending_today.requests,
+        "tokens_today": int(daily("tokens_today")) + pending_today.total_tokens,
+        "prompt_tokens_today": int(daily("prompt_tokens_today")) + pending_today.prompt_tokens,
+        "completion_tokens_today": int(daily("completion_tokens_today")) + pending_today.completion_tokens,
+        "cost_usd_today": round(daily("cost_usd_today") + pending_today.cost_usd, 6),
+        "total_requests": int(row.get("total_requests") or 0) + pending_total.requests,
+        "total_tokens": int(row.get("total_tokens") or 0) + pending_total.total_tokens,
+        "total_cost_usd": round(float(row.get("total_cost_usd") or 0) + pending_total.cost_usd, 6),
+    }
+
+
+usage_ledger = UsageLedger()
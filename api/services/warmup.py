@@ -0,0 +1,138 @@
+"""Background response-cache warm-up for fresh deploys."""
+
+import asyncio
+import html
+import time
+from collections import Counter
+
+from auth import get_supabase_admin
+from config import get_settings
+from logging_config import anonymize_text, logger
+from pinned_topics import PINNED_TOPICS
+from services.cache import cache_get, cache_set
+from services.inference import generate_explanation, response_cache_key
+from services.semantic_cache import semantic_cache, semantic_cache_enabled
+from utils import FREE_LEVELS, LEARNING_MODE, normalize_mode, sanitize_topic
+
+
+async def fetch_top_history_topics(
+    levels: list[str], top_n: int, *, max_rows: int
+) -> dict[str, list[tuple[str, str]]]:
+    """
+    Return the ``top_n`` most requested ``(topic, mode)`` pairs for each level.
+
+    History stores topics as sanitized (HTML-escaped) by ``/query``, so they
+    are unescaped here and can go through ``sanitize_topic`` again unchanged.
+    """
+    if top_n <= 0:
+        return {level: [] for level in levels}
+
+    supabase = get_supabase_admin()
+    if not supabase:
+        return {level: [] for level in levels}
+
+    def _fetch_recent():
+        return (
+            supabase.table("history")
+            .select("topic, levels, mode")
+            .order("created_at", desc=True)
+            .limit(max_rows)
+            .execute()
+        )
+
+    try:
+        response = await asyncio.to_thread(_fetch_recent)
+    except Exception as exc:
+        logger.warning("cache_warmup_history_fetch_failed", error=str(exc))
+        return {level: [] for level in levels}
+
+    counters = {level: Counter() for level in levels}
+    rows = getattr(response, "data", None)
+    for row in rows if isinstance(rows, list) else []:
+        if not isinstance(row, dict) or not row.get("topic"):
+            continue
+        topic = html.unescape(str(row["topic"]))
+        mode = normalize_mode(row.get("mode"))
+        for level in row.get("levels") or []:
+            if level in counters:
+                counters[level][(topic, mode)] += 1
+
+    return {level: [entry for entry, _ in counter.most_common(top_n)] for level, counter in counters.items()}
+
+
+async def warm_response_cache(
+    *,
+    mode: str = LEARNING_MODE,
+    levels: list[str] | None = None,
+    concurrency: int | None = None,
+    top_n: int | None = None,
+) -> dict[str, int]:
+    """
+    Pre-generate cached responses for pinned topics and popular history topics.
+
+    Pinned topics are warmed in ``mode`` and history topics in the mode they
+    were requested in. Entries already present under the current prompt/model
+    version are skipped, so re-running after a deploy without prompt changes
+    costs only cache reads.
+    """
+    settings = get_settings()
+    mode = normalize_mode(mode)
+    levels = list(levels or FREE_LEVELS)
+    concurrency = max(int(concurrency or getattr(settings, "cache_warmup_concurrency", 4)), 1)
+    top_n = max(int(top_n if top_n is not None else getattr(settings, "cache_warmup_top_n", 20)), 0)
+    max_rows = max(int(getattr(settings, "cache_warmup_history_rows", 1000)), 1)
+
+    pinned_topics = [str(item["title"]) for item in PINNED_TOPICS]
+    history_topics = await fetch_top_history_topics(levels, top_n, max_rows=max_rows)
+
+    pinned = [(topic, mode) for topic in pinned_topics]
+    jobs: dict[tuple[str, str, str], None] = {}
+    for level in levels:
+        for raw_topic, topic_mode in [*pinned, *history_topics.get(level, [])]:
+            try:
+                topic = sanitize_topic(raw_topic)
+            except ValueError:
+                continue
+            jobs[(topic, level, topic_mode)] = None
+
+    stats = {"warmed": 0, "skipped": 0, "failed": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+
+    async def _warm(topic: str, level: str, mode: str) -> None:
+        async with semaphore:
+            key = response_cache_key(topic, level, mode)
+            if await cache_get(key):
+                stats["skipped"] += 1
+                return
+            try:
+                text = await generate_explanation(topic, level, mode=mode, request_id="cache-warmup")
+            except Exception as exc:
+                stats["failed"] += 1
+                logger.warning(
+                    "cache_warmup_generation_failed",
+                    topic_hash=anonymize_text(topic),
+                    level=level,
+                    mode=mode,
+                    error=str(exc),
+                )
+                return
+            if text and await cache_set(key, {"text": text}):
+                stats["warmed"] += 1
+                if semantic_cache_enabled():
+                    semantic_cache.remember(topic, key, mode=mode, level=level, scope="query")
+            else:
+                stats["failed"] += 1
+
+    await asyncio.gather(*(_warm(topic, level, topic_mode) for topic, level, topic_mode in jobs))
+
+    logger.info(
+        "cache_warmup_complete",
+        mode=mode,
+        levels=levels,
+        jobs=len(jobs),
+        concurrency=concurrency,
+        duration_ms=round((time.perf_counter() - started) * 1000, 2),
+        **stats,
+    )
+    return stats
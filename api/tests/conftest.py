@@ -1,3 +1,4 @@
+import json
 import os
 import types
 from types import SimpleNamespace
@@ -11,10 +12,17 @@ import api.main as api_main_app
 import config as config_module
 import auth as auth_module
 import services.cache as cache_module
+import services.circuit_breaker as circuit_breaker_module
+import services.idempotency as idempotency_module
 import services.search as search_module
 import services.llm_client as llm_client_module
 import services.inference as inference_module
 import services.rate_limit as rate_limit_module
+import services.retrieval_index as retrieval_index_module
+import services.semantic_cache as semantic_cache_module
+import services.sse_resume as sse_resume_module
+import services.token_estimator as token_estimator_module
+import services.usage_ledger as usage_ledger_module
 
 
 class AppClientWrapper:
@@ -64,7 +72,33 @@ class DummyRedis:
     async def ttl(self, key):
         return 60
 
-    async def eval(self, _script, _num_keys, key, requested, limit, window_seconds):
+    async def delete(self, key):
+        return 1 if self.store.pop(key, None) is not None else 0
+
+    async def rpush(self, key, *values, ttl=None):
+        entries = self.store.setdefault(key, [])
+        entries.extend(values)
+        return len(entries)
+
+    async def lrange(self, key, start, stop):
+        entries = self.store.get(key) or []
+        return entries[start:] if stop == -1 else entries[start : stop + 1]
+
+    async def eval_batch(self, script, calls):
+        return [await self.eval(script, len(keys), *keys, *args) for keys, args in calls]
+
+    async def eval(self, script, _num_keys, key, *args):
+        if script == rate_limit_module.ADJUST_SCRIPT:
+            if key not in self.store:
+                return 0
+            value = max(int(self.store[key]) + int(args[0]), 0)
+            self.store[key] = value
+            return value
+        if script == idempotency_module.CLAIM_SCRIPT:
+            return self._eval_idempotency_claim(key, *args)
+        if script == idempotency_module.HEARTBEAT_SCRIPT:
+            return self._eval_idempotency_heartbeat(key, *args)
+        requested, limit, window_seconds = args
         current = int(self.store.get(key, 0))
         requested_value = int(requested)
         limit_value = int(limit)
@@ -77,6 +111,35 @@ class DummyRedis:
         self.store[key] = consumed
         return [1, consumed, window_value]
 
+    def _eval_idempotency_claim(self, key, record_json, now, stale_seconds, _ttl):
+        raw = self.store.get(key)
+        if raw is not None:
+            try:
+                record = json.loads(raw)
+            except (TypeError, ValueError):
+                return ["unknown", raw]
+            if not isinstance(record, dict):
+                return ["unknown", raw]
+            if record.get("status") == "completed":
+                return ["replay", raw]
+            if record.get("status") == "in_progress":
+                beat = record.get("heartbeat_at") or record.get("started_at") or 0
+                if int(now) - int(beat) < int(stale_seconds):
+                    return ["busy", raw]
+        self.store[key] = record_json
+        return ["reclaimed", raw] if raw is not None else ["claimed", ""]
+
+    def _eval_idempotency_heartbeat(self, key, owner, now, _ttl):
+        raw = self.store.get(key)
+        if raw is None:
+            return 0
+        record = json.loads(raw)
+        if record.get("status") != "in_progress" or record.get("owner") != owner:
+            return 0
+        record["heartbeat_at"] = int(now)
+        self.store[key] = json.dumps(record)
+        return 1
+
     async def close(self):
         return True
 
@@ -128,10 +191,15 @@ class FakeSupabase:
         self.inserts = []
         self.updates = []
         self.deletes = []
+        self.rpcs = []
 
     def table(self, table):
         return FakeSupabaseQuery(self, table)
 
+    def rpc(self, function, params):
+        self.rpcs.append((function, params))
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=self.responses.get(function)))
+
 
 @pytest.fixture(scope="session")
 def test_settings():
@@ -186,10 +254,57 @@ def patch_settings(monkeypatch, test_settings):
     monkeypatch.setattr(cache_module, "get_settings", lambda: test_settings)
     monkeypatch.setattr(auth_module, "get_settings", lambda: test_settings)
     monkeypatch.setattr(llm_client_module, "get_settings", lambda: test_settings)
+    monkeypatch.setattr(token_estimator_module, "get_settings", lambda: test_settings)
+    monkeypatch.setattr(usage_ledger_module, "get_settings", lambda: test_settings)
+    monkeypatch.setattr(retrieval_index_module, "get_settings", lambda: test_settings)
+    monkeypatch.setattr(inference_module, "get_settings", lambda: test_settings)
+    monkeypatch.setattr(sse_resume_module, "get_settings", lambda: test_settings)
     search_module.settings = test_settings
     return test_settings
 
 
+@pytest.fixture(autouse=True)
+def reset_semantic_cache():
+    semantic_cache_module.semantic_cache.clear()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def reset_sse_event_logs():
+    sse_resume_module.clear_local_logs()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def reset_model_breakers():
+    circuit_breaker_module.circuit_breakers.reset()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def reset_output_sizes():
+    token_estimator_module.output_sizes.reset()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def reset_usage_reconciler():
+    rate_limit_module.usage_reconciler.reset()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def reset_usage_ledger():
+    usage_ledger_module.usage_ledger.reset()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def reset_retrieval_index(tmp_path):
+    retrieval_index_module.retrieval_index.reset(directory=str(tmp_path / "retrieval"))
+    yield
+
+
 @pytest.fixture(autouse=True)
 def patch_llm_client(monkeypatch):
     class DummyChoice:
@@ -223,8 +338,16 @@ def patch_asyncio_to_thread(monkeypatch):
 
 
 @pytest.fixture
-def dummy_redis():
-    return DummyRedis()
+def dummy_redis(monkeypatch):
+    client = DummyRedis()
+
+    async def _get_redis():
+        return client
+
+    monkeypatch.setattr(cache_module, "get_redis", _get_redis)
+    monkeypatch.setattr(rate_limit_module, "get_redis", _get_redis)
+    monkeypatch.setattr(idempotency_module, "get_redis", _get_redis)
+    return client
 
 
 @pytest.fixture
@@ -235,8 +358,6 @@ async def app_client(monkeypatch, dummy_redis):
     async def _get_redis():
         return dummy_redis
 
-    monkeypatch.setattr(cache_module, "get_redis", _get_redis)
-    monkeypatch.setattr(rate_limit_module, "get_redis", _get_redis)
     monkeypatch.setattr(api_main_app, "get_redis", _get_redis)
     monkeypatch.setattr(api_main_app, "close_redis", _noop_close)
     monkeypatch.setattr(api_main_app, "redis_available", False)
@@ -1,7 +1,9 @@
 import asyncio
 from types import SimpleNamespace
 
+import orjson
 import pytest
+
 import services.cache as cache_module
 
 
@@ -73,3 +75,30 @@ async def test_get_redis_singleton_is_lock_safe(monkeypatch):
 
     assert all(client is clients[0] for client in clients)
     assert FakeRedisClient.instances == 1
+
+
+def test_small_values_stay_plain_json():
+    assert cache_module.encode_cache_value({"text": "short"}) == '{"text":"short"}'
+
+
+def test_large_values_are_compressed_and_round_trip(monkeypatch, test_settings):
+    payload = {"text": "Black holes bend spacetime. " * 400}
+    encoded = cache_module.encode_cache_value(payload)
+
+    assert encoded.startswith("~kb1:")
+    assert len(encoded) < len(orjson.dumps(payload)) / 4
+    assert cache_module.decode_cache_value(encoded) == payload
+
+    monkeypatch.setattr(test_settings, "cache_compression_codec", "gzip", raising=False)
+    gzip_encoded = cache_module.encode_cache_value(payload)
+    assert gzip_encoded.startswith("~kb1:g:")
+    assert cache_module.decode_cache_value(gzip_encoded.encode("utf-8")) == payload
+
+    monkeypatch.setattr(test_settings, "cache_compression_codec", "none", raising=False)
+    assert cache_module.encode_cache_value(payload) == orjson.dumps(payload).decode("utf-8")
+
+
+def test_decode_accepts_legacy_json_and_rejects_unknown_headers():
+    assert cache_module.decode_cache_value(b'{"response": "legacy"}') == {"response": "legacy"}
+    with pytest.raises(ValueError):
+        cache_module.decode_cache_value("~kb9:g:AAAA")
@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+import pytest
+
+import services.circuit_breaker as breaker_module
+import services.inference as inference_module
+from services.llm_errors import LLMBadRequest, LLMCapacityExceeded, LLMUnavailable
+
+
+def _registry(**overrides):
+    options = {"min_requests": 4, "error_rate": 0.5, "open_seconds": 0.05, "max_open_seconds": 0.2}
+    options.update(overrides)
+    return breaker_module.CircuitBreakerRegistry(breaker_module.BreakerPolicy(**options))
+
+
+def _fail(registry, alias, times, exc=None):
+    for _ in range(times):
+        registry.record_failure(alias, exc or LLMUnavailable("down"), 0.1)
+
+
+def test_breaker_trips_per_alias_on_error_rate():
+    registry = _registry()
+    registry.record_success("technical-primary", 0.1)
+    _fail(registry, "technical-primary", 3)
+
+    assert registry.state("technical-primary") == breaker_module.STATE_OPEN
+    assert not registry.allow("technical-primary")
+    assert registry.allow("default-fast")
+
+
+def test_breaker_ignores_caller_errors_and_trips_on_slow_calls():
+    registry = _registry(slow_call_seconds=1.0, slow_call_rate=0.75)
+    _fail(registry, "default-fast", 6, LLMBadRequest("bad payload"))
+    assert registry.state("default-fast") == breaker_module.STATE_CLOSED
+
+    for _ in range(4):
+        registry.record_success("default-fast", 2.5)
+    assert registry.state("default-fast") == breaker_module.STATE_OPEN
+
+
+@pytest.mark.asyncio
+async def test_half_open_admits_one_probe_and_backs_off_when_it_fails():
+    registry = _registry()
+    _fail(registry, "socratic", 4)
+    await asyncio.sleep(0.06)
+
+    assert registry.allow("socratic")
+    assert not registry.allow("socratic")
+    registry.record_failure("socratic", LLMUnavailable("still down"))
+    assert registry.state("socratic") == breaker_module.STATE_OPEN
+
+    await asyncio.sleep(0.06)
+    assert not registry.allow("socratic"), "second cooldown is doubled"
+    await asyncio.sleep(0.05)
+    assert registry.allow("socratic")
+    registry.record_success("socratic", 0.1)
+    assert registry.state("socratic") == breaker_module.STATE_CLOSED
+
+
+@pytest.mark.asyncio
+async def test_trips_are_shared_through_redis(dummy_redis):
+    tripping = _registry(open_seconds=5)
+    _fail(tripping, "technical-primary", 4)
+    await asyncio.sleep(0)
+    assert "knowbear:breaker:technical-primary" in dummy_redis.store
+
+    follower = _registry()
+    assert follower.allow("technical-primary")
+    await asyncio.sleep(0)
+    assert follower.state("technical-primary") == breaker_module.STATE_OPEN
+    assert not follower.allow("technical-primary")
+
+
+@pytest.mark.asyncio
+async def test_open_breaker_reroutes_to_fallback_alias_without_calling_primary(monkeypatch):
+    called = []
+
+    class _Message:
+        content = "fallback answer"
+
+    class _Choice:
+        message = _Message()
+
+    class _Response:
+        choices = [_Choice()]
+        usage = None
+        model = "fallback-model"
+
+    async def fake_create_chat_completion(*, model, **_kwargs):
+        called.append(model)
+        return _Response()
+
+    registry = _registry(open_seconds=60)
+    _fail(registry, inference_module.TECHNICAL_MODEL_PRIMARY, 4)
+    monkeypatch.setattr(inference_module, "circuit_breakers", registry)
+    monkeypatch.setattr(inference_module, "create_chat_completion", fake_create_chat_completion)
+
+    started = time.perf_counter()
+    result = await inference_module.call_model(inference_module.TECHNICAL_MODEL_PRIMARY, "prompt")
+
+    assert result == "fallback answer"
+    assert called == [inference_module.TECHNICAL_MODEL_FALLBACK]
+    assert time.perf_counter() - started < 0.5
+
+    _fail(registry, "socratic", 4)
+    with pytest.raises(breaker_module.LLMCircuitOpen):
+        await inference_module.call_model("socratic", "prompt")
+
+
+@pytest.mark.asyncio
+async def test_half_open_probe_is_returned_when_admission_is_rejected(monkeypatch):
+    async def fake_stream_chat_completion(**_kwargs):
+        yield "never reached"
+
+    registry = _registry()
+    _fail(registry, "socratic", 4)
+    await asyncio.sleep(0.06)
+    scheduler = inference_module.InferenceScheduler(default_limit=1, alias_limits={}, max_queue=0, max_wait_seconds=1)
+    monkeypatch.setattr(inference_module, "circuit_breakers", registry)
+    monkeypatch.setattr(inference_module, "inference_scheduler", scheduler)
+    monkeypatch.setattr(inference_module, "stream_chat_completion", fake_stream_chat_completion)
+
+    async with scheduler.admit("socratic"):
+        with pytest.raises(LLMCapacityExceeded):
+            await inference_module.call_model("socratic", "prompt")
+        assert registry._breaker("socratic").probes_in_flight == 0
+
+        with pytest.raises(LLMCapacityExceeded):
+            async for _chunk in inference_module._admitted_stream("socratic", {}, messages=[]):
+                pass
+        assert registry._breaker("socratic").probes_in_flight == 0
+
+    assert registry.state("socratic") == breaker_module.STATE_HALF_OPEN
+    assert registry.allow("socratic"), "the probe slot is still free for a call that gets admitted"
@@ -1,18 +1,10 @@
+import asyncio
+
 import pytest
-from fastapi.responses import Response
 
 import auth as auth_module
 import routers.export as export_module
-
-
-def fake_streaming_response(content, **kwargs):
-    body = content.getvalue() if hasattr(content, "getvalue") else content
-    return Response(
-        content=body,
-        media_type=kwargs.get("media_type"),
-        headers=kwargs.get("headers"),
-        status_code=kwargs.get("status_code", 200),
-    )
+import routers.query as query_module
 
 
 @pytest.mark.asyncio
@@ -21,7 +13,7 @@ async def test_export_requires_pro(app_client, monkeypatch, fake_user):
         return False
 
     monkeypatch.setattr(export_module, "check_is_pro", fake_check_is_pro)
-    monkeypatch.setattr(export_module, "StreamingResponse", fake_streaming_response)
+
     async def fake_auth():
         return {"user": fake_user}
 
@@ -46,7 +38,7 @@ async def test_export_txt_success(app_client, monkeypatch, fake_user):
         return True
 
     monkeypatch.setattr(export_module, "check_is_pro", fake_check_is_pro)
-    monkeypatch.setattr(export_module, "StreamingResponse", fake_streaming_response)
+
     async def fake_auth():
         return {"user": fake_user}
 
@@ -64,6 +56,7 @@ async def test_export_txt_success(app_client, monkeypatch, fake_user):
     )
 
     assert resp.status_code == 200
+    assert "knowbear-cats.txt" in resp.headers["content-disposition"]
     assert "text/plain" in resp.headers.get("content-type", "")
     assert "Cats" in resp.text
     assert "Meow" in resp.text
@@ -83,7 +76,6 @@ async def test_export_missing_levels_triggers_generation(app_client, monkeypatch
     monkeypatch.setattr(export_module, "check_is_pro", fake_check_is_pro)
     monkeypatch.setattr(export_module, "generate_explanation", fake_generate)
     monkeypatch.setattr(export_module, "FREE_LEVELS", ["eli5", "eli10"])
-    monkeypatch.setattr(export_module, "StreamingResponse", fake_streaming_response)
 
     async def fake_auth():
         return {"user": fake_user}
@@ -111,7 +103,7 @@ async def test_export_invalid_format(app_client, monkeypatch, fake_user):
         return True
 
     monkeypatch.setattr(export_module, "check_is_pro", fake_check_is_pro)
-    monkeypatch.setattr(export_module, "StreamingResponse", fake_streaming_response)
+
     async def fake_auth():
         return {"user": fake_user}
 
@@ -128,3 +120,66 @@ async def test_export_invalid_format(app_client, monkeypatch, fake_user):
         }
     )
     assert resp.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_export_reads_cached_levels_before_generating(app_client, monkeypatch, fake_user):
+    async def fake_check_is_pro(_user_id):
+        return True
+
+    calls = []
+
+    async def fake_generate(_topic, level, mode=None, **_kwargs):
+        calls.append(level)
+        return f"generated {level}"
+
+    async def fake_auth():
+        return {"user": fake_user}
+
+    await query_module._cache_set_response("Cats", "eli10", "learning", "cached eli10")
+    monkeypatch.setattr(export_module, "check_is_pro", fake_check_is_pro)
+    monkeypatch.setattr(export_module, "generate_explanation", fake_generate)
+    monkeypatch.setattr(export_module, "FREE_LEVELS", ["eli5", "eli10", "meme"])
+    app_client.app.dependency_overrides[auth_module.verify_token] = fake_auth
+
+    resp = await app_client.post(
+        "/api/export",
+        json={"topic": "Cats", "explanations": {"eli5": "Meow"}, "format": "md", "mode": "learning"},
+    )
+
+    assert resp.status_code == 200
+    assert calls == ["meme"]
+    assert resp.text.index("Meow") < resp.text.index("cached eli10") < resp.text.index("generated meme")
+    assert (await query_module._cache_get_exact_response("Cats", "meme", "learning"))["text"] == "generated meme"
+
+
+@pytest.mark.asyncio
+async def test_export_sections_stream_in_level_order_without_waiting_for_slow_levels(monkeypatch):
+    release_eli5 = asyncio.Event()
+
+    async def fake_generate(_topic, level, mode=None, **_kwargs):
+        if level == "eli5":
+            await release_eli5.wait()
+        return f"generated {level}"
+
+    monkeypatch.setattr(export_module, "generate_explanation", fake_generate)
+    sections = export_module._sections_in_order(
+        ["eli5", "eli10", "meme"],
+        {},
+        topic="Cats",
+        cache_topic=None,
+        mode="learning",
+        user_id="user-1",
+    )
+    chunks = export_module._write_document("Cats", sections, 3)
+
+    assert await anext(chunks) == b"# Cats\n\n---\n\n"
+    first = asyncio.ensure_future(anext(chunks))
+    await asyncio.sleep(0)
+    assert not first.done()  # eli5 is slow; later levels wait behind it
+    release_eli5.set()
+    assert b"generated eli5" in await first
+    assert [chunk async for chunk in chunks] == [
+        b"## ELI-10\n\ngenerated eli10\n\n---\n\n",
+        b"## MEME\n\ngenerated meme\n\n---\n\n",
+    ]
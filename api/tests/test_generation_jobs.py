@@ -0,0 +1,123 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main as main_app
+import routers.messages as messages_module
+import services.generation_jobs as generation_jobs_module
+from conftest import FakeSupabase
+
+
+@pytest.mark.asyncio
+async def test_pool_runs_jobs_to_completion_and_refuses_when_full():
+    pool = generation_jobs_module.GenerationJobPool(max_jobs=1)
+    release = asyncio.Event()
+    drained = []
+
+    async def slow_job():
+        await release.wait()
+        for frame in ("a", "b"):
+            drained.append(frame)
+            yield frame
+
+    async def other_job():
+        yield "never"
+
+    assert pool.submit("job-1", slow_job)
+    assert not pool.submit("job-2", other_job)
+    assert pool.running("job-1")
+
+    release.set()
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    assert drained == ["a", "b"]
+    assert len(pool) == 0
+
+
+@pytest.mark.asyncio
+async def test_pool_shutdown_cancels_running_jobs():
+    pool = generation_jobs_module.GenerationJobPool(max_jobs=2)
+    closed = asyncio.Event()
+
+    async def endless_job():
+        try:
+            while True:
+                await asyncio.sleep(1)
+                yield "tick"
+        finally:
+            closed.set()
+
+    pool.submit("job", endless_job)
+    await asyncio.sleep(0)
+    await pool.shutdown()
+
+    assert closed.is_set()
+    assert len(pool) == 0
+
+
+@pytest.mark.asyncio
+async def test_messages_job_mode_streams_from_background_job(app_client, monkeypatch, test_settings):
+    monkeypatch.setattr(test_settings, "generation_jobs_enabled", True, raising=False)
+    monkeypatch.setattr(generation_jobs_module, "get_settings", lambda: test_settings)
+    user = SimpleNamespace(id="user-job", email="user@example.com", user_metadata={})
+
+    async def fake_verify_token():
+        return {"user": user}
+
+    async def fake_is_pro(*_args, **_kwargs):
+        return False
+
+    async def fast_stream(*_args, **_kwargs):
+        for chunk in ("background ", "answer"):
+            await asyncio.sleep(0)
+            yield chunk
+
+    fake_supabase = FakeSupabase(
+        responses={
+            "conversations": {"id": "conv-job", "user_id": user.id, "mode": "socratic", "settings": {}},
+            "messages": [{"id": "assistant-job"}],
+            "users": {"is_pro": False},
+        }
+    )
+
+    main_app.app.dependency_overrides[messages_module.verify_token] = fake_verify_token
+    monkeypatch.setattr(messages_module, "check_is_pro", fake_is_pro)
+    monkeypatch.setattr(messages_module, "generate_stream_explanation", fast_stream)
+    monkeypatch.setattr(messages_module, "get_supabase_admin", lambda: fake_supabase)
+    monkeypatch.setattr(messages_module, "get_settings", lambda: test_settings)
+
+    submitted = []
+    original_submit = generation_jobs_module.generation_jobs.submit
+
+    def tracking_submit(job_id, factory):
+        submitted.append(job_id)
+        return original_submit(job_id, factory)
+
+    monkeypatch.setattr(generation_jobs_module.generation_jobs, "submit", tracking_submit)
+
+    try:
+        resp = await app_client.post(
+            "/api/messages",
+            json={
+                "conversation_id": "conv-job",
+                "content": "run in background",
+                "client_generated_id": "6b3c9a51-7f0e-4d2b-9a8c-1e2f3a4b5c6d",
+                "assistant_client_id": "7c4d0b62-8a1f-4e3c-8b9d-2f3a4b5c6d7e",
+                "mode": "socratic",
+                "prompt_mode": "eli5",
+            },
+        )
+        assert resp.status_code == 200
+        assert "background" in resp.text and "answer" in resp.text
+        assert "event: done" in resp.text
+        assert submitted == [messages_module._idempotency_key(user.id, "6b3c9a51-7f0e-4d2b-9a8c-1e2f3a4b5c6d")]
+
+        for _ in range(20):
+            if ("messages", {"content": "background answer"}) in fake_supabase.updates:
+                break
+            await asyncio.sleep(0.01)
+        assert ("messages", {"content": "background answer"}) in fake_supabase.updates
+    finally:
+        main_app.app.dependency_overrides.pop(messages_module.verify_token, None)
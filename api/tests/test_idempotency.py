@@ -0,0 +1,107 @@
+import orjson
+import pytest
+
+import services.idempotency as idempotency_module
+
+
+@pytest.fixture
+def store(monkeypatch):
+    data = {}
+
+    async def fake_cache_get(key):
+        return data.get(key)
+
+    async def fake_cache_set_if_absent(key, value, _ttl):
+        if key in data:
+            return False
+        data[key] = value
+        return True
+
+    monkeypatch.setattr(idempotency_module, "cache_get", fake_cache_get)
+    monkeypatch.setattr(idempotency_module, "cache_set_if_absent", fake_cache_set_if_absent)
+    return data
+
+
+@pytest.mark.asyncio
+async def test_pointer_to_existing_cache_entry_writes_nothing(store):
+    store["knowbear:cache:v3:abc"] = {"response": "answer"}
+
+    pointer = await idempotency_module.response_pointer("answer", cache_key="knowbear:cache:v3:abc", ttl=60)
+
+    assert list(store) == ["knowbear:cache:v3:abc"]
+    assert await idempotency_module.resolve_response({"status": "completed", **pointer}) == "answer"
+
+
+@pytest.mark.asyncio
+async def test_pointer_without_cache_entry_stores_body_by_hash(store):
+    first = await idempotency_module.response_pointer("partial answer", cache_key=None, ttl=60)
+    second = await idempotency_module.response_pointer("partial answer", cache_key=None, ttl=60)
+
+    assert first == second
+    assert store[first["response_key"]] == {"text": "partial answer"}
+    assert await idempotency_module.resolve_response(first) == "partial answer"
+
+
+@pytest.mark.asyncio
+async def test_resolve_rejects_replaced_body_and_reads_legacy_records(store):
+    pointer = await idempotency_module.response_pointer("v1", cache_key="knowbear:k", ttl=60)
+    store["knowbear:k"] = {"text": "v2"}
+
+    assert await idempotency_module.resolve_response(pointer) is None
+    assert await idempotency_module.resolve_response({"response": "inline"}) == "inline"
+
+
+@pytest.mark.asyncio
+async def test_claim_is_exclusive_until_completed(dummy_redis):
+    manager = idempotency_module.IdempotencyManager("test", ttl_seconds=60, stale_seconds=30)
+
+    first = await manager.claim("knowbear:idem:a", message_id="a")
+    duplicate = await manager.claim("knowbear:idem:a", message_id="a")
+    assert first.outcome == idempotency_module.OUTCOME_CLAIMED
+    assert duplicate.outcome == idempotency_module.OUTCOME_BUSY
+
+    await manager.complete(first, "done", response_key=None, message_id="a")
+    replay = await manager.claim("knowbear:idem:a", message_id="a")
+
+    assert replay.outcome == idempotency_module.OUTCOME_REPLAY
+    assert replay.response == "done"
+    assert replay.existing["message_id"] == "a"
+
+
+@pytest.mark.asyncio
+async def test_stale_heartbeat_is_reclaimed_and_failed_records_retry(dummy_redis):
+    manager = idempotency_module.IdempotencyManager("test", ttl_seconds=60, stale_seconds=5)
+    dummy_redis.store["knowbear:idem:b"] = orjson.dumps({"status": "in_progress", "owner": "gone", "heartbeat_at": 1}).decode()
+
+    reclaimed = await manager.claim("knowbear:idem:b")
+    assert reclaimed.outcome == idempotency_module.OUTCOME_RECLAIMED
+    assert reclaimed.existing["owner"] == "gone"
+
+    await manager.fail(reclaimed)
+    retried = await manager.claim("knowbear:idem:b")
+    assert retried.outcome == idempotency_module.OUTCOME_RECLAIMED
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_refreshes_only_the_owner(dummy_redis):
+    manager = idempotency_module.IdempotencyManager("test", ttl_seconds=60, stale_seconds=5)
+    claim = await manager.claim("knowbear:idem:c")
+
+    assert await manager._heartbeat(claim) is True
+
+    dummy_redis.store["knowbear:idem:c"] = orjson.dumps({"status": "in_progress", "owner": "someone-else"}).decode()
+    assert await manager._heartbeat(claim) is False
+
+
+@pytest.mark.asyncio
+async def test_claim_degrades_to_owned_when_redis_is_down(monkeypatch):
+    async def broken_redis():
+        raise RuntimeError("redis down")
+
+    monkeypatch.setattr(idempotency_module, "get_redis", broken_redis)
+    manager = idempotency_module.IdempotencyManager("test-down", ttl_seconds=60, stale_seconds=5)
+
+    claim = await manager.claim("knowbear:idem:d")
+
+    assert claim.owned
+    assert idempotency_module.idempotency_metrics()["test-down"]["error"] == 1
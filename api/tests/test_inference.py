@@ -1,7 +1,11 @@
+import asyncio
+import time
+
 import pytest
 
 import services.inference as inference_module
 import services.llm_client as llm_client
+from services.llm_errors import LLMCapacityExceeded
 
 
 @pytest.mark.asyncio
@@ -214,3 +218,190 @@ async def test_generate_stream_explanation_technical_partial_stream_failure_is_g
     assert chunks == ["partial"]
     assert telemetry_sink.get("stream_completed") is False
     assert telemetry_sink.get("partial_failure") is True
+
+
+def _scheduler(**overrides):
+    options = {"default_limit": 1, "alias_limits": {}, "max_queue": 4, "max_wait_seconds": 1.0}
+    options.update(overrides)
+    return inference_module.InferenceScheduler(**options)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_hands_freed_slots_to_pro_lane_first():
+    scheduler = _scheduler(max_wait_seconds=5.0)
+    order: list[str] = []
+    release = asyncio.Event()
+
+    async def worker(name: str, priority: str):
+        async with scheduler.admit("default-fast", priority=priority):
+            order.append(name)
+            if name == "holder":
+                await release.wait()
+
+    holder = asyncio.create_task(worker("holder", inference_module.PRIORITY_FREE))
+    await asyncio.sleep(0)
+    free = asyncio.create_task(worker("free", inference_module.PRIORITY_FREE))
+    await asyncio.sleep(0)
+    pro = asyncio.create_task(worker("pro", inference_module.PRIORITY_PRO))
+    await asyncio.sleep(0)
+
+    assert scheduler.snapshot()["default-fast"] == {"active": 1, "limit": 1, "queued_pro": 1, "queued_free": 1}
+    release.set()
+    await asyncio.gather(holder, free, pro)
+
+    assert order == ["holder", "pro", "free"]
+    assert scheduler.snapshot()["default-fast"]["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_rejects_full_queues_and_unmeetable_deadlines():
+    scheduler = _scheduler(max_queue=0, alias_limits={"technical-primary": 2})
+    async with scheduler.admit("default-fast"):
+        with pytest.raises(LLMCapacityExceeded):
+            async with scheduler.admit("default-fast"):
+                pass
+        # Caps are per alias, so other models are unaffected.
+        async with scheduler.admit("technical-primary"):
+            pass
+
+    scheduler = _scheduler()
+    async with scheduler.admit("default-fast"):
+        with pytest.raises(LLMCapacityExceeded):
+            async with scheduler.admit("default-fast", deadline=time.perf_counter() + 0.01):
+                pass
+
+    assert scheduler.rejections[("default-fast", "deadline")] == 1
+    assert scheduler.snapshot()["default-fast"]["queued_free"] == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_times_out_waiters_and_reports_queue_wait():
+    scheduler = _scheduler(max_wait_seconds=0.05)
+    scheduler._gate("default-fast").service_seconds = 0.01
+
+    async with scheduler.admit("default-fast"):
+        with pytest.raises(LLMCapacityExceeded):
+            async with scheduler.admit("default-fast"):
+                pass
+
+    async def short_hold():
+        async with scheduler.admit("default-fast"):
+            await asyncio.sleep(0.02)
+
+    holder = asyncio.create_task(short_hold())
+    await asyncio.sleep(0)
+    async with scheduler.admit("default-fast") as wait_ms:
+        assert wait_ms >= 10
+    await holder
+    assert scheduler.rejections[("default-fast", "timeout")] == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_records_admission_wait_in_route_telemetry(monkeypatch):
+    async def fake_stream(*_args, **_kwargs):
+        yield "hello"
+
+    monkeypatch.setattr(inference_module, "stream_chat_completion", fake_stream)
+    monkeypatch.setattr(inference_module, "inference_scheduler", _scheduler())
+    telemetry_sink: dict[str, object] = {}
+
+    chunks = [
+        chunk
+        async for chunk in inference_module.generate_stream_explanation(
+            "topic", "eli5", mode="learning", is_pro=True, telemetry_sink=telemetry_sink
+        )
+    ]
+
+    assert chunks == ["hello"]
+    assert telemetry_sink["queue_wait_ms"] == 0.0
+
+
+@pytest.mark.asyncio
+async def test_stream_fallback_reuses_the_stream_classification(monkeypatch):
+    calls = []
+
+    async def failing_stream(*_args, **_kwargs):
+        raise RuntimeError("stream down")
+        yield  # pragma: no cover
+
+    async def fake_call_model(*_args, **_kwargs):
+        return "valid technical response"
+
+    def counting_detect(topic):
+        calls.append(topic)
+        return {"intent": "compare", "depth": "deep"}
+
+    monkeypatch.setattr(inference_module, "stream_chat_completion", failing_stream)
+    monkeypatch.setattr(inference_module, "detect_intent_and_depth", counting_detect)
+    monkeypatch.setattr(inference_module, "detect_diagram_type", lambda _topic: None)
+    monkeypatch.setattr(inference_module, "call_model", fake_call_model)
+    monkeypatch.setattr(inference_module, "validate_technical_response", lambda *_args, **_kwargs: (True, ""))
+
+    chunks = [chunk async for chunk in inference_module.generate_stream_explanation("topic", "eli15", mode="technical")]
+
+    assert "".join(chunks) == "valid technical response"
+    assert calls == ["topic"]
+
+
+def _stub_technical(monkeypatch, intent="explain"):
+    monkeypatch.setattr(inference_module, "detect_intent_and_depth", lambda _topic: {"intent": intent, "depth": "medium"})
+    monkeypatch.setattr(inference_module, "detect_diagram_type", lambda _topic: None)
+    monkeypatch.setattr(inference_module, "build_technical_prompt", lambda *_args, **_kwargs: "prompt")
+
+
+@pytest.mark.asyncio
+async def test_off_track_technical_stream_switches_models_before_anything_is_shown(monkeypatch):
+    models = []
+    closed = []
+
+    async def fake_stream(*, model, **_kwargs):
+        models.append(model)
+        try:
+            if model == "technical-primary":
+                for _ in range(100):
+                    yield "Rambling intro with no sections at all. "
+            else:
+                yield "## Core"
+                yield " Idea\nThe point."
+        finally:
+            closed.append(model)
+
+    _stub_technical(monkeypatch)
+    monkeypatch.setattr(inference_module, "stream_chat_completion", fake_stream)
+    telemetry_sink: dict[str, object] = {}
+
+    chunks = [
+        chunk
+        async for chunk in inference_module.generate_stream_explanation(
+            "topic", "eli15", mode="technical", telemetry_sink=telemetry_sink
+        )
+    ]
+
+    assert chunks == ["## Core", " Idea\nThe point."]
+    assert models == ["technical-primary", "technical-fallback"]
+    assert closed == models
+    assert telemetry_sink["model_alias"] == "technical-fallback"
+    assert telemetry_sink["structure_abort"]["reason"] == "no_structure"
+    assert telemetry_sink["structure_abort"]["discarded_chars"] < 600
+    assert telemetry_sink["structure_valid"] is False
+
+
+@pytest.mark.asyncio
+async def test_structured_technical_stream_is_released_at_the_first_header(monkeypatch):
+    seen_by_consumer = []
+
+    async def fake_stream(*, model, **_kwargs):
+        yield "Intro. "
+        assert seen_by_consumer == []
+        yield "## Core Idea\n"
+        # Held chunks are released once the header shows up, before the model produces more.
+        assert seen_by_consumer == ["Intro. ", "## Core Idea\n"]
+        yield "The rest."
+
+    _stub_technical(monkeypatch)
+    monkeypatch.setattr(inference_module, "stream_chat_completion", fake_stream)
+
+    async for chunk in inference_module.generate_stream_explanation("topic", "eli15", mode="technical"):
+        seen_by_consumer.append(chunk)
+
+    assert seen_by_consumer == ["Intro. ", "## Core Idea\n", "The rest."]
@@ -1,5 +1,9 @@
 import pytest
+import services.intent as intent_module
 from services.intent import (
+    Classification,
+    StructureTracker,
+    classify,
     detect_intent_and_depth,
     detect_diagram_type,
     validate_technical_response,
@@ -66,6 +70,25 @@ class TestDetectDiagramType:
         assert detect_diagram_type("draw the er diagram for this schema") == "erDiagram"
 
 
+class TestClassify:
+    def test_overlapping_hits_resolve_by_priority_not_position(self):
+        # "architecture" is both a brainstorm intent and a flowchart trigger; "vs" outranks it for intent,
+        # and "sequence" outranks "flow" for the diagram even though it appears later.
+        result = classify("Microservice architecture vs monolith request flow sequence in depth")
+        assert result == Classification(intent="compare", depth="deep", diagram_type="sequenceDiagram")
+
+    def test_patterns_with_their_own_groups_still_match(self):
+        assert classify("how would we shard this") == Classification("brainstorm", "medium", None)
+        assert classify("should i use a timeline") == Classification("brainstorm", "medium", "timeline")
+
+    def test_results_are_memoized_per_normalized_query(self):
+        intent_module._classify_normalized.cache_clear()
+        classify("What is a  B-Tree")
+        classify("what is a b-tree")
+        info = intent_module._classify_normalized.cache_info()
+        assert (info.hits, info.misses) == (1, 1)
+
+
 class TestValidateTechnicalResponse:
     def test_empty_string_invalid(self):
         valid, reason = validate_technical_response("", "explain")
@@ -127,3 +150,31 @@ class TestValidateTechnicalResponse:
         valid, reason = validate_technical_response(response, "brainstorm")
         assert not valid
         assert reason == "missing_brainstorm_structure"
+
+
+class TestStructureTracker:
+    COMPARE = (
+        "## Option A\nSummary.\nStrengths.\nWeaknesses.\n\n"
+        "## Option B\nSummary.\nStrengths.\nWeaknesses.\n\n"
+        "## Key Differences\n- A\n- B\n- C\n\n"
+        "## Recommendation\nGo with A when latency matters; otherwise B is simpler to run."
+    )
+
+    def test_headers_split_across_deltas_match_the_full_text_verdict(self):
+        tracker = StructureTracker("compare")
+        for index in range(0, len(self.COMPARE), 3):
+            tracker.feed(self.COMPARE[index : index + 3])
+        assert tracker.headers_seen == 4
+        assert tracker.result() == validate_technical_response(self.COMPARE, "compare") == (True, "")
+
+    def test_missing_first_header_goes_off_track_early(self):
+        tracker = StructureTracker("explain", first_header_chars=100)
+        assert tracker.feed("Sure! Here is a friendly overview of the topic. " * 2) is None
+        assert tracker.feed("It keeps going without any of the requested sections.") == "no_structure"
+        assert not tracker.on_track
+
+    def test_long_gap_after_a_header_stalls(self):
+        tracker = StructureTracker("explain", section_max_chars=200)
+        tracker.feed("## Core Idea\n")
+        assert tracker.on_track
+        assert tracker.feed("words " * 40) == "structure_stalled"
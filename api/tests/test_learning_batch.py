@@ -0,0 +1,81 @@
+import pytest
+
+import services.inference as inference_module
+from services.learning_batch import LevelSectionSplitter, split_usage
+
+
+def _feed_all(splitter, text, step):
+    pieces = []
+    for index in range(0, len(text), step):
+        pieces.extend(splitter.feed(text[index : index + step]))
+    pieces.extend(splitter.close())
+    return pieces
+
+
+def test_splitter_routes_sections_with_markers_split_across_deltas():
+    response = "Sure!\n<<<eli5>>>\nGravity is a hug.\n<<<meme>>>\nGravity: the original clingy friend.\n<<<end>>>\nthanks"
+    for step in (1, 3, 7, len(response)):
+        splitter = LevelSectionSplitter(["eli5", "meme"])
+        pieces = _feed_all(splitter, response, step)
+        assert splitter.sections() == {"eli5": "Gravity is a hug.", "meme": "Gravity: the original clingy friend."}
+        assert {level for level, _ in pieces} == {"eli5", "meme"}
+        assert "".join(text for level, text in pieces if level == "eli5").strip() == "Gravity is a hug."
+
+
+def test_splitter_streams_text_before_the_line_ends():
+    splitter = LevelSectionSplitter(["eli5"])
+    assert splitter.feed("<<<eli5>>>\nGravity ") == [("eli5", "Gravity ")]
+    assert splitter.feed("pulls") == [("eli5", "pulls")]
+
+
+def test_cut_off_and_unmarked_sections_are_reported_missing():
+    splitter = LevelSectionSplitter(["eli5", "eli10", "meme"])
+    _feed_all(splitter, "<<<eli5>>>\nShort and sweet.\n<<<eli10>>>\nThis one ran out of tok", 5)
+    assert splitter.sections() == {"eli5": "Short and sweet."}
+    assert splitter.missing() == ["eli10", "meme"]
+
+
+def test_split_usage_adds_up_to_the_reported_totals():
+    shares = split_usage({"prompt_tokens": 101, "completion_tokens": 300}, {"eli5": 100, "eli10": 200, "meme": 1})
+    assert sum(share["prompt_tokens"] for share in shares.values()) == 101
+    assert sum(share["completion_tokens"] for share in shares.values()) == 300
+    assert shares["eli10"]["completion_tokens"] > shares["eli5"]["completion_tokens"] > shares["meme"]["completion_tokens"]
+
+
+@pytest.mark.asyncio
+async def test_generate_learning_batch_makes_one_call_and_splits_usage(monkeypatch):
+    calls = []
+
+    async def fake_stream(*, model, messages, telemetry_sink, **_kwargs):
+        calls.append((model, messages[0]["content"]))
+        telemetry_sink["token_usage"] = {"prompt_tokens": 40, "completion_tokens": 60, "total_tokens": 100}
+        telemetry_sink["estimated_cost_usd"] = 0.01
+        yield "<<<eli5>>>\nA hug from Earth.\n<<<eli15>>>\n"
+        yield "Mass curves spacetime, and objects follow the curve.\n<<<end>>>"
+
+    monkeypatch.setattr(inference_module, "stream_chat_completion", fake_stream)
+    level_telemetry = {"eli5": {}, "eli15": {}}
+
+    results = await inference_module.generate_learning_batch(
+        "gravity", ["eli5", "eli15"], level_telemetry=level_telemetry
+    )
+
+    assert results == {"eli5": "A hug from Earth.", "eli15": "Mass curves spacetime, and objects follow the curve."}
+    assert len(calls) == 1 and calls[0][0] == "learning-detailed"
+    assert "<<<eli5>>>" in calls[0][1] and "<<<eli15>>>" in calls[0][1] and "gravity" in calls[0][1]
+    assert sum(sink["token_usage"]["total_tokens"] for sink in level_telemetry.values()) == 100
+    assert sum(sink["estimated_cost_usd"] for sink in level_telemetry.values()) == pytest.approx(0.01)
+    assert {sink["generation_strategy"] for sink in level_telemetry.values()} == {"batched"}
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_returns_only_complete_sections(monkeypatch):
+    async def broken_stream(**_kwargs):
+        yield "<<<eli5>>>\nA hug from Earth.\n<<<meme>>>\nhalf a jo"
+        raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(inference_module, "stream_chat_completion", broken_stream)
+
+    results = await inference_module.generate_learning_batch("gravity", ["eli5", "meme"])
+
+    assert results == {"eli5": "A hug from Earth."}
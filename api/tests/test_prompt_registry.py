@@ -0,0 +1,68 @@
+import pytest
+
+from prompts import (
+    PROMPTS,
+    TECHNICAL_BRAINSTORM_PROMPT,
+    TECHNICAL_COMPARE_PROMPT,
+    TECHNICAL_STRUCTURED_PROMPT,
+    _TECHNICAL_DEEPER_LAYER,
+    _TECHNICAL_DIAGRAM_INSTRUCTION,
+)
+from services.inference import build_technical_prompt
+from services.prompt_registry import (
+    TECHNICAL_DEPTHS,
+    TECHNICAL_DIAGRAM_TYPES,
+    TECHNICAL_INTENTS,
+    compile_template,
+    prompt_registry,
+)
+from utils import FREE_LEVELS
+
+
+def _legacy_technical_prompt(topic, intent, depth, diagram_type):
+    diagram_instruction = (
+        _TECHNICAL_DIAGRAM_INSTRUCTION.format(diagram_type=diagram_type)
+        if diagram_type and intent != "compare"
+        else ""
+    )
+    if intent == "brainstorm":
+        return TECHNICAL_BRAINSTORM_PROMPT.format(topic=topic, diagram_instruction=diagram_instruction)
+    if intent == "compare":
+        return TECHNICAL_COMPARE_PROMPT.format(topic=topic)
+    return TECHNICAL_STRUCTURED_PROMPT.format(
+        topic=topic,
+        deeper_layer_instruction=_TECHNICAL_DEEPER_LAYER if depth == "deep" else "",
+        diagram_instruction=diagram_instruction,
+    )
+
+
+@pytest.mark.parametrize("level", FREE_LEVELS)
+def test_learning_prompts_match_str_format(level):
+    compiled = prompt_registry.get("learning", level=level)
+    assert compiled.render(topic="Black {holes}") == PROMPTS[level].format(topic="Black {holes}")
+
+
+def test_socratic_prompt_matches_str_format():
+    compiled = prompt_registry.get("socratic")
+    rendered = compiled.render(topic="entropy", conversation_context="none")
+    assert rendered == PROMPTS["socratic"].format(topic="entropy", conversation_context="none")
+
+
+def test_technical_prompts_match_legacy_builder():
+    for intent in (*TECHNICAL_INTENTS, "unknown"):
+        for depth in TECHNICAL_DEPTHS:
+            for diagram_type in (*TECHNICAL_DIAGRAM_TYPES, "mindmap"):
+                expected = _legacy_technical_prompt("Raft", intent, depth, diagram_type)
+                assert build_technical_prompt("Raft", intent, depth, diagram_type) == expected
+
+
+def test_unknown_level_returns_none():
+    assert prompt_registry.get("learning", level="nope") is None
+
+
+def test_compile_template_inlines_static_fields_and_hashes_content():
+    compiled = compile_template("A {x} B {topic} C", x="{literal}")
+    assert compiled.fields == ("topic",)
+    assert compiled.render(topic="t") == "A {literal} B t C"
+    assert compile_template("A {topic}").version != compile_template("B {topic}").version
+    assert compile_template("A {topic}").version == compile_template("A {topic}").version
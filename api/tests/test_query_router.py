@@ -39,6 +39,35 @@ async def test_query_cache_hit_returns_cached(app_client, monkeypatch):
     assert body["explanations"]["eli5"] == "cached"
 
 
+@pytest.mark.asyncio
+async def test_query_dual_reads_legacy_key_and_backfills(app_client, monkeypatch):
+    # The previous release's key format, unchanged from before response keys were versioned.
+    store = {"knowbear:cats:learning:eli5": {"text": "legacy cached"}}
+    writes = []
+
+    async def fake_cache_get(key):
+        return store.get(key)
+
+    async def fake_cache_set(key, value):
+        writes.append(key)
+        return True
+
+    async def fake_generate_explanation(*_args, **_kwargs):
+        pytest.fail("generate_explanation should not be called")
+
+    monkeypatch.setattr(query_module, "cache_get", fake_cache_get)
+    monkeypatch.setattr(query_module, "cache_set", fake_cache_set)
+    monkeypatch.setattr(query_module, "generate_explanation", fake_generate_explanation)
+
+    resp = await app_client.post(
+        "/api/query",
+        json={"topic": "Cats", "levels": ["eli5"], "mode": "learning"}
+    )
+    assert resp.status_code == 200
+    assert resp.json()["explanations"]["eli5"] == "legacy cached"
+    assert writes == [query_module.response_cache_key("Cats", "eli5", "learning")]
+
+
 @pytest.mark.asyncio
 async def test_query_waits_for_history_persistence(app_client, monkeypatch, fake_user):
     async def fake_cache_get(_key):
@@ -169,6 +198,40 @@ async def test_query_stream_emits_done(app_client, monkeypatch):
     assert "chunk" in text
 
 
+@pytest.mark.asyncio
+async def test_query_stream_prefetches_images_for_visual_topics(app_client, monkeypatch, test_settings):
+    monkeypatch.setattr(test_settings, "serper_api_key", "key", raising=False)
+    started = []
+
+    async def fake_stream(*_args, **_kwargs):
+        yield "Draw the "
+        await asyncio.sleep(0.02)
+        assert started, "image lookup starts before generation finishes"
+        yield "flowchart"
+
+    async def fake_get_images(topic):
+        started.append(topic)
+        return [{"url": "https://img.example/flow.png", "title": "Flow"}]
+
+    async def fake_cache_get(_key):
+        return None
+
+    monkeypatch.setattr(query_module, "generate_stream_explanation", fake_stream)
+    monkeypatch.setattr(query_module, "cache_get", fake_cache_get)
+    monkeypatch.setattr(query_module.search_service, "get_images", fake_get_images)
+
+    resp = await app_client.post(
+        "/api/query/stream",
+        json={"topic": "Login flowchart", "levels": ["eli5"], "mode": "learning"}
+    )
+
+    assert resp.status_code == 200
+    text = resp.text
+    assert started == ["Login flowchart"]
+    assert "event: images" in text
+    assert text.index("event: images") < text.index("data: [DONE]")
+
+
 @pytest.mark.asyncio
 async def test_query_anonymous_rate_limit_exceeded(app_client, monkeypatch, test_settings):
     test_settings.anonymous_rate_limit_burst = 1
@@ -265,3 +328,61 @@ async def test_query_circuit_breaker_trigger_rejects(app_client, monkeypatch, te
     )
     assert resp.status_code == 503
     assert resp.json()["detail"]["type"] == "circuit_breaker_open"
+
+
+@pytest.mark.asyncio
+async def test_query_cache_hit_refunds_breaker_reservation(app_client, monkeypatch, dummy_redis):
+    async def fake_cache_get(_key):
+        return {"text": "cached"}
+
+    monkeypatch.setattr(query_module, "cache_get", fake_cache_get)
+
+    resp = await app_client.post(
+        "/api/query",
+        json={"topic": "Cats", "levels": ["eli5", "eli10"], "mode": "learning"}
+    )
+    assert resp.status_code == 200
+    assert resp.json()["cached"] is True
+
+    await rate_limit_module.usage_reconciler.flush()
+    breaker_keys = [key for key in dummy_redis.store if key.startswith("knowbear:circuit:tokens:")]
+    assert breaker_keys
+    assert all(dummy_redis.store[key] == 0 for key in breaker_keys)
+
+
+@pytest.mark.asyncio
+async def test_query_batches_levels_and_falls_back_per_level_for_missing_sections(app_client, monkeypatch, test_settings):
+    cached = {}
+    per_level_calls = []
+
+    async def fake_cache_get(_key):
+        return None
+
+    async def fake_cache_set(key, value, **_kwargs):
+        cached[key] = value
+        return True
+
+    async def fake_batch(topic, levels, *, level_telemetry=None, **_kwargs):
+        assert levels == ["eli5", "eli10", "meme"]
+        level_telemetry["eli5"]["token_usage"] = {"prompt_tokens": 10, "completion_tokens": 20, "total_tokens": 30}
+        return {"eli5": "batched eli5"}
+
+    async def fake_generate_explanation(_topic, level, **_kwargs):
+        per_level_calls.append(level)
+        return f"single {level}"
+
+    monkeypatch.setattr(test_settings, "learning_batch_enabled", True, raising=False)
+    monkeypatch.setattr(query_module, "cache_get", fake_cache_get)
+    monkeypatch.setattr(query_module, "cache_set", fake_cache_set)
+    monkeypatch.setattr(query_module, "generate_learning_batch", fake_batch)
+    monkeypatch.setattr(query_module, "generate_explanation", fake_generate_explanation)
+
+    resp = await app_client.post(
+        "/api/query",
+        json={"topic": "Cats", "levels": ["eli5", "eli10", "meme"], "mode": "learning"},
+    )
+
+    assert resp.status_code == 200
+    assert resp.json()["explanations"] == {"eli5": "batched eli5", "eli10": "single eli10", "meme": "single meme"}
+    assert sorted(per_level_calls) == ["eli10", "meme"]
+    assert query_module.response_cache_key("Cats", "eli5", "learning") in cached
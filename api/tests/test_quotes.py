@@ -0,0 +1,53 @@
+import pytest
+
+import services.quotes as quotes_module
+import services.search as search_module
+
+
+def test_bundled_corpus_loads_and_pools_respect_tags_and_length():
+    corpus = quotes_module.quote_corpus
+    assert len(corpus) > 50
+
+    pool = corpus.pool(
+        tags=quotes_module.REGENERATION_TAGS,
+        min_chars=quotes_module.REGENERATION_MIN_CHARS,
+        max_chars=quotes_module.REGENERATION_MAX_CHARS,
+        exclude_authors=quotes_module.OVERUSED_AUTHORS,
+    )
+    assert pool
+    assert all(50 <= len(corpus.contents[position]) <= 120 for position in pool)
+    assert not {corpus.authors[position] for position in pool} & quotes_module.OVERUSED_AUTHORS
+    assert corpus.pool(tags=frozenset({"technology"}), max_chars=60) == corpus.pool(
+        tags=frozenset({"technology"}), max_chars=60
+    )
+
+
+def test_seeded_rotation_cycles_the_whole_pool_before_repeating():
+    corpus = quotes_module.QuoteCorpus(
+        [(f"quote number {index}", f"author {index}", ("learning",)) for index in range(7)]
+    )
+    pool = corpus.pool(tags=frozenset({"learning"}))
+
+    first_cycle = [corpus.pick(pool, seed="user-1") for _ in range(7)]
+    assert sorted(first_cycle) == sorted(pool)
+    assert corpus.pick(pool, seed="user-1") == first_cycle[0]
+    assert [corpus.pick(pool, seed="user-2") for _ in range(7)] != first_cycle
+
+
+@pytest.mark.asyncio
+async def test_quotes_need_no_network_or_redis(monkeypatch):
+    async def fail(*_args, **_kwargs):
+        raise AssertionError("quotes must not touch the cache")
+
+    monkeypatch.setattr(search_module, "cache_get", fail)
+    monkeypatch.setattr(search_module, "cache_set", fail)
+    monkeypatch.setattr(search_module.httpx, "AsyncClient", None)
+    manager = search_module.SearchManager()
+
+    loading = await manager.get_quote(seed="request-1")
+    assert loading.startswith("«") and " — " in loading
+
+    first = await manager.get_regeneration_quote(seed="user-1")
+    second = await manager.get_regeneration_quote(seed="user-1")
+    assert first.startswith("---\n") and second.startswith("---\n")
+    assert first != second
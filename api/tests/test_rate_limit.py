@@ -89,3 +89,63 @@ async def test_quota_does_not_consume_tokens_on_reject(monkeypatch, test_setting
     allowed = await rate_limit_module.check_daily_quota(user_id="user-1", estimated_tokens=5)
     assert allowed.allowed is True
     assert allowed.consumed == 5
+
+
+@pytest.mark.asyncio
+async def test_usage_reconciler_batches_corrections_to_quota_and_breaker(monkeypatch, test_settings):
+    from conftest import DummyRedis
+
+    monkeypatch.setattr(test_settings, "daily_token_quota_per_user", 10000, raising=False)
+    monkeypatch.setattr(test_settings, "circuit_breaker_tokens_per_minute", 100000, raising=False)
+    monkeypatch.setattr(test_settings, "quota_reconcile_flush_seconds", 60, raising=False)
+    monkeypatch.setattr(test_settings, "rate_limit_burst", 0, raising=False)
+    monkeypatch.setattr(test_settings, "rate_limit_per_user", 0, raising=False)
+    redis = DummyRedis()
+
+    async def get_dummy_redis():
+        return redis
+
+    monkeypatch.setattr(rate_limit_module, "get_settings", lambda: test_settings)
+    monkeypatch.setattr(rate_limit_module, "get_redis", get_dummy_redis)
+    reconciler = rate_limit_module.UsageReconciler()
+
+    first = await rate_limit_module.enforce_request_controls(user_id="user-1", client_ip=None, estimated_tokens=1000)
+    second = await rate_limit_module.enforce_request_controls(user_id="user-1", client_ip=None, estimated_tokens=1000)
+    assert first.quota_key == "knowbear:quota:user-1"
+    assert redis.store[first.quota_key] == 2000
+
+    assert reconciler.settle(first, 1300) == 300
+    assert reconciler.refund(second) == -1000
+    assert reconciler.settle(second, 5000) == 0, "a reservation settles once"
+    assert reconciler.pending() == {first.quota_key: -700, first.breaker_key: -700}
+    assert redis.store[first.quota_key] == 2000
+
+    await reconciler.shutdown()
+    assert redis.store[first.quota_key] == 1300
+    assert redis.store[first.breaker_key] == 1300
+    assert reconciler.pending() == {}
+
+
+@pytest.mark.asyncio
+async def test_usage_reconciler_skips_expired_counters_and_never_goes_negative(monkeypatch):
+    from conftest import DummyRedis
+
+    redis = DummyRedis()
+    redis.store["knowbear:quota:user-2"] = 100
+
+    async def get_dummy_redis():
+        return redis
+
+    monkeypatch.setattr(rate_limit_module, "get_redis", get_dummy_redis)
+    reconciler = rate_limit_module.UsageReconciler()
+    reservation = rate_limit_module.UsageReservation(
+        tokens=500,
+        quota_key="knowbear:quota:user-2",
+        breaker_key="knowbear:circuit:tokens:1",
+    )
+
+    reconciler.refund(reservation)
+    await reconciler.flush()
+
+    assert redis.store["knowbear:quota:user-2"] == 0
+    assert "knowbear:circuit:tokens:1" not in redis.store
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+import routers.query as query_router
+import services.retrieval_index as retrieval_index_module
+
+RAFT = (
+    "Raft is a consensus algorithm. A leader is elected by majority vote and replicates its log to followers.\n\n"
+    "Entries are committed once a quorum of followers has stored them, so a minority failure never loses data."
+)
+PAXOS = (
+    "Paxos reaches agreement on a single value through prepare and accept phases run by proposers and acceptors. "
+    "Multi-Paxos chains instances to build a replicated log."
+)
+PASTA = "Boil pasta in well salted water and taste it a minute before the packet time; drain and toss with the sauce."
+
+
+def _index(tmp_path):
+    return retrieval_index_module.RetrievalIndex(directory=str(tmp_path / "segments"))
+
+
+def test_search_ranks_by_bm25_and_returns_the_best_passage(tmp_path):
+    index = _index(tmp_path)
+    index.add("raft", RAFT, title="How does Raft work?", source="explanation")
+    index.add("paxos", PAXOS, title="Paxos explained", source="explanation")
+    index.add("pasta", PASTA, title="Cooking pasta", source="explanation")
+
+    results = index.search("raft quorum committed")
+
+    assert [doc.key for doc in results] == ["raft"]
+    assert results[0].snippet.startswith("Entries are committed once a quorum")
+    assert [doc.key for doc in index.search("replicated log")] == ["paxos", "raft"]
+
+
+def test_owner_scoping_and_superseded_versions(tmp_path):
+    index = _index(tmp_path)
+    index.add("message:1", RAFT, title="raft", source="message", owner="user-a")
+    index.add("explain:raft", PAXOS, title="consensus", source="explanation")
+
+    assert [doc.key for doc in index.search("raft leader", owner="user-b")] == []
+    assert [doc.key for doc in index.search("raft leader", owner="user-a")] == ["message:1"]
+
+    assert not index.add("explain:raft", PAXOS, title="consensus"), "unchanged text is not re-indexed"
+    index.add("explain:raft", RAFT.replace("Raft", "Viewstamped replication"), title="consensus")
+    assert len(index) == 2
+    assert index.search("paxos acceptors") == []
+    assert index.search("viewstamped replication")[0].key == "explain:raft"
+
+
+@pytest.mark.asyncio
+async def test_segments_persist_reload_and_compact(tmp_path, monkeypatch, test_settings):
+    monkeypatch.setattr(test_settings, "retrieval_index_max_segments", 2, raising=False)
+    monkeypatch.setattr(test_settings, "retrieval_index_max_documents", 2, raising=False)
+    index = _index(tmp_path)
+    for key, text in (("raft", RAFT), ("paxos", PAXOS), ("pasta", PASTA)):
+        index.add(key, text, title=key)
+        await index.flush()
+
+    files = [name for name in os.listdir(tmp_path / "segments") if name.endswith(".json.gz")]
+    assert len(files) == 1, "three segments were compacted into one"
+    assert index.stats["compactions"] == 1
+
+    reloaded = _index(tmp_path)
+    assert reloaded.load() == 1
+    assert len(reloaded) == 2, "the oldest document fell outside the document cap"
+    assert reloaded.search("raft leader") == []
+    assert reloaded.search("boil pasta")[0].key == "pasta"
+    reloaded.add("raft", RAFT, title="raft")
+    assert reloaded.search("raft leader")[0].key == "raft"
+
+
+def test_related_context_packs_prior_explanations(tmp_path):
+    index = _index(tmp_path)
+    index.add("raft", RAFT, title="How does Raft work?")
+
+    context = index.related_context("committed quorum", token_budget=200)
+
+    assert context.startswith("How does Raft work?: Entries are committed")
+    assert index.related_context("unrelated kittens", token_budget=200) == ""
+
+
+@pytest.mark.asyncio
+async def test_cached_explanations_are_indexed(monkeypatch):
+    async def fake_cache_set(_key, _value, ttl=None):
+        return True
+
+    monkeypatch.setattr(query_router, "cache_set", fake_cache_set)
+
+    key = await query_router._cache_set_response("raft consensus", "eli15", "learning", RAFT)
+
+    results = retrieval_index_module.retrieval_index.search("raft quorum")
+    assert [doc.key for doc in results] == [key]
+    assert results[0].source == "explanation"
+    assert results[0].title == "raft consensus"
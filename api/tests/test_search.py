@@ -1,12 +1,24 @@
+import asyncio
+import time
+
 import pytest
 
+import services.cache as cache_module
 import services.search as search_module
+from services.search_results import SearchResult, canonical_url, merge_results, pack_context, rank_results
 
 
 @pytest.mark.asyncio
 async def test_search_context_cache_hit(monkeypatch):
     async def fake_cache_get(_key):
-        return {"content": "cached"}
+        return {
+            "providers": {
+                "tavily": {
+                    "results": [{"title": "", "url": "", "snippet": "cached", "provider": "tavily"}],
+                    "fetched_at": time.time(),
+                }
+            }
+        }
 
     async def fake_cache_set(_key, _value, ttl=None):
         return True
@@ -56,3 +68,199 @@ async def test_get_images_no_api_key(monkeypatch):
     manager = search_module.SearchManager()
     images = await manager.get_images("topic")
     assert images == []
+
+
+def _counting_manager(monkeypatch, results):
+    manager = search_module.SearchManager()
+    calls = []
+
+    async def search(query):
+        calls.append(query)
+        await asyncio.sleep(0)
+        return results.pop(0) if results else ""
+
+    monkeypatch.setattr(manager, "_select_provider", lambda _query: "tavily")
+    for name in ("_search_tavily", "_search_serper", "_search_exa"):
+        monkeypatch.setattr(manager, name, search)
+    return manager, calls
+
+
+@pytest.mark.asyncio
+async def test_normalized_queries_share_one_entry_and_concurrent_misses_fetch_once(dummy_redis, monkeypatch):
+    manager, calls = _counting_manager(monkeypatch, ["fresh results"])
+
+    first, second = await asyncio.gather(
+        manager.get_search_context("What is a Binary Tree?"),
+        manager.get_search_context("binary tree"),
+    )
+    third = await manager.get_structured_search_context("  binary   TREE ")
+
+    assert first == second == "fresh results"
+    assert calls == ["What is a Binary Tree?"]
+    assert third["cache"] == "hit"
+    assert third["provider"] == "tavily"
+    assert third["context"] == "fresh results"
+
+
+@pytest.mark.asyncio
+async def test_stale_entry_is_served_immediately_and_refreshed_in_background(dummy_redis, monkeypatch, test_settings):
+    monkeypatch.setattr(test_settings, "search_cache_fresh_seconds", 60, raising=False)
+    manager, calls = _counting_manager(monkeypatch, ["refreshed results"])
+    key = search_module.search_cache_key("rust ownership")
+    old = [{"title": "", "url": "", "snippet": "old results", "provider": "serper"}]
+    await cache_module.cache_set(key, {"providers": {"serper": {"results": old, "fetched_at": time.time() - 120}}}, ttl=600)
+
+    stale = await manager.get_structured_search_context("rust ownership")
+    assert stale["cache"] == "stale"
+    assert stale["context"] == "old results"
+
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert calls and set(calls) == {"rust ownership"}
+    entry = await cache_module.cache_get(key)
+    assert set(entry["providers"]) == {"serper", "tavily"}
+    assert await manager.get_search_context("rust ownership") == "refreshed results\nold results"
+
+
+@pytest.mark.asyncio
+async def test_empty_results_are_negatively_cached(dummy_redis, monkeypatch):
+    manager, calls = _counting_manager(monkeypatch, [])
+
+    assert await manager.get_search_context("zzqx nothing") == search_module.NO_CONTEXT
+    structured = await manager.get_structured_search_context("zzqx nothing")
+
+    assert structured["cache"] == "negative"
+    assert len(calls) == 3, "one primary attempt plus the two fallbacks, then nothing"
+
+
+def test_provider_selection_follows_live_latency_and_success(monkeypatch, test_settings):
+    monkeypatch.setattr(test_settings, "search_explore_rate", 0.0, raising=False)
+    manager = search_module.SearchManager()
+    for _ in range(5):
+        manager.health["tavily"].observe(2.0, ok=True)
+        manager.health["serper"].observe(0.3, ok=False)
+        manager.health["exa"].observe(0.4, ok=True)
+
+    assert manager._provider_order("consensus algorithms") == ["exa", "tavily", "serper"]
+
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_and_cancelled_when_backup_answers(monkeypatch, test_settings):
+    monkeypatch.setattr(test_settings, "search_hedge_min_seconds", 0.05, raising=False)
+    monkeypatch.setattr(test_settings, "search_hedge_max_seconds", 0.05, raising=False)
+    manager = search_module.SearchManager()
+    cancelled = asyncio.Event()
+
+    async def slow(_query):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "slow"
+
+    async def fast(_query):
+        await asyncio.sleep(0.01)
+        return "hedged result"
+
+    monkeypatch.setattr(manager, "_provider_order", lambda _query: ["tavily", "serper", "exa"])
+    monkeypatch.setattr(manager, "_search_tavily", slow)
+    monkeypatch.setattr(manager, "_search_serper", fast)
+    monkeypatch.setattr(manager, "_search_exa", slow)
+
+    started = time.perf_counter()
+    fetched = await manager._fetch("raft consensus")
+
+    assert [result.snippet for result in fetched["serper"]] == ["hedged result"]
+    assert set(fetched) == {"serper"}
+    assert time.perf_counter() - started < 1
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    assert manager.health["serper"].samples
+
+
+def test_merge_dedups_by_canonical_url_and_keeps_the_longer_snippet():
+    tavily = [
+        SearchResult("Raft", "https://www.raft.github.io/?utm_source=x#intro", "Consensus.", "tavily"),
+        SearchResult("Paxos", "https://example.com/paxos", "Paxos made simple.", "tavily"),
+    ]
+    serper = [SearchResult("Raft", "http://raft.github.io", "Raft is a consensus algorithm.", "serper")]
+
+    merged = merge_results([tavily, serper])
+
+    assert canonical_url("https://www.raft.github.io/?utm_source=x#intro") == canonical_url("http://raft.github.io")
+    assert [result.title for result in merged] == ["Raft", "Paxos"]
+    assert merged[0].snippet == "Raft is a consensus algorithm."
+
+
+def test_bm25_ranks_relevant_snippets_first_and_packer_respects_budget():
+    results = [
+        SearchResult("Cooking", "https://a.example/pasta", "How to boil pasta properly.", "exa"),
+        SearchResult("Raft log", "https://b.example/raft", "Raft replicates the log to a quorum of followers.", "exa"),
+        SearchResult("Summary", "", "Raft elects a leader that replicates the log.", "tavily"),
+    ]
+
+    ranked = rank_results("raft log replication", results)
+    assert ranked[0].url == "https://b.example/raft"
+    assert ranked[-1].url == "https://a.example/pasta"
+    assert ranked[-1].score == 0
+
+    packed = pack_context(ranked, token_budget=50)
+    lines = packed.splitlines()
+    assert lines[0] == "Summary: Raft elects a leader that replicates the log."
+    assert "pasta" not in packed
+    assert len(pack_context(ranked, token_budget=3).split()) <= 3
+
+
+@pytest.mark.asyncio
+async def test_structured_context_merges_providers_into_ranked_results(dummy_redis, monkeypatch, test_settings):
+    monkeypatch.setattr(test_settings, "search_merge_grace_seconds", 0.2, raising=False)
+    manager = search_module.SearchManager()
+
+    async def tavily(_query):
+        return [SearchResult("Raft", "https://raft.github.io/", "Raft consensus overview.", "tavily")]
+
+    async def serper(_query):
+        await asyncio.sleep(0.01)
+        return [
+            SearchResult("Raft", "https://www.raft.github.io", "Raft consensus algorithm, leader election and log.", "serper"),
+            SearchResult("Weather", "https://weather.example", "Sunny today.", "serper"),
+        ]
+
+    monkeypatch.setattr(manager, "_provider_order", lambda _query: ["tavily", "serper", "exa"])
+    monkeypatch.setattr(manager, "_search_tavily", tavily)
+    monkeypatch.setattr(manager, "_search_serper", serper)
+
+    structured = await manager.get_structured_search_context("raft consensus")
+
+    assert structured["providers"] == ["serper", "tavily"]
+    assert [result["url"] for result in structured["results"]] == ["https://raft.github.io/", "https://weather.example"]
+    assert "leader election" in structured["context"]
+    cached = await manager.get_structured_search_context("raft consensus")
+    assert cached["cache"] == "hit"
+    assert cached["results"] == structured["results"]
+
+
+@pytest.mark.asyncio
+async def test_images_are_cached_by_canonical_topic_and_shared_in_flight(dummy_redis, monkeypatch, test_settings):
+    monkeypatch.setattr(test_settings, "serper_api_key", "key", raising=False)
+    manager = search_module.SearchManager()
+    calls = []
+
+    async def fetch(key, query):
+        calls.append(query)
+        await asyncio.sleep(0.01)
+        images = [{"url": "https://img.example/tcp.png", "title": "TCP handshake"}]
+        await cache_module.cache_set(key, {"images": images, "fetched_at": time.time()}, ttl=60)
+        return images
+
+    monkeypatch.setattr(manager, "_fetch_images", fetch)
+
+    prefetch = manager.prefetch_images("TCP handshake diagram")
+    assert prefetch is not None
+    direct = await manager.get_images("tcp handshake DIAGRAM?")
+    assert await manager.prefetched_images(prefetch) == direct
+    assert await manager.get_images("TCP handshake diagram") == direct
+    assert len(calls) == 1
+
+    assert manager.prefetch_images("history of rome") is None
+    assert await manager.prefetched_images(None) == []
@@ -0,0 +1,106 @@
+import pytest
+
+import auth as auth_module
+import routers.query as query_module
+from services.semantic_cache import SemanticCacheIndex, semantic_form
+
+
+def test_semantic_form_drops_modifiers_and_plurals():
+    assert semantic_form("Explain black holes simply") == semantic_form("What's a black hole?")
+
+
+def test_lookup_matches_paraphrase_within_namespace():
+    index = SemanticCacheIndex()
+    index.remember("quantum entanglement", "key-1", mode="learning", level="eli5")
+
+    match = index.lookup("Quantum entanglements", mode="learning", level="eli5")
+    assert match is not None
+    assert match.cache_key == "key-1"
+    assert index.lookup("Quantum entanglements", mode="learning", level="eli10") is None
+    assert index.lookup("quantum entanglement", mode="learning", level="eli5", scope="messages:0.70") is None
+    assert index.stats["hits"] == 1
+    assert index.stats["misses"] == 2
+
+
+def test_lookup_rejects_distinct_topics():
+    index = SemanticCacheIndex()
+    index.remember("black holes", "key-1", mode="learning", level="eli5")
+    index.remember("Python 2 features", "key-2", mode="learning", level="eli5")
+
+    assert index.lookup("white holes", mode="learning", level="eli5") is None
+    assert index.lookup("Python 3 features", mode="learning", level="eli5") is None
+
+
+@pytest.mark.parametrize(
+    ("stored", "other"),
+    [
+        ("Henry VIII", "Henry VII"),
+        ("Hepatitis A", "Hepatitis B"),
+        ("Vitamin A deficiency", "Vitamin D deficiency"),
+        ("CPU architecture", "GPU architecture"),
+        ("Type I error", "Type II error"),
+    ],
+)
+def test_lookup_rejects_topics_that_differ_by_an_identifier(stored, other):
+    index = SemanticCacheIndex()
+    index.remember(stored, "key-1", mode="learning", level="eli5")
+
+    assert index.lookup(other, mode="learning", level="eli5") is None
+    assert index.lookup(stored.lower(), mode="learning", level="eli5") is not None
+
+
+def test_technical_namespace_separates_intents():
+    index = SemanticCacheIndex()
+    index.remember("Compare TCP vs UDP", "key-1", mode="technical", level="technical_depth")
+
+    assert index.lookup("Explain TCP and UDP", mode="technical", level="technical_depth") is None
+
+
+def test_eviction_and_forget_drop_entries():
+    index = SemanticCacheIndex(max_entries=1)
+    index.remember("photosynthesis", "key-1", mode="learning", level="eli5")
+    index.remember("mitochondria", "key-2", mode="learning", level="eli5")
+
+    assert len(index) == 1
+    assert index.stats["evictions"] == 1
+    assert index.lookup("photosynthesis", mode="learning", level="eli5") is None
+
+    index.forget("key-2", topic="mitochondria", mode="learning", level="eli5")
+    assert index.lookup("mitochondria", mode="learning", level="eli5") is None
+
+
+@pytest.mark.asyncio
+async def test_query_serves_near_duplicate_from_semantic_cache(app_client, monkeypatch):
+    store = {}
+    generated = []
+
+    async def fake_cache_get(key):
+        return store.get(key)
+
+    async def fake_cache_set(key, value):
+        store[key] = value
+        return True
+
+    async def fake_generate_explanation(topic, *_args, **_kwargs):
+        generated.append(topic)
+        return f"about {topic}"
+
+    async def fake_auth():
+        return None
+
+    monkeypatch.setattr(query_module, "cache_get", fake_cache_get)
+    monkeypatch.setattr(query_module, "cache_set", fake_cache_set)
+    monkeypatch.setattr(query_module, "generate_explanation", fake_generate_explanation)
+    app_client.app.dependency_overrides[auth_module.verify_token_optional] = fake_auth
+
+    first = await app_client.post("/api/query", json={"topic": "Black holes", "levels": ["eli5"], "mode": "learning"})
+    second = await app_client.post(
+        "/api/query",
+        json={"topic": "Explain black hole simply", "levels": ["eli5"], "mode": "learning"},
+    )
+
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert second.json()["cached"] is True
+    assert second.json()["explanations"]["eli5"] == "about Black holes"
+    assert generated == ["Black holes"]
@@ -0,0 +1,201 @@
+import asyncio
+import re
+from types import SimpleNamespace
+
+import pytest
+
+import main as main_app
+import routers.messages as messages_module
+import services.sse_resume as sse_resume_module
+from conftest import FakeSupabase
+from services.streaming import SseEventBuilder
+
+
+async def _not_live():
+    return False
+
+
+def _ids(text):
+    return [int(value) for value in re.findall(r"^id: (\d+)$", text, flags=re.MULTILINE)]
+
+
+async def _collect(reader):
+    return [frame async for frame in sse_resume_module.resume_event_stream(reader)]
+
+
+@pytest.mark.asyncio
+async def test_local_reader_replays_missed_frames_then_tails(dummy_redis):
+    log = sse_resume_module.open_event_log("knowbear:test:events", ttl=60)
+    builder = SseEventBuilder(recorder=log.record)
+    builder.emit("meta", "{}")
+    builder.emit("delta", "one")
+    builder.emit("heartbeat", "{}")
+
+    reader = sse_resume_module.EventLogReader(
+        "knowbear:test:events", 1, is_live=_not_live, keepalive_seconds=0.05
+    )
+    assert await reader.available()
+    task = asyncio.create_task(_collect(reader))
+    await asyncio.sleep(0.02)
+    builder.emit("delta", "two")
+    builder.emit("done", "[DONE]")
+    frames = await asyncio.wait_for(task, timeout=1)
+
+    assert _ids("".join(frames)) == [2, 4, 5]
+    assert reader.end == sse_resume_module.END_DONE
+
+
+@pytest.mark.asyncio
+async def test_redis_reader_serves_other_workers_and_closes_interrupted_logs(dummy_redis):
+    log = sse_resume_module.open_event_log("knowbear:test:events", ttl=60)
+    builder = SseEventBuilder(recorder=log.record)
+    for index in range(3):
+        builder.emit("delta", str(index))
+    await log.close()
+    sse_resume_module.clear_local_logs()
+
+    reader = sse_resume_module.EventLogReader(
+        "knowbear:test:events", 1, is_live=_not_live, keepalive_seconds=0.05
+    )
+    assert await reader.available()
+    text = "".join(await _collect(reader))
+
+    assert _ids(text) == [2, 3, 4, 5]
+    assert "event: error" in text and "event: done" in text
+    assert reader.end == sse_resume_module.END_INTERRUPTED
+
+
+@pytest.mark.asyncio
+async def test_reader_unavailable_without_log_or_after_truncation(dummy_redis, monkeypatch, test_settings):
+    missing = sse_resume_module.EventLogReader("knowbear:none", 0, is_live=_not_live, keepalive_seconds=0.05)
+    assert not await missing.available()
+
+    monkeypatch.setattr(test_settings, "sse_resume_max_events", 2, raising=False)
+    log = sse_resume_module.open_event_log("knowbear:test:events", ttl=60)
+    builder = SseEventBuilder(recorder=log.record)
+    for index in range(3):
+        builder.emit("delta", str(index))
+
+    truncated = sse_resume_module.EventLogReader(
+        "knowbear:test:events", 0, is_live=_not_live, keepalive_seconds=0.05
+    )
+    assert log.end == sse_resume_module.END_TRUNCATED
+    assert not await truncated.available()
+
+
+@pytest.mark.asyncio
+async def test_slow_local_reader_continues_from_redis_after_buffer_overrun(dummy_redis):
+    log = sse_resume_module.open_event_log("knowbear:test:events", ttl=60)
+    builder = SseEventBuilder(recorder=log.record)
+    builder.emit("delta", "0")
+
+    reader = sse_resume_module.EventLogReader(
+        "knowbear:test:events", 0, is_live=_not_live, keepalive_seconds=0.05
+    )
+    assert await reader.available()
+    stream = sse_resume_module.resume_event_stream(reader)
+    frames = [await stream.__anext__()]
+    # The reader stalls while the producer overruns the in-process buffer.
+    total = sse_resume_module.LOCAL_BUFFER_EVENTS + 100
+    for index in range(1, total):
+        builder.emit("delta", str(index))
+    builder.emit("done", "[DONE]")
+    frames.extend([frame async for frame in stream])
+
+    assert _ids("".join(frames)) == list(range(1, total + 2))
+    assert reader.end == sse_resume_module.END_DONE
+
+
+@pytest.mark.asyncio
+async def test_redis_reader_stops_at_a_gap_instead_of_skipping_frames(dummy_redis):
+    log = sse_resume_module.open_event_log("knowbear:test:events", ttl=60)
+    builder = SseEventBuilder(recorder=log.record)
+    for index in range(3):
+        builder.emit("delta", str(index))
+    await log.close()
+    sse_resume_module.clear_local_logs()
+    # Simulate a lost append: the second frame never reached the list.
+    key = "knowbear:test:events"
+    dummy_redis.store[key].pop(1)
+
+    reader = sse_resume_module.EventLogReader(key, 0, is_live=_not_live, keepalive_seconds=0.05)
+    assert await reader.available()
+    text = "".join(await _collect(reader))
+
+    assert "data: 0\n" in text
+    assert "data: 1\n" not in text and "data: 2\n" not in text
+    assert reader.end == sse_resume_module.STATUS_GAP
+    assert '"resumable":false' in text
+
+
+@pytest.mark.asyncio
+async def test_truncated_log_reports_truncation_to_readers(dummy_redis, monkeypatch, test_settings):
+    monkeypatch.setattr(test_settings, "sse_resume_max_events", 2, raising=False)
+    log = sse_resume_module.open_event_log("knowbear:test:events", ttl=60)
+    builder = SseEventBuilder(recorder=log.record)
+    builder.emit("delta", "0")
+    reader = sse_resume_module.EventLogReader(
+        "knowbear:test:events", 0, is_live=_not_live, keepalive_seconds=0.05
+    )
+    assert await reader.available()
+    for index in range(1, 4):
+        builder.emit("delta", str(index))
+    text = "".join(await _collect(reader))
+
+    assert reader.end == sse_resume_module.END_TRUNCATED
+    assert '"truncated":true' in text
+
+
+@pytest.mark.asyncio
+async def test_messages_resume_with_last_event_id_sends_only_missed_events(app_client, monkeypatch, test_settings):
+    user = SimpleNamespace(id="user-resume", email="user@example.com", user_metadata={})
+    generations = 0
+
+    async def fake_verify_token():
+        return {"user": user}
+
+    async def fake_is_pro(*_args, **_kwargs):
+        return False
+
+    async def fast_stream(*_args, **_kwargs):
+        nonlocal generations
+        generations += 1
+        for chunk in ("alpha ", "beta ", "gamma"):
+            yield chunk
+
+    fake_supabase = FakeSupabase(
+        responses={
+            "conversations": {"id": "conv-resume", "user_id": user.id, "mode": "socratic", "settings": {}},
+            "messages": [{"id": "assistant-resume"}],
+            "users": {"is_pro": False},
+        }
+    )
+
+    main_app.app.dependency_overrides[messages_module.verify_token] = fake_verify_token
+    monkeypatch.setattr(messages_module, "check_is_pro", fake_is_pro)
+    monkeypatch.setattr(messages_module, "generate_stream_explanation", fast_stream)
+    monkeypatch.setattr(messages_module, "get_supabase_admin", lambda: fake_supabase)
+    monkeypatch.setattr(messages_module, "get_settings", lambda: test_settings)
+
+    try:
+        payload = {
+            "conversation_id": "conv-resume",
+            "content": "resume me",
+            "client_generated_id": "0b7f6f7e-51d4-4f5e-9d0c-2f1f4c1c9a11",
+            "assistant_client_id": "4e0c8f2a-9b3d-4f65-8c1e-6a7b8c9d0e1f",
+            "mode": "socratic",
+            "prompt_mode": "eli5",
+        }
+        first = await app_client.post("/api/messages", json=payload)
+        assert first.status_code == 200
+        first_ids = _ids(first.text)
+
+        resumed = await app_client.post("/api/messages", json=payload, headers={"Last-Event-ID": "2"})
+        assert resumed.status_code == 200
+        assert _ids(resumed.text) == [event_id for event_id in first_ids if event_id > 2]
+        assert "alpha" not in resumed.text
+        assert "gamma" in resumed.text
+        assert "replay" not in resumed.text
+        assert generations == 1
+    finally:
+        main_app.app.dependency_overrides.pop(messages_module.verify_token, None)
@@ -0,0 +1,177 @@
+import asyncio
+
+import pytest
+
+import routers.query as query_module
+import services.cache as cache_module
+import services.stream_cache as stream_cache_module
+from services.stream_cache import (
+    STATUS_ABORTED,
+    STATUS_COMPLETE,
+    STATUS_MISS,
+    StreamCacheReader,
+    StreamCacheWriter,
+    chunk_list_unusable,
+)
+
+
+async def _collect(reader, **kwargs):
+    return [chunk async for chunk in reader.chunks(**kwargs)]
+
+
+@pytest.mark.asyncio
+async def test_writer_coalesces_chunks_and_reader_replays(dummy_redis, monkeypatch):
+    monkeypatch.setattr(stream_cache_module, "FLUSH_CHARS", 4)
+    writer = StreamCacheWriter("list", ttl=60, lock_ttl=10)
+    assert await writer.claim() is True
+
+    for chunk in ["ab", "cd", "ef"]:
+        writer.append(chunk)
+    await writer.finish()
+
+    assert writer.completed is True
+    assert "list:writer" not in dummy_redis.store
+    reader = StreamCacheReader("list", follow=False)
+    assert "".join(await _collect(reader)) == "abcdef"
+    assert reader.status == STATUS_COMPLETE
+
+
+@pytest.mark.asyncio
+async def test_second_writer_cannot_claim_and_reader_tails_generation(dummy_redis, monkeypatch):
+    monkeypatch.setattr(stream_cache_module, "FLUSH_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(stream_cache_module, "TAIL_POLL_SECONDS", 0.01)
+    writer = StreamCacheWriter("list", ttl=60, lock_ttl=10)
+    assert await writer.claim() is True
+    assert await StreamCacheWriter("list", ttl=60, lock_ttl=10).claim() is False
+
+    async def produce():
+        for chunk in ["one ", "two ", "three"]:
+            await asyncio.sleep(0.02)
+            writer.append(chunk)
+        await writer.finish()
+
+    reader = StreamCacheReader("list", idle_timeout=1)
+    chunks, _ = await asyncio.gather(_collect(reader), produce())
+
+    assert "".join(chunks) == "one two three"
+    assert reader.status == STATUS_COMPLETE
+
+
+@pytest.mark.asyncio
+async def test_aborted_generation_is_not_replayed(dummy_redis):
+    writer = StreamCacheWriter("list", ttl=60, lock_ttl=10)
+    await writer.claim()
+    writer.append("partial")
+    await writer.abort()
+
+    reader = StreamCacheReader("list")
+    assert await _collect(reader) == []
+    assert reader.status == STATUS_ABORTED
+
+    empty = StreamCacheReader("missing")
+    assert await _collect(empty) == []
+    assert empty.status == STATUS_MISS
+
+
+async def _crash_writer(dummy_redis, list_key, text):
+    """Leave what a writer that died mid-generation leaves: chunks, no marker, an expired lock."""
+    writer = StreamCacheWriter(list_key, ttl=60, lock_ttl=10)
+    await writer.claim()
+    writer.append(text)
+    writer._schedule(writer._drain(), ttl=writer.ttl)
+    await writer._tail
+    dummy_redis.store.pop(f"{list_key}:writer")
+
+
+async def _abort_after_flush(_redis, list_key, text):
+    """An aborted generation whose chunks reached Redis before ``abort``."""
+    writer = StreamCacheWriter(list_key, ttl=60, lock_ttl=10)
+    await writer.claim()
+    writer.append(text)
+    writer._schedule(writer._drain(), ttl=writer.ttl)
+    await writer._tail
+    await writer.abort()
+
+
+@pytest.mark.asyncio
+async def test_chunk_list_unusable_unless_finished_or_still_being_written(dummy_redis):
+    await _crash_writer(dummy_redis, "crashed", "partial")
+    assert await chunk_list_unusable("crashed") is True
+    await _abort_after_flush(dummy_redis, "aborted", "partial")
+    assert await chunk_list_unusable("aborted") is True
+
+    live = StreamCacheWriter("live", ttl=60, lock_ttl=10)
+    await live.claim()
+    live.append("partial")
+    live._schedule(live._drain(), ttl=live.ttl)
+    await live._tail
+    assert await chunk_list_unusable("live") is False
+
+    await live.finish()
+    assert await chunk_list_unusable("live") is False
+    assert await chunk_list_unusable("missing") is False
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("leave_partial", [_crash_writer, _abort_after_flush])
+async def test_query_stream_regenerates_over_an_unfinished_list(
+    app_client, dummy_redis, monkeypatch, test_settings, leave_partial
+):
+    test_settings.stream_start_timeout_seconds = 0.5
+    test_settings.stream_max_seconds = 2
+    test_settings.stream_heartbeat_seconds = 0.1
+    calls = []
+
+    async def fake_stream(*_args, **_kwargs):
+        calls.append(1)
+        for chunk in ["Cells ", "divide."]:
+            yield chunk
+
+    async def no_blob(_key):
+        return None
+
+    monkeypatch.setattr(query_module, "generate_stream_explanation", fake_stream)
+    monkeypatch.setattr(query_module, "cache_get", no_blob)
+    monkeypatch.setattr(query_module, "get_settings", lambda: test_settings)
+    list_key = stream_cache_module.stream_cache_key(query_module._cache_key("mitosis", "eli5", "learning"))
+    await leave_partial(dummy_redis, list_key, "Half an ans")
+
+    payload = {"topic": "mitosis", "levels": ["eli5"], "mode": "learning"}
+    first = await app_client.post("/api/query/stream", json=payload)
+    second = await app_client.post("/api/query/stream", json=payload)
+
+    assert calls == [1]
+    assert "Half an ans" not in first.text and "Half an ans" not in second.text
+    assert "Cells " in first.text and "Cells divide." in second.text
+    assert "event: done" in second.text
+
+
+@pytest.mark.asyncio
+async def test_query_stream_replays_from_chunk_cache(app_client, monkeypatch, test_settings):
+    test_settings.stream_start_timeout_seconds = 0.5
+    test_settings.stream_max_seconds = 2
+    test_settings.stream_heartbeat_seconds = 0.1
+    calls = []
+
+    async def fake_stream(*_args, **_kwargs):
+        calls.append(1)
+        for chunk in ["Cells ", "divide."]:
+            yield chunk
+
+    async def no_blob(_key):
+        return None
+
+    monkeypatch.setattr(query_module, "generate_stream_explanation", fake_stream)
+    monkeypatch.setattr(query_module, "cache_get", no_blob)
+    monkeypatch.setattr(query_module, "get_settings", lambda: test_settings)
+
+    payload = {"topic": "mitosis", "levels": ["eli5"], "mode": "learning"}
+    first = await app_client.post("/api/query/stream", json=payload)
+    second = await app_client.post("/api/query/stream", json=payload)
+
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert calls == [1]
+    # The replay serves the coalesced list entry rather than the two original deltas.
+    assert "Cells divide." in second.text
+    assert "event: done" in second.text
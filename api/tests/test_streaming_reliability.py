@@ -1,4 +1,6 @@
 import asyncio
+import hashlib
+import json
 import time
 from types import SimpleNamespace
 
@@ -7,6 +9,7 @@ import pytest
 import main as main_app
 import routers.messages as messages_module
 import routers.query as query_module
+import services.rate_limit as rate_limit_module
 from conftest import FakeSupabase
 
 
@@ -128,9 +131,103 @@ async def test_messages_idempotency_replay(app_client, monkeypatch, test_setting
 
 
 @pytest.mark.asyncio
-async def test_messages_reclaims_stale_in_progress_idempotency(app_client, monkeypatch, test_settings):
+@pytest.mark.parametrize(
+    ("failing_role", "detail"),
+    [("user", "Failed to save user message"), ("assistant", "Failed to start assistant message")],
+)
+async def test_messages_insert_failure_refunds_reservation(app_client, monkeypatch, test_settings, failing_role, detail):
+    user = SimpleNamespace(id="user-123", email="user@example.com", user_metadata={})
+    reservation = SimpleNamespace(tokens=500)
+    refunded = []
+
+    async def fake_verify_token():
+        return {"user": user}
+
+    async def fake_is_pro(*_args, **_kwargs):
+        return False
+
+    async def fake_controls(**_kwargs):
+        return reservation
+
+    class FailingInsertSupabase(FakeSupabase):
+        def table(self, table):
+            query = super().table(table)
+            insert = query.insert
+
+            def failing_insert(payload):
+                if table == "messages" and payload.get("role") == failing_role:
+                    raise RuntimeError("insert failed")
+                return insert(payload)
+
+            query.insert = failing_insert
+            return query
+
+    fake_supabase = FailingInsertSupabase(
+        responses={
+            "conversations": {"id": "conv-1", "user_id": user.id, "mode": "socratic", "settings": {}},
+            "messages": [{"id": "assistant-1"}],
+            "users": {"is_pro": False},
+        }
+    )
+
+    main_app.app.dependency_overrides[messages_module.verify_token] = fake_verify_token
+    monkeypatch.setattr(messages_module, "check_is_pro", fake_is_pro)
+    monkeypatch.setattr(messages_module, "enforce_request_controls", fake_controls)
+    monkeypatch.setattr(messages_module.usage_reconciler, "refund", refunded.append)
+    monkeypatch.setattr(messages_module, "get_supabase_admin", lambda: fake_supabase)
+    monkeypatch.setattr(messages_module, "get_settings", lambda: test_settings)
+
+    try:
+        payload = {
+            "conversation_id": "conv-1",
+            "content": "hello",
+            "client_generated_id": "7a1c2e3f-4b5d-4c6e-8f70-8192a3b4c5d6",
+            "assistant_client_id": "1f2e3d4c-5b6a-4978-8695-a4b3c2d1e0f9",
+            "mode": "socratic",
+            "prompt_mode": "eli5",
+        }
+        resp = await app_client.post("/api/messages", json=payload)
+
+        assert resp.status_code == 500
+        assert resp.json()["detail"] == detail
+        assert refunded == [reservation]
+    finally:
+        main_app.app.dependency_overrides.pop(messages_module.verify_token, None)
+
+
+@pytest.mark.asyncio
+async def test_messages_cache_dual_reads_previous_release_key(app_client, dummy_redis):
+    # The previous release's key format: raw content, no schema or prompt version.
+    digest = hashlib.sha256("Why is the sky blue?\x00learning\x00eli5\x000.70".encode("utf-8")).hexdigest()
+    legacy_key = f"knowbear:cache:{digest}"
+    dummy_redis.store[legacy_key] = json.dumps({"response": "Rayleigh scattering."})
+    cache_key = messages_module._message_cache_key("Why is the sky blue?", "learning", "eli5", 0.7)
+
+    assert messages_module._legacy_message_cache_key("Why is the sky blue?", "learning", "eli5", 0.7) == legacy_key
+    payload, payload_key = await messages_module._cache_get_message(
+        cache_key,
+        legacy_key,
+        60,
+        content="Why is the sky blue?",
+        mode="learning",
+        prompt_mode="eli5",
+        temperature=0.7,
+    )
+
+    assert payload == {"response": "Rayleigh scattering."}
+    assert payload_key == cache_key
+    assert cache_key in dummy_redis.store
+
+
+@pytest.mark.asyncio
+async def test_messages_reclaims_stale_in_progress_idempotency(app_client, dummy_redis, monkeypatch, test_settings):
     user = SimpleNamespace(id="user-reclaim", email="user@example.com", user_metadata={})
     stale_started_at = int(time.time()) - 999
+    client_message_id = "8a5f7736-2edb-4f7b-bf45-9b8f2ea1ea1e"
+    idempotency_key = messages_module._idempotency_key(user.id, client_message_id)
+    dummy_redis.store[idempotency_key] = json.dumps(
+        {"status": "in_progress", "owner": "crashed-worker", "started_at": stale_started_at, "heartbeat_at": stale_started_at}
+    )
 
     async def fake_verify_token():
         return {"user": user}
@@ -141,14 +238,6 @@ async def test_messages_reclaims_stale_in_progress_idempotency(app_client, monke
     async def fast_stream(*_args, **_kwargs):
         yield "ok"
 
-    async def fake_cache_get(key):
-        if str(key).startswith("knowbear:idempotency:"):
-            return {"status": "in_progress", "started_at": stale_started_at}
-        return None
-
-    async def fake_cache_set(_key, _value, ttl=None):
-        return True
-
     fake_supabase = FakeSupabase(
         responses={
             "conversations": {"id": "conv-reclaim", "user_id": user.id, "mode": "learning", "settings": {}},
@@ -161,15 +250,13 @@ async def test_messages_reclaims_stale_in_progress_idempotency(app_client, monke
     monkeypatch.setattr(messages_module, "check_is_pro", fake_is_pro)
     monkeypatch.setattr(messages_module, "generate_stream_explanation", fast_stream)
     monkeypatch.setattr(messages_module, "get_supabase_admin", lambda: fake_supabase)
-    monkeypatch.setattr(messages_module, "cache_get", fake_cache_get)
-    monkeypatch.setattr(messages_module, "cache_set", fake_cache_set)
     monkeypatch.setattr(messages_module, "get_settings", lambda: test_settings)
 
     try:
         payload = {
             "conversation_id": "conv-reclaim",
             "content": "hello",
-            "client_generated_id": "8a5f7736-2edb-4f7b-bf45-9b8f2ea1ea1e",
+            "client_generated_id": client_message_id,
             "assistant_client_id": "8f2c9e58-0ae5-4fce-bc73-51f1ca6f43c4",
             "mode": "learning",
             "prompt_mode": "eli5",
@@ -179,35 +266,19 @@ async def test_messages_reclaims_stale_in_progress_idempotency(app_client, monke
         assert resp.status_code == 200
         assert "event: delta" in resp.text
         assert "ok" in resp.text
+        record = json.loads(dummy_redis.store[idempotency_key])
+        assert record["status"] == "completed"
+        assert record["assistant_message_id"] == "assistant-reclaim"
     finally:
         main_app.app.dependency_overrides.pop(messages_module.verify_token, None)
 
 
 @pytest.mark.asyncio
-async def test_query_stream_idempotency_replay_with_message_id(app_client, monkeypatch, test_settings):
-    store: dict[str, dict] = {}
-
+async def test_query_stream_idempotency_replay_with_message_id(app_client, dummy_redis, monkeypatch, test_settings):
     async def fake_stream(*_args, **_kwargs):
         yield "hello replay"
 
-    async def fake_cache_get(key):
-        return store.get(str(key))
-
-    async def fake_cache_set(key, value, ttl=None):
-        store[str(key)] = value
-        return True
-
-    async def fake_cache_set_if_absent(key, value, ttl):
-        k = str(key)
-        if k in store:
-            return False
-        store[k] = value
-        return True
-
     monkeypatch.setattr(query_module, "generate_stream_explanation", fake_stream)
-    monkeypatch.setattr(query_module, "cache_get", fake_cache_get)
-    monkeypatch.setattr(query_module, "cache_set", fake_cache_set)
-    monkeypatch.setattr(query_module, "cache_set_if_absent", fake_cache_set_if_absent)
     monkeypatch.setattr(query_module, "get_settings", lambda: test_settings)
 
     payload = {
@@ -224,6 +295,71 @@ async def test_query_stream_idempotency_replay_with_message_id(app_client, monke
     second = await app_client.post("/api/query/stream", json=payload)
     assert second.status_code == 200
     assert "\"replay\":true" in second.text.replace(" ", "")
+    assert "hello replay" in second.text
+
+    record = next(
+        json.loads(value)
+        for key, value in dummy_redis.store.items()
+        if key.startswith("knowbear:query_stream:idempotency:")
+    )
+    assert record["status"] == "completed"
+    assert "response" not in record
+    assert record["response_key"] == query_module._cache_key("test", "eli5", "learning")
+
+
+@pytest.mark.asyncio
+async def test_query_stream_replays_and_duplicates_do_not_debit_quota(app_client, dummy_redis, monkeypatch, test_settings):
+    user = SimpleNamespace(id="user-query-quota", email="user@example.com", user_metadata={})
+
+    async def fake_auth():
+        return {"user": user}
+
+    async def fake_stream(*_args, **_kwargs):
+        yield "hello quota"
+
+    async def fake_is_pro(*_args, **_kwargs):
+        return False
+
+    async def counters():
+        await rate_limit_module.usage_reconciler.flush()
+        return {
+            key: value
+            for key, value in dummy_redis.store.items()
+            if key.startswith(("knowbear:quota:", "knowbear:circuit:tokens:"))
+        }
+
+    main_app.app.dependency_overrides[query_module.verify_token_optional] = fake_auth
+    monkeypatch.setattr(query_module, "generate_stream_explanation", fake_stream)
+    monkeypatch.setattr(query_module, "check_is_pro", fake_is_pro)
+    monkeypatch.setattr(query_module, "get_supabase_admin", lambda: FakeSupabase())
+    monkeypatch.setattr(query_module, "get_settings", lambda: test_settings)
+
+    try:
+        payload = {
+            "topic": "quota",
+            "levels": ["eli5"],
+            "mode": "learning",
+            "message_id": "0d5e9c1a-7b2f-4e3d-9a8c-1f2e3d4c5b6a",
+        }
+        first = await app_client.post("/api/query/stream", json=payload)
+        assert first.status_code == 200
+        settled = await counters()
+        assert f"knowbear:quota:{user.id}" in settled
+
+        replay = await app_client.post("/api/query/stream", json=payload)
+        assert "\"replay\":true" in replay.text.replace(" ", "")
+        assert await counters() == settled
+
+        busy_id = "6f4e3d2c-1b0a-4987-8654-3a2b1c0d9e8f"
+        now = int(time.time())
+        dummy_redis.store[query_module._query_stream_idempotency_key(user.id, busy_id)] = json.dumps(
+            {"status": "in_progress", "owner": "other-worker", "started_at": now, "heartbeat_at": now}
+        )
+        busy = await app_client.post("/api/query/stream", json={**payload, "message_id": busy_id})
+        assert busy.status_code == 409
+        assert await counters() == settled
+    finally:
+        main_app.app.dependency_overrides.pop(query_module.verify_token_optional, None)
 
 
 @pytest.mark.asyncio
@@ -0,0 +1,86 @@
+import pytest
+
+import services.token_estimator as token_estimator_module
+from services.token_estimator import count_tokens, count_tokens_batch, estimate_request_tokens, reconcile_usage
+
+
+def test_count_tokens_tracks_words_not_characters(monkeypatch):
+    monkeypatch.setattr(token_estimator_module, "tiktoken", None)
+    monkeypatch.setattr(token_estimator_module, "_encoders", {})
+
+    assert count_tokens("") == 0
+    assert count_tokens("what is a binary tree") == 5
+    assert count_tokens("x = 12345;") == 5
+    assert count_tokens_batch(["hello world", "", "internationalization"]) == [2, 0, 4]
+
+
+def test_encoder_loads_only_on_request_and_failures_are_retried(monkeypatch):
+    calls = []
+
+    class FakeEncoder:
+        def encode_ordinary(self, text):
+            return text.split()
+
+    class FakeTiktoken:
+        @staticmethod
+        def get_encoding(name):
+            calls.append(name)
+            if len(calls) == 1:
+                raise OSError("ranks unavailable")
+            return FakeEncoder()
+
+    monkeypatch.setattr(token_estimator_module, "tiktoken", FakeTiktoken)
+    monkeypatch.setattr(token_estimator_module, "_encoders", {})
+
+    # Counting never loads the encoder itself, so a request cannot block on a download.
+    assert count_tokens("internationalization matters") == 6
+    assert calls == []
+
+    assert token_estimator_module.load_encoder("cl100k_base") is None
+    assert isinstance(token_estimator_module.load_encoder("cl100k_base"), FakeEncoder)
+    assert calls == ["cl100k_base", "cl100k_base"]
+    assert count_tokens("internationalization matters") == 2
+
+
+def test_count_tokens_with_real_encoder(monkeypatch):
+    pytest.importorskip("tiktoken")
+    monkeypatch.setattr(token_estimator_module, "_encoders", {})
+    if token_estimator_module.load_encoder("cl100k_base") is None:
+        pytest.skip("cl100k_base ranks not cached; run scripts/fetch_tiktoken_bpe.py")
+
+    assert count_tokens("hello world") == 2
+    assert count_tokens_batch(["hello world", ""]) == [2, 0]
+
+
+def test_estimate_uses_default_output_until_enough_samples(test_settings, monkeypatch):
+    monkeypatch.setattr(test_settings, "token_estimator_min_samples", 5, raising=False)
+    estimate = estimate_request_tokens("explain recursion", mode="learning", levels=["eli5", "eli15"])
+    assert estimate.output_tokens == {"eli5": 900, "eli15": 900}
+    assert estimate.total == 2 * (estimate.prompt_tokens + 900)
+
+    for completion in (100, 120, 140, 160, 400):
+        reconcile_usage(
+            estimate,
+            level="eli5",
+            token_usage={"prompt_tokens": 300, "completion_tokens": completion, "total_tokens": 300 + completion},
+            alias="default-fast",
+        )
+
+    learned = estimate_request_tokens("explain recursion", mode="learning", levels=["eli5", "eli15"])
+    assert learned.output_tokens == {"eli5": 400, "eli15": 900}
+    assert learned.prompt_overhead["eli5"] == 300 - estimate.prompt_tokens
+    assert learned.reserved_for("eli5") == 300 + 400
+
+
+def test_reconcile_reports_delta_against_reservation():
+    estimate = estimate_request_tokens("short topic", mode="socratic", levels=["eli15"])
+    reserved = estimate.reserved_for("eli15")
+
+    delta = reconcile_usage(
+        estimate,
+        level="eli15",
+        token_usage={"prompt_tokens": 50, "completion_tokens": 150, "total_tokens": 200},
+    )
+
+    assert delta == 200 - reserved
+    assert reconcile_usage(estimate, level="eli15", token_usage=None) is None
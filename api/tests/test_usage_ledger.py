@@ -0,0 +1,165 @@
+from types import SimpleNamespace
+
+import pytest
+
+import auth as auth_module
+import main as main_app
+import services.usage_ledger as usage_ledger_module
+from conftest import FakeSupabase
+
+
+@pytest.mark.asyncio
+async def test_ledger_aggregates_requests_and_flushes_one_batched_upsert(monkeypatch):
+    supabase = FakeSupabase()
+    monkeypatch.setattr(usage_ledger_module, "get_supabase_admin", lambda: supabase)
+    ledger = usage_ledger_module.UsageLedger()
+
+    ledger.record("user-1", tokens=300, token_usage={"prompt_tokens": 100, "completion_tokens": 200}, cost_usd=0.001)
+    ledger.record("user-1", tokens=0)
+    ledger.record("user-2", tokens=50, is_pro=True)
+    ledger.record(None, tokens=999)
+    assert supabase.rpcs == []
+
+    await ledger.shutdown()
+
+    assert len(supabase.rpcs) == 1
+    function, params = supabase.rpcs[0]
+    assert function == usage_ledger_module.RECORD_FUNCTION
+    rows = {row["user_id"]: row for row in params["batch"]}
+    assert rows["user-1"]["requests"] == 2
+    assert rows["user-1"]["total_tokens"] == 300
+    assert rows["user-1"]["prompt_tokens"] == 100
+    assert rows["user-1"]["cost_usd"] == pytest.approx(0.001)
+    assert rows["user-2"]["tier"] == "pro"
+    assert ledger.pending_for("user-1").requests == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_deltas_for_the_next_attempt(monkeypatch):
+    class BrokenSupabase(FakeSupabase):
+        def rpc(self, function, params):
+            raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(usage_ledger_module, "get_supabase_admin", lambda: BrokenSupabase())
+    ledger = usage_ledger_module.UsageLedger()
+    ledger.record("user-1", tokens=120)
+
+    await ledger.flush()
+
+    assert ledger.pending_for("user-1").total_tokens == 120
+    assert ledger.stats["flush_failures"] == 1
+
+
+class RowCheckingSupabase(FakeSupabase):
+    """Rejects any batch containing a user in ``bad``, like an FK violation for a deleted user."""
+
+    def __init__(self, bad, code="23503"):
+        super().__init__()
+        self.bad = set(bad)
+        self.code = code
+
+    def rpc(self, function, params):
+        self.rpcs.append((function, params))
+        rejected = [row["user_id"] for row in params["batch"] if row["user_id"] in self.bad]
+
+        def execute():
+            if rejected:
+                error = RuntimeError(f"rejected {rejected}")
+                error.code = self.code
+                raise error
+            return SimpleNamespace(data=len(params["batch"]))
+
+        return SimpleNamespace(execute=execute)
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_row_by_row_and_bad_rows_are_dead_lettered(monkeypatch):
+    supabase = RowCheckingSupabase({"deleted-user"})
+    monkeypatch.setattr(usage_ledger_module, "get_supabase_admin", lambda: supabase)
+    ledger = usage_ledger_module.UsageLedger()
+    for user_id in ("user-1", "deleted-user", "user-2"):
+        ledger.record(user_id, tokens=10)
+
+    await ledger.flush()
+
+    written = [params["batch"][0]["user_id"] for _, params in supabase.rpcs[1:] if len(params["batch"]) == 1]
+    assert sorted(written) == ["deleted-user", "user-1", "user-2"]
+    assert ledger.stats["dead_lettered"] == 1
+    assert ledger.pending_for("deleted-user").requests == 0
+    assert ledger.pending_for("user-1").requests == 0
+
+
+@pytest.mark.asyncio
+async def test_rows_failing_transiently_are_dead_lettered_after_capped_attempts(monkeypatch):
+    supabase = RowCheckingSupabase({"flaky-user"}, code="")
+    monkeypatch.setattr(usage_ledger_module, "get_supabase_admin", lambda: supabase)
+    ledger = usage_ledger_module.UsageLedger()
+
+    for attempt in range(usage_ledger_module.MAX_ROW_ATTEMPTS):
+        ledger.record("user-1", tokens=10)
+        ledger.record("flaky-user", tokens=10)
+        await ledger.flush()
+        if attempt < usage_ledger_module.MAX_ROW_ATTEMPTS - 1:
+            assert ledger.pending_for("flaky-user").requests == attempt + 1
+
+    assert ledger.pending_for("flaky-user").requests == 0
+    assert ledger.stats["dead_lettered"] == 1
+    assert ledger.pending_for("user-1").requests == 0
+
+
+@pytest.mark.asyncio
+async def test_outage_during_row_retry_keeps_every_row(monkeypatch):
+    supabase = RowCheckingSupabase({"user-1", "user-2", "user-3"}, code="")
+    monkeypatch.setattr(usage_ledger_module, "get_supabase_admin", lambda: supabase)
+    ledger = usage_ledger_module.UsageLedger()
+    for user_id in ("user-1", "user-2", "user-3"):
+        ledger.record(user_id, tokens=10)
+
+    await ledger.flush()
+
+    # One batch call, then row calls only until the outage is recognized.
+    assert len(supabase.rpcs) == 1 + usage_ledger_module.OUTAGE_PROBE_ROWS
+    assert all(ledger.pending_for(user_id).requests == 1 for user_id in ("user-1", "user-2", "user-3"))
+    assert ledger.stats["dead_lettered"] == 0
+
+
+@pytest.mark.asyncio
+async def test_usage_endpoint_adds_unflushed_usage_to_persisted_row(app_client, monkeypatch, fake_user):
+    today = usage_ledger_module.usage_day()
+    supabase = FakeSupabase(
+        responses={
+            "user_usage": [
+                {
+                    "user_id": fake_user.id,
+                    "tier": "free",
+                    "last_reset_date": today,
+                    "prompts_today": 3,
+                    "tokens_today": 1000,
+                    "total_requests": 10,
+                    "total_tokens": 4000,
+                    "total_cost_usd": 0.5,
+                }
+            ]
+        }
+    )
+
+    async def fake_verify_token():
+        return {"user": fake_user}
+
+    monkeypatch.setattr(usage_ledger_module, "get_supabase_admin", lambda: supabase)
+    main_app.app.dependency_overrides[auth_module.verify_token] = fake_verify_token
+    usage_ledger_module.usage_ledger.record(fake_user.id, tokens=250, cost_usd=0.01)
+
+    try:
+        resp = await app_client.get("/api/usage")
+    finally:
+        main_app.app.dependency_overrides.pop(auth_module.verify_token, None)
+
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["requests_today"] == 4
+    assert body["tokens_today"] == 1250
+    assert body["total_tokens"] == 4250
+    assert body["total_cost_usd"] == pytest.approx(0.51)
+    assert body["daily_token_limit"] == 50000
+    assert body["tokens_remaining"] == 48750
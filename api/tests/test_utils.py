@@ -1,6 +1,6 @@
 import pytest
 
-from utils import sanitize_topic, topic_cache_key
+from utils import canonical_topic_key, canonicalize_topic, sanitize_topic, topic_cache_key
 
 
 def test_sanitize_topic_valid():
@@ -25,3 +25,35 @@ def test_sanitize_topic_missing():
 def test_topic_cache_key_format():
     key = topic_cache_key("Hello World!", "eli5")
     assert key == "knowbear:hello_world:eli5"
+
+
+def test_canonicalize_topic_merges_trivial_phrasings():
+    assert canonicalize_topic("What is TCP?") == canonicalize_topic("what is tcp") == "tcp"
+    assert canonicalize_topic("What&#x27;s a black hole") == "black hole"
+    assert canonicalize_topic("  Explain   quantum physics! ") == "quantum physics"
+
+
+def test_canonicalize_topic_preserves_meaningful_symbols():
+    assert canonicalize_topic("C++") != canonicalize_topic("C")
+    assert canonicalize_topic("node.js") == "node.js"
+    assert canonicalize_topic("what is the") == "what is the"
+
+
+def test_canonicalize_topic_keeps_articles_that_carry_meaning():
+    assert canonicalize_topic("What is a vitamin") == "vitamin"
+    assert canonicalize_topic("Vitamin A") == "vitamin a"
+    assert canonicalize_topic("Vitamin A") != canonicalize_topic("Vitamin")
+    assert canonicalize_topic("Hepatitis A") != canonicalize_topic("Hepatitis")
+    assert canonicalize_topic("A* search") == "a* search"
+    assert canonicalize_topic('print("a")') != canonicalize_topic("print()")
+    assert canonicalize_topic("the theory of the mind") == "theory of the mind"
+
+
+def test_canonical_topic_key_hashes_full_topic():
+    long_a = "a" * 60 + " alpha"
+    long_b = "a" * 60 + " beta"
+    assert topic_cache_key(long_a, "eli5") == topic_cache_key(long_b, "eli5")
+    assert canonical_topic_key(long_a, "eli5") != canonical_topic_key(long_b, "eli5")
+    assert canonical_topic_key("What is TCP?", "eli5", mode="learning", version="v") == canonical_topic_key(
+        "tcp", "eli5", mode="learning", version="v"
+    )
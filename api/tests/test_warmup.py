@@ -0,0 +1,90 @@
+import pytest
+
+import services.inference as inference_module
+import services.warmup as warmup_module
+from conftest import FakeSupabase
+
+
+@pytest.mark.asyncio
+async def test_warmup_generates_pinned_and_history_topics(monkeypatch, test_settings):
+    store = {}
+    generated = []
+
+    async def fake_cache_get(key):
+        return store.get(key)
+
+    async def fake_cache_set(key, value, ttl=None):
+        store[key] = value
+        return True
+
+    async def fake_generate(topic, level, **_kwargs):
+        generated.append((topic, level))
+        return f"{topic}:{level}"
+
+    fake_supabase = FakeSupabase(
+        responses={
+            "history": [
+                {"topic": "Entropy", "levels": ["eli5"]},
+                {"topic": "Entropy", "levels": ["eli5", "eli10"]},
+                {"topic": "Rare", "levels": ["eli5"]},
+            ]
+        }
+    )
+
+    monkeypatch.setattr(warmup_module, "PINNED_TOPICS", [{"title": "Black Holes"}])
+    monkeypatch.setattr(warmup_module, "cache_get", fake_cache_get)
+    monkeypatch.setattr(warmup_module, "cache_set", fake_cache_set)
+    monkeypatch.setattr(warmup_module, "generate_explanation", fake_generate)
+    monkeypatch.setattr(warmup_module, "get_supabase_admin", lambda: fake_supabase)
+    monkeypatch.setattr(warmup_module, "get_settings", lambda: test_settings)
+
+    stats = await warmup_module.warm_response_cache(levels=["eli5", "eli10"], concurrency=2, top_n=1)
+
+    assert sorted(generated) == sorted(
+        [("Black Holes", "eli5"), ("Black Holes", "eli10"), ("Entropy", "eli5"), ("Entropy", "eli10")]
+    )
+    assert stats == {"warmed": 4, "skipped": 0, "failed": 0}
+    assert store[inference_module.response_cache_key("Entropy", "eli5", "learning")] == {"text": "Entropy:eli5"}
+
+    rerun = await warmup_module.warm_response_cache(levels=["eli5", "eli10"], concurrency=2, top_n=1)
+    assert rerun == {"warmed": 0, "skipped": 4, "failed": 0}
+
+
+@pytest.mark.asyncio
+async def test_warmup_unescapes_history_topics_and_uses_their_mode(monkeypatch, test_settings):
+    generated = []
+
+    async def fake_cache_get(_key):
+        return None
+
+    async def fake_cache_set(_key, _value, ttl=None):
+        return True
+
+    async def fake_generate(topic, level, **kwargs):
+        generated.append((topic, level, kwargs["mode"]))
+        return "text"
+
+    # /query stores the sanitized, HTML-escaped topic.
+    fake_supabase = FakeSupabase(
+        responses={"history": [{"topic": "Newton&#x27;s laws", "levels": ["eli5"], "mode": "socratic"}]}
+    )
+
+    monkeypatch.setattr(warmup_module, "PINNED_TOPICS", [])
+    monkeypatch.setattr(warmup_module, "cache_get", fake_cache_get)
+    monkeypatch.setattr(warmup_module, "cache_set", fake_cache_set)
+    monkeypatch.setattr(warmup_module, "generate_explanation", fake_generate)
+    monkeypatch.setattr(warmup_module, "get_supabase_admin", lambda: fake_supabase)
+    monkeypatch.setattr(warmup_module, "get_settings", lambda: test_settings)
+
+    stats = await warmup_module.warm_response_cache(levels=["eli5"], top_n=5)
+
+    assert generated == [("Newton&#x27;s laws", "eli5", "socratic")]
+    assert stats == {"warmed": 1, "skipped": 0, "failed": 0}
+
+
+def test_response_cache_key_changes_with_prompt_version(monkeypatch):
+    before = inference_module.response_cache_key("Cats", "eli5", "learning")
+    monkeypatch.setattr(inference_module.prompt_registry, "version_for", lambda *_args: "changed")
+    after = inference_module.response_cache_key("Cats", "eli5", "learning")
+    assert before != after
+    assert ":changed.default-fast:" in after
@@ -1,15 +1,28 @@
 """Input validation and mode normalization utilities."""
 
+import hashlib
 import html
 import json
 import logging
 import os
 import re
+import unicodedata
 
 MAX_TOPIC_LENGTH = 200
+CANONICAL_CACHE_KEY_SCHEMA = "v3"
 ALLOWED_PATTERN = re.compile(r"^[\w\s\-.,!?'\"()]+$", re.UNICODE)
 _logger = logging.getLogger(__name__)
 
+# Leading request phrasing that does not change what is being explained.
+_INTERROGATIVE_PREFIX_PATTERN = re.compile(
+    r"^(?:(?:please|can you|could you|tell me|explain|describe|define|about|"
+    r"what(?:'s| is| are| was| were)?|whats|who(?:'s| is| are| was)?|meaning of|definition of)\s+)+"
+)
+# Only a leading article is filler; elsewhere "a" is often the subject ("vitamin a", "hepatitis a").
+_LEADING_ARTICLE_PATTERN = re.compile(r"^(?:a|an|the)(?:\s+|$)")
+_SENTENCE_PUNCTUATION_PATTERN = re.compile(r"[?!\"()\u201c\u201d]|[.,;:'\u2019](?=\s|$)|(?<=\s)'")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
 LEARNING_MODE = "learning"
 TECHNICAL_MODE = "technical"
 SOCRATIC_MODE = "socratic"
@@ -60,6 +73,35 @@ def topic_cache_key(topic: str, level: str, mode: str | None = None) -> str:
     return f"knowbear:{safe}:{mode}:{level}" if mode else f"knowbear:{safe}:{level}"
 
 
+def canonicalize_topic(topic: str) -> str:
+    """
+    Reduce a topic to a canonical form so trivially different phrasings share a key.
+
+    Pipeline: HTML unescape -> NFKC -> casefold -> typographic/sentence punctuation
+    removal -> leading interrogative stripping -> leading article removal -> whitespace collapse.
+    Symbols that carry meaning ("c++", "c#", "node.js") are preserved.
+    """
+    text = unicodedata.normalize("NFKC", html.unescape(topic or "")).casefold()
+    text = text.replace("\u2019", "'")
+    text = _WHITESPACE_PATTERN.sub(" ", _SENTENCE_PUNCTUATION_PATTERN.sub(" ", text)).strip()
+    stripped = _INTERROGATIVE_PREFIX_PATTERN.sub("", text)
+    stripped = _LEADING_ARTICLE_PATTERN.sub("", stripped).strip()
+    # A topic made only of filler words ("what is the") keeps its punctuation-free form.
+    return stripped or text
+
+
+def canonical_topic_key(topic: str, level: str, mode: str | None = None, version: str | None = None) -> str:
+    """Collision-free cache key: a hash of the full canonical topic rather than a truncated slug."""
+    digest = hashlib.sha256(canonicalize_topic(topic).encode("utf-8")).hexdigest()[:32]
+    parts = [f"knowbear:{CANONICAL_CACHE_KEY_SCHEMA}"]
+    if version:
+        parts.append(version)
+    if mode:
+        parts.append(mode.strip().lower())
+    parts.extend([level, digest])
+    return ":".join(parts)
+
+
 def normalize_mode(mode: str | None) -> str:
     normalized = (mode or "").strip().lower()
     return MODE_ALIASES.get(normalized, LEARNING_MODE)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Compare cache hit rates of legacy slug keys vs canonical topic keys over real queries.
+
+Replays topics in order against an unbounded, TTL-free simulated cache and reports
+how many requests each key scheme would have served from cache. Legacy hits where a
+different topic collided onto the same slug are counted as false hits, not hits.
+
+Sources:
+  --file PATH      plain text (one topic per line) or JSONL with "topic"/"content",
+                   optional "level" and "mode" fields
+  --history        read topics/levels from the Supabase history table (needs
+                   SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY)
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+from typing import Iterator
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from utils import canonical_topic_key, canonicalize_topic, topic_cache_key  # noqa: E402
+
+
+def iter_file_queries(path: str) -> Iterator[tuple[str, str, str]]:
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                topic = row.get("topic") or row.get("content")
+                if topic:
+                    yield str(topic), str(row.get("level") or "eli15"), str(row.get("mode") or "learning")
+            else:
+                yield line, "eli15", "learning"
+
+
+def iter_history_queries(max_rows: int) -> Iterator[tuple[str, str, str]]:
+    from config import get_settings
+    from supabase import create_client
+
+    settings = get_settings()
+    if not settings.supabase_url or not settings.supabase_service_role_key:
+        raise SystemExit("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY are required for --history")
+
+    client = create_client(settings.supabase_url, settings.supabase_service_role_key)
+    response = (
+        client.table("history")
+        .select("topic, levels, mode")
+        .order("created_at", desc=False)
+        .limit(max_rows)
+        .execute()
+    )
+    for row in response.data or []:
+        for level in row.get("levels") or ["eli15"]:
+            yield str(row.get("topic") or ""), str(level), str(row.get("mode") or "learning")
+
+
+def run_benchmark(queries: Iterator[tuple[str, str, str]]) -> dict[str, float]:
+    legacy_seen: set[str] = set()
+    canonical_seen: set[str] = set()
+    legacy_forms: dict[str, set[str]] = defaultdict(set)
+    total = legacy_hits = legacy_false_hits = canonical_hits = 0
+
+    for topic, level, mode in queries:
+        if not topic.strip():
+            continue
+        total += 1
+        legacy_key = topic_cache_key(topic, level, mode=mode)
+        canonical_key = canonical_topic_key(topic, level, mode=mode)
+        canonical_form = canonicalize_topic(topic)
+        if legacy_key in legacy_seen:
+            if canonical_form in legacy_forms[legacy_key]:
+                legacy_hits += 1
+            else:
+                # A different topic collided onto this slug and would be served the wrong answer.
+                legacy_false_hits += 1
+        legacy_seen.add(legacy_key)
+        legacy_forms[legacy_key].add(canonical_form)
+        if canonical_key in canonical_seen:
+            canonical_hits += 1
+        canonical_seen.add(canonical_key)
+
+    legacy_rate = legacy_hits / total if total else 0.0
+    canonical_rate = canonical_hits / total if total else 0.0
+    return {
+        "requests": total,
+        "legacy_distinct_keys": len(legacy_seen),
+        "canonical_distinct_keys": len(canonical_seen),
+        "legacy_hit_rate": round(legacy_rate, 4),
+        "canonical_hit_rate": round(canonical_rate, 4),
+        "hit_rate_uplift": round(canonical_rate - legacy_rate, 4),
+        "legacy_false_hits": legacy_false_hits,
+        "legacy_collisions": sum(1 for forms in legacy_forms.values() if len(forms) > 1),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark canonical topic cache keys against legacy keys.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", help="Query log file (text or JSONL)")
+    source.add_argument("--history", action="store_true", help="Read queries from the Supabase history table")
+    parser.add_argument("--max-rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    queries = iter_file_queries(args.file) if args.file else iter_history_queries(args.max_rows)
+    print(json.dumps(run_benchmark(queries), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
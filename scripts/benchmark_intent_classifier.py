@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Compare the legacy per-pattern intent/depth/diagram scan with the precompiled classifier.
+
+Runs each query through three paths and reports mean and p99 microseconds per query:
+  legacy     every INTENT/DEPTH regex with re.search, then the DIAGRAM_TRIGGERS substring scan
+  compiled   QueryClassifier.classify (guard + merged regex per label, no memo)
+  memoized   services.intent.classify (LRU per normalized query)
+It also counts queries where legacy and compiled disagree, which should be zero.
+
+  --file PATH      plain text (one topic per line) or JSONL with "topic"/"content"
+  --repeat N       passes over the query list (default 20; memo hits dominate after the first)
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+from typing import Callable
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "api"))
+
+import services.intent as intent  # noqa: E402
+
+SAMPLE_TOPICS = [
+    "what is a b-tree",
+    "compare RLHF vs DPO in depth",
+    "design a rate limiter architecture",
+    "how does attention work under the hood",
+    "explain the raft request flow as a sequence",
+    "pros and cons of event sourcing",
+    "derive backpropagation from first principles",
+    "briefly, what is a bloom filter",
+    "model a tcp connection as a state machine",
+    "ways to shard a postgres database",
+    "timeline of the unix operating system",
+    "er diagram for an e-commerce schema",
+    "kubernetes deployment pipeline steps",
+    "how should we structure a monorepo",
+]
+
+
+def legacy_classify(query: str) -> tuple[str, str, str | None]:
+    lowered = query.lower().strip()
+    intent_name = "explain"
+    for name, patterns in intent.INTENT_PATTERNS:
+        if any(re.search(pattern, lowered) for pattern in patterns):
+            intent_name = name
+            break
+    depth = "medium"
+    for name, patterns in intent.DEPTH_PATTERNS:
+        if any(re.search(pattern, lowered) for pattern in patterns):
+            depth = name
+            break
+    diagram = None
+    for keyword, diagram_type in intent.DIAGRAM_TRIGGERS:
+        if keyword in lowered:
+            diagram = diagram_type
+            break
+    return intent_name, depth, diagram
+
+
+def load_queries(path: str | None) -> list[str]:
+    if not path:
+        rng = random.Random(3)
+        # A small set of topics with suffixes, repeated the way popular topics repeat in real traffic.
+        return [f"{rng.choice(SAMPLE_TOPICS)} {rng.choice(['', 'for beginners', 'in production', 'at scale'])}".strip()
+                for _ in range(2000)]
+    queries = []
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                line = str(row.get("topic") or row.get("content") or "")
+            if line:
+                queries.append(line)
+    return queries
+
+
+def as_tuple(result: intent.Classification) -> tuple[str, str, str | None]:
+    return result.intent, result.depth, result.diagram_type
+
+
+def time_path(fn: Callable[[str], object], queries: list[str], repeat: int) -> dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            started = time.perf_counter_ns()
+            fn(query)
+            samples.append((time.perf_counter_ns() - started) / 1000)
+    ordered = sorted(samples)
+    return {
+        "mean_us": round(statistics.fmean(samples), 3),
+        "p99_us": round(ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)], 3),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the compiled intent classifier.")
+    parser.add_argument("--file", help="Query log file (text or JSONL)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    queries = load_queries(args.file)
+    if not queries:
+        raise SystemExit("no queries")
+    compiled = intent.QueryClassifier()
+    mismatches = sum(
+        1
+        for query in queries
+        if legacy_classify(query) != as_tuple(compiled.classify(query.lower().strip()))
+    )
+    intent._classify_normalized.cache_clear()
+    report = {
+        "queries": len(queries),
+        "distinct": len(set(queries)),
+        "mismatches": mismatches,
+        "legacy": time_path(legacy_classify, queries, args.repeat),
+        "compiled": time_path(lambda query: compiled.classify(query.lower()), queries, args.repeat),
+        "memoized": time_path(intent.classify, queries, args.repeat),
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Measure local retrieval index latency: indexing, segment flush, cold load and BM25 queries.
+
+Documents come from a JSONL file ("text"/"content" plus optional "title"/"topic") or are
+synthesized from a fixed vocabulary. Queries reuse document titles so most have matches.
+Segments are written to a temporary directory that is removed afterwards.
+
+  --file PATH        JSONL documents (default: synthetic)
+  --documents N      synthetic document count (default 5000)
+  --queries N        number of timed queries (default 1000)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Iterator
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from services.retrieval_index import RetrievalIndex  # noqa: E402
+
+VOCABULARY = (
+    "raft paxos consensus leader follower quorum log replication snapshot election term vote "
+    "btree lsm compaction memtable sstable bloom filter index page cache eviction lru "
+    "tcp congestion window retransmit handshake latency throughput backpressure queue "
+    "gradient descent loss optimizer momentum batch normalization attention transformer embedding "
+    "kubernetes pod scheduler container image registry rollout canary autoscaling"
+).split()
+
+
+def iter_file_documents(path: str) -> Iterator[tuple[str, str]]:
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            text = row.get("text") or row.get("content")
+            if text:
+                yield str(row.get("title") or row.get("topic") or ""), str(text)
+
+
+def iter_synthetic_documents(count: int, seed: int = 7) -> Iterator[tuple[str, str]]:
+    rng = random.Random(seed)
+    for _ in range(count):
+        title = " ".join(rng.sample(VOCABULARY, 3))
+        paragraphs = [" ".join(rng.choices(VOCABULARY, k=rng.randint(40, 90))) for _ in range(rng.randint(2, 5))]
+        yield title, "\n\n".join(paragraphs)
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+async def run_benchmark(documents: list[tuple[str, str]], query_count: int) -> dict[str, float]:
+    with tempfile.TemporaryDirectory() as directory:
+        index = RetrievalIndex(directory=directory)
+        index.load()
+
+        started = time.perf_counter()
+        for position, (title, text) in enumerate(documents):
+            index.add(f"doc:{position}", text, title=title, source="benchmark")
+        add_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        await index.flush()
+        flush_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        reloaded = RetrievalIndex(directory=directory)
+        reloaded.load()
+        load_seconds = time.perf_counter() - started
+
+        rng = random.Random(11)
+        queries = [rng.choice(documents)[0] or " ".join(rng.sample(VOCABULARY, 3)) for _ in range(query_count)]
+        latencies = []
+        hits = 0
+        for query in queries:
+            started = time.perf_counter()
+            results = reloaded.search(query, limit=5)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += bool(results)
+
+        segment_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+    return {
+        "documents": len(reloaded),
+        "queries": len(queries),
+        "query_hit_rate": round(hits / len(queries), 4) if queries else 0.0,
+        "add_docs_per_second": round(len(documents) / add_seconds, 1) if add_seconds else 0.0,
+        "flush_ms": round(flush_seconds * 1000, 2),
+        "cold_load_ms": round(load_seconds * 1000, 2),
+        "segment_bytes": segment_bytes,
+        "query_p50_ms": round(statistics.median(latencies), 3) if latencies else 0.0,
+        "query_p95_ms": round(percentile(latencies, 0.95), 3) if latencies else 0.0,
+        "query_p99_ms": round(percentile(latencies, 0.99), 3) if latencies else 0.0,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the local BM25 retrieval index.")
+    parser.add_argument("--file", help="JSONL documents with text/content and optional title/topic")
+    parser.add_argument("--documents", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    source = iter_file_documents(args.file) if args.file else iter_synthetic_documents(args.documents)
+    documents = list(source)
+    if not documents:
+        raise SystemExit("no documents to index")
+    print(json.dumps(asyncio.run(run_benchmark(documents, args.queries)), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
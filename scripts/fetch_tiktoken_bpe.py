@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""Download tiktoken BPE ranks into the directory the API reads them from at startup.
+
+services.token_estimator points TIKTOKEN_CACHE_DIR at api/data/tiktoken when it exists,
+so running this at build time means the API never fetches ranks while serving.
+
+  --dir PATH         target directory (default: api/data/tiktoken)
+  --encoding NAME    encodings to fetch, repeatable (default: cl100k_base)
+"""
+
+import argparse
+import os
+import sys
+
+DEFAULT_DIR = os.path.join(os.path.dirname(__file__), "..", "api", "data", "tiktoken")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fetch tiktoken BPE ranks for offline use.")
+    parser.add_argument("--dir", default=DEFAULT_DIR)
+    parser.add_argument("--encoding", action="append", dest="encodings")
+    args = parser.parse_args()
+
+    target = os.path.abspath(args.dir)
+    os.makedirs(target, exist_ok=True)
+    # Must be set before tiktoken reads its cache location.
+    os.environ["TIKTOKEN_CACHE_DIR"] = target
+    import tiktoken
+
+    for name in args.encodings or ["cl100k_base"]:
+        encoder = tiktoken.get_encoding(name)
+        print(f"{name}: {encoder.n_vocab} tokens cached in {target}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
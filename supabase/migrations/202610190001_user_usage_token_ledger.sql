@@ -0,0 +1,101 @@
+-- Token and cost accounting on user_usage, written in batches by the API
+-- Safe, idempotent, Supabase-compatible version
+
+ALTER TABLE user_usage
+  ADD COLUMN IF NOT EXISTS tokens_today bigint NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS prompt_tokens_today bigint NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS completion_tokens_today bigint NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS cost_usd_today numeric(14, 6) NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS total_requests bigint NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS total_tokens bigint NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS total_cost_usd numeric(14, 6) NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT NOW();
+
+-- Counters are billing data now; users may read their row but only the service role writes it.
+DROP POLICY IF EXISTS user_usage_update ON user_usage;
+
+-- =========================
+-- Batched additive upsert
+-- =========================
+-- batch: [{"user_id", "usage_date", "tier", "requests", "prompt_tokens",
+--          "completion_tokens", "total_tokens", "cost_usd"}, ...] with one entry per user.
+-- Daily counters restart when a newer usage_date arrives; deltas from an older day
+-- only count toward the lifetime totals.
+CREATE OR REPLACE FUNCTION record_user_usage(batch jsonb)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  applied integer;
+BEGIN
+  INSERT INTO user_usage AS u (
+    user_id,
+    tier,
+    last_reset_date,
+    prompts_today,
+    tokens_today,
+    prompt_tokens_today,
+    completion_tokens_today,
+    cost_usd_today,
+    total_requests,
+    total_tokens,
+    total_cost_usd,
+    updated_at
+  )
+  SELECT
+    (item->>'user_id')::uuid,
+    COALESCE(item->>'tier', 'free'),
+    (item->>'usage_date')::date,
+    COALESCE((item->>'requests')::integer, 0),
+    COALESCE((item->>'total_tokens')::bigint, 0),
+    COALESCE((item->>'prompt_tokens')::bigint, 0),
+    COALESCE((item->>'completion_tokens')::bigint, 0),
+    COALESCE((item->>'cost_usd')::numeric, 0),
+    COALESCE((item->>'requests')::bigint, 0),
+    COALESCE((item->>'total_tokens')::bigint, 0),
+    COALESCE((item->>'cost_usd')::numeric, 0),
+    NOW()
+  FROM jsonb_array_elements(batch) AS item
+  ON CONFLICT (user_id) DO UPDATE SET
+    tier = EXCLUDED.tier,
+    prompts_today = CASE
+      WHEN u.last_reset_date < EXCLUDED.last_reset_date THEN EXCLUDED.prompts_today
+      WHEN u.last_reset_date = EXCLUDED.last_reset_date THEN u.prompts_today + EXCLUDED.prompts_today
+      ELSE u.prompts_today
+    END,
+    tokens_today = CASE
+      WHEN u.last_reset_date < EXCLUDED.last_reset_date THEN EXCLUDED.tokens_today
+      WHEN u.last_reset_date = EXCLUDED.last_reset_date THEN u.tokens_today + EXCLUDED.tokens_today
+      ELSE u.tokens_today
+    END,
+    prompt_tokens_today = CASE
+      WHEN u.last_reset_date < EXCLUDED.last_reset_date THEN EXCLUDED.prompt_tokens_today
+      WHEN u.last_reset_date = EXCLUDED.last_reset_date THEN u.prompt_tokens_today + EXCLUDED.prompt_tokens_today
+      ELSE u.prompt_tokens_today
+    END,
+    completion_tokens_today = CASE
+      WHEN u.last_reset_date < EXCLUDED.last_reset_date THEN EXCLUDED.completion_tokens_today
+      WHEN u.last_reset_date = EXCLUDED.last_reset_date THEN u.completion_tokens_today + EXCLUDED.completion_tokens_today
+      ELSE u.completion_tokens_today
+    END,
+    cost_usd_today = CASE
+      WHEN u.last_reset_date < EXCLUDED.last_reset_date THEN EXCLUDED.cost_usd_today
+      WHEN u.last_reset_date = EXCLUDED.last_reset_date THEN u.cost_usd_today + EXCLUDED.cost_usd_today
+      ELSE u.cost_usd_today
+    END,
+    last_reset_date = GREATEST(u.last_reset_date, EXCLUDED.last_reset_date),
+    total_requests = u.total_requests + EXCLUDED.total_requests,
+    total_tokens = u.total_tokens + EXCLUDED.total_tokens,
+    total_cost_usd = u.total_cost_usd + EXCLUDED.total_cost_usd,
+    updated_at = NOW();
+
+  GET DIAGNOSTICS applied = ROW_COUNT;
+  RETURN applied;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION record_user_usage(jsonb) FROM PUBLIC;
+REVOKE ALL ON FUNCTION record_user_usage(jsonb) FROM anon, authenticated;
+GRANT EXECUTE ON FUNCTION record_user_usage(jsonb) TO service_role;